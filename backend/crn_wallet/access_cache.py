@@ -0,0 +1,104 @@
+"""
+In-process TTL/LRU cache for lookups that run on every request
+(staff IPs, banned IPs, user ban flags).
+
+Entries expire after a fixed TTL, so any change made outside this process
+becomes visible within that bound. Local writers call invalidate()/clear(),
+which also bump a version counter: a load that started before the bump is
+not stored, so a concurrent reader cannot put a stale value back in the cache.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+# Sentinel for "not cached" - cached values themselves may be None/False
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry expiry and hit/miss counters"""
+
+    def __init__(self, name, ttl=60, max_size=10000):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.version = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if missing/expired"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, version=None, ttl=None):
+        """
+        Store a value. If version is given and the cache was invalidated
+        since it was read, the value is dropped as possibly stale.
+        ttl overrides the cache-wide TTL for this entry.
+        """
+        with self._lock:
+            if version is not None and version != self.version:
+                return False
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def get_or_load(self, key, loader):
+        """Return the cached value for key, calling loader(key) on a miss"""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        version = self.version
+        value = loader(key)
+        self.set(key, value, version=version)
+        return value
+
+    def invalidate(self, key):
+        """Drop one key and reject in-flight loads that started before now"""
+        with self._lock:
+            self._data.pop(key, None)
+            self.version += 1
+            self.invalidations += 1
+
+    def clear(self):
+        """Drop every entry and reject in-flight loads that started before now"""
+        with self._lock:
+            self._data.clear()
+            self.version += 1
+            self.invalidations += 1
+
+    def get_stats(self):
+        """Get hit/miss statistics for this cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "version": self.version
+            }
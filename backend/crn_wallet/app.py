@@ -172,18 +172,18 @@ def transfer_funds():
     if sender.get("wallet_lock", False):
         return jsonify({"success": False, "message": "Sender wallet is locked"}), 400
     
-    # Update balances
+    # Update balances (balance_num is the numeric copy the leaderboard index sorts on)
     new_sender_balance = sender_balance - amount
     new_receiver_balance = float(receiver.get("balance", "0")) + amount
     
     users_collection.update_one(
         {"user_id": sender_id},
-        {"$set": {"balance": str(new_sender_balance)}}
+        {"$set": {"balance": str(new_sender_balance), "balance_num": new_sender_balance}}
     )
     
     users_collection.update_one(
         {"user_id": receiver_id},
-        {"$set": {"balance": str(new_receiver_balance)}}
+        {"$set": {"balance": str(new_receiver_balance), "balance_num": new_receiver_balance}}
     )
     
     return jsonify({
@@ -1,8 +1,25 @@
 
 from flask import request
+import os
+import csv
+import bisect
 import logging
+import ipaddress
+import threading
 import requests
 import random
+from functools import lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    from backend.crn_wallet.access_cache import TTLCache
+except ImportError:
+    from access_cache import TTLCache
+
+try:
+    import maxminddb
+except ImportError:
+    maxminddb = None
 
 # IP info tokens (replace with your actual tokens if needed)
 ipinfo_tokens = [
@@ -12,18 +29,215 @@ ipinfo_tokens = [
     '5cd1b4773a35c2'
 ]
 
-def get_ip_info(ip_address):
+IPINFO_URL = os.environ.get('IPINFO_URL', 'https://ipinfo.io')
+IPINFO_TIMEOUT = 2  # seconds
+IPINFO_CACHE_TTL = 6 * 60 * 60  # IP metadata rarely changes
+IPINFO_NEGATIVE_TTL = 5 * 60  # failed lookups are retried after this
+IPINFO_CACHE_SIZE = 50000
+
+# Optional offline database (.mmdb, or .csv with start_ip,end_ip columns)
+IPINFO_DB_PATH = os.environ.get('IPINFO_DB_PATH', '')
+
+# Proxies allowed to set forwarding headers; override with a comma-separated
+# TRUSTED_PROXIES environment variable
+DEFAULT_TRUSTED_PROXIES = [
+    '127.0.0.0/8', '::1/128', '10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16', 'fc00::/7'
+]
+
+# Cloudflare edge ranges (https://www.cloudflare.com/ips/)
+CLOUDFLARE_NETWORKS = [
+    '173.245.48.0/20', '103.21.244.0/22', '103.22.200.0/22', '103.31.4.0/22',
+    '141.101.64.0/18', '108.162.192.0/18', '190.93.240.0/20', '188.114.96.0/20',
+    '197.234.240.0/22', '198.41.128.0/17', '162.158.0.0/15', '104.16.0.0/13',
+    '104.24.0.0/14', '172.64.0.0/13', '131.0.72.0/22',
+    '2400:cb00::/32', '2606:4700::/32', '2803:f800::/32', '2405:b500::/32',
+    '2405:8100::/32', '2a06:98c0::/29', '2c0f:f248::/32'
+]
+
+def parse_networks(entries):
+    """
+    Parse CIDR strings, skipping invalid ones
+    """
+    networks = []
+    for entry in entries:
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(entry, strict=False))
+        except ValueError:
+            logging.warning(f"Ignoring invalid network: {entry}")
+    return tuple(networks)
+
+TRUSTED_PROXY_NETWORKS = parse_networks(
+    os.environ['TRUSTED_PROXIES'].split(',') if os.environ.get('TRUSTED_PROXIES') else DEFAULT_TRUSTED_PROXIES
+) + parse_networks(CLOUDFLARE_NETWORKS)
+CLOUDFLARE_PROXY_NETWORKS = parse_networks(CLOUDFLARE_NETWORKS)
+
+def normalize_ip(value):
+    """
+    Return the canonical form of an IP string, or None if it is not an IP
+    """
+    if not value:
+        return None
+    try:
+        address = ipaddress.ip_address(value.strip())
+    except ValueError:
+        return None
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return str(address)
+
+def _in_networks(ip, networks):
+    address = ipaddress.ip_address(ip)
+    return any(address in network for network in networks if network.version == address.version)
+
+@lru_cache(maxsize=4096)
+def is_trusted_proxy(ip):
+    """
+    Check if an IP belongs to a proxy whose forwarding headers we trust
+    """
+    return _in_networks(ip, TRUSTED_PROXY_NETWORKS)
+
+@lru_cache(maxsize=4096)
+def is_cloudflare_ip(ip):
+    """
+    Check if an IP belongs to a Cloudflare edge
+    """
+    return _in_networks(ip, CLOUDFLARE_PROXY_NETWORKS)
+
+def resolve_client_ip(remote_addr, headers):
+    """
+    Resolve the client IP from the socket peer and forwarding headers.
+    Headers are only believed when they were added by a trusted proxy.
+    No network I/O is involved.
+    """
+    remote = normalize_ip(remote_addr)
+    if remote is None:
+        return remote_addr
+
+    # A direct, untrusted peer can put anything in the headers
+    if not is_trusted_proxy(remote):
+        return remote
+
+    chain = [ip for ip in (normalize_ip(part) for part in (headers.get('X-Forwarded-For') or '').split(',')) if ip]
+
+    # Cloudflare's header is only valid when the nearest hop is a Cloudflare edge
+    cf_ip = normalize_ip(headers.get('CF-Connecting-IP'))
+    if cf_ip and (is_cloudflare_ip(remote) or (chain and is_cloudflare_ip(chain[-1]))):
+        return cf_ip
+
+    # Walk X-Forwarded-For from the nearest hop; the first untrusted address is the client
+    for ip in reversed(chain):
+        if not is_trusted_proxy(ip):
+            return ip
+
+    # Every hop is internal: the request originated inside the trusted network
+    if chain:
+        return chain[0]
+
+    real_ip = normalize_ip(headers.get('X-Real-IP'))
+    if real_ip:
+        return real_ip
+
+    return remote
+
+class LocalIPDatabase:
+    """
+    Offline IP metadata from a MaxMind-format .mmdb file or a CSV of IP ranges
     """
-    Get IP information from IPinfo service using an appropriate token
+
+    def __init__(self, path):
+        self.path = path
+        self._reader = None
+        self._starts = []
+        self._rows = []
+
+        if path.endswith('.mmdb'):
+            if maxminddb is None:
+                raise ImportError("maxminddb is required to read .mmdb databases")
+            self._reader = maxminddb.open_database(path)
+        else:
+            self._load_csv(path)
+
+    def _load_csv(self, path):
+        """
+        Load a CSV with start_ip,end_ip columns; other columns become the metadata
+        """
+        rows = []
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                try:
+                    start = ipaddress.ip_address(row.pop('start_ip'))
+                    end = ipaddress.ip_address(row.pop('end_ip'))
+                except (KeyError, ValueError):
+                    continue
+                rows.append(((start.version, int(start)), int(end), row))
+
+        rows.sort(key=lambda r: r[0])
+        self._starts = [r[0] for r in rows]
+        self._rows = rows
+
+    def lookup(self, ip_address):
+        """
+        Get metadata for an IP, or None if the database has no entry
+        """
+        if self._reader is not None:
+            record = self._reader.get(ip_address)
+            return dict(record, ip=ip_address) if record else None
+
+        address = ipaddress.ip_address(ip_address)
+        key = (address.version, int(address))
+        index = bisect.bisect_right(self._starts, key) - 1
+        if index >= 0:
+            (version, start), end, row = self._rows[index]
+            if version == address.version and start <= key[1] <= end:
+                return dict(row, ip=ip_address)
+        return None
+
+def open_local_ip_database(path):
+    """
+    Open the offline IP database if one is configured and readable
+    """
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        database = LocalIPDatabase(path)
+        logging.info(f"Loaded local IP database from {path}")
+        return database
+    except Exception as e:
+        logging.error(f"Error loading local IP database {path}: {e}")
+        return None
+
+local_ip_db = open_local_ip_database(IPINFO_DB_PATH)
+
+# LRU+TTL cache of IP metadata; None marks a failed lookup (negative cache)
+ip_info_cache = TTLCache("ip_info", ttl=IPINFO_CACHE_TTL, max_size=IPINFO_CACHE_SIZE)
+_lookup_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ipinfo")
+_pending_lookups = {}
+_pending_lock = threading.Lock()
+_MISSING = object()
+
+def fetch_ip_info(ip_address):
+    """
+    Look up IP information without the cache: local database first, then IPinfo
     """
+    if local_ip_db is not None:
+        try:
+            info = local_ip_db.lookup(ip_address)
+        except ValueError:
+            return None
+        if info:
+            return info
+
     if not ipinfo_tokens:
         return None
-    
+
     # Use a random token from the list to distribute usage
     token = random.choice(ipinfo_tokens)
-    
+
     try:
-        response = requests.get(f"https://ipinfo.io/{ip_address}?token={token}")
+        response = requests.get(f"{IPINFO_URL}/{ip_address}?token={token}", timeout=IPINFO_TIMEOUT)
         if response.status_code == 200:
             return response.json()
         else:
@@ -33,53 +247,43 @@ def get_ip_info(ip_address):
         logging.error(f"Error in IPinfo query: {e}")
         return None
 
-def get_real_client_ip():
+def _load_ip_info(ip_address, version):
+    info = fetch_ip_info(ip_address)
+    ip_info_cache.set(ip_address, info, version=version,
+                      ttl=None if info else IPINFO_NEGATIVE_TTL)
+    return info
+
+def get_ip_info_async(ip_address):
+    """
+    Get a Future with IP information without blocking the caller.
+    Concurrent lookups of the same IP share one fetch.
+    """
+    info = ip_info_cache.get(ip_address, _MISSING)
+    if info is not _MISSING:
+        future = Future()
+        future.set_result(info)
+        return future
+
+    with _pending_lock:
+        future = _pending_lookups.get(ip_address)
+        if future is None:
+            future = _lookup_executor.submit(_load_ip_info, ip_address, ip_info_cache.version)
+            _pending_lookups[ip_address] = future
+            future.add_done_callback(lambda f: _pending_lookups.pop(ip_address, None))
+    return future
+
+def get_ip_info(ip_address):
+    """
+    Get IP information (cached; blocks only on a cache miss)
     """
-    Get the client's real IP address using various sources and IPinfo service
-    """
-    # Get IP from different headers
-    ip_candidates = []
-    
-    # Try to get IP from different headers in priority order
-    if request.headers.get('X-Forwarded-For'):
-        forwarded_ips = request.headers.get('X-Forwarded-For').split(',')
-        if forwarded_ips:
-            ip_candidates.extend([ip.strip() for ip in forwarded_ips])
-    
-    if request.headers.get('X-Real-IP'):
-        ip_candidates.append(request.headers.get('X-Real-IP').strip())
-    
-    if request.headers.get('CF-Connecting-IP'):  # Cloudflare
-        ip_candidates.append(request.headers.get('CF-Connecting-IP').strip())
-    
-    # Add current request IP
-    if request.remote_addr:
-        ip_candidates.append(request.remote_addr)
-    
-    # Remove private and duplicate IPs
-    filtered_ips = []
-    private_ip_prefixes = ['10.', '172.16.', '172.17.', '172.18.', '172.19.', '172.20.', 
-                          '172.21.', '172.22.', '172.23.', '172.24.', '172.25.', '172.26.', 
-                          '172.27.', '172.28.', '172.29.', '172.30.', '172.31.', '192.168.']
-    
-    for ip in ip_candidates:
-        if ip and not any(ip.startswith(prefix) for prefix in private_ip_prefixes) and ip != '127.0.0.1' and ip != 'localhost':
-            filtered_ips.append(ip)
-    
-    # If we didn't find any public IP, use the first IP we got
-    if not filtered_ips and ip_candidates:
-        return ip_candidates[0]
-    elif not filtered_ips:
-        return request.remote_addr
-    
-    # Use the first public IP we found and verify with IPinfo
-    real_ip = filtered_ips[0]
-    
     try:
-        ip_info = get_ip_info(real_ip)
-        if ip_info and 'ip' in ip_info:
-            return ip_info['ip']  # Use IP verified through IPinfo
+        return get_ip_info_async(ip_address).result(timeout=IPINFO_TIMEOUT + 1)
     except Exception as e:
-        logging.error(f"Error verifying IP through IPinfo: {e}")
-    
-    return real_ip
+        logging.error(f"Error in IPinfo query: {e}")
+        return None
+
+def get_real_client_ip():
+    """
+    Get the client's real IP address from the trusted proxy chain
+    """
+    return resolve_client_ip(request.remote_addr, request.headers)
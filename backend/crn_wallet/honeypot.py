@@ -15,6 +15,11 @@ from functools import wraps
 from pymongo import MongoClient
 import os
 
+try:
+    from backend.crn_wallet.state_backend import state_backend
+except ImportError:
+    from state_backend import state_backend
+
 # تكوين الاتصال بقاعدة البيانات - يجب تعديله حسب إعدادات التطبيق
 try:
     # Get MongoDB URI from config if available, otherwise use default
@@ -156,9 +161,15 @@ def setup_honeypot(app, wallet_db=None):
                 ip_access_attempts[ip]['attempts'] += 1
                 ip_access_attempts[ip]['last_attempt'] = current_time
         
+        # عدّ المحاولات عبر جميع العمال حتى لا يوزع المهاجم طلباته عليهم
+        if state_backend.shared:
+            shared_attempts, _ = state_backend.incr_attempts('honeypot', ip, 86400, current_time)
+            ip_access_attempts[ip]['attempts'] = max(ip_access_attempts[ip]['attempts'], shared_attempts)
+        
         # فحص ما إذا كان يجب حظر عنوان IP
         if ip_access_attempts[ip]['attempts'] >= MAX_ATTEMPTS_BEFORE_BLOCK:
             BLOCKED_IPS.add(ip)
+            state_backend.ban('honeypot', ip, BLOCK_DURATION)
             logging.warning(f"IP {ip} blocked for accessing honeypot paths repeatedly")
             # إضافة إلى قاعدة البيانات إذا كانت متاحة
             if db is not None:
@@ -190,6 +201,10 @@ def setup_honeypot(app, wallet_db=None):
                 else:
                     logging.warning(f"Blocked request from IP: {client_ip}")
                     return jsonify({'error': 'Access denied'}), 403
+            elif state_backend.is_banned('honeypot', client_ip):
+                # محظور من عامل آخر
+                logging.warning(f"Blocked request from IP: {client_ip}")
+                return jsonify({'error': 'Access denied'}), 403
             
             return view_func(*args, **kwargs)
         return decorated_function
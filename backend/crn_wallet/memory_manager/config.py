@@ -15,6 +15,31 @@ from typing import Dict, List, Optional, Any, Union
 
 logger = logging.getLogger("memory_manager")
 
+# Request priority classes for admission control, most important first.
+# limit_share: fraction of the adaptive concurrency limit the class may fill
+# max_concurrency: absolute cap on in-flight requests of the class (None = no cap)
+# max_queue_ms: how long a request may wait for a slot before it is shed
+DEFAULT_PRIORITY_CLASSES = {
+    'critical': {'priority': 0, 'limit_share': 1.0, 'max_concurrency': None, 'max_queue_ms': 2000.0},
+    'high': {'priority': 1, 'limit_share': 0.9, 'max_concurrency': None, 'max_queue_ms': 1000.0},
+    'normal': {'priority': 2, 'limit_share': 0.75, 'max_concurrency': None, 'max_queue_ms': 250.0},
+    'low': {'priority': 3, 'limit_share': 0.5, 'max_concurrency': 8, 'max_queue_ms': 0.0},
+}
+
+# Request path patterns (fnmatch, first match wins) -> priority class
+DEFAULT_ENDPOINT_PRIORITIES = [
+    ('*/staff/login', 'critical'),
+    ('*/staff/verify-token', 'critical'),
+    ('*/staff/refresh-token', 'critical'),
+    ('*/staff/*', 'high'),
+    ('*/wallet/transfer', 'high'),
+    ('*/transactions/export', 'low'),
+    ('*/stats', 'low'),
+    ('*/users/all', 'low'),
+    ('*/users/top-*', 'low'),
+    ('*/logs', 'low'),
+]
+
 @dataclass
 class GarbageCollectionConfig:
     """Configuration for garbage collection optimization"""
@@ -98,6 +123,16 @@ class MonitoringConfig:
     
     # Number of log files to keep
     max_log_files: int = 10
+    
+    # Per-request memory tracking: "sampled", "full" (every request) or "off"
+    request_tracking: str = "sampled"
+    
+    # Fraction of requests measured in sampled mode
+    request_sample_rate: float = 0.05
+    
+    # Per-request measurement source: "rss" (/proc/self/statm) or "tracemalloc"
+    # (exact Python allocations, but traces every allocation; use for profiling sessions)
+    request_memory_source: str = "rss"
 
 @dataclass
 class StressHandlingConfig:
@@ -128,6 +163,18 @@ class StressHandlingConfig:
     
     # Maximum time for stress handling mode (seconds, 0 for unlimited)
     max_stress_time: float = 300.0  # 5 minutes
+    
+    # Admission control: priority classes sharing an adaptive concurrency limit
+    admission_control: bool = True
+    priority_classes: Dict[str, Dict[str, Any]] = field(default_factory=lambda: dict(DEFAULT_PRIORITY_CLASSES))
+    endpoint_priorities: List[Any] = field(default_factory=lambda: list(DEFAULT_ENDPOINT_PRIORITIES))
+    default_priority: str = "normal"
+    
+    # Adaptive limit: shrinks when smoothed latency exceeds the target, grows slowly otherwise
+    latency_target_ms: float = 250.0
+    initial_concurrency_limit: int = 64
+    min_concurrency_limit: int = 4
+    max_concurrency_limit: int = 512
 
 @dataclass
 class SelfHealingConfig:
@@ -205,6 +252,11 @@ class ObjectTrackerConfig(ComponentConfig):
         self.track_types = True
         self.detect_leaks = True
         self.detect_cycles = True
+        # "generational" (young generations exact, oldest sampled), "sampled", or "full" (exhaustive scan)
+        self.census_mode = "generational"
+        self.census_sample_size = 20000
+        # Max objects visited by one on-demand cycle search
+        self.cycle_max_objects = 10000
 
 class HeapAnalyzerConfig(ComponentConfig):
     """Configuration for the heap analyzer component"""
@@ -214,6 +266,14 @@ class HeapAnalyzerConfig(ComponentConfig):
         self.history_size = 24
         self.log_directory = "logs/memory"
         self.deep_analysis = False
+        # "tracemalloc" (snapshots diffed on a worker) or "full" (gc.collect + pympler/guppy every tick)
+        self.analysis_mode = "tracemalloc"
+        self.tracemalloc_frames = 1
+        self.hotspot_limit = 20
+        # Full-heap summaries run at most this often, and only under low load
+        self.full_summary_interval = 3600.0
+        self.low_load_stress_level = 0.5
+        self.low_load_cpu_percent = 40.0
 
 class CriticalSectionConfig(ComponentConfig):
     """Configuration for the critical section analyzer component"""
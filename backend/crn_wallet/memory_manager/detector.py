@@ -16,6 +16,8 @@ import socket
 from typing import Dict, List, Optional, Any, Tuple
 from dataclasses import dataclass, asdict, field
 
+from .sampler import get_resource_sampler
+
 logger = logging.getLogger("memory_manager.detector")
 
 @dataclass
@@ -143,15 +145,15 @@ class SystemDetector:
         self.last_usage = ResourceUsage()
         self.last_check_time = 0.0
         self.last_io_counters = None
-        self.last_net_counters = None
+        self.monitor_interval = 5.0
+        self.refresh_counter = 0
         
         # Initialize history tracking
         self.history_lock = threading.RLock()
         self.usage_history = []
         self.history_size = config.monitoring.history_size if config else 720
         
-        # Background monitoring thread
-        self.monitor_thread = None
+        # Background monitoring runs as a task on the shared resource sampler
         self.running = False
         
         logger.info(f"System detector initialized on {self.system_info.hostname}")
@@ -213,7 +215,18 @@ class SystemDetector:
             return self.system_info
     
     def get_resource_usage(self) -> ResourceUsage:
-        """Get current resource usage snapshot"""
+        """
+        Get current resource usage snapshot.
+        While monitoring is active this returns the last published usage without
+        touching the system; otherwise a detailed sample is collected.
+        """
+        usage = self.current_usage
+        if self.running and time.time() - usage.timestamp < self.monitor_interval * 2:
+            return usage
+        return self._collect_resource_usage(get_resource_sampler().snapshot)
+    
+    def _collect_resource_usage(self, snapshot) -> ResourceUsage:
+        """Build a detailed usage record on top of a shared sampler snapshot"""
         current_time = time.time()
         
         # Create new usage object
@@ -221,23 +234,16 @@ class SystemDetector:
         usage.timestamp = current_time
         
         try:
-            # CPU usage
-            usage.cpu_percent = psutil.cpu_percent(interval=None)
+            # CPU, memory and network come from the shared sampler
+            usage.cpu_percent = snapshot.cpu_percent
             usage.cpu_percent_per_core = psutil.cpu_percent(interval=None, percpu=True)
+            usage.load_averages = list(snapshot.load_averages)
             
-            if hasattr(os, 'getloadavg'):
-                try:
-                    usage.load_averages = list(os.getloadavg())
-                except:
-                    usage.load_averages = []
-            
-            # Memory usage
-            mem = psutil.virtual_memory()
-            usage.memory_used_bytes = mem.used
-            usage.memory_available_bytes = mem.available
-            usage.memory_percent = mem.percent
-            usage.memory_used_gb = mem.used / (1024**3)
-            usage.memory_available_gb = mem.available / (1024**3)
+            usage.memory_used_bytes = snapshot.memory_used_bytes
+            usage.memory_available_bytes = snapshot.memory_available_bytes
+            usage.memory_percent = snapshot.memory_percent
+            usage.memory_used_gb = snapshot.memory_used_bytes / (1024**3)
+            usage.memory_available_gb = snapshot.memory_available_bytes / (1024**3)
             
             # Swap usage
             swap = psutil.swap_memory()
@@ -257,23 +263,17 @@ class SystemDetector:
             self.last_io_counters = io_counters
             
             # Network I/O rates
-            net_counters = psutil.net_io_counters()
-            if net_counters and self.last_net_counters:
-                time_diff = current_time - self.last_check_time
-                if time_diff > 0:
-                    usage.net_sent_bytes_sec = (net_counters.bytes_sent - self.last_net_counters.bytes_sent) / time_diff
-                    usage.net_recv_bytes_sec = (net_counters.bytes_recv - self.last_net_counters.bytes_recv) / time_diff
-                    usage.net_packets_sent_sec = (net_counters.packets_sent - self.last_net_counters.packets_sent) / time_diff
-                    usage.net_packets_recv_sec = (net_counters.packets_recv - self.last_net_counters.packets_recv) / time_diff
-            self.last_net_counters = net_counters
+            usage.net_sent_bytes_sec = snapshot.net_sent_bytes_sec
+            usage.net_recv_bytes_sec = snapshot.net_recv_bytes_sec
+            usage.net_packets_sent_sec = snapshot.net_packets_sent_sec
+            usage.net_packets_recv_sec = snapshot.net_packets_recv_sec
             
             # Process-specific metrics
+            usage.process_memory_bytes = snapshot.process_rss_bytes
+            usage.process_memory_percent = snapshot.process_memory_percent
+            usage.process_cpu_percent = snapshot.process_cpu_percent
             try:
                 proc = self.process
-                proc_mem = proc.memory_info()
-                usage.process_memory_bytes = proc_mem.rss
-                usage.process_memory_percent = proc.memory_percent()
-                usage.process_cpu_percent = proc.cpu_percent(interval=None)
                 usage.process_threads = proc.num_threads()
                 usage.process_open_files = len(proc.open_files())
             except:
@@ -301,48 +301,34 @@ class SystemDetector:
             return usage
     
     def start_monitoring(self, interval_seconds=5.0):
-        """Start background monitoring thread"""
-        if self.monitor_thread and self.monitor_thread.is_alive():
-            logger.warning("Monitoring thread already running")
+        """Start periodic monitoring on the shared resource sampler thread"""
+        if self.running:
+            logger.warning("Monitoring already running")
             return False
         
         self.running = True
-        self.monitor_thread = threading.Thread(
-            target=self._monitoring_loop,
-            args=(interval_seconds,),
-            daemon=True
-        )
-        self.monitor_thread.start()
+        self.monitor_interval = interval_seconds
+        get_resource_sampler().add_task(self._monitoring_task, interval_seconds)
         logger.info(f"System monitoring started with interval: {interval_seconds}s")
         return True
     
     def stop_monitoring(self):
-        """Stop background monitoring thread"""
+        """Stop periodic monitoring"""
         self.running = False
-        if self.monitor_thread:
-            self.monitor_thread.join(timeout=2.0)
+        get_resource_sampler().remove_task(self._monitoring_task)
         logger.info("System monitoring stopped")
     
-    def _monitoring_loop(self, interval_seconds):
-        """Background thread for periodic resource monitoring"""
-        counter = 0
-        while self.running:
-            try:
-                # Get current resource usage
-                self.get_resource_usage()
-                
-                # Refresh system info periodically (every 10 minutes)
-                if counter % 120 == 0:  # 120 * 5 seconds = 10 minutes
-                    self.refresh_system_info()
-                
-                # Increment counter
-                counter += 1
-                
-            except Exception as e:
-                logger.error(f"Error in monitoring loop: {e}")
-            
-            # Sleep for the interval
-            time.sleep(interval_seconds)
+    def _monitoring_task(self, snapshot):
+        """Periodic resource monitoring, run by the shared sampler"""
+        # Build the detailed usage record from the fresh snapshot
+        self._collect_resource_usage(snapshot)
+        
+        # Refresh system info periodically (every 10 minutes)
+        if self.refresh_counter % max(1, int(600 / self.monitor_interval)) == 0:
+            self.refresh_system_info()
+        
+        # Increment counter
+        self.refresh_counter += 1
     
     def get_historical_usage(self, minutes=5) -> List[ResourceUsage]:
         """Get historical resource usage data for the specified number of minutes"""
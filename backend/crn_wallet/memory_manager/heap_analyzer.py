@@ -6,18 +6,37 @@ and optimizing memory allocation patterns.
 
 This module provides tools to understand memory layout, detect fragmentation
 issues, and track allocation patterns over time.
+
+Analysis modes (heap_analyzer.analysis_mode):
+
+- "tracemalloc" (default): each tick takes a tracemalloc snapshot (traced
+  with few frames) and hands it to a worker thread. The worker aggregates it
+  by file/line, diffs it against the previous tick and updates the hotspots.
+  There is no forced gc.collect() or full object walk. A full-heap
+  summarization with pympler/guppy runs at most every full_summary_interval
+  seconds, and only while the StressHandler (or, without one, the shared
+  resource sampler) reports low load.
+- "full": the original in-process gc.collect() + pympler/guppy analysis on
+  every tick.
 """
 
 import os
 import sys
 import time
+import queue
+import heapq
 import logging
 import threading
 import traceback
+import tracemalloc
 from typing import Dict, List, Any, Optional, Tuple, Union
 from collections import defaultdict, deque
 import gc
 
+from .sampler import get_resource_sampler
+from .stress_handler import StressState
+from .utils import get_process_rss
+
 # Try to import optional modules for deeper heap analysis
 try:
     import psutil
@@ -50,17 +69,28 @@ except ImportError:
 
 logger = logging.getLogger("memory_manager.heap_analyzer")
 
+ANALYSIS_MODES = ("tracemalloc", "full")
+
+# Allocations made by the import machinery and tracemalloc itself are not hotspots
+TRACEMALLOC_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
 class HeapAnalyzer:
     """
     Analyzes heap memory layout, detects fragmentation, and provides
     insights into memory allocation patterns.
     """
     
-    def __init__(self, app=None, config=None, system_detector=None):
+    def __init__(self, app=None, config=None, system_detector=None, stress_handler=None):
         """Initialize the heap analyzer"""
         self.app = app
         self.config = config
         self.system_detector = system_detector
+        self.stress_handler = stress_handler
         
         # Configuration defaults
         self.enabled = True
@@ -68,6 +98,12 @@ class HeapAnalyzer:
         self.history_size = 24  # Keep 24 snapshots
         self.log_directory = "logs/memory"
         self.deep_analysis = HAS_PYMPLER or HAS_GUPPY  # Use deep analysis if available
+        self.analysis_mode = "tracemalloc"
+        self.tracemalloc_frames = 1
+        self.hotspot_limit = 20
+        self.full_summary_interval = 3600.0  # seconds between full-heap summarizations
+        self.low_load_stress_level = 0.5  # StressHandler level below which load counts as low
+        self.low_load_cpu_percent = 40.0  # used when no StressHandler is attached
         
         # Override with config if available
         if config and hasattr(config, 'heap_analyzer'):
@@ -76,6 +112,16 @@ class HeapAnalyzer:
             self.history_size = getattr(config.heap_analyzer, 'history_size', self.history_size)
             self.log_directory = getattr(config.heap_analyzer, 'log_directory', self.log_directory)
             self.deep_analysis = getattr(config.heap_analyzer, 'deep_analysis', self.deep_analysis)
+            self.analysis_mode = getattr(config.heap_analyzer, 'analysis_mode', self.analysis_mode)
+            self.tracemalloc_frames = getattr(config.heap_analyzer, 'tracemalloc_frames', self.tracemalloc_frames)
+            self.hotspot_limit = getattr(config.heap_analyzer, 'hotspot_limit', self.hotspot_limit)
+            self.full_summary_interval = getattr(config.heap_analyzer, 'full_summary_interval', self.full_summary_interval)
+            self.low_load_stress_level = getattr(config.heap_analyzer, 'low_load_stress_level', self.low_load_stress_level)
+            self.low_load_cpu_percent = getattr(config.heap_analyzer, 'low_load_cpu_percent', self.low_load_cpu_percent)
+        
+        if self.analysis_mode not in ANALYSIS_MODES:
+            logger.warning(f"Unknown heap analysis mode {self.analysis_mode!r}, using 'tracemalloc'")
+            self.analysis_mode = "tracemalloc"
         
         # Set up data structures for tracking heap metrics
         self.heap_history = deque(maxlen=self.history_size)
@@ -83,9 +129,10 @@ class HeapAnalyzer:
         self.fragmentation_index = 0.0  # 0-1 scale, higher means more fragmented
         self.history_lock = threading.RLock()
         
-        # Advanced analysis tools
+        # Advanced analysis tools (created lazily in tracemalloc mode: SummaryTracker
+        # walks the whole heap when it is created)
         self.pympler_tracker = None
-        if HAS_PYMPLER and self.deep_analysis:
+        if HAS_PYMPLER and self.deep_analysis and self.analysis_mode == "full":
             try:
                 self.pympler_tracker = tracker.SummaryTracker()
                 logger.info("Initialized Pympler memory tracker")
@@ -95,6 +142,32 @@ class HeapAnalyzer:
         # Analysis thread
         self.analyzer_thread = None
         self.running = False
+        self.paused = False
+        
+        # Snapshot processing worker (tracemalloc mode); holds at most one pending snapshot
+        self.worker_thread = None
+        self._snapshot_queue = queue.Queue(maxsize=1)
+        self._processing_lock = threading.Lock()
+        self._previous_lines = None  # (filename, lineno) -> (size, count) of the previous snapshot
+        self._started_tracemalloc = False  # stop tracing on stop_analysis() only if we started it
+        self.hotspots = []
+        self.last_full_summary = 0.0
+        
+        # Analysis cost
+        self.snapshots_taken = 0
+        self.snapshots_dropped = 0
+        self.full_summaries = 0
+        self.full_summaries_deferred = 0
+        self.last_snapshot_ms = 0.0
+        self.last_processing_ms = 0.0
+        
+        # Let the stress handler pause snapshots under load
+        if stress_handler is not None:
+            stress_handler.register_background_task(
+                'heap_analyzer',
+                pause_function=self.pause_analysis,
+                resume_function=self.resume_analysis
+            )
         
         # Initialize heap monitoring
         if self.enabled:
@@ -106,6 +179,8 @@ class HeapAnalyzer:
         
         # Log available analysis tools
         available_tools = []
+        if self.analysis_mode == "tracemalloc":
+            available_tools.append("tracemalloc")
         if HAS_PSUTIL:
             available_tools.append("psutil")
         if HAS_GUPPY:
@@ -140,7 +215,16 @@ class HeapAnalyzer:
             name="heap-analyzer"
         )
         self.analyzer_thread.start()
-        logger.info(f"Heap analysis started with interval: {self.analysis_interval}s")
+        
+        if self.analysis_mode == "tracemalloc" and not (self.worker_thread and self.worker_thread.is_alive()):
+            self.worker_thread = threading.Thread(
+                target=self._worker_loop,
+                daemon=True,
+                name="heap-analyzer-worker"
+            )
+            self.worker_thread.start()
+        
+        logger.info(f"Heap analysis started with interval: {self.analysis_interval}s (mode: {self.analysis_mode})")
         return True
     
     def stop_analysis(self):
@@ -148,17 +232,40 @@ class HeapAnalyzer:
         self.running = False
         if self.analyzer_thread:
             self.analyzer_thread.join(timeout=2.0)
+        if self.worker_thread:
+            self.worker_thread.join(timeout=2.0)
+        if self._started_tracemalloc:
+            # Tracing costs memory and time on every allocation; don't leave it on after we stop
+            with self._processing_lock:
+                if tracemalloc.is_tracing():
+                    tracemalloc.stop()
+                self._started_tracemalloc = False
+                self._previous_lines = None
         logger.info("Heap analysis stopped")
     
+    def pause_analysis(self):
+        """Skip analysis ticks until resume_analysis() (used by the stress handler)"""
+        self.paused = True
+    
+    def resume_analysis(self):
+        """Resume analysis ticks after pause_analysis()"""
+        self.paused = False
+    
     def _analysis_loop(self):
         """Background thread for heap analysis"""
         while self.running:
             try:
-                # Analyze heap
-                self._analyze_heap()
-                
-                # Detect fragmentation
-                self._analyze_fragmentation()
+                if self.paused:
+                    pass
+                elif self.analysis_mode == "tracemalloc":
+                    # Processing and fragmentation analysis happen on the worker
+                    self._queue_snapshot()
+                else:
+                    # Analyze heap
+                    self._analyze_heap()
+                    
+                    # Detect fragmentation
+                    self._analyze_fragmentation()
                 
             except Exception as e:
                 logger.error(f"Error in heap analysis loop: {e}")
@@ -167,6 +274,240 @@ class HeapAnalyzer:
             # Sleep for the analysis interval
             time.sleep(self.analysis_interval)
     
+    def _worker_loop(self):
+        """Process queued tracemalloc snapshots off the analysis and request threads"""
+        while self.running:
+            try:
+                snapshot, taken_at = self._snapshot_queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            try:
+                self._process_snapshot(snapshot, taken_at)
+            except Exception as e:
+                logger.error(f"Error processing heap snapshot: {e}")
+                logger.error(traceback.format_exc())
+            finally:
+                del snapshot
+    
+    def _take_snapshot(self):
+        """Take a tracemalloc snapshot, starting tracing on first use"""
+        if not tracemalloc.is_tracing():
+            # Few frames per allocation keep tracing overhead and snapshot size low
+            tracemalloc.start(self.tracemalloc_frames)
+            self._started_tracemalloc = True
+        start = time.perf_counter()
+        snapshot = tracemalloc.take_snapshot()
+        self.last_snapshot_ms = (time.perf_counter() - start) * 1000
+        self.snapshots_taken += 1
+        return snapshot, time.time()
+    
+    def _queue_snapshot(self):
+        """Take a snapshot and hand it to the worker; dropped if the worker is still busy"""
+        snapshot, taken_at = self._take_snapshot()
+        try:
+            self._snapshot_queue.put_nowait((snapshot, taken_at))
+        except queue.Full:
+            self.snapshots_dropped += 1
+    
+    def is_low_load(self):
+        """Check if the process is quiet enough for a full-heap summarization"""
+        handler = self.stress_handler
+        if handler is not None:
+            if handler.current_state != StressState.NORMAL or handler.background_tasks_paused:
+                return False
+            history = handler.resource_history
+            return not history or history[-1][1] < self.low_load_stress_level
+        return get_resource_sampler().snapshot.cpu_percent < self.low_load_cpu_percent
+    
+    def _process_snapshot(self, snapshot, taken_at):
+        """Aggregate a snapshot by file/line, diff it with the previous one and record the metrics"""
+        with self._processing_lock:
+            start = time.perf_counter()
+            stats = snapshot.filter_traces(TRACEMALLOC_FILTERS).statistics('lineno')
+            
+            lines = {}
+            files = defaultdict(lambda: [0, 0])
+            traced_bytes = traced_blocks = 0
+            for stat in stats:
+                frame = stat.traceback[0]
+                lines[(frame.filename, frame.lineno)] = (stat.size, stat.count)
+                totals = files[frame.filename]
+                totals[0] += stat.size
+                totals[1] += stat.count
+                traced_bytes += stat.size
+                traced_blocks += stat.count
+            
+            previous = self._previous_lines
+            self._previous_lines = lines
+            limit = self.hotspot_limit
+            
+            # statistics() is sorted by size, largest first
+            hotspots = []
+            for stat in stats[:limit]:
+                frame = stat.traceback[0]
+                prev_size, prev_count = (previous if previous is not None else lines).get((frame.filename, frame.lineno), (0, 0))
+                hotspots.append({
+                    'file': frame.filename,
+                    'line': frame.lineno,
+                    'size_kb': stat.size / 1024,
+                    'count': stat.count,
+                    'avg_size_bytes': stat.size // stat.count if stat.count else 0,
+                    'size_delta_kb': (stat.size - prev_size) / 1024,
+                    'count_delta': stat.count - prev_count
+                })
+            
+            top_files = [
+                {'file': filename, 'size_kb': size / 1024, 'count': count}
+                for filename, (size, count) in heapq.nlargest(limit, files.items(), key=lambda item: item[1][0])
+            ]
+            
+            current_gc_total = sum(gc.get_count())
+            gc_count_delta = current_gc_total - self.last_gc_count
+            self.last_gc_count = current_gc_total
+            
+            process_memory = get_process_rss()
+            traced_current, traced_peak = tracemalloc.get_traced_memory()
+            metrics = {
+                'timestamp': taken_at,
+                'analysis_mode': 'tracemalloc',
+                'process_memory_bytes': process_memory,
+                'process_memory_mb': process_memory / (1024 * 1024),
+                'gc_stats': {
+                    'collections': gc.get_count(),
+                    # Traced blocks stand in for the object count, which would need a full heap walk
+                    'objects': traced_blocks,
+                    'garbage': len(gc.garbage)
+                },
+                'gc_count_delta': gc_count_delta,
+                'fragmentation_index': self.fragmentation_index,
+                'traced_bytes': traced_bytes,
+                'traced_blocks': traced_blocks,
+                'traced_peak_bytes': traced_peak,
+                'tracemalloc_overhead_bytes': tracemalloc.get_tracemalloc_memory(),
+                'hotspots': hotspots,
+                'top_files': top_files
+            }
+            
+            if previous is not None:
+                changes = (
+                    (key, lines.get(key, (0, 0)), previous.get(key, (0, 0)))
+                    for key in lines.keys() | previous.keys()
+                )
+                metrics['memory_diff'] = [
+                    {
+                        'location': f"{filename}:{lineno}",
+                        'size_delta': size - prev_size,
+                        'count_delta': count - prev_count
+                    }
+                    for (filename, lineno), (size, count), (prev_size, prev_count) in heapq.nlargest(
+                        limit, changes, key=lambda change: abs(change[1][0] - change[2][0]))
+                    if size != prev_size
+                ]
+            
+            # Full-heap summarization only when the process is quiet
+            if self.deep_analysis and (HAS_PYMPLER or HAS_GUPPY) and \
+                    time.time() - self.last_full_summary >= self.full_summary_interval:
+                if self.is_low_load():
+                    gc.collect()
+                    self._add_full_heap_summary(metrics)
+                    self.last_full_summary = time.time()
+                    self.full_summaries += 1
+                else:
+                    self.full_summaries_deferred += 1
+            
+            with self.history_lock:
+                self.heap_history.append(metrics)
+                self.hotspots = hotspots
+            
+            self._analyze_fragmentation()
+            self.last_processing_ms = (time.perf_counter() - start) * 1000
+            
+            logger.info(f"Heap snapshot processed: {traced_bytes / (1024 * 1024):.1f}MB traced in "
+                        f"{len(lines)} lines, {self.last_processing_ms:.0f}ms")
+            return metrics
+    
+    def _add_full_heap_summary(self, metrics):
+        """Add pympler/guppy whole-heap statistics to metrics (walks every object)"""
+        if HAS_PYMPLER and self.deep_analysis and self.pympler_tracker is None:
+            try:
+                self.pympler_tracker = tracker.SummaryTracker()
+                logger.info("Initialized Pympler memory tracker")
+            except Exception as e:
+                logger.warning(f"Failed to initialize Pympler tracker: {e}")
+        
+        # Add Pympler metrics if available
+        if self.pympler_tracker:
+            try:
+                # Get detailed size by type
+                all_objects = muppy.get_objects()
+                sum_data = summary.summarize(all_objects)
+                
+                # Extract top types by size
+                type_stats = []
+                for row in sum_data:
+                    type_stats.append({
+                        'type': str(row[0]),
+                        'count': row[1],
+                        'size_bytes': row[2]
+                    })
+                
+                # Sort by size (descending)
+                metrics['top_types_by_size'] = sorted(
+                    type_stats, 
+                    key=lambda x: x['size_bytes'], 
+                    reverse=True
+                )[:10]  # Top 10
+                
+                # Get memory diff since last snapshot
+                try:
+                    diff = self.pympler_tracker.diff()
+                    # Convert to simpler dict format
+                    diff_data = []
+                    for row in diff:
+                        diff_data.append({
+                            'type': str(row[0]),
+                            'count_delta': row[1],
+                            'size_delta': row[2]
+                        })
+                    
+                    metrics.setdefault('memory_diff', sorted(
+                        diff_data, 
+                        key=lambda x: abs(x['size_delta']), 
+                        reverse=True
+                    )[:10])  # Top 10 changes
+                except Exception as e:
+                    logger.debug(f"Error getting memory diff: {e}")
+                    
+            except Exception as e:
+                logger.warning(f"Error collecting Pympler metrics: {e}")
+        
+        # Add Guppy metrics if available
+        if HAS_GUPPY and self.deep_analysis:
+            try:
+                h = hpy()
+                heap = h.heap()
+                metrics['heap_size'] = heap.size
+                metrics['heap_count'] = heap.count
+                
+                # Get top 10 types by size
+                guppy_stats = []
+                for row in heap.byrcs:
+                    guppy_stats.append({
+                        'type': str(row.rcs.rs_name),
+                        'count': row.rcs.rs_ninstance,
+                        'size_bytes': row.size
+                    })
+                
+                if not metrics.get('top_types_by_size'):
+                    metrics['top_types_by_size'] = sorted(
+                        guppy_stats, 
+                        key=lambda x: x['size_bytes'], 
+                        reverse=True
+                    )[:10]  # Top 10
+                    
+            except Exception as e:
+                logger.debug(f"Error collecting Guppy metrics: {e}")
+    
     def _analyze_heap(self):
         """Analyze heap memory usage and collect metrics"""
         try:
@@ -206,78 +547,8 @@ class HeapAnalyzer:
                 'fragmentation_index': self.fragmentation_index
             }
             
-            # Add Pympler metrics if available
-            if self.pympler_tracker:
-                try:
-                    # Get detailed size by type
-                    all_objects = muppy.get_objects()
-                    sum_data = summary.summarize(all_objects)
-                    
-                    # Extract top types by size
-                    type_stats = []
-                    for row in sum_data:
-                        type_stats.append({
-                            'type': str(row[0]),
-                            'count': row[1],
-                            'size_bytes': row[2]
-                        })
-                    
-                    # Sort by size (descending)
-                    metrics['top_types_by_size'] = sorted(
-                        type_stats, 
-                        key=lambda x: x['size_bytes'], 
-                        reverse=True
-                    )[:10]  # Top 10
-                    
-                    # Get memory diff since last snapshot
-                    try:
-                        diff = self.pympler_tracker.diff()
-                        # Convert to simpler dict format
-                        diff_data = []
-                        for row in diff:
-                            diff_data.append({
-                                'type': str(row[0]),
-                                'count_delta': row[1],
-                                'size_delta': row[2]
-                            })
-                        
-                        metrics['memory_diff'] = sorted(
-                            diff_data, 
-                            key=lambda x: abs(x['size_delta']), 
-                            reverse=True
-                        )[:10]  # Top 10 changes
-                    except Exception as e:
-                        logger.debug(f"Error getting memory diff: {e}")
-                        
-                except Exception as e:
-                    logger.warning(f"Error collecting Pympler metrics: {e}")
-            
-            # Add Guppy metrics if available
-            if HAS_GUPPY and self.deep_analysis:
-                try:
-                    h = hpy()
-                    heap = h.heap()
-                    metrics['heap_size'] = heap.size
-                    metrics['heap_count'] = heap.count
-                    
-                    # Get top 10 types by size
-                    guppy_stats = []
-                    for row in heap.byrcs:
-                        guppy_stats.append({
-                            'type': str(row.rcs.rs_name),
-                            'count': row.rcs.rs_ninstance,
-                            'size_bytes': row.size
-                        })
-                    
-                    if not metrics.get('top_types_by_size'):
-                        metrics['top_types_by_size'] = sorted(
-                            guppy_stats, 
-                            key=lambda x: x['size_bytes'], 
-                            reverse=True
-                        )[:10]  # Top 10
-                        
-                except Exception as e:
-                    logger.debug(f"Error collecting Guppy metrics: {e}")
+            # Add Pympler/Guppy metrics if available
+            self._add_full_heap_summary(metrics)
             
             # Save metrics to history
             with self.history_lock:
@@ -324,11 +595,12 @@ class HeapAnalyzer:
                     # GC ran but memory still grew - possible fragmentation
                     gc_factor = min(1.0, 0.2 * (current['gc_count_delta']))
                 
-                # 3. Process memory vs. actual object size ratio (if available from Pympler)
+                # 3. Process memory vs. actual object size ratio (tracemalloc or Pympler)
                 object_size_factor = 0.0
-                if 'top_types_by_size' in current:
-                    # Sum the sizes of all top objects
-                    total_object_size = sum(item['size_bytes'] for item in current['top_types_by_size'])
+                if 'traced_bytes' in current or 'top_types_by_size' in current:
+                    # Bytes held by live Python allocations, else the sizes of the top types
+                    total_object_size = current.get('traced_bytes') or sum(
+                        item['size_bytes'] for item in current.get('top_types_by_size', []))
                     # If objects take less space than process memory, the rest might be fragmentation
                     if total_object_size > 0 and current['process_memory_bytes'] > total_object_size:
                         ratio = (current['process_memory_bytes'] - total_object_size) / current['process_memory_bytes']
@@ -376,6 +648,11 @@ class HeapAnalyzer:
             if 'memory_diff' in latest:
                 summary['memory_diff'] = latest['memory_diff']
             
+            # Add tracemalloc aggregates if available
+            for key in ('traced_bytes', 'traced_peak_bytes', 'tracemalloc_overhead_bytes', 'hotspots', 'top_files'):
+                if key in latest:
+                    summary[key] = latest[key]
+            
             return summary
     
     def get_fragmentation_history(self):
@@ -393,6 +670,11 @@ class HeapAnalyzer:
     def run_immediate_analysis(self):
         """Run an immediate heap analysis"""
         try:
+            if self.analysis_mode == "tracemalloc":
+                # Processed in the caller's thread; the full-heap summary still waits for low load
+                snapshot, taken_at = self._take_snapshot()
+                return self._process_snapshot(snapshot, taken_at)
+            
             # Force garbage collection
             gc.collect()
             
@@ -414,6 +696,11 @@ class HeapAnalyzer:
         Returns:
             List of allocation hotspots if available
         """
+        # Per file/line hotspots from the latest processed tracemalloc snapshot
+        if self.analysis_mode == "tracemalloc":
+            with self.history_lock:
+                return list(self.hotspots)
+        
         # This is expensive, so we only do it on request
         hotspots = []
         
@@ -502,14 +789,15 @@ class HeapAnalyzer:
             if 'memory_diff' in latest:
                 for diff in latest['memory_diff']:
                     if diff['size_delta'] > 1024 * 1024:  # >1MB
+                        growing = f"allocations at {diff['location']}" if 'location' in diff else f"object type: {diff['type']}"
                         suggestions.append({
-                            'issue': f"Rapidly growing object type: {diff['type']} (+{diff['size_delta']/(1024*1024):.1f}MB)",
+                            'issue': f"Rapidly growing {growing} (+{diff['size_delta']/(1024*1024):.1f}MB)",
                             'suggestion': 'Review lifecycle management and potential memory leaks',
                             'priority': 'High'
                         })
         
         # Add general suggestions based on available tools
-        if not HAS_PYMPLER and not HAS_GUPPY:
+        if not HAS_PYMPLER and not HAS_GUPPY and self.analysis_mode == "full":
             suggestions.append({
                 'issue': 'Limited heap analysis capabilities',
                 'suggestion': 'Install Pympler or Guppy for more detailed memory diagnostics',
@@ -525,7 +813,16 @@ class HeapAnalyzer:
             'snapshots_count': len(self.heap_history),
             'deep_analysis_available': self.deep_analysis,
             'pympler_available': HAS_PYMPLER,
-            'guppy_available': HAS_GUPPY
+            'guppy_available': HAS_GUPPY,
+            'analysis_mode': self.analysis_mode,
+            'paused': self.paused,
+            'snapshots_taken': self.snapshots_taken,
+            'snapshots_dropped': self.snapshots_dropped,
+            'last_snapshot_ms': round(self.last_snapshot_ms, 2),
+            'last_processing_ms': round(self.last_processing_ms, 2),
+            'full_summaries': self.full_summaries,
+            'full_summaries_deferred': self.full_summaries_deferred,
+            'tracemalloc_overhead_bytes': tracemalloc.get_tracemalloc_memory() if tracemalloc.is_tracing() else 0
         }
     
     def register(self, app=None):
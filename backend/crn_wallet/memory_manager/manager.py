@@ -20,6 +20,7 @@ from .monitor import MemoryMonitor
 from .object_tracker import ObjectTracker
 from .heap_analyzer import HeapAnalyzer  
 from .critical_section import CriticalSectionAnalyzer
+from .stress_handler import StressHandler
 
 logger = logging.getLogger("memory_manager.manager")
 
@@ -29,13 +30,14 @@ class MemoryManager:
     capabilities including monitoring, analysis, and optimization.
     """
     
-    def __init__(self, app=None, config=None):
+    def __init__(self, app=None, config=None, stress_handler=None):
         """
         Initialize the memory manager with optional Flask app and configuration.
         
         Args:
             app: Optional Flask application to register with
             config: Optional configuration object or dictionary
+            stress_handler: Optional StressHandler to share; one is created if not given
         """
         self.app = app
         self.config = config
@@ -43,6 +45,8 @@ class MemoryManager:
         
         # Core components
         self.memory_monitor = None
+        self.stress_handler = stress_handler
+        self._owns_stress_handler = stress_handler is None
         
         # Advanced analysis components
         self.object_tracker = None
@@ -100,8 +104,16 @@ class MemoryManager:
         if self.initialized:
             return self
         
+        # Stress handler, so background analysis can back off under load
+        if self.stress_handler is None:
+            try:
+                self.stress_handler = StressHandler(app=self.app, config=self.config)
+                self.component_status['stress_handler'] = 'initialized'
+            except Exception as e:
+                logger.error(f"Error initializing stress handler: {e}")
+        
         # Initialize core monitor
-        self.memory_monitor = MemoryMonitor(app=self.app, config=self.config)
+        self.memory_monitor = MemoryMonitor(app=self.app, config=self.config, stress_handler=self.stress_handler)
         self.component_status['monitor'] = 'initialized'
         
         # Initialize advanced components
@@ -118,7 +130,8 @@ class MemoryManager:
             self.heap_analyzer = HeapAnalyzer(
             app=self.app,
             config=self.config,
-                system_detector=self.memory_monitor.system_detector if hasattr(self.memory_monitor, 'system_detector') else None
+                system_detector=self.memory_monitor.system_detector if hasattr(self.memory_monitor, 'system_detector') else None,
+                stress_handler=self.stress_handler
         )
             self.component_status['heap_analyzer'] = 'initialized'
         
@@ -155,6 +168,15 @@ class MemoryManager:
                 logger.error(f"Error starting memory monitor: {e}")
                 self.component_status['monitor'] = 'error'
         
+        # Start stress monitoring (a shared handler is started by its owner)
+        if self.stress_handler and self._owns_stress_handler and self.stress_handler.enabled:
+            try:
+                self.stress_handler.start_monitoring()
+                self.component_status['stress_handler'] = 'active'
+            except Exception as e:
+                logger.error(f"Error starting stress handler: {e}")
+                self.component_status['stress_handler'] = 'error'
+        
         # Start advanced components
         try:
             # Object Tracker
@@ -210,6 +232,13 @@ class MemoryManager:
         except Exception as e:
             logger.error(f"Error stopping advanced memory components: {e}")
         
+        if self.stress_handler and self._owns_stress_handler:
+            try:
+                self.stress_handler.stop_monitoring()
+                self.component_status['stress_handler'] = 'stopped'
+            except Exception as e:
+                logger.error(f"Error stopping stress handler: {e}")
+        
         logger.info("Memory manager stopped all components")
         return self
     
@@ -244,7 +273,10 @@ class MemoryManager:
                 'active': self.object_tracker.is_tracking,
                 'tracked_objects': obj_metrics.get('tracked_objects', 0),
                 'retain_cycles': obj_metrics.get('retain_cycles', 0),
-                'dangling_pointers': obj_metrics.get('dangling_pointers', 0)
+                'dangling_pointers': obj_metrics.get('dangling_pointers', 0),
+                'census_mode': obj_metrics.get('census_mode'),
+                'last_pause_ms': obj_metrics.get('last_pause_ms', 0),
+                'overhead_bytes': obj_metrics.get('overhead_bytes', 0)
             }
         
         # Heap Analyzer status
@@ -465,6 +497,9 @@ class MemoryManager:
         if self.object_tracker:
             try:
                 results['objects'] = self.object_tracker.get_object_summary()
+                # Cycle search is bounded and only runs when asked for
+                if getattr(getattr(self.config, 'object_tracker', None), 'detect_cycles', True):
+                    results['cycles'] = self.object_tracker.find_cycles()
             except Exception as e:
                 logger.error(f"Error running immediate object analysis: {e}")
         
@@ -0,0 +1,291 @@
+"""
+Resource Sampler Module
+---------------------
+A single background thread samples CPU, memory, network rates and process RSS
+at a fixed cadence and publishes each result as an immutable ResourceSnapshot.
+Readers get the latest snapshot with one attribute read: no locks, no system
+calls and no sleeps on the caller's path.
+
+Uses psutil when available and falls back to /proc on Linux.
+"""
+
+import os
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Tuple, Optional, Callable, List
+
+from .utils import get_process_rss
+
+try:
+    import psutil
+    HAS_PSUTIL = True
+except ImportError:
+    HAS_PSUTIL = False
+
+logger = logging.getLogger("memory_manager.sampler")
+
+# Assumed link capacity for network usage percentages (1 Gbps)
+DEFAULT_NETWORK_CAPACITY_BITS = 1000 * 1000 * 1000
+
+
+@dataclass(frozen=True)
+class ResourceSnapshot:
+    """Resource usage at one instant; never modified after publication"""
+    timestamp: float = 0.0
+    cpu_percent: float = 0.0
+    load_averages: Tuple[float, ...] = ()
+    memory_percent: float = 0.0
+    memory_used_bytes: int = 0
+    memory_available_bytes: int = 0
+    net_sent_bytes_sec: float = 0.0
+    net_recv_bytes_sec: float = 0.0
+    net_packets_sent_sec: float = 0.0
+    net_packets_recv_sec: float = 0.0
+    process_rss_bytes: int = 0
+    process_cpu_percent: float = 0.0
+    sample_duration_ms: float = 0.0
+
+    @property
+    def age(self) -> float:
+        """Seconds since the snapshot was taken"""
+        return time.time() - self.timestamp
+
+    @property
+    def process_memory_percent(self) -> float:
+        """Process RSS as a percentage of total system memory"""
+        total = self.memory_used_bytes + self.memory_available_bytes
+        return self.process_rss_bytes / total * 100 if total else 0.0
+
+    def network_usage_percent(self, capacity_bits: float = DEFAULT_NETWORK_CAPACITY_BITS) -> float:
+        """Network throughput as a percentage of the link capacity"""
+        bits_per_sec = (self.net_sent_bytes_sec + self.net_recv_bytes_sec) * 8
+        return min(100.0, bits_per_sec / capacity_bits * 100)
+
+
+def _read_proc_cpu_times():
+    """(busy, total) jiffies from the aggregate line of /proc/stat"""
+    with open('/proc/stat', 'rb') as f:
+        values = [int(v) for v in f.readline().split()[1:]]
+    idle = values[3] + (values[4] if len(values) > 4 else 0)
+    total = sum(values[:8])
+    return total - idle, total
+
+
+def _read_proc_meminfo():
+    """(used, available) bytes from /proc/meminfo"""
+    info = {}
+    with open('/proc/meminfo', 'rb') as f:
+        for line in f:
+            key, value = line.split(b':', 1)
+            info[key] = int(value.split()[0]) * 1024
+    total = info.get(b'MemTotal', 0)
+    available = info.get(b'MemAvailable', info.get(b'MemFree', 0))
+    return total - available, available
+
+
+def _read_proc_net():
+    """(bytes_sent, bytes_recv, packets_sent, packets_recv) summed over /proc/net/dev"""
+    sent = recv = packets_sent = packets_recv = 0
+    with open('/proc/net/dev', 'rb') as f:
+        for line in f.readlines()[2:]:
+            fields = line.split(b':', 1)[1].split()
+            recv += int(fields[0])
+            packets_recv += int(fields[1])
+            sent += int(fields[8])
+            packets_sent += int(fields[9])
+    return sent, recv, packets_sent, packets_recv
+
+
+class ResourceSampler:
+    """Samples system resources on one background thread and publishes snapshots"""
+
+    def __init__(self, interval: float = 1.0, network_capacity_bits: float = DEFAULT_NETWORK_CAPACITY_BITS):
+        """
+        Args:
+            interval: Seconds between samples
+            network_capacity_bits: Link capacity used for network usage percentages
+        """
+        self.interval = interval
+        self.network_capacity_bits = network_capacity_bits
+        self._snapshot = ResourceSnapshot()
+        self._previous = None  # raw counters of the previous sample
+        self._tasks: List[List] = []  # [callback, interval, last_run]
+        self._tasks_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self.samples_taken = 0
+        self.errors = 0
+
+        if HAS_PSUTIL:
+            self._process = psutil.Process(os.getpid())
+            # Prime the non-blocking percentage counters
+            psutil.cpu_percent(interval=None)
+            self._process.cpu_percent(interval=None)
+
+    @property
+    def snapshot(self) -> ResourceSnapshot:
+        """The latest published snapshot (sampled synchronously if none exists yet)"""
+        snapshot = self._snapshot
+        if snapshot.timestamp == 0.0:
+            snapshot = self.sample()
+        return snapshot
+
+    def _read_counters(self):
+        """Raw cumulative counters; rates are computed against the previous sample"""
+        now = time.time()
+        if HAS_PSUTIL:
+            net = psutil.net_io_counters()
+            mem = psutil.virtual_memory()
+            return {
+                'time': now,
+                'cpu_percent': psutil.cpu_percent(interval=None),
+                'process_cpu_percent': self._process.cpu_percent(interval=None),
+                'memory': (mem.used, mem.available, mem.percent),
+                'net': (net.bytes_sent, net.bytes_recv, net.packets_sent, net.packets_recv) if net else (0, 0, 0, 0),
+            }
+
+        counters = {'time': now, 'cpu_times': _read_proc_cpu_times(), 'process_times': sum(os.times()[:2])}
+        used, available = _read_proc_meminfo()
+        total = used + available
+        counters['memory'] = (used, available, used / total * 100 if total else 0.0)
+        counters['net'] = _read_proc_net()
+        return counters
+
+    def sample(self) -> ResourceSnapshot:
+        """Take a sample now and publish it"""
+        start = time.perf_counter()
+        try:
+            current = self._read_counters()
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error sampling resources: {e}")
+            return self._snapshot
+
+        previous = self._previous
+        elapsed = current['time'] - previous['time'] if previous else 0
+
+        if HAS_PSUTIL:
+            cpu_percent = current['cpu_percent']
+            process_cpu_percent = current['process_cpu_percent']
+        elif previous:
+            busy = current['cpu_times'][0] - previous['cpu_times'][0]
+            total = current['cpu_times'][1] - previous['cpu_times'][1]
+            cpu_percent = busy / total * 100 if total > 0 else 0.0
+            process_cpu_percent = (current['process_times'] - previous['process_times']) / elapsed * 100 if elapsed > 0 else 0.0
+        else:
+            cpu_percent = process_cpu_percent = 0.0
+
+        if previous and elapsed > 0:
+            rates = [(now - before) / elapsed for now, before in zip(current['net'], previous['net'])]
+        else:
+            rates = [0.0, 0.0, 0.0, 0.0]
+
+        load_averages = ()
+        if hasattr(os, 'getloadavg'):
+            try:
+                load_averages = tuple(os.getloadavg())
+            except OSError:
+                pass
+
+        used, available, memory_percent = current['memory']
+        snapshot = ResourceSnapshot(
+            timestamp=current['time'],
+            cpu_percent=cpu_percent,
+            load_averages=load_averages,
+            memory_percent=memory_percent,
+            memory_used_bytes=used,
+            memory_available_bytes=available,
+            net_sent_bytes_sec=rates[0],
+            net_recv_bytes_sec=rates[1],
+            net_packets_sent_sec=rates[2],
+            net_packets_recv_sec=rates[3],
+            process_rss_bytes=get_process_rss(),
+            process_cpu_percent=process_cpu_percent,
+            sample_duration_ms=(time.perf_counter() - start) * 1000
+        )
+
+        self._previous = current
+        # A single reference assignment: readers see the old or the new snapshot, never a mix
+        self._snapshot = snapshot
+        self.samples_taken += 1
+        return snapshot
+
+    def add_task(self, callback: Callable[[ResourceSnapshot], None], interval: float):
+        """Run callback(snapshot) on the sampler thread every interval seconds"""
+        with self._tasks_lock:
+            self._tasks.append([callback, interval, 0.0])
+
+    def remove_task(self, callback: Callable[[ResourceSnapshot], None]):
+        """Stop running a callback added with add_task"""
+        with self._tasks_lock:
+            self._tasks = [task for task in self._tasks if task[0] != callback]
+
+    def _run_tasks(self, snapshot):
+        now = time.time()
+        with self._tasks_lock:
+            due = [task for task in self._tasks if now - task[2] >= task[1]]
+            for task in due:
+                task[2] = now
+        for callback, _, _ in due:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logger.error(f"Error in resource sampler task {getattr(callback, '__qualname__', callback)}: {e}")
+
+    def _loop(self):
+        while self._running:
+            started = time.time()
+            snapshot = self.sample()
+            self._run_tasks(snapshot)
+            time.sleep(max(0.05, self.interval - (time.time() - started)))
+
+    @property
+    def is_running(self) -> bool:
+        return self._running and self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the sampling thread"""
+        if self.is_running:
+            return self
+        self._running = True
+        self.sample()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="resource-sampler")
+        self._thread.start()
+        logger.info(f"Resource sampler started with interval: {self.interval}s")
+        return self
+
+    def stop(self):
+        """Stop the sampling thread"""
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=2.0)
+
+    def get_metrics(self):
+        """Sampler health metrics"""
+        snapshot = self._snapshot
+        return {
+            'running': self.is_running,
+            'interval_seconds': self.interval,
+            'samples_taken': self.samples_taken,
+            'errors': self.errors,
+            'snapshot_age_seconds': round(snapshot.age, 3) if snapshot.timestamp else None,
+            'last_sample_ms': round(snapshot.sample_duration_ms, 3),
+            'tasks': len(self._tasks),
+            'source': 'psutil' if HAS_PSUTIL else 'procfs',
+        }
+
+
+_sampler: Optional[ResourceSampler] = None
+_sampler_lock = threading.Lock()
+
+
+def get_resource_sampler(interval: float = 1.0) -> ResourceSampler:
+    """Get the process-wide sampler, starting it on first use"""
+    global _sampler
+    if _sampler is None:
+        with _sampler_lock:
+            if _sampler is None:
+                _sampler = ResourceSampler(interval=interval).start()
+    return _sampler
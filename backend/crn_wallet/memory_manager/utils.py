@@ -17,6 +17,33 @@ from collections import defaultdict
 
 logger = logging.getLogger("memory_manager.utils")
 
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+_psutil_process = None
+
+def get_process_rss():
+    """
+    Get the resident set size of this process in bytes.
+    Reads /proc/self/statm where available (a few microseconds), falling back
+    to psutil; returns 0 if neither works.
+    """
+    global _psutil_process
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        if _psutil_process is None:
+            import psutil
+            _psutil_process = psutil.Process()
+        return _psutil_process.memory_info().rss
+    except Exception:
+        return 0
+
 # Object size estimation utilities
 def get_size(obj, seen=None):
     """Recursively find size of objects in bytes"""
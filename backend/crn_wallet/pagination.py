@@ -0,0 +1,172 @@
+"""
+Keyset (cursor) pagination helpers for MongoDB listings.
+
+skip((page - 1) * limit) makes the server walk and discard every earlier
+document, so deep pages get linearly slower. A keyset cursor remembers the
+(sort value, _id) of the last document shown and the next page starts with a
+range query on that pair, which an index on (sort field, _id) answers in
+constant time regardless of depth.
+
+Cursors are opaque URL-safe tokens; clients pass them back as ?after= or
+?before=. Listings keep accepting ?page= as a fallback.
+"""
+
+import base64
+from bson import json_util
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor token cannot be decoded"""
+
+
+def encode_cursor(sort_value, doc_id):
+    """Encode the (sort value, _id) of a document into an opaque token"""
+    raw = json_util.dumps([sort_value, doc_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a token produced by encode_cursor() into (sort value, _id)"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        sort_value, doc_id = json_util.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return sort_value, doc_id
+    except Exception as e:
+        raise InvalidCursor(f"Invalid pagination cursor: {token}") from e
+
+
+def get_sort_value(doc, field):
+    """Get a possibly nested (dotted) sort field from a document"""
+    value = doc
+    for part in field.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def keyset_filter(field, sort_value, doc_id, op):
+    """
+    Build the filter for documents strictly past (sort_value, doc_id).
+
+    op is '$lt' when walking towards smaller keys and '$gt' towards larger.
+    Missing/null sort values sort lowest in MongoDB and are handled explicitly,
+    since range operators never match them.
+    """
+    branches = [{field: sort_value, '_id': {op: doc_id}}]
+
+    if sort_value is None:
+        if op == '$gt':
+            branches.append({field: {'$ne': None}})
+    else:
+        branches.append({field: {op: sort_value}})
+        if op == '$lt':
+            branches.append({field: None})
+
+    return {'$or': branches}
+
+
+def cursor_window(query, field, direction, after=None, before=None):
+    """
+    Get the (query, sort, reverse) needed to fetch the page next to a cursor.
+
+    Args:
+        query: Base filter of the listing
+        field: Sort field
+        direction: 1 or -1, the listing's sort direction
+        after: Cursor of the last document of the previous page
+        before: Cursor of the first document of the next page
+
+    Returns:
+        tuple: (filter, sort spec, whether results must be reversed)
+    """
+    token = after or before
+    backwards = bool(before) and not after
+
+    # Walking backwards means scanning in the opposite order and flipping the page
+    scan_direction = -direction if backwards else direction
+    sort = [(field, scan_direction), ('_id', scan_direction)]
+
+    if not token:
+        return query, sort, backwards
+
+    sort_value, doc_id = decode_cursor(token)
+    op = '$gt' if scan_direction == 1 else '$lt'
+    condition = keyset_filter(field, sort_value, doc_id, op)
+    combined = {'$and': [query, condition]} if query else condition
+    return combined, sort, backwards
+
+
+def build_cursors(docs, field, has_more, backwards=False, has_previous=False):
+    """
+    Get the next/previous cursor tokens for a fetched page.
+
+    Args:
+        docs: Documents of the page, in display order (must include _id)
+        field: Sort field
+        has_more: Whether more documents exist in the scan direction
+        backwards: Whether the page was fetched with a before= cursor
+        has_previous: Whether documents exist before this page (forward scans)
+
+    Returns:
+        dict: {'next': token or None, 'prev': token or None}
+    """
+    if not docs:
+        return {'next': None, 'prev': None}
+
+    first, last = docs[0], docs[-1]
+    if backwards:
+        # We came from the page after this one, so there is always a next page
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, has_previous
+
+    return {
+        'next': encode_cursor(get_sort_value(last, field), last['_id']) if has_next else None,
+        'prev': encode_cursor(get_sort_value(first, field), first['_id']) if has_prev else None
+    }
+
+
+def page_number(page, after=None, before=None):
+    """Page number to report for a listing; None when a cursor picked the page"""
+    return None if (after or before) else page
+
+
+def paginate(collection, query, field, direction, limit, after=None, before=None, page=1, projection=None):
+    """
+    Fetch one page of a find() listing using a cursor, or page number as fallback.
+
+    Args:
+        collection: PyMongo collection
+        query: Base filter
+        field: Sort field
+        direction: 1 or -1
+        limit: Page size
+        after: Cursor returned as 'next' by a previous call
+        before: Cursor returned as 'prev' by a previous call
+        page: 1-based page number, used only when no cursor is given
+        projection: Optional find() projection (_id is always fetched for the cursor)
+
+    Returns:
+        tuple: (documents, cursors dict)
+    """
+    if projection is not None and projection.get('_id', 1) == 0:
+        projection = {k: v for k, v in projection.items() if k != '_id'} or None
+
+    filter_query, sort, backwards = cursor_window(query, field, direction, after, before)
+    cursor = collection.find(filter_query, projection).sort(sort)
+
+    skip = 0
+    if not (after or before) and page > 1:
+        skip = (page - 1) * limit
+        cursor = cursor.skip(skip)
+
+    # One extra document tells us whether another page exists
+    docs = list(cursor.limit(limit + 1))
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    if backwards:
+        docs.reverse()
+
+    cursors = build_cursors(docs, field, has_more, backwards, has_previous=bool(after) or skip > 0)
+    return docs, cursors
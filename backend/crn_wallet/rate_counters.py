@@ -0,0 +1,230 @@
+"""
+Sharded request counters for the security middleware.
+
+Each key (usually a client IP) gets a fixed ring of time buckets covering the
+window plus a one-second counter, so recording a request and reading its rate
+are O(1) no matter how many requests or keys are tracked. Keys are spread over
+lock-striped shards so worker threads only contend when they hash to the same
+shard. Global per-second totals are kept per shard and summed on read, so no
+lock is shared by every request.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class _KeyWindow:
+    """Bucketed counts for one key"""
+
+    __slots__ = ('slot', 'total', 'buckets', 'second', 'second_count', 'prev_second_count', 'last_seen')
+
+    def __init__(self, bucket_count):
+        self.slot = 0
+        self.total = 0
+        self.buckets = [0] * bucket_count
+        self.second = 0
+        self.second_count = 0
+        self.prev_second_count = 0
+        self.last_seen = 0.0
+
+
+class _Shard:
+    """One lock stripe: its keys plus its share of the global per-second totals"""
+
+    __slots__ = ('lock', 'keys', 'global_counts', 'global_seconds')
+
+    def __init__(self, window):
+        self.lock = threading.Lock()
+        self.keys = OrderedDict()
+        self.global_counts = [0] * window
+        self.global_seconds = [-1] * window
+
+
+def _second_rate(second, count, prev_count, now):
+    """Sliding one-second estimate from the current and previous second buckets"""
+    current = int(now)
+    if second == current:
+        return count + prev_count * (1.0 - (now - current))
+    if second == current - 1:
+        return count * (1.0 - (now - current))
+    return 0.0
+
+
+class ShardedCounterStore:
+    """Per-key sliding window counters with striped locks and global totals"""
+
+    def __init__(self, window=60, bucket_count=12, shards=64, max_keys=100000):
+        """
+        Args:
+            window: Window length in seconds for per-key and global counts
+            bucket_count: Buckets per key window (resolution = window / bucket_count)
+            shards: Number of lock stripes
+            max_keys: Tracked keys before least recently seen ones are evicted
+        """
+        self.window = window
+        self.bucket_count = bucket_count
+        self.bucket_width = window / bucket_count
+        self.max_keys_per_shard = max(1, max_keys // shards)
+        self._shards = [_Shard(window) for _ in range(shards)]
+        self.total_hits = 0
+        self.evictions = 0
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _advance(self, entry, slot):
+        """Zero the buckets that fell out of the window since the entry was last touched"""
+        gap = slot - entry.slot
+        if gap <= 0:
+            return
+        if gap >= self.bucket_count:
+            entry.buckets = [0] * self.bucket_count
+            entry.total = 0
+        else:
+            buckets = entry.buckets
+            for s in range(entry.slot + 1, slot + 1):
+                index = s % self.bucket_count
+                entry.total -= buckets[index]
+                buckets[index] = 0
+        entry.slot = slot
+
+    def hit(self, key, now=None):
+        """
+        Record one request for key.
+
+        Returns:
+            tuple: (requests in the window, requests in the last second) for key
+        """
+        if now is None:
+            now = time.time()
+        slot = int(now / self.bucket_width)
+        second = int(now)
+        shard = self._shard(key)
+
+        with shard.lock:
+            entry = shard.keys.get(key)
+            if entry is None:
+                entry = _KeyWindow(self.bucket_count)
+                entry.slot = slot
+                shard.keys[key] = entry
+                if len(shard.keys) > self.max_keys_per_shard:
+                    shard.keys.popitem(last=False)
+                    self.evictions += 1
+            else:
+                shard.keys.move_to_end(key)
+                self._advance(entry, slot)
+
+            entry.buckets[slot % self.bucket_count] += 1
+            entry.total += 1
+            entry.last_seen = now
+
+            if entry.second != second:
+                entry.prev_second_count = entry.second_count if entry.second == second - 1 else 0
+                entry.second = second
+                entry.second_count = 0
+            entry.second_count += 1
+
+            index = second % self.window
+            if shard.global_seconds[index] != second:
+                shard.global_seconds[index] = second
+                shard.global_counts[index] = 0
+            shard.global_counts[index] += 1
+
+            # Approximate under contention; only used for sampling decisions
+            self.total_hits += 1
+
+            return entry.total, _second_rate(entry.second, entry.second_count, entry.prev_second_count, now)
+
+    def count(self, key, now=None):
+        """Get the number of requests for key in the window"""
+        if now is None:
+            now = time.time()
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.keys.get(key)
+            if entry is None:
+                return 0
+            self._advance(entry, int(now / self.bucket_width))
+            return entry.total
+
+    def rate(self, key, now=None):
+        """Get the requests per second estimate for key"""
+        if now is None:
+            now = time.time()
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.keys.get(key)
+            if entry is None:
+                return 0.0
+            return _second_rate(entry.second, entry.second_count, entry.prev_second_count, now)
+
+    def last_seen(self, key):
+        """Get the time of the last request for key (0 if not tracked)"""
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.keys.get(key)
+            return entry.last_seen if entry else 0
+
+    def global_rate(self, now=None):
+        """Get the requests per second estimate across all keys"""
+        if now is None:
+            now = time.time()
+        second = int(now)
+        current = previous = 0
+        cur_index = second % self.window
+        prev_index = (second - 1) % self.window
+        for shard in self._shards:
+            if shard.global_seconds[cur_index] == second:
+                current += shard.global_counts[cur_index]
+            if shard.global_seconds[prev_index] == second - 1:
+                previous += shard.global_counts[prev_index]
+        return current + previous * (1.0 - (now - second))
+
+    def global_count(self, now=None):
+        """Get the number of requests across all keys in the window"""
+        if now is None:
+            now = time.time()
+        oldest = int(now) - self.window
+        total = 0
+        for shard in self._shards:
+            for stamp, count in zip(shard.global_seconds, shard.global_counts):
+                if stamp > oldest:
+                    total += count
+        return total
+
+    def active_keys(self, now=None):
+        """Get the number of keys seen within the window"""
+        if now is None:
+            now = time.time()
+        cutoff = now - self.window
+        active = 0
+        for shard in self._shards:
+            with shard.lock:
+                active += sum(1 for entry in shard.keys.values() if entry.last_seen > cutoff)
+        return active
+
+    def expire_idle(self, now=None):
+        """Drop keys with no requests in the window; returns how many were dropped"""
+        if now is None:
+            now = time.time()
+        cutoff = now - self.window
+        removed = 0
+        for shard in self._shards:
+            with shard.lock:
+                # Keys are kept in last-seen order, so idle ones are at the front
+                while shard.keys:
+                    key, entry = next(iter(shard.keys.items()))
+                    if entry.last_seen > cutoff:
+                        break
+                    del shard.keys[key]
+                    removed += 1
+        return removed
+
+    def __contains__(self, key):
+        shard = self._shard(key)
+        with shard.lock:
+            return key in shard.keys
+
+    def __len__(self):
+        return sum(len(shard.keys) for shard in self._shards)
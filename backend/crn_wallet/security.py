@@ -5,17 +5,17 @@ import json
 import os
 import hashlib
 import re
-from collections import defaultdict, deque
+from collections import defaultdict
 from functools import wraps
 from flask import request, jsonify, abort, session, Blueprint, redirect
 import random
-import redis
 
-# Initialize Redis client
 try:
-    redis_client = redis.Redis(host='localhost', port=6379, db=0)
-except:
-    redis_client = None
+    from backend.crn_wallet.rate_counters import ShardedCounterStore
+    from backend.crn_wallet.state_backend import state_backend
+except ImportError:
+    from rate_counters import ShardedCounterStore
+    from state_backend import state_backend
 
 # تكوين السجل
 logging.basicConfig(
@@ -73,23 +73,24 @@ except:
 
 # ========================= هياكل البيانات =========================
 
-# تتبع عدد الطلبات من كل IP والأوقات
-ip_request_timestamps = defaultdict(list)
+# تتبع عدد الطلبات من كل IP (نوافذ زمنية مقسمة على أقفال متعددة بدلاً من قوائم الطوابع الزمنية)
+ip_request_counters = ShardedCounterStore(window=60)
 temporarily_blocked = {}  # IP المحظورة مؤقتًا مع وقت انتهاء الحظر
 ip_last_activity = {}     # وقت آخر نشاط لكل IP
 ip_country_data = {}      # بيانات البلد لكل IP
 failed_logins = defaultdict(int)  # عدد محاولات تسجيل الدخول الفاشلة
 path_access_count = defaultdict(int)  # عدد الوصول لكل مسار
-
-# تتبع سلوك الطلبات العالمي للكشف عن هجمات DDOS
-global_request_timestamps = deque(maxlen=10000)  # تخزين الطوابع الزمنية العامة للطلبات
+path_access_lock = threading.Lock()
 
 # قفل للمزامنة
 request_lock = threading.RLock()
 
+# تشغيل التنظيف كل هذا العدد من الطلبات
+CLEANUP_EVERY_REQUESTS = 1000
+
 # Add temporary storage for tracking suspicious behavior
 SUSPICIOUS_IPS = {}
-REQUEST_HISTORY = {}
+REQUEST_HISTORY = ShardedCounterStore(window=60)  # Request rates for suspicious/DDoS detection
 PERMANENT_BLACKLIST = set()
 BANNED_KEYWORDS = set(['احا', 'كسم', 'نيك', 'طيز', 'عير', 'زبي', 'كس', 'متناك', 'خول'])
 
@@ -193,17 +194,10 @@ def is_suspicious_request():
         
         # Check request frequency - only block if clearly abusive
         current_time = time.time()
-        ip_history = REQUEST_HISTORY.get(ip, [])
-        
-        # Clean old history (older than 60 seconds)
-        ip_history = [t for t in ip_history if current_time - t < 60]
         
-        # Add current request
-        ip_history.append(current_time)
-        REQUEST_HISTORY[ip] = ip_history
-        
-        # Count requests in the last second
-        requests_last_second = sum(1 for t in ip_history if current_time - t < 1)
+        # Record the request and get requests in the last second
+        _, rate = REQUEST_HISTORY.hit(ip, current_time)
+        requests_last_second = int(rate)
         
         # Only block if requests are clearly abusive (more than 10 per second)
         if requests_last_second > 10:
@@ -225,60 +219,50 @@ def is_suspicious_request():
 
 def check_rate_limit(ip, path):
     """التحقق مما إذا كان IP قد تجاوز حدود الطلبات"""
-    with request_lock:
-        # IP المسموح بها معفاة من فحص الحد
-        if ip in WHITELISTED_IPS:
-            return True
-            
-        current_time = time.time()
-        limit = get_rate_limit(path)
-        
-        # تنظيف الطوابع الزمنية القديمة (أقدم من دقيقة واحدة)
-        cutoff_time = current_time - 60
-        ip_request_timestamps[ip] = [t for t in ip_request_timestamps[ip] if t > cutoff_time]
-        
-        # إضافة الطابع الزمني الحالي
-        ip_request_timestamps[ip].append(current_time)
-        
-        # حساب الطلبات في النافذة الزمنية
-        count = len(ip_request_timestamps[ip])
-        
-        # تحديث آخر نشاط
-        ip_last_activity[ip] = current_time
+    # IP المسموح بها معفاة من فحص الحد
+    if ip in WHITELISTED_IPS:
+        return True
         
-        # زيادة عداد المسار
+    current_time = time.time()
+    limit = get_rate_limit(path)
+    
+    # تسجيل الطلب وحساب الطلبات في النافذة الزمنية (دقيقة واحدة) - O(1) وبقفل جزئي فقط
+    count, _ = ip_request_counters.hit(ip, current_time)
+    
+    # مع Redis تكون الميزانية مشتركة بين جميع عمال gunicorn
+    if state_backend.shared:
+        count = max(count, state_backend.hit('rate', ip, 60, current_time))
+    
+    # تحديث آخر نشاط
+    ip_last_activity[ip] = current_time
+    
+    # زيادة عداد المسار
+    with path_access_lock:
         path_access_count[path] += 1
-        
-        # إضافة إلى سجل الطلبات العالمي لكشف DDOS
-        global_request_timestamps.append(current_time)
-        
-        # التنظيف الدوري (بعد 1000 طلب)
-        total_requests = sum(len(timestamps) for timestamps in ip_request_timestamps.values())
-        if total_requests > 1000:
-            cleanup_old_data()
-            
-        # التحقق من الوصول إلى عتبة حد الطلبات - only block if significantly exceeded
-        if count > limit * 2:  # Only block if requests are double the limit
-            # زيادة الحظر المؤقت حسب مقدار التجاوز
-            duration = min(300 * (count / limit), 3600)  # من 5 دقائق إلى ساعة حسب شدة التجاوز
+    
+    # التنظيف الدوري (كل 1000 طلب)
+    if ip_request_counters.total_hits % CLEANUP_EVERY_REQUESTS == 0:
+        cleanup_old_data()
+        
+    # التحقق من الوصول إلى عتبة حد الطلبات - only block if significantly exceeded
+    if count > limit * 2:  # Only block if requests are double the limit
+        # زيادة الحظر المؤقت حسب مقدار التجاوز
+        duration = min(300 * (count / limit), 3600)  # من 5 دقائق إلى ساعة حسب شدة التجاوز
+        with request_lock:
             temporarily_block_ip(ip, int(duration))
-            return False
-            
-        return True
+        return False
+        
+    return True
 
 def detect_ddos_attack():
     """Detect potential DDoS attacks based on request patterns"""
     try:
-        # Calculate request rates
+        # Calculate request rates (maintained incrementally by REQUEST_HISTORY)
         current_time = time.time()
-        total_requests = sum(len(times) for times in REQUEST_HISTORY.values())
         active_ips = len(REQUEST_HISTORY)
         
         # Calculate requests in last second across all IPs
-        requests_last_second = sum(
-            sum(1 for t in times if current_time - t < 1)
-            for times in REQUEST_HISTORY.values()
-        )
+        requests_last_second = int(REQUEST_HISTORY.global_rate(current_time))
         
         # If extremely high traffic, enable aggressive mode
         if requests_last_second > 100:  # Adjust threshold as needed
@@ -300,14 +284,11 @@ def cleanup_old_data():
     """تنظيف البيانات القديمة"""
     with request_lock:
         current_time = time.time()
-        cutoff_time = current_time - 60
         day_ago = current_time - 86400  # قبل يوم واحد
         
-        # إزالة الطوابع الزمنية القديمة
-        for ip in list(ip_request_timestamps.keys()):
-            ip_request_timestamps[ip] = [t for t in ip_request_timestamps[ip] if t > cutoff_time]
-            if not ip_request_timestamps[ip]:
-                del ip_request_timestamps[ip]
+        # إزالة عدادات IP الخاملة (بدون طلبات في آخر دقيقة)
+        ip_request_counters.expire_idle(current_time)
+        REQUEST_HISTORY.expire_idle(current_time)
         
         # إزالة IP المحظورة مؤقتًا التي انتهت صلاحيتها
         for ip in list(temporarily_blocked.keys()):
@@ -323,7 +304,7 @@ def cleanup_old_data():
                 
         # إعادة تعيين عدادات الفشل في تسجيل الدخول القديمة
         for ip in list(failed_logins.keys()):
-            if ip not in ip_request_timestamps or not ip_request_timestamps[ip]:
+            if ip not in ip_request_counters:
                 del failed_logins[ip]
 
 def temporarily_block_ip(ip, duration=300):
@@ -333,9 +314,8 @@ def temporarily_block_ip(ip, duration=300):
         if ip not in temporarily_blocked:
             expiry = time.time() + duration
             
-            # Use Redis if available
-            if redis_client:
-                redis_client.setex(f'blocked_ip:{ip}', duration, '1')
+            # Share the block with the other workers
+            state_backend.ban('security', ip, duration)
             
             # Also keep in local memory
             temporarily_blocked[ip] = expiry
@@ -353,9 +333,8 @@ def permanently_block_ip(ip):
     try:
         # Only block if not already blocked
         if ip not in PERMANENT_BLACKLIST:
-            # Use Redis if available
-            if redis_client:
-                redis_client.set(f'permanent_blocked_ip:{ip}', '1')
+            # Share the block with the other workers
+            state_backend.ban('security', ip)
             
             # Add to permanent blacklist
             PERMANENT_BLACKLIST.add(ip)
@@ -384,6 +363,7 @@ def whitelist_ip(ip):
         # إزالة من الحظر المؤقت إذا كان موجودًا
         if ip in temporarily_blocked:
             del temporarily_blocked[ip]
+        state_backend.unban('security', ip)
         
         save_whitelist()
         logging.info(f"تمت إضافة IP {ip} إلى القائمة البيضاء")
@@ -403,7 +383,8 @@ def is_ip_blocked(ip):
     if ip in temporarily_blocked and temporarily_blocked[ip] > current_time:
         return True
     
-    return False
+    # الحظر الصادر من العمال الآخرين (من النسخة المحلية، بدون رحلة شبكة)
+    return state_backend.is_banned('security', ip)
 
 def record_login_failure(ip):
     """تسجيل فشل محاولة تسجيل الدخول"""
@@ -467,7 +448,7 @@ def validate_request():
     
     # الكشف عن هجمات DDOS
     # هذا يمكن أن يكون ثقيلًا، لذا نشغله بشكل دوري فقط (كل 10 طلبات)
-    if sum(len(ts) for ts in ip_request_timestamps.values()) % 10 == 0:
+    if ip_request_counters.total_hits % 10 == 0:
         if detect_ddos_attack():
             # لا نحظر جميع الطلبات في حالة DDOS، بل نقوم فقط بمراقبة وحظر أسوأ المصادر
             pass
@@ -633,6 +614,7 @@ def setup_security_endpoints(app):
             
         if ip in temporarily_blocked:
             del temporarily_blocked[ip]
+        state_backend.unban('security', ip)
             
         return jsonify({
             'success': True, 
@@ -682,8 +664,7 @@ def setup_security_endpoints(app):
             remaining_block_time = int(temporarily_blocked[ip] - current_time)
             
         # حساب نشاط الطلبات الحديثة
-        recent_requests = len([t for t in ip_request_timestamps.get(ip, [])
-                            if t > current_time - 60])  # آخر دقيقة
+        recent_requests = ip_request_counters.count(ip, current_time)  # آخر دقيقة
             
         return jsonify({
             'success': True,
@@ -708,23 +689,23 @@ def setup_security_endpoints(app):
             abort(403)
             
         current_time = time.time()
-        minute_ago = current_time - 60
         hour_ago = current_time - 3600
         day_ago = current_time - 86400
         
         # عدد الطلبات في النطاقات الزمنية المختلفة
-        requests_last_minute = sum(1 for t in global_request_timestamps if t > minute_ago)
+        requests_last_minute = ip_request_counters.global_count(current_time)
         
         # عدد IP النشطة
-        active_ips_minute = sum(1 for ip, timestamps in ip_request_timestamps.items()
-                             if any(t > minute_ago for t in timestamps))
+        active_ips_minute = ip_request_counters.active_keys(current_time)
         
  # حساب عدد المحظورين
         temp_blocked_count = sum(1 for expiry in temporarily_blocked.values() if expiry > current_time)
         
         # الحصول على أكثر المسارات طلبًا
+        with path_access_lock:
+            path_counts = list(path_access_count.items())
         top_paths = sorted(
-            [(path, count) for path, count in path_access_count.items()],
+            path_counts,
             key=lambda x: x[1],
             reverse=True
         )[:10]
@@ -1,6 +1,7 @@
 from flask import Flask, request, jsonify, send_from_directory, redirect
 from flask_cors import CORS
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import os
 import sys
 from bson.objectid import ObjectId
@@ -18,6 +19,7 @@ import requests  # إضافة مكتبة requests لاستدعاء خدمة IPin
 from werkzeug.security import generate_password_hash, check_password_hash
 import math
 import threading
+import socket
 
 # Import helper functions
 try:
@@ -63,6 +65,17 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 if current_dir not in sys.path:
     sys.path.append(current_dir)
 
+try:
+    from backend.crn_wallet.access_cache import TTLCache
+    from backend.crn_wallet.pagination import paginate, page_number, InvalidCursor
+    from backend.crn_wallet.state_backend import state_backend
+    from backend.crn_wallet.write_behind import WriteBehindQueue
+except ImportError:
+    from access_cache import TTLCache
+    from pagination import paginate, page_number, InvalidCursor
+    from state_backend import state_backend
+    from write_behind import WriteBehindQueue
+
 try:
     from transaction_history import transaction_routes
 except ImportError:
@@ -189,74 +202,56 @@ BLOCK_TIME = 15 * 60  # 15 minutes in seconds
 # Define whitelisted IPs that bypass rate limiting
 WHITELISTED_IPS = ['127.0.0.1', '::1']  # Add any additional trusted IPs as needed
 
+# Write-behind queues: login/activity logs and rate-limit records are written
+# by a background thread in batches instead of on the request thread
+log_write_queue = WriteBehindQueue("logs", max_size=20000, batch_size=500, policy="drop_newest").start()
+rate_limit_write_queue = WriteBehindQueue("rate_limits", max_size=5000, batch_size=200, policy="block").start()
+
+def get_write_queue_stats():
+    """Get depth and counters of the write-behind queues"""
+    return {
+        "logs": log_write_queue.get_stats(),
+        "rate_limits": rate_limit_write_queue.get_stats()
+    }
+
 # Function to save rate limit data to database
 def save_rate_limit_to_db(ip, attempts, timestamp, is_blocked=False, expiry=None, permanent=False, blocks=0, abuse_detected=False, reason=None):
-    """Save rate limit data to database for persistence"""
+    """Queue rate limit data for persistence (pending updates for the same IP are merged)"""
     try:
         rate_limits_collection = wallet_db["rate_limits"]
         
-        # Find existing record
-        existing = rate_limits_collection.find_one({"ip": ip})
-        
         now = datetime.now(UTC).isoformat()
         
-        if existing:
-            # Update existing record
-            update_data = {
-                "attempts": attempts,
-                "timestamp": timestamp,
-                "is_blocked": is_blocked,
-                "updated_at": now
-            }
-            
-            # Add optional fields if provided
-            if expiry:
-                update_data["expiry"] = expiry
-            
-            if permanent:
-                update_data["permanent_block"] = True
-                
-            if blocks:
-                update_data["blocks"] = blocks
-                
-            if abuse_detected:
-                update_data["abuse_detected"] = True
-                
-            if reason:
-                update_data["block_reason"] = reason
+        update_data = {
+            "attempts": attempts,
+            "timestamp": timestamp,
+            "is_blocked": is_blocked,
+            "updated_at": now
+        }
+        
+        # Add optional fields if provided
+        if expiry:
+            update_data["expiry"] = expiry
+        
+        if permanent:
+            update_data["permanent_block"] = True
             
-            rate_limits_collection.update_one(
-                {"ip": ip},
-                {"$set": update_data}
-            )
-        else:
-            # Create new record
-            record = {
-                "ip": ip,
-                "attempts": attempts,
-                "timestamp": timestamp,
-                "is_blocked": is_blocked,
-                "created_at": now,
-                "updated_at": now
-            }
+        if blocks:
+            update_data["blocks"] = blocks
             
-            # Add optional fields if provided
-            if expiry:
-                record["expiry"] = expiry
-                
-            if permanent:
-                record["permanent_block"] = True
-                
-            if blocks:
-                record["blocks"] = blocks
-                
-            if abuse_detected:
-                record["abuse_detected"] = True
-                
-            if reason:
-                record["block_reason"] = reason
+        if abuse_detected:
+            update_data["abuse_detected"] = True
             
-            rate_limits_collection.insert_one(record)
+        if reason:
+            update_data["block_reason"] = reason
+        
+        # Upsert replaces the find_one + update_one/insert_one round trips
+        rate_limit_write_queue.upsert(
+            rate_limits_collection,
+            {"ip": ip},
+            update_data,
+            set_on_insert={"created_at": now}
+        )
     except Exception as e:
         logging.error(f"Error saving rate limit data: {str(e)}")
 
@@ -298,6 +293,73 @@ load_rate_limits_from_db()
 token_cache = {}
 TOKEN_CACHE_TTL = 5 * 60  # 5 minutes in seconds
 
+# Caches for the access checks in before_request (staff IPs, banned IPs, user ban flags)
+# Local ban changes invalidate immediately; other workers pick them up through the
+# shared version counter within ACCESS_CACHE_VERSION_CHECK, and ACCESS_CACHE_TTL caps
+# staleness for changes made directly in the database. Anything else that changes
+# bans or staff IPs should $inc the version document to apply within seconds.
+ACCESS_CACHE_TTL = 60  # seconds
+ACCESS_CACHE_VERSION_CHECK = 5  # seconds between reads of the shared version counter
+ACCESS_CACHE_VERSION_ID = "access_cache_version"
+staff_ip_cache = TTLCache("staff_ips", ttl=ACCESS_CACHE_TTL)
+banned_ip_cache = TTLCache("banned_ips", ttl=ACCESS_CACHE_TTL)
+user_ban_cache = TTLCache("user_bans", ttl=ACCESS_CACHE_TTL, max_size=50000)
+access_cache_state = {"version": None, "checked_at": 0}
+access_cache_lock = threading.Lock()
+
+def sync_access_caches():
+    """Clear the access caches if another process bumped the shared version counter"""
+    current_time = time.time()
+    if current_time - access_cache_state["checked_at"] < ACCESS_CACHE_VERSION_CHECK:
+        return
+
+    # Only one request per interval pays for the version read
+    if not access_cache_lock.acquire(blocking=False):
+        return
+    try:
+        access_cache_state["checked_at"] = current_time
+        doc = settings_collection.find_one({"_id": ACCESS_CACHE_VERSION_ID}, {"version": 1})
+        version = doc.get("version", 0) if doc else 0
+
+        if access_cache_state["version"] is not None and version != access_cache_state["version"]:
+            staff_ip_cache.clear()
+            banned_ip_cache.clear()
+            user_ban_cache.clear()
+            logging.info(f"Access caches cleared (version {access_cache_state['version']} -> {version})")
+
+        access_cache_state["version"] = version
+    except Exception as e:
+        logging.error(f"Error checking access cache version: {str(e)}")
+    finally:
+        access_cache_lock.release()
+
+def invalidate_access_caches(user_id=None, staff=False):
+    """Drop cached ban (or staff IP) state after a change and notify other processes"""
+    if user_id:
+        user_ban_cache.invalidate(user_id)
+    if staff:
+        staff_ip_cache.clear()
+    # banned_users is keyed by user but looked up by IP, so drop all IP entries
+    banned_ip_cache.clear()
+
+    try:
+        settings_collection.update_one(
+            {"_id": ACCESS_CACHE_VERSION_ID},
+            {"$inc": {"version": 1}},
+            upsert=True
+        )
+    except Exception as e:
+        logging.error(f"Error bumping access cache version: {str(e)}")
+
+def get_access_cache_stats():
+    """Get hit/miss counters for the access caches"""
+    return {
+        "staff_ips": staff_ip_cache.get_stats(),
+        "banned_ips": banned_ip_cache.get_stats(),
+        "user_bans": user_ban_cache.get_stats(),
+        "shared_version": access_cache_state["version"]
+    }
+
 # Helper function to find user by Discord ID
 def find_user_by_discord_id(user_id):
     return users_collection.find_one({"user_id": user_id})
@@ -320,7 +382,7 @@ def log_login_attempt(username, client_ip, success=False, user_id=None, details=
             
         # استخدام قاعدة staff بدلاً من wallet_db
         logs_collection = staff_db["login_logs"]
-        logs_collection.insert_one(log)
+        log_write_queue.insert(logs_collection, log)
         
         # Also send to the general logging system
         action_type = "login_success" if success else "login_failure"
@@ -352,7 +414,7 @@ def log_activity(user_id, username, action_type, description=None, details=None)
         "timestamp": datetime.now(UTC).isoformat(),
     }
     try:
-        activity_logs_collection.insert_one(log_data)
+        log_write_queue.insert(activity_logs_collection, log_data)
     except Exception as e:
         print(f"Error logging activity: {str(e)}")
 
@@ -398,6 +460,317 @@ def serve(path):
 # API routes prefix
 API_PREFIX = '/api'
 
+# Materialized user counters kept in the settings collection so dashboard stats
+# are a single read. Ban/lock/delete handlers apply deltas; a background job
+# recounts periodically to absorb users created or edited by other services.
+# Every delta bumps a generation field, and a recount only overwrites the
+# counters if no delta landed while it was counting.
+USER_STATS_ID = "user_stats"
+USER_STATS_RECONCILE_INTERVAL = 5 * 60  # seconds between full recounts
+USER_STATS_RECONCILE_ATTEMPTS = 3
+USER_STATS_LEASE_ID = "user_stats_reconcile_lease"
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+USER_STATS_FIELDS = ('total', 'active', 'banned', 'locked')
+USER_STATS_PROJECTION = {'ban': 1, 'wallet_lock': 1}
+
+def user_stats_flags(user):
+    """Get the counters a single user document contributes to"""
+    if not user:
+        return {field: 0 for field in USER_STATS_FIELDS}
+    # Same semantics as the {'ban': True} / {'ban': False} queries (missing field counts as neither)
+    banned = user.get('ban') is True
+    locked = user.get('wallet_lock') is True
+    return {
+        'total': 1,
+        'active': int(user.get('ban') is False and user.get('wallet_lock') is False),
+        'banned': int(banned),
+        'locked': int(locked)
+    }
+
+def update_user_stats(before, after):
+    """Apply the counter change between two versions of a user document"""
+    old_flags = user_stats_flags(before)
+    new_flags = user_stats_flags(after)
+    delta = {field: new_flags[field] - old_flags[field]
+             for field in USER_STATS_FIELDS if new_flags[field] != old_flags[field]}
+    if not delta:
+        return
+    
+    try:
+        # No upsert: a missing document is rebuilt by reconcile_user_stats()
+        settings_collection.update_one({"_id": USER_STATS_ID}, {"$inc": {**delta, "generation": 1}})
+    except Exception as e:
+        logging.error(f"Error updating user stats counters: {str(e)}")
+
+def count_user_stats():
+    """Recount all users in one aggregation pass"""
+    pipeline = [{
+        '$group': {
+            '_id': None,
+            'total': {'$sum': 1},
+            'active': {'$sum': {'$cond': [
+                {'$and': [{'$eq': ['$ban', False]}, {'$eq': ['$wallet_lock', False]}]}, 1, 0
+            ]}},
+            'banned': {'$sum': {'$cond': [{'$eq': ['$ban', True]}, 1, 0]}},
+            'locked': {'$sum': {'$cond': [{'$eq': ['$wallet_lock', True]}, 1, 0]}}
+        }
+    }]
+    result = list(users_collection.aggregate(pipeline))
+    return {field: (result[0][field] if result else 0) for field in USER_STATS_FIELDS}
+
+def reconcile_user_stats():
+    """
+    Recount all users and store the counters, unless deltas land meanwhile.
+    
+    The counters are only overwritten if their generation is unchanged since
+    the count started; otherwise the count is retried. If every attempt races
+    with a delta, the current counters (which include the deltas) are kept
+    until the next pass.
+    """
+    for _ in range(USER_STATS_RECONCILE_ATTEMPTS):
+        doc = settings_collection.find_one({"_id": USER_STATS_ID}, {"generation": 1})
+        stats = count_user_stats()
+        reconciled_at = datetime.now(UTC).isoformat()
+        
+        if doc is None:
+            try:
+                settings_collection.insert_one(
+                    {"_id": USER_STATS_ID, **stats, "generation": 0, "reconciled_at": reconciled_at}
+                )
+                return stats
+            except DuplicateKeyError:
+                continue
+        
+        result = settings_collection.update_one(
+            {"_id": USER_STATS_ID, "generation": doc.get("generation")},
+            {"$set": {**stats, "reconciled_at": reconciled_at}}
+        )
+        if result.matched_count:
+            return stats
+    
+    logging.info("User stats changed during every recount; keeping the delta-maintained counters")
+    return get_user_stats()
+
+def acquire_job_lease(lease_id, ttl):
+    """
+    Claim a job for ttl seconds across all workers.
+    
+    Returns True for the worker that holds the lease (renewing it), False for the others.
+    """
+    now = time.time()
+    try:
+        settings_collection.update_one(
+            {"_id": lease_id, "$or": [{"expires_at": {"$lt": now}}, {"owner": WORKER_ID}]},
+            {"$set": {"owner": WORKER_ID, "expires_at": now + ttl}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # The lease exists and is held by another worker
+        return False
+
+def get_user_stats():
+    """Get the materialized user counters, rebuilding them if missing"""
+    doc = settings_collection.find_one({"_id": USER_STATS_ID})
+    if not doc:
+        stats = count_user_stats()
+        try:
+            settings_collection.insert_one({"_id": USER_STATS_ID, **stats, "generation": 0,
+                                            "reconciled_at": datetime.now(UTC).isoformat()})
+        except DuplicateKeyError:
+            pass
+        return stats
+    return {field: doc.get(field, 0) for field in USER_STATS_FIELDS}
+
+def schedule_user_stats_reconcile():
+    """Recount user stats in the background to correct any drift (one worker per interval)"""
+    def run_reconcile():
+        while True:
+            try:
+                # Every worker runs this loop; only the lease holder recounts
+                if acquire_job_lease(USER_STATS_LEASE_ID, USER_STATS_RECONCILE_INTERVAL * 2):
+                    reconcile_user_stats()
+            except Exception as e:
+                logging.error(f"Error reconciling user stats: {e}")
+            time.sleep(USER_STATS_RECONCILE_INTERVAL)
+    
+    reconcile_thread = threading.Thread(target=run_reconcile, daemon=True)
+    reconcile_thread.start()
+
+# Start the user stats reconciler
+schedule_user_stats_reconcile()
+
+def ensure_pagination_indexes():
+    """Create the (sort key, _id) indexes that keyset pagination range scans rely on"""
+    index_specs = [
+        (users_collection, 'created_at'),
+        (mining_db["mining_violations"], 'timestamp'),
+        (staff_db["logs"], 'timestamp'),
+        (staff_db["login_logs"], 'timestamp')
+    ]
+    for collection, field in index_specs:
+        try:
+            collection.create_index([(field, -1), ('_id', -1)])
+        except Exception as e:
+            logging.error(f"Error creating pagination index on {collection.name}.{field}: {e}")
+
+ensure_pagination_indexes()
+
+# Numeric copy of the string balance field so the leaderboard can use an index
+# instead of a $toDouble + in-memory sort over every user. Writers in this app
+# set it in the same update (see balance_fields). Users created or credited by
+# other services (bot, mining) write balance directly, so a background job
+# fills in users without the field and walks the collection in bounded batches
+# to fix stale copies (one worker per interval).
+BALANCE_NUM_FIELD = "balance_num"
+BALANCE_SYNC_ID = "balance_num_sync"
+BALANCE_SYNC_LEASE_ID = "balance_num_sync_lease"
+BALANCE_SYNC_INTERVAL = 60  # seconds between sync runs
+BALANCE_SYNC_BATCH = 5000  # users checked for a stale copy per run
+
+def balance_fields(balance):
+    """Get the $set fields for a new balance string (string + numeric copy)"""
+    try:
+        numeric = float(balance)
+    except (ValueError, TypeError):
+        numeric = 0.0
+    return {"balance": balance, BALANCE_NUM_FIELD: numeric}
+
+def fill_missing_numeric_balances():
+    """Set balance_num on users that do not have it (new users from other services)"""
+    numeric_balance = {'$convert': {'input': '$balance', 'to': 'double', 'onError': 0.0, 'onNull': 0.0}}
+    result = users_collection.update_many(
+        {BALANCE_NUM_FIELD: {'$exists': False}},
+        [{'$set': {BALANCE_NUM_FIELD: numeric_balance}}]
+    )
+    return result.modified_count
+
+def fix_stale_numeric_balances(batch_size=BALANCE_SYNC_BATCH):
+    """
+    Check the next batch of users (by _id) for a balance_num that no longer matches balance.
+    
+    The position is kept in the settings collection and wraps around at the end,
+    so successive runs cover the whole collection without a full scan per run.
+    """
+    state = settings_collection.find_one({"_id": BALANCE_SYNC_ID}) or {}
+    query = {}
+    if state.get("last_id") is not None:
+        query["_id"] = {"$gt": state["last_id"]}
+    
+    users = list(users_collection.find(query, {"balance": 1, BALANCE_NUM_FIELD: 1})
+                 .sort("_id", 1).limit(batch_size))
+    
+    fixed = 0
+    for user in users:
+        if BALANCE_NUM_FIELD not in user:
+            continue
+        numeric = balance_fields(user.get("balance"))[BALANCE_NUM_FIELD]
+        if user[BALANCE_NUM_FIELD] != numeric:
+            # Only if balance is unchanged since we read it; a newer write set its own copy
+            result = users_collection.update_one(
+                {"_id": user["_id"], "balance": user.get("balance")},
+                {"$set": {BALANCE_NUM_FIELD: numeric}}
+            )
+            fixed += result.modified_count
+    
+    last_id = users[-1]["_id"] if len(users) == batch_size else None
+    settings_collection.update_one(
+        {"_id": BALANCE_SYNC_ID},
+        {"$set": {"last_id": last_id, "synced_at": datetime.now(UTC).isoformat()}},
+        upsert=True
+    )
+    return fixed
+
+def sync_numeric_balances():
+    """Fill in missing and fix stale balance_num copies"""
+    filled = fill_missing_numeric_balances()
+    fixed = fix_stale_numeric_balances()
+    if filled or fixed:
+        logging.info(f"Numeric balance sync: filled {filled} users, fixed {fixed} stale copies")
+    return filled, fixed
+
+def schedule_balance_sync():
+    """Keep balance_num in sync in the background (one worker per interval)"""
+    def run_sync():
+        while True:
+            try:
+                # Every worker runs this loop; only the lease holder syncs
+                if acquire_job_lease(BALANCE_SYNC_LEASE_ID, BALANCE_SYNC_INTERVAL * 2):
+                    sync_numeric_balances()
+            except Exception as e:
+                logging.error(f"Error syncing numeric balances: {e}")
+            time.sleep(BALANCE_SYNC_INTERVAL)
+    
+    sync_thread = threading.Thread(target=run_sync, daemon=True)
+    sync_thread.start()
+
+try:
+    users_collection.create_index([(BALANCE_NUM_FIELD, -1), ('_id', -1)])
+except Exception as e:
+    logging.error(f"Error creating balance leaderboard index: {e}")
+
+# Start the numeric balance sync
+schedule_balance_sync()
+
+def get_transaction_counts(user_ids):
+    """Get the number of stored transactions per user with one aggregation"""
+    if not user_ids:
+        return {}
+    pipeline = [
+        {"$match": {"user_id": {"$in": list(user_ids)}}},
+        {"$project": {
+            "_id": 0,
+            "user_id": 1,
+            "count": {"$size": {"$ifNull": ["$transactions", []]}}
+        }}
+    ]
+    return {doc["user_id"]: doc["count"] for doc in wallet_db["user_transactions"].aggregate(pipeline)}
+
+# Discord avatar URLs by user_id; None is cached too so users without an avatar
+# do not cost a query on every page load
+AVATAR_CACHE_TTL = 10 * 60  # seconds
+avatar_cache = TTLCache("discord_avatars", ttl=AVATAR_CACHE_TTL, max_size=20000)
+
+def get_discord_avatars(user_ids):
+    """Get Discord avatar URLs for several users: cache first, then one $in query"""
+    avatars = {}
+    missing = []
+    for user_id in set(user_ids):
+        url = avatar_cache.get(user_id, False)
+        if url is False:
+            missing.append(user_id)
+        elif url:
+            avatars[user_id] = url
+    
+    if not missing:
+        return avatars
+    
+    version = avatar_cache.version
+    found = {}
+    discord_users = wallet_db["discord_users"].find(
+        {"user_id": {"$in": missing}, "avatar": {"$nin": [None, ""]}},
+        {"_id": 0, "user_id": 1, "avatar": 1}
+    )
+    for discord_user in discord_users:
+        user_id = discord_user["user_id"]
+        found[user_id] = f"https://cdn.discordapp.com/avatars/{user_id}/{discord_user['avatar']}.webp"
+    
+    for user_id in missing:
+        avatar_cache.set(user_id, found.get(user_id), version=version)
+    
+    avatars.update(found)
+    return avatars
+
+def enrich_discord_avatars(users):
+    """Fill in the avatar of every user in a page that lacks one, using Discord data"""
+    avatars = get_discord_avatars([
+        user["user_id"] for user in users if not user.get("avatar") and user.get("user_id")
+    ])
+    for user in users:
+        if not user.get("avatar") and user.get("user_id") in avatars:
+            user["avatar"] = avatars[user["user_id"]]
+    return users
+
 # User management endpoints
 @app.route(f'{API_PREFIX}/users/all', methods=['GET'])
 def get_all_users():
@@ -413,6 +786,8 @@ def get_all_users():
         search = request.args.get('search', '')
         status_filter = request.args.get('status', 'all')
         account_filter = request.args.get('account', 'all')
+        after = request.args.get('after')
+        before = request.args.get('before')
         
         # بناء استعلام البحث
         query = {}
@@ -443,48 +818,48 @@ def get_all_users():
             elif account_filter == 'vip':  # تغيير الاستعلام هنا لاستخدام premium بدلاً من vip
                 query['premium'] = True  # استخدام premium بدلاً من vip
         
-        # حساب إجمالي المستخدمين للترقيم
-        total_users = users_collection.count_documents(query)
+        # الحصول على إحصائيات المستخدمين (مستند العدادات المحسوبة مسبقاً)
+        stats = get_user_stats()
+        
+        # حساب إجمالي المستخدمين للترقيم - بدون مرشحات يكفي العداد الإجمالي
+        if query:
+            total_users = users_collection.count_documents(query)
+        else:
+            total_users = stats['total']
         total_pages = (total_users + limit - 1) // limit  # ضمان التقريب لأعلى
         
         # الحصول على المستخدمين بالترتيب حسب تاريخ الإنشاء (الأحدث أولاً)
-        users = list(users_collection.find(query).sort('created_at', -1).skip((page - 1) * limit).limit(limit))
+        # يستخدم مؤشر after/before عند توفره، وإلا رقم الصفحة
+        users, cursors = paginate(users_collection, query, 'created_at', -1, limit,
+                                  after=after, before=before, page=page)
         
-        # تحويل _id إلى نص وإضافة بيانات Discord إذا كانت متاحة
-        discord_users_collection = wallet_db["discord_users"]
+        # تحويل _id إلى نص
         for user in users:
             user['_id'] = str(user['_id'])
-            
-            # محاولة العثور على بيانات Discord المقابلة إذا لم تكن avatar موجودة بالفعل
-            if 'avatar' not in user or not user['avatar']:
-                discord_user = discord_users_collection.find_one({"user_id": user['user_id']})
-                if discord_user and 'avatar' in discord_user:
-                    user['avatar'] = f"https://cdn.discordapp.com/avatars/{user['user_id']}/{discord_user['avatar']}.webp"
-                    print(f"Added Discord avatar for user {user['username']}: {user['avatar']}")
         
-        # الحصول على إحصائيات المستخدمين
-        total_count = users_collection.count_documents({})
-        active_count = users_collection.count_documents({'$and': [{'ban': False}, {'wallet_lock': False}]})
-        banned_count = users_collection.count_documents({'ban': True})
-        locked_count = users_collection.count_documents({'wallet_lock': True})
+        # إضافة صور Discord للمستخدمين الذين لا يملكون صورة (استعلام واحد للصفحة)
+        enrich_discord_avatars(users)
         
         return jsonify({
             'success': True,
             'users': users,
             'pagination': {
-                'page': page,
+                'page': page_number(page, after, before),
                 'limit': limit,
                 'total': total_users,
-                'pages': total_pages
+                'pages': total_pages,
+                'next_cursor': cursors['next'],
+                'prev_cursor': cursors['prev']
             },
-            'stats': {
-                'total': total_count,
-                'active': active_count,
-                'banned': banned_count,
-                'locked': locked_count
-            }
+            'stats': stats
         })
         
+    except InvalidCursor as e:
+        return jsonify({
+            'success': False,
+            'message': 'مؤشر الترقيم غير صالح',
+            'error': str(e)
+        }), 400
     except Exception as e:
         logging.error(f"خطأ في الحصول على المستخدمين: {str(e)}")
         return jsonify({
@@ -503,19 +878,9 @@ def get_users_stats():
     - المستخدمين ذوي المحافظ المقفولة
     """
     try:
-        total_count = users_collection.count_documents({})
-        active_count = users_collection.count_documents({'$and': [{'ban': False}, {'wallet_lock': False}]})
-        banned_count = users_collection.count_documents({'ban': True})
-        locked_count = users_collection.count_documents({'wallet_lock': True})
-        
         return jsonify({
             'success': True,
-            'stats': {
-                'total': total_count,
-                'active': active_count,
-                'banned': banned_count,
-                'locked': locked_count
-            }
+            'stats': get_user_stats()
         })
         
     except Exception as e:
@@ -526,6 +891,38 @@ def get_users_stats():
             'error': str(e)
         }), 500
 
+@app.route(f'{API_PREFIX}/system/access-cache-stats', methods=['GET'])
+def access_cache_stats():
+    """
+    إحصائيات ذاكرة التخزين المؤقت لفحوصات الوصول
+    """
+    if not is_staff_ip(get_real_client_ip()):
+        return jsonify({
+            'success': False,
+            'message': 'غير مصرح'
+        }), 403
+    
+    return jsonify({
+        'success': True,
+        'stats': get_access_cache_stats()
+    })
+
+@app.route(f'{API_PREFIX}/system/write-queue-stats', methods=['GET'])
+def write_queue_stats():
+    """
+    إحصائيات طوابير الكتابة المؤجلة (العمق والمحذوف والمكتوب)
+    """
+    if not is_staff_ip(get_real_client_ip()):
+        return jsonify({
+            'success': False,
+            'message': 'غير مصرح'
+        }), 403
+    
+    return jsonify({
+        'success': True,
+        'stats': get_write_queue_stats()
+    })
+
 @app.route(f'{API_PREFIX}/users/toggle-ban', methods=['POST'])
 def toggle_user_ban():
     """
@@ -543,17 +940,22 @@ def toggle_user_ban():
             }), 400
         
         # تحديث حالة الحظر
-        result = users_collection.update_one(
+        previous = users_collection.find_one_and_update(
             {'user_id': user_id},
-            {'$set': {'ban': ban_status}}
+            {'$set': {'ban': ban_status}},
+            projection=USER_STATS_PROJECTION,
+            return_document=ReturnDocument.BEFORE
         )
         
-        if result.matched_count == 0:
+        if previous is None:
             return jsonify({
                 'success': False,
                 'message': 'لم يتم العثور على المستخدم'
             }), 404
         
+        update_user_stats(previous, {**previous, 'ban': ban_status})
+        invalidate_access_caches(user_id)
+        
         return jsonify({
             'success': True,
             'message': 'تم تحديث حالة الحظر بنجاح'
@@ -584,17 +986,21 @@ def toggle_wallet_lock():
             }), 400
         
         # تحديث حالة قفل المحفظة
-        result = users_collection.update_one(
+        previous = users_collection.find_one_and_update(
             {'user_id': user_id},
-            {'$set': {'wallet_lock': lock_status}}
+            {'$set': {'wallet_lock': lock_status}},
+            projection=USER_STATS_PROJECTION,
+            return_document=ReturnDocument.BEFORE
         )
         
-        if result.matched_count == 0:
+        if previous is None:
             return jsonify({
                 'success': False,
                 'message': 'لم يتم العثور على المستخدم'
             }), 404
         
+        update_user_stats(previous, {**previous, 'wallet_lock': lock_status})
+        
         return jsonify({
             'success': True,
             'message': 'تم تحديث حالة قفل المحفظة بنجاح'
@@ -645,12 +1051,12 @@ def transfer_funds():
     
     users_collection.update_one(
         {"user_id": sender_id},
-        {"$set": {"balance": str(new_sender_balance)}}
+        {"$set": balance_fields(str(new_sender_balance))}
     )
     
     users_collection.update_one(
         {"user_id": receiver_id},
-        {"$set": {"balance": str(new_receiver_balance)}}
+        {"$set": balance_fields(str(new_receiver_balance))}
     )
     
     return jsonify({
@@ -718,10 +1124,16 @@ def ban_user():
         print(f"User {user_id} unbanned")
     
     # تحديث حالة الحظر للمستخدم
-    users_collection.update_one(
+    previous = users_collection.find_one_and_update(
         {"user_id": user_id},
-        {"$set": update_data}
+        {"$set": update_data},
+        projection=USER_STATS_PROJECTION,
+        return_document=ReturnDocument.BEFORE
     )
+    if previous is not None:
+        update_user_stats(previous, {**previous, **update_data})
+    
+    invalidate_access_caches(user_id)
     
     status = "banned" if ban_status else "unbanned"
     return jsonify({
@@ -767,18 +1179,22 @@ def delete_user():
         return jsonify({"success": False, "message": "User ID is required"}), 400
     
     # Delete from wallet database
-    wallet_result = users_collection.delete_one({"user_id": user_id})
+    deleted_user = users_collection.find_one_and_delete({"user_id": user_id}, projection=USER_STATS_PROJECTION)
+    if deleted_user is not None:
+        update_user_stats(deleted_user, None)
     
     # Delete from mining database (assuming similar structure)
     mining_result = mining_db["users"].delete_one({"user_id": user_id})
     
-    if wallet_result.deleted_count == 0 and mining_result.deleted_count == 0:
+    if deleted_user is None and mining_result.deleted_count == 0:
         return jsonify({"success": False, "message": "User not found in any database"}), 404
     
+    invalidate_access_caches(user_id)
+    
     return jsonify({
         "success": True,
         "message": "User deleted successfully",
-        "wallet_deleted": wallet_result.deleted_count > 0,
+        "wallet_deleted": deleted_user is not None,
         "mining_deleted": mining_result.deleted_count > 0
     })
 
@@ -1035,7 +1451,7 @@ def update_balance():
     # Update the user's balance
     result = users_collection.update_one(
         {"user_id": user_id},
-        {"$set": {"balance": formatted_balance}}
+        {"$set": balance_fields(formatted_balance)}
     )
     
     if result.modified_count == 0:
@@ -1069,60 +1485,51 @@ def get_top_users_by_balance():
     try:
         limit = int(request.args.get('limit', 50))
         page = int(request.args.get('page', 1))
+        after = request.args.get('after')
+        before = request.args.get('before')
         
-        # حساب التخطي بناءً على رقم الصفحة وحجم الصفحة
-        skip = (page - 1) * limit
-        
-        # الحصول على إجمالي المستخدمين للترقيم
-        total_count = users_collection.count_documents({})
+        # الحصول على إجمالي المستخدمين للترقيم (من مستند العدادات)
+        total_count = get_user_stats()['total']
         
         # حساب إجمالي الصفحات
         total_pages = (total_count + limit - 1) // limit
         
         # الحصول على المستخدمين مرتبين حسب الرصيد (من الأعلى إلى الأقل)
-        # تحويل الرصيد إلى قيمة رقمية للترتيب
-        pipeline = [
-            {"$addFields": {"numeric_balance": {"$toDouble": "$balance"}}},
-            {"$sort": {"numeric_balance": -1}},
-            {"$skip": skip},
-            {"$limit": limit},
-            {"$project": {
-                "_id": 0,
-                "user_id": 1,
-                "username": 1,
-                "avatar": 1,
-                "balance": 1
-            }}
-        ]
+        # باستخدام الحقل الرقمي المفهرس balance_num بدلاً من التحويل عند كل طلب
+        users, cursors = paginate(
+            users_collection, {}, BALANCE_NUM_FIELD, -1, limit,
+            after=after, before=before, page=page,
+            projection={"user_id": 1, "username": 1, "avatar": 1, "balance": 1, BALANCE_NUM_FIELD: 1}
+        )
         
-        users = list(users_collection.aggregate(pipeline))
+        # جلب عدد المعاملات وصور Discord لكل الصفحة باستعلامين فقط
+        transaction_counts = get_transaction_counts([user["user_id"] for user in users])
+        enrich_discord_avatars(users)
         
-        # جلب بيانات المعاملات لكل مستخدم
         for user in users:
-            # البحث عن وثيقة معاملات المستخدم في مجموعة user_transactions
-            user_transactions_doc = wallet_db["user_transactions"].find_one({"user_id": user["user_id"]})
-            if user_transactions_doc:
-                user["total_transactions"] = len(user_transactions_doc.get("transactions", []))
-            else:
-                user["total_transactions"] = 0
-                
-            # إضافة صورة المستخدم من Discord إذا غير موجودة
-            if not user.get("avatar"):
-                discord_user = wallet_db["discord_users"].find_one({"user_id": user["user_id"]})
-                if discord_user and discord_user.get("avatar"):
-                    user["avatar"] = f"https://cdn.discordapp.com/avatars/{user['user_id']}/{discord_user['avatar']}.webp"
+            user.pop("_id", None)
+            user.pop(BALANCE_NUM_FIELD, None)
+            user["total_transactions"] = transaction_counts.get(user["user_id"], 0)
         
         return jsonify({
             'success': True,
             'users': users,
             'pagination': {
-                'page': page,
+                'page': page_number(page, after, before),
                 'limit': limit,
                 'total': total_count,
-                'pages': total_pages
+                'pages': total_pages,
+                'next_cursor': cursors['next'],
+                'prev_cursor': cursors['prev']
             }
         })
         
+    except InvalidCursor as e:
+        return jsonify({
+            'success': False,
+            'message': 'مؤشر الترقيم غير صالح',
+            'error': str(e)
+        }), 400
     except Exception as e:
         logging.error(f"خطأ في الحصول على أعلى المستخدمين: {str(e)}")
         return jsonify({
@@ -1141,61 +1548,61 @@ def get_top_transactors():
         limit = int(request.args.get('limit', 50))
         page = int(request.args.get('page', 1))
         
-        # البحث في مجموعة user_transactions
-        user_transactions = wallet_db["user_transactions"].find({})
-        
-        # حساب عدد المعاملات لكل مستخدم
-        transactors = []
-        for user_doc in user_transactions:
-            transactions_count = len(user_doc.get("transactions", []))
-            if transactions_count > 0:
-                transactors.append({
-                    "user_id": user_doc["user_id"],
-                    "transactions_count": transactions_count
-                })
-        
-        # ترتيب المستخدمين حسب عدد المعاملات
-        transactors.sort(key=lambda x: x["transactions_count"], reverse=True)
+        # حساب عدد المعاملات داخل قاعدة البيانات باستخدام $size بدلاً من تحميل كل المصفوفات
+        # $sort متبوع بـ $limit يحتفظ بأعلى K مستخدم فقط في الذاكرة
+        pipeline = [
+            {"$project": {
+                "_id": 0,
+                "user_id": 1,
+                "transactions_count": {"$size": {"$ifNull": ["$transactions", []]}}
+            }},
+            {"$match": {"transactions_count": {"$gt": 0}}},
+            {"$facet": {
+                "total": [{"$count": "count"}],
+                "page": [
+                    {"$sort": {"transactions_count": -1, "user_id": 1}},
+                    {"$skip": (page - 1) * limit},
+                    {"$limit": limit}
+                ]
+            }}
+        ]
+        result = next(wallet_db["user_transactions"].aggregate(pipeline), {})
+        paginated_transactors = result.get("page", [])
         
         # حساب إجمالي المستخدمين وإجمالي الصفحات
-        total_count = len(transactors)
+        total_count = result["total"][0]["count"] if result.get("total") else 0
         total_pages = (total_count + limit - 1) // limit if total_count > 0 else 1
         
-        # تطبيق الترقيم
-        start_idx = (page - 1) * limit
-        end_idx = min(start_idx + limit, total_count)
-        paginated_transactors = transactors[start_idx:end_idx]
-        
-        # الحصول على بيانات المستخدمين الأكثر نشاطا
-        top_users = []
-        for i, transactor in enumerate(paginated_transactors):
-            user_id = transactor["user_id"]
-            
-            # الحصول على بيانات المستخدم
-            user = users_collection.find_one({"user_id": user_id}, {
+        # الحصول على بيانات المستخدمين وأول 5 معاملات للصفحة كاملة باستعلام واحد لكل منهما
+        user_ids = [transactor["user_id"] for transactor in paginated_transactors]
+        users_by_id = {
+            user["user_id"]: user
+            for user in users_collection.find({"user_id": {"$in": user_ids}}, {
                 "_id": 0,
                 "user_id": 1,
                 "username": 1,
                 "avatar": 1
             })
+        }
+        recent_transactions = {
+            doc["user_id"]: doc.get("transactions", [])
+            for doc in wallet_db["user_transactions"].find(
+                {"user_id": {"$in": user_ids}},
+                {"_id": 0, "user_id": 1, "transactions": {"$slice": 5}}
+            )
+        }
+        enrich_discord_avatars(list(users_by_id.values()))
+        
+        # الحصول على بيانات المستخدمين الأكثر نشاطا بنفس ترتيب الصفحة
+        top_users = []
+        for transactor in paginated_transactors:
+            user = users_by_id.get(transactor["user_id"])
+            if not user:
+                continue
             
-            if user:
-                # إضافة صورة المستخدم من Discord إذا غير موجودة
-                if not user.get("avatar"):
-                    discord_user = wallet_db["discord_users"].find_one({"user_id": user_id})
-                    if discord_user and discord_user.get("avatar"):
-                        user["avatar"] = f"https://cdn.discordapp.com/avatars/{user['user_id']}/{discord_user['avatar']}.webp"
-                
-                # الحصول على معاملات المستخدم
-                user_transactions_doc = wallet_db["user_transactions"].find_one({"user_id": user_id})
-                if user_transactions_doc:
-                    user["total_transactions"] = len(user_transactions_doc.get("transactions", []))
-                    user["transactions"] = user_transactions_doc.get("transactions", [])[:5]  # آخر 5 معاملات فقط
-                else:
-                    user["total_transactions"] = transactor["transactions_count"]
-                    user["transactions"] = []
-                
-                top_users.append(user)
+            user["total_transactions"] = transactor["transactions_count"]
+            user["transactions"] = recent_transactions.get(user["user_id"], [])
+            top_users.append(user)
         
         return jsonify({
             'success': True,
@@ -1225,9 +1632,8 @@ def get_mining_violations():
     try:
         limit = int(request.args.get('limit', 50))
         page = int(request.args.get('page', 1))
-        
-        # حساب التخطي بناءً على رقم الصفحة وحجم الصفحة
-        skip = (page - 1) * limit
+        after = request.args.get('after')
+        before = request.args.get('before')
         
         # محاولة العثور على "mining_violations" في قاعدة البيانات
         collection_names = mining_db.list_collection_names()
@@ -1239,7 +1645,7 @@ def get_mining_violations():
                 'success': True,
                 'violations': [],
                 'pagination': {
-                    'page': page,
+                    'page': page_number(page, after, before),
                     'limit': limit,
                     'total': 0,
                     'pages': 1
@@ -1254,7 +1660,8 @@ def get_mining_violations():
         total_pages = (total_count + limit - 1) // limit if total_count > 0 else 1
         
         # الحصول على مخالفات التعدين من قاعدة البيانات مع الترقيم
-        violations = list(mining_db["mining_violations"].find({}).sort("timestamp", -1).skip(skip).limit(limit))
+        violations, cursors = paginate(mining_db["mining_violations"], {}, "timestamp", -1, limit,
+                                       after=after, before=before, page=page)
         
         # تحويل _id إلى نص وتنسيق البيانات
         formatted_violations = []
@@ -1281,13 +1688,21 @@ def get_mining_violations():
             'success': True,
             'violations': formatted_violations,
             'pagination': {
-                'page': page,
+                'page': page_number(page, after, before),
                 'limit': limit,
                 'total': total_count,
-                'pages': total_pages
+                'pages': total_pages,
+                'next_cursor': cursors['next'],
+                'prev_cursor': cursors['prev']
             }
         })
         
+    except InvalidCursor as e:
+        return jsonify({
+            'success': False,
+            'message': 'مؤشر الترقيم غير صالح',
+            'error': str(e)
+        }), 400
     except Exception as e:
         logging.error(f"خطأ في الحصول على مخالفات التعدين: {str(e)}")
         return jsonify({
@@ -1528,6 +1943,7 @@ def add_staff_member():
         
         # إدراج عضو الفريق الجديد
         result = team_collection.insert_one(new_staff)
+        invalidate_access_caches(staff=True)
         new_staff['_id'] = str(result.inserted_id)
         
         # إضافة معلومات الصورة الرمزية
@@ -1602,6 +2018,7 @@ def update_staff_member():
             {"_id": ObjectId(staff_id)},
             {"$set": updates}
         )
+        invalidate_access_caches(staff=True)
         
         if result.modified_count == 0:
             return jsonify({
@@ -1652,6 +2069,7 @@ def delete_staff_member():
         
         # حذف العضو
         result = team_collection.delete_one({"_id": ObjectId(staff_id)})
+        invalidate_access_caches(staff=True)
         
         if result.deleted_count == 0:
             return jsonify({
@@ -1708,6 +2126,44 @@ BLOCK_TIME = 900  # Block duration in seconds (15 minutes)
 MAX_REQUEST_RATE = 40  # Maximum requests per minute
 REQUEST_RATE_WINDOW = 60  # Time window in seconds for rate tracking
 
+def sync_login_attempts(ip):
+    """Merge failed login attempts recorded by other workers into login_attempts"""
+    if not state_backend.shared:
+        return
+    attempts, last_attempt = state_backend.get_attempts('login', ip)
+    record = login_attempts.setdefault(ip, {'attempts': 0, 'timestamp': last_attempt})
+    if attempts > record.get('attempts', 0):
+        record['attempts'] = attempts
+        record['timestamp'] = last_attempt
+
+def record_failed_login(ip, current_time):
+    """Count a failed login for an IP in this worker and in the shared state backend"""
+    record = login_attempts[ip]
+    shared_attempts, _ = state_backend.incr_attempts('login', ip, BLOCK_TIME, current_time)
+    record['attempts'] = max(record['attempts'] + 1, shared_attempts)
+    record['timestamp'] = current_time
+    return record['attempts']
+
+def reset_login_attempts(ip, current_time):
+    """Clear the failed logins of an IP in this worker and in the shared state backend"""
+    login_attempts[ip] = {'attempts': 0, 'timestamp': current_time}
+    state_backend.reset_attempts('login', ip)
+
+def load_staff_ip(ip):
+    """Check the staff database for an IP (uncached)"""
+    staff_collection = staff_db["staff"]
+    return staff_collection.find_one({"ip_addresses": ip}, {"_id": 1}) is not None
+
+def load_banned_ip(ip):
+    """Get the banned_users record for an IP, or None (uncached)"""
+    ban_collection = staff_db.get_collection("banned_users")
+    return ban_collection.find_one({"ip_address": ip}, {"user_id": 1})
+
+def load_user_ban(user_id):
+    """Check the ban flag of a user (uncached)"""
+    user = users_collection.find_one({"user_id": user_id}, {"ban": 1})
+    return bool(user and user.get('ban', False) == True)
+
 def is_staff_ip(ip):
     """Check if an IP belongs to a staff member"""
     try:
@@ -1715,14 +2171,8 @@ def is_staff_ip(ip):
         if ip in WHITELISTED_IPS:
             return True
             
-        # Check staff database for IP
-        staff_collection = staff_db["staff"]
-        staff = staff_collection.find_one({"ip_addresses": ip})
-        
-        if staff:
-            return True
-            
-        return False
+        # Check staff database for IP (cached for ACCESS_CACHE_TTL)
+        return staff_ip_cache.get_or_load(ip, load_staff_ip)
     except Exception as e:
         logging.error(f"Error checking staff IP: {str(e)}")
         return False
@@ -1738,6 +2188,9 @@ def before_request():
     current_time = time.time()
     path = request.path
     
+    # Pick up ban changes made by other server processes
+    sync_access_caches()
+    
     # استثناء عناوين IP الخاصة بالمسؤولين (localhost وغيرها)
     if client_ip in WHITELISTED_IPS or is_staff_ip(client_ip):
         # السماح بأي وصول للمسؤولين دون قيود
@@ -1745,8 +2198,7 @@ def before_request():
         
     # فحص ما إذا كان هذا IP محظوراً في قاعدة بيانات banned_users
     try:
-        ban_collection = staff_db.get_collection("banned_users")
-        banned_user = ban_collection.find_one({"ip_address": client_ip})
+        banned_user = banned_ip_cache.get_or_load(client_ip, load_banned_ip)
         
         if banned_user:
             # حظر الوصول لنفس عنوان IP إلا إذا كان مسؤول
@@ -1781,9 +2233,8 @@ def before_request():
     # If we have a user_id, check if this user is banned
     # Only block if this specific user is banned, not globally
     if user_id:
-        user = users_collection.find_one({"user_id": user_id})
         # Only apply ban for this specific user, not globally
-        if user and user.get('ban', False) == True:
+        if user_ban_cache.get_or_load(user_id, load_user_ban):
             # Return ban message only for API requests for this specific banned user
             return jsonify({
                 'success': False,
@@ -1813,6 +2264,7 @@ def before_request():
                             'permanent_block': True,
                             'reason': f"Abusive content: {term}"
                         }
+                        state_backend.ban('login', client_ip)
                         
                         # Save to database
                         save_rate_limit_to_db(
@@ -1850,6 +2302,7 @@ def before_request():
                     login_attempts[client_ip]['timestamp'] = current_time
                     login_attempts[client_ip]['permanent_block'] = True
                     login_attempts[client_ip]['reason'] = "DoS attempt detected"
+                    state_backend.ban('login', client_ip)
                     
                     save_rate_limit_to_db(
                         ip=client_ip,
@@ -1880,10 +2333,13 @@ def before_request():
     
     # Only apply the rest of the logic to login routes
     if f'{API_PREFIX}/staff/login' in request.path:
+        # Pick up failed attempts counted by other workers
+        sync_login_attempts(client_ip)
+        
         # Check if IP is blocked due to too many attempts
         if client_ip in login_attempts:
-            # Check for permanent block
-            if login_attempts[client_ip].get('permanent_block', False):
+            # Check for permanent block (issued by this or another worker)
+            if login_attempts[client_ip].get('permanent_block', False) or state_backend.is_banned('login', client_ip):
                 return jsonify({
                     'success': False,
                     'message': 'Your IP has been permanently blocked due to suspicious activity',
@@ -1927,6 +2383,7 @@ def before_request():
                     }), 429
                 else:
                     # Reset after block time with tracking for repeat offenders
+                    state_backend.reset_attempts('login', client_ip)
                     login_attempts[client_ip] = {
                         'attempts': 0, 
                         'timestamp': current_time,
@@ -1981,7 +2438,7 @@ def log_login_attempt(username, client_ip, success, user_id=None, details=None):
             log["user_id"] = user_id
             
         logs_collection = staff_db["login_logs"]
-        logs_collection.insert_one(log)
+        log_write_queue.insert(logs_collection, log)
         
         # Also send to the general logging system
         action_type = "login_success" if success else "login_failure"
@@ -2049,7 +2506,7 @@ def staff_login():
                         return redirect(f'{API_PREFIX}/rate-limit?time_left={time_left}')
                 else:
                     # Reset attempts after block time
-                    login_attempts[client_ip] = {'attempts': 0, 'timestamp': current_time}
+                    reset_login_attempts(client_ip, current_time)
                     
                     # تحديث قاعدة البيانات بإزالة الحظر
                     save_rate_limit_to_db(
@@ -2076,8 +2533,7 @@ def staff_login():
             )
             
             # Increment failed attempts even for missing credentials
-            login_attempts[client_ip]['attempts'] += 1
-            login_attempts[client_ip]['timestamp'] = current_time
+            record_failed_login(client_ip, current_time)
             
             # تحديث قاعدة البيانات
             save_rate_limit_to_db(
@@ -2099,8 +2555,7 @@ def staff_login():
         
         if not staff_member:
             # لم يتم العثور على المستخدم
-            login_attempts[client_ip]['attempts'] += 1
-            login_attempts[client_ip]['timestamp'] = current_time
+            record_failed_login(client_ip, current_time)
             
             # تحديث قاعدة البيانات
             is_now_blocked = login_attempts[client_ip]['attempts'] >= MAX_ATTEMPTS
@@ -2154,8 +2609,7 @@ def staff_login():
         stored_password = staff_member.get('password', '')
         if not stored_password or stored_password != password:
             # كلمة المرور غير صحيحة
-            login_attempts[client_ip]['attempts'] += 1
-            login_attempts[client_ip]['timestamp'] = current_time
+            record_failed_login(client_ip, current_time)
             
             # تحديث قاعدة البيانات
             is_now_blocked = login_attempts[client_ip]['attempts'] >= MAX_ATTEMPTS
@@ -2240,7 +2694,7 @@ def staff_login():
             }), 403
         
         # Reset login attempts on successful login
-        login_attempts[client_ip] = {'attempts': 0, 'timestamp': current_time}
+        reset_login_attempts(client_ip, current_time)
         
         # تحديث قاعدة البيانات بإزالة الحظر
         save_rate_limit_to_db(
@@ -2755,27 +3209,31 @@ def get_staff_logs():
         # Get total count for pagination
         total = logs_collection.count_documents(query)
         
-        # Implement pagination
+        # Implement pagination (after/before cursors, page number as fallback)
         per_page = 10
         total_pages = math.ceil(total / per_page)
-        skip = (page - 1) * per_page
         
         # Get logs with pagination and sorting
-        logs = list(logs_collection.find(
-            query,
-            {'_id': 0}  # Exclude _id field
-        ).sort('timestamp', -1).skip(skip).limit(per_page))
+        logs, cursors = paginate(logs_collection, query, 'timestamp', -1, per_page,
+                                 after=request.args.get('after'), before=request.args.get('before'),
+                                 page=page)
+        for log in logs:
+            log.pop('_id', None)  # Exclude _id field
         
         return jsonify({
             'success': True,
             'logs': logs,
             'pagination': {
-                'page': page,
+                'page': page_number(page, request.args.get('after'), request.args.get('before')),
                 'total_pages': total_pages,
                 'total': total,
-                'per_page': per_page
+                'per_page': per_page,
+                'next_cursor': cursors['next'],
+                'prev_cursor': cursors['prev']
             }
         })
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'message': 'مؤشر الترقيم غير صالح', 'error': str(e)}), 400
     except Exception as e:
         print(f"Error getting logs: {str(e)}")
         return jsonify({'success': False, 'message': 'حدث خطأ أثناء جلب السجلات'}), 500
@@ -3248,6 +3706,7 @@ def clear_rate_limit():
         # Clear rate limit in memory
         if ip in login_attempts:
             login_attempts[ip] = {'attempts': 0, 'timestamp': time.time()}
+        state_backend.reset_attempts('login', ip)
         
         # Clear rate limit in database
         rate_limits_collection = staff_db["rate_limits"]
@@ -3307,27 +3766,31 @@ def get_login_logs():
         # Get total count for pagination
         total = logs_collection.count_documents(query)
         
-        # Implement pagination
+        # Implement pagination (after/before cursors, page number as fallback)
         per_page = 20
         total_pages = math.ceil(total / per_page)
-        skip = (page - 1) * per_page
         
         # Get logs with pagination and sorting
-        logs = list(logs_collection.find(
-            query,
-            {'_id': 0}  # Exclude _id field
-        ).sort('timestamp', -1).skip(skip).limit(per_page))
+        logs, cursors = paginate(logs_collection, query, 'timestamp', -1, per_page,
+                                 after=request.args.get('after'), before=request.args.get('before'),
+                                 page=page)
+        for log in logs:
+            log.pop('_id', None)  # Exclude _id field
         
         return jsonify({
             'success': True,
             'logs': logs,
             'pagination': {
-                'page': page,
+                'page': page_number(page, request.args.get('after'), request.args.get('before')),
                 'total_pages': total_pages,
                 'total': total,
-                'per_page': per_page
+                'per_page': per_page,
+                'next_cursor': cursors['next'],
+                'prev_cursor': cursors['prev']
             }
         })
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'message': 'مؤشر الترقيم غير صالح', 'error': str(e)}), 400
     except Exception as e:
         print(f"Error getting login logs: {str(e)}")
         return jsonify({'success': False, 'message': 'حدث خطأ أثناء جلب سجلات تسجيل الدخول'}), 500
@@ -0,0 +1,291 @@
+"""
+Pluggable store for rate windows, login attempts and bans.
+
+Per-process dicts give every gunicorn worker its own budget and keep bans
+local to the worker that issued them. This module offers the same small API
+over two implementations:
+
+- InProcessStateBackend: single-process state (development, tests, fallback)
+- RedisStateBackend: state shared by every worker through Redis. Counters use
+  a Lua script or a MULTI pipeline so each update is atomic and costs one round
+  trip. Ban checks are answered from a local replica of the ban sets that is
+  refreshed only when the shared ban version changes (checked at most every
+  sync_interval seconds), so the common "not banned" check needs no round trip.
+
+Any redis-py compatible client works, including fakeredis for tests.
+Select with STATE_BACKEND=memory|redis and REDIS_URL.
+"""
+
+import os
+import time
+import logging
+import threading
+
+try:
+    from backend.crn_wallet.rate_counters import ShardedCounterStore
+except ImportError:
+    from rate_counters import ShardedCounterStore
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# INCR a fixed-window counter and set its expiry when the window opens
+_WINDOW_HIT_SCRIPT = """
+local count = redis.call('INCR', KEYS[1])
+if count == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return count
+"""
+
+PERMANENT = float('inf')
+
+
+class InProcessStateBackend:
+    """State kept in this process only"""
+
+    shared = False
+
+    def __init__(self):
+        self._windows = {}
+        self._attempts = {}
+        self._bans = {}
+        self._lock = threading.Lock()
+
+    def hit(self, namespace, key, window, now=None):
+        """Record one event for key and return the count in the current window"""
+        store = self._windows.get((namespace, window))
+        if store is None:
+            with self._lock:
+                store = self._windows.setdefault((namespace, window), ShardedCounterStore(window=window))
+        count, _ = store.hit(key, now)
+        return count
+
+    def incr_attempts(self, namespace, key, ttl, now=None):
+        """Add a failed attempt for key; attempts expire ttl seconds after the last one"""
+        now = time.time() if now is None else now
+        with self._lock:
+            count, _, expires = self._attempts.get((namespace, key), (0, 0, 0))
+            if expires <= now:
+                count = 0
+            count += 1
+            self._attempts[(namespace, key)] = (count, now, now + ttl)
+            return count, now
+
+    def get_attempts(self, namespace, key, now=None):
+        """Get (attempts, time of last attempt) for key"""
+        now = time.time() if now is None else now
+        with self._lock:
+            count, last, expires = self._attempts.get((namespace, key), (0, 0, 0))
+            if expires <= now:
+                return 0, 0
+            return count, last
+
+    def reset_attempts(self, namespace, key):
+        """Forget the failed attempts of key"""
+        with self._lock:
+            self._attempts.pop((namespace, key), None)
+
+    def ban(self, namespace, key, duration=None):
+        """Ban key for duration seconds, or permanently if duration is None"""
+        expiry = PERMANENT if duration is None else time.time() + duration
+        with self._lock:
+            self._bans.setdefault(namespace, {})[key] = expiry
+
+    def unban(self, namespace, key):
+        """Lift a ban"""
+        with self._lock:
+            self._bans.get(namespace, {}).pop(key, None)
+
+    def is_banned(self, namespace, key):
+        """Check if key is currently banned"""
+        expiry = self._bans.get(namespace, {}).get(key)
+        return expiry is not None and expiry > time.time()
+
+    def banned(self, namespace):
+        """Get {key: expiry} of active bans"""
+        now = time.time()
+        with self._lock:
+            return {k: v for k, v in self._bans.get(namespace, {}).items() if v > now}
+
+
+class RedisStateBackend:
+    """State shared by all workers through Redis, with a local ban replica"""
+
+    shared = True
+
+    def __init__(self, client, prefix="crn:", sync_interval=1.0):
+        """
+        Args:
+            client: redis-py compatible client
+            prefix: Key prefix for everything this backend writes
+            sync_interval: Max seconds between checks of the shared ban version
+        """
+        self.client = client
+        self.prefix = prefix
+        self.sync_interval = sync_interval
+        self._window_hit = client.register_script(_WINDOW_HIT_SCRIPT)
+        self._version_key = f"{prefix}bans:version"
+        self._replica = {}  # namespace -> {key: expiry}
+        self._replica_version = None
+        self._checked_at = 0.0
+        self._sync_lock = threading.Lock()
+        # Used when Redis is unreachable so requests keep being limited locally
+        self.fallback = InProcessStateBackend()
+        self.errors = 0
+
+    def _error(self, action, e):
+        self.errors += 1
+        logger.error(f"Redis state backend error during {action}: {e}")
+
+    def hit(self, namespace, key, window, now=None):
+        now = time.time() if now is None else now
+        redis_key = f"{self.prefix}rate:{namespace}:{key}:{int(now // window)}"
+        try:
+            return int(self._window_hit(keys=[redis_key], args=[int(window) + 1]))
+        except Exception as e:
+            self._error("hit", e)
+            return self.fallback.hit(namespace, key, window, now)
+
+    def incr_attempts(self, namespace, key, ttl, now=None):
+        now = time.time() if now is None else now
+        redis_key = f"{self.prefix}attempts:{namespace}:{key}"
+        try:
+            pipe = self.client.pipeline(transaction=True)
+            pipe.hincrby(redis_key, "count", 1)
+            pipe.hset(redis_key, "last", now)
+            pipe.expire(redis_key, int(ttl))
+            count = pipe.execute()[0]
+            return int(count), now
+        except Exception as e:
+            self._error("incr_attempts", e)
+            return self.fallback.incr_attempts(namespace, key, ttl, now)
+
+    def get_attempts(self, namespace, key, now=None):
+        try:
+            data = self.client.hgetall(f"{self.prefix}attempts:{namespace}:{key}")
+        except Exception as e:
+            self._error("get_attempts", e)
+            return self.fallback.get_attempts(namespace, key, now)
+        if not data:
+            return 0, 0
+        return int(data.get(b"count", data.get("count", 0))), float(data.get(b"last", data.get("last", 0)))
+
+    def reset_attempts(self, namespace, key):
+        self.fallback.reset_attempts(namespace, key)
+        try:
+            self.client.delete(f"{self.prefix}attempts:{namespace}:{key}")
+        except Exception as e:
+            self._error("reset_attempts", e)
+
+    def _ban_key(self, namespace):
+        return f"{self.prefix}bans:{namespace}"
+
+    def ban(self, namespace, key, duration=None):
+        expiry = PERMANENT if duration is None else time.time() + duration
+        # Visible to this process immediately, to the others on their next sync
+        self._replica.setdefault(namespace, {})[key] = expiry
+        try:
+            pipe = self.client.pipeline(transaction=True)
+            pipe.zadd(self._ban_key(namespace), {key: expiry})
+            pipe.incr(self._version_key)
+            pipe.execute()
+        except Exception as e:
+            self._error("ban", e)
+            self.fallback.ban(namespace, key, duration)
+
+    def unban(self, namespace, key):
+        self._replica.get(namespace, {}).pop(key, None)
+        self.fallback.unban(namespace, key)
+        try:
+            pipe = self.client.pipeline(transaction=True)
+            pipe.zrem(self._ban_key(namespace), key)
+            pipe.incr(self._version_key)
+            pipe.execute()
+        except Exception as e:
+            self._error("unban", e)
+
+    def _load_namespace(self, pipe, namespace, now):
+        pipe.zremrangebyscore(self._ban_key(namespace), "-inf", now)
+        pipe.zrangebyscore(self._ban_key(namespace), now, "+inf", withscores=True)
+
+    def sync(self, force=False):
+        """Reload the ban replica if another worker changed the bans"""
+        now = time.time()
+        if not force and now - self._checked_at < self.sync_interval:
+            return
+        # One request per interval pays for the version check; others use the replica
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._checked_at = now
+            version = self.client.get(self._version_key)
+            if version == self._replica_version and not force:
+                return
+
+            namespaces = list(self._replica)
+            pipe = self.client.pipeline(transaction=False)
+            for namespace in namespaces:
+                self._load_namespace(pipe, namespace, now)
+            results = pipe.execute()
+
+            replica = {}
+            for i, namespace in enumerate(namespaces):
+                members = results[i * 2 + 1]
+                replica[namespace] = {
+                    (member.decode() if isinstance(member, bytes) else member): score
+                    for member, score in members
+                }
+            self._replica = replica
+            self._replica_version = version
+        except Exception as e:
+            self._error("sync", e)
+        finally:
+            self._sync_lock.release()
+
+    def is_banned(self, namespace, key):
+        if namespace not in self._replica:
+            # First use of this namespace in this process: load it now
+            self._replica[namespace] = {}
+            self.sync(force=True)
+        else:
+            self.sync()
+        expiry = self._replica.get(namespace, {}).get(key)
+        if expiry is not None and expiry > time.time():
+            return True
+        return self.fallback.is_banned(namespace, key)
+
+    def banned(self, namespace):
+        self.sync()
+        now = time.time()
+        bans = {k: v for k, v in self._replica.get(namespace, {}).items() if v > now}
+        bans.update(self.fallback.banned(namespace))
+        return bans
+
+
+def create_state_backend():
+    """
+    Create the configured backend: Redis when reachable (REDIS_URL, default
+    localhost) unless STATE_BACKEND=memory, otherwise in-process.
+    """
+    kind = os.environ.get("STATE_BACKEND", "redis").lower()
+    if kind == "memory" or redis is None:
+        return InProcessStateBackend()
+
+    url = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+    try:
+        client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        client.ping()
+        logger.info(f"Using Redis state backend at {url}")
+        return RedisStateBackend(client, prefix=os.environ.get("STATE_PREFIX", "crn:"))
+    except Exception as e:
+        logger.warning(f"Redis state backend unavailable ({e}); using in-process state")
+        return InProcessStateBackend()
+
+
+# Shared backend used by security.py, honeypot.py and server.py
+state_backend = create_state_backend()
@@ -5,8 +5,10 @@ from datetime import datetime
 import logging
 import csv
 import io
+import tempfile
 import pandas as pd
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from openpyxl.utils import get_column_letter
 
@@ -22,6 +24,22 @@ config.read('config.ini')
 client = MongoClient(MONGO_URI)
 wallet_db = client["cryptonel_wallet"]
 user_transactions_collection = wallet_db["user_transactions"]
+settings_collection = wallet_db["settings"]
+
+# Shared version document of server.py's access caches; bumping it makes every
+# worker drop its cached ban state within ACCESS_CACHE_VERSION_CHECK
+ACCESS_CACHE_VERSION_ID = "access_cache_version"
+
+def bump_access_cache_version():
+    """Tell every server worker to reload cached ban state"""
+    try:
+        settings_collection.update_one(
+            {"_id": ACCESS_CACHE_VERSION_ID},
+            {"$inc": {"version": 1}},
+            upsert=True
+        )
+    except Exception as e:
+        logging.error(f"Error bumping access cache version: {str(e)}")
 
 # API prefix
 API_PREFIX = '/api'
@@ -128,10 +146,281 @@ def get_user_transactions():
             "error": str(e)
         }), 500 
 
+# أعمدة ملف التصدير بالترتيب
+EXPORT_FIELDS = ("transaction_id", "type", "amount", "fee", "timestamp", "status",
+                 "counterparty_id", "counterparty_address")
+EXPORT_HEADERS = ["رقم المعاملة", "النوع", "المبلغ", "الرسوم", "التاريخ والوقت", "الحالة",
+                  "معرف الطرف الآخر", "عنوان الطرف الآخر"]
+EXPORT_COLUMN_WIDTHS = [30, 12, 15, 15, 25, 15, 30, 40]
+EXPORT_STATUS_MAPPING = {
+    "completed": "مكتملة",
+    "pending": "قيد التنفيذ",
+    "canceled": "ملغية"
+}
+EXPORT_TYPE_MAPPING = {
+    "sent": "إرسال",
+    "received": "استلام"
+}
+# Documents fetched per cursor round trip, and bytes per chunk of a streamed file
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def _selected_transactions(selected_ids):
+    """$filter expression keeping only the selected transactions of the user document"""
+    return {"$filter": {
+        "input": {"$ifNull": ["$transactions", []]},
+        "as": "tx",
+        "cond": {"$in": ["$$tx.transaction_id", selected_ids]}
+    }}
+
+
+def export_transactions_pipeline(user_id, selected_ids=None):
+    """
+    Aggregation yielding one projected document per transaction, newest first.
+    Selection, unwinding and sorting all run on the server.
+    """
+    transactions = _selected_transactions(selected_ids) if selected_ids else "$transactions"
+    projection = {field: f"$tx.{field}" for field in EXPORT_FIELDS if field != "timestamp"}
+    # التواريخ المستوردة بصيغة {"$date": ...} تُستبدل بقيمتها قبل الترتيب
+    projection["timestamp"] = {"$cond": [
+        {"$eq": [{"$type": "$tx.timestamp"}, "object"]},
+        {"$arrayElemAt": [{"$map": {"input": {"$objectToArray": "$tx.timestamp"}, "in": "$$this.v"}}, 0]},
+        "$tx.timestamp"
+    ]}
+    return [
+        {"$match": {"user_id": user_id}},
+        {"$project": {"_id": 0, "tx": transactions}},
+        {"$unwind": "$tx"},
+        {"$project": projection},
+        {"$sort": {"timestamp": -1}}
+    ]
+
+
+def count_export_transactions(user_id, selected_ids=None):
+    """Get (total, exported) transaction counts, or None if the user does not exist"""
+    counts = {"_id": 0, "total": {"$size": {"$ifNull": ["$transactions", []]}}}
+    if selected_ids:
+        counts["selected"] = {"$size": _selected_transactions(selected_ids)}
+    result = list(user_transactions_collection.aggregate([{"$match": {"user_id": user_id}}, {"$project": counts}]))
+    if not result:
+        return None
+    return result[0]["total"], result[0].get("selected", result[0]["total"])
+
+
+def _format_export_timestamp(timestamp):
+    if isinstance(timestamp, dict) and "$date" in timestamp:
+        timestamp = timestamp["$date"]
+    if isinstance(timestamp, str):
+        try:
+            timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+        except ValueError:
+            try:
+                timestamp = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S.%f%z")
+            except ValueError:
+                return "تاريخ غير صحيح"
+    if isinstance(timestamp, datetime):
+        return timestamp.strftime("%Y-%m-%d %H:%M:%S")
+    return timestamp
+
+
+def iter_export_rows(cursor):
+    """Turn projected transaction documents into display rows, one at a time"""
+    for tx in cursor:
+        yield (
+            tx.get("transaction_id", ""),
+            EXPORT_TYPE_MAPPING.get(tx.get("type", ""), tx.get("type", "")),
+            tx.get("amount", "0"),
+            tx.get("fee", "0"),
+            _format_export_timestamp(tx.get("timestamp")),
+            EXPORT_STATUS_MAPPING.get(tx.get("status", ""), tx.get("status", "")),
+            tx.get("counterparty_id", ""),
+            tx.get("counterparty_address", "")
+        )
+
+
+def stream_csv(rows):
+    """Generate CSV text chunks (UTF-8 with BOM so Excel detects the encoding)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_HEADERS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def stream_file(file_obj):
+    """Generate a file's content in chunks and close it at the end"""
+    try:
+        file_obj.seek(0)
+        while True:
+            chunk = file_obj.read(EXPORT_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        file_obj.close()
+
+
+class _ExportStyles:
+    """Cell styles of the transactions workbook, created once per export"""
+
+    def __init__(self):
+        self.border = Border(left=Side(style='thin'), right=Side(style='thin'),
+                             top=Side(style='thin'), bottom=Side(style='thin'))
+        self.header_font = Font(name='Arial', size=12, bold=True, color="FFFFFF")
+        self.header_fill = PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid")
+        self.header_alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
+        self.title_font = Font(name='Arial', size=16, bold=True, color="FFFFFF")
+        self.title_fill = PatternFill(start_color="2F75B5", end_color="2F75B5", fill_type="solid")
+        self.info_fill = PatternFill(start_color="E8F1FB", end_color="E8F1FB", fill_type="solid")
+        self.label_font = Font(name='Arial', size=11, bold=True)
+        self.value_font = Font(name='Arial', size=11)
+        self.center = Alignment(horizontal='center', vertical='center')
+        self.left = Alignment(horizontal='left', vertical='center')
+        self.right = Alignment(horizontal='right', vertical='center')
+        self.row_fills = (PatternFill(start_color="F5F9FD", end_color="F5F9FD", fill_type="solid"),
+                          PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid"))
+        red = PatternFill(start_color="FFD9D9", end_color="FFD9D9", fill_type="solid")
+        green = PatternFill(start_color="E2EFDA", end_color="E2EFDA", fill_type="solid")
+        yellow = PatternFill(start_color="FFF2CC", end_color="FFF2CC", fill_type="solid")
+        self.type_styles = {
+            "إرسال": (red, Font(name='Arial', size=11, bold=True, color="C00000")),
+            "استلام": (green, Font(name='Arial', size=11, bold=True, color="006100")),
+        }
+        self.default_type_font = Font(name='Arial', size=11, bold=True)
+        self.status_styles = {
+            "مكتملة": (green, Font(name='Arial', size=11, color="006100", bold=True)),
+            "قيد التنفيذ": (yellow, Font(name='Arial', size=11, color="9C5700", bold=True)),
+            "ملغية": (red, Font(name='Arial', size=11, color="C00000", bold=True)),
+        }
+        self.sent_amount_font = Font(name='Arial', size=11, color="C00000", bold=True)
+        self.received_amount_font = Font(name='Arial', size=11, color="006100", bold=True)
+
+
+def _cell(ws, value, font=None, fill=None, alignment=None, border=None):
+    cell = WriteOnlyCell(ws, value=value)
+    if font is not None:
+        cell.font = font
+    if fill is not None:
+        cell.fill = fill
+    if alignment is not None:
+        cell.alignment = alignment
+    if border is not None:
+        cell.border = border
+    return cell
+
+
+def _with_currency(value, fee=False):
+    """Append the currency unit (fees only when non-zero)"""
+    if fee:
+        try:
+            if float(value) <= 0:
+                return value
+        except (TypeError, ValueError):
+            return value
+    return f"{value} CRN"
+
+
+def write_transactions_xlsx(rows, file_obj, user_info, admin_notes="", selection=None):
+    """
+    Write the styled transactions report to file_obj with openpyxl's
+    write-only mode: rows go straight to a temporary XML file, so memory use
+    does not grow with the number of transactions.
+    """
+    styles = _ExportStyles()
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("معاملات المستخدم")
+
+    # إعداد اتجاه الصفحة للغة العربية وعرض الأعمدة (قبل إضافة أي صف)
+    ws.sheet_view.rightToLeft = True
+    for i, width in enumerate(EXPORT_COLUMN_WIDTHS, 1):
+        ws.column_dimensions[get_column_letter(i)].width = width
+
+    # Write-only sheets do not track their size, so count appended rows here
+    row_count = [0]
+
+    def append(cells):
+        ws.append(cells)
+        row_count[0] += 1
+
+    def banner(text, font, fill, alignment=styles.center):
+        row = row_count[0] + 1
+        ws.merged_cells.add(f'A{row}:H{row}')
+        append([_cell(ws, text, font, fill, alignment, styles.border)])
+
+    def info_row(label, value, label2, value2):
+        row = row_count[0] + 1
+        for cells in ('A{0}:B{0}', 'C{0}:D{0}', 'E{0}:F{0}', 'G{0}:H{0}'):
+            ws.merged_cells.add(cells.format(row))
+        label_cell = lambda text: _cell(ws, text, styles.label_font, styles.info_fill, styles.left, styles.border)
+        value_cell = lambda text: _cell(ws, text, styles.value_font, styles.info_fill, styles.right, styles.border)
+        append([label_cell(label), None, value_cell(value), None,
+                   label_cell(label2), None, value_cell(value2), None])
+
+    # معلومات المستخدم في الأعلى
+    banner(f"تقرير معاملات المستخدم: {user_info['username']} ({user_info['user_id']})",
+           styles.title_font, styles.title_fill)
+    info_row("معرف المستخدم:", user_info['user_id'], "الرصيد الحالي:", f"{user_info['balance']} CRN")
+    info_row("اسم المستخدم:", user_info['username'], "البريد الإلكتروني:", user_info['email'])
+    banner(f"تم إنشاء التقرير في: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+           Font(name='Arial', size=10, italic=True),
+           PatternFill(start_color="DDEBF7", end_color="DDEBF7", fill_type="solid"))
+
+    # ملاحظات المشرف ومعلومات المعاملات المحددة
+    if admin_notes.strip():
+        banner(f"ملاحظات المشرف: {admin_notes}", styles.value_font,
+               PatternFill(start_color="FFF2CC", end_color="FFF2CC", fill_type="solid"), styles.right)
+    if selection:
+        exported, total = selection
+        banner(f"تم تصدير {exported} معاملة من أصل {total} معاملة", Font(name='Arial', size=10),
+               PatternFill(start_color="EBF1DE", end_color="EBF1DE", fill_type="solid"))
+
+    # إضافة مساحة
+    ws.row_dimensions[row_count[0] + 1].height = 10
+    append([])
+
+    append([_cell(ws, header, styles.header_font, styles.header_fill, styles.header_alignment, styles.border)
+               for header in EXPORT_HEADERS])
+
+    # إضافة البيانات صفاً بصف
+    for row_num, (tx_id, tx_type, amount, fee, timestamp, status, cp_id, cp_address) in \
+            enumerate(rows, row_count[0] + 1):
+        row_fill = styles.row_fills[row_num % 2]
+        type_fill, type_font = styles.type_styles.get(tx_type, (None, styles.default_type_font))
+        status_fill, status_font = styles.status_styles.get(status, (None, styles.value_font))
+        amount_font = styles.sent_amount_font if tx_type == "إرسال" else styles.received_amount_font
+        ws.append([
+            _cell(ws, tx_id, fill=row_fill, alignment=styles.right, border=styles.border),
+            _cell(ws, tx_type, type_font, type_fill or row_fill, styles.center, styles.border),
+            _cell(ws, _with_currency(amount), amount_font, row_fill, styles.center, styles.border),
+            _cell(ws, _with_currency(fee, fee=True), fill=row_fill, alignment=styles.center, border=styles.border),
+            _cell(ws, timestamp, fill=row_fill, alignment=styles.center, border=styles.border),
+            _cell(ws, status, status_font if status_fill else None, status_fill or row_fill, styles.center, styles.border),
+            _cell(ws, cp_id, fill=row_fill, alignment=styles.right, border=styles.border),
+            _cell(ws, cp_address, fill=row_fill, alignment=styles.right, border=styles.border),
+        ])
+
+    # مصادقة المستند
+    ws.protection.sheet = True
+    ws.protection.password = "cryptonel"
+
+    wb.save(file_obj)
+
+
 @transaction_routes.route(f'{API_PREFIX}/admin/user/transactions/export', methods=['GET'])
 def export_user_transactions():
     """
-    تصدير معاملات المستخدم بتنسيق Excel
+    تصدير معاملات المستخدم بتنسيق Excel أو CSV
+    
+    The rows come from a server-side sorted aggregation cursor and are written
+    out as they arrive: CSV is streamed directly and XLSX is built with
+    openpyxl's write-only mode in a temporary file, then streamed.
     """
     try:
         # الحصول على معرف المستخدم من المعلمات
@@ -152,316 +441,63 @@ def export_user_transactions():
                 "error": "missing_user_id"
             }), 400
         
-        # البحث عن المستخدم في قاعدة البيانات
-        user = user_transactions_collection.find_one({"user_id": user_id})
+        # عدد المعاملات (يتحقق أيضاً من وجود المستخدم) دون تحميل المصفوفة
+        counts = count_export_transactions(user_id, selected_transaction_ids)
         
-        if not user:
+        if counts is None:
             return jsonify({
                 "success": False,
                 "message": "لم يتم العثور على المستخدم",
                 "error": "user_not_found"
             }), 404
-        
-        # استخراج المعاملات من وثيقة المستخدم
-        transactions = user.get("transactions", [])
-        
-        # تصفية المعاملات حسب المعرفات المحددة (إذا وجدت)
-        if selected_transaction_ids:
-            transactions = [tx for tx in transactions if tx.get('transaction_id') in selected_transaction_ids]
-            print(f"Filtered transactions by selection, found {len(transactions)} transactions")
+        total_count, export_count = counts
         
         # الحصول على بيانات المستخدم الإضافية من مجموعة المستخدمين
         users_collection = wallet_db["users"]
-        user_details = users_collection.find_one({"user_id": user_id})
-        username = "غير معروف"
-        balance = "0.00000000"
-        email = "غير متوفر"
-        account_type = "غير متوفر"
-        
-        if user_details:
-            username = user_details.get("username", "غير معروف")
-            balance = user_details.get("balance", "0.00000000")
-            email = user_details.get("email", "غير متوفر")
-            account_type = user_details.get("account_type", "غير متوفر")
-            print(f"Found user details for export with username: {username} and balance: {balance}")
-        else:
-            print(f"User details not found in users collection for export user_id: {user_id}")
-        
-        # ترتيب المعاملات حسب الطابع الزمني (الأحدث أولاً)
-        for tx in transactions:
-            if isinstance(tx.get("timestamp"), dict) and "$date" in tx["timestamp"]:
-                tx["timestamp"] = tx["timestamp"]["$date"]
-        
-        transactions.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
-        
-        # تحويل البيانات إلى تنسيق قابل للقراءة
-        formatted_transactions = []
-        for tx in transactions:
-            timestamp = tx.get("timestamp")
-            if isinstance(timestamp, str):
-                try:
-                    timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-                except:
-                    try:
-                        timestamp = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S.%f%z")
-                    except:
-                        timestamp = "تاريخ غير صحيح"
-            
-            status_mapping = {
-                "completed": "مكتملة",
-                "pending": "قيد التنفيذ",
-                "canceled": "ملغية"
-            }
-            
-            type_mapping = {
-                "sent": "إرسال",
-                "received": "استلام"
-            }
-            
-            formatted_transactions.append({
-                "رقم المعاملة": tx.get("transaction_id", ""),
-                "النوع": type_mapping.get(tx.get("type", ""), tx.get("type", "")),
-                "المبلغ": tx.get("amount", "0"),
-                "الرسوم": tx.get("fee", "0"),
-                "التاريخ والوقت": timestamp if isinstance(timestamp, datetime) else timestamp,
-                "الحالة": status_mapping.get(tx.get("status", ""), tx.get("status", "")),
-                "معرف الطرف الآخر": tx.get("counterparty_id", ""),
-                "عنوان الطرف الآخر": tx.get("counterparty_address", "")
-            })
-        
-        # بناء ملف إكسل
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "معاملات المستخدم"
-        
-        # إعداد اتجاه الصفحة للغة العربية
-        ws.sheet_view.rightToLeft = True
-        
-        # أنماط التنسيق
-        header_font = Font(name='Arial', size=12, bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid")
-        header_alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-        
-        # حدود الخلايا
-        thin_border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
+        user_details = users_collection.find_one(
+            {"user_id": user_id},
+            {"_id": 0, "username": 1, "balance": 1, "email": 1}
+        ) or {}
+        user_info = {
+            "user_id": user_id,
+            "username": user_details.get("username", "غير معروف"),
+            "balance": user_details.get("balance", "0.00000000"),
+            "email": user_details.get("email", "غير متوفر")
+        }
+        
+        # المعاملات مرتبة من الأحدث إلى الأقدم على الخادم
+        cursor = user_transactions_collection.aggregate(
+            export_transactions_pipeline(user_id, selected_transaction_ids),
+            allowDiskUse=True,
+            batchSize=EXPORT_BATCH_SIZE
         )
+        rows = iter_export_rows(cursor)
+        filename = f"transactions_{user_info['username']}_{user_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
         
-        # معلومات المستخدم في الأعلى - تحسين التنسيق
-        ws.merge_cells('A1:H1')
-        ws['A1'] = f"تقرير معاملات المستخدم: {username} ({user_id})"
-        ws['A1'].font = Font(name='Arial', size=16, bold=True)
-        ws['A1'].alignment = Alignment(horizontal='center', vertical='center')
-        ws['A1'].fill = PatternFill(start_color="2F75B5", end_color="2F75B5", fill_type="solid")
-        ws['A1'].font = Font(name='Arial', size=16, bold=True, color="FFFFFF")
-        
-        # القسم الأول: معلومات المستخدم
-        info_fill = PatternFill(start_color="E8F1FB", end_color="E8F1FB", fill_type="solid")
-        label_font = Font(name='Arial', size=11, bold=True)
-        value_font = Font(name='Arial', size=11)
-        
-        # الصف الثاني: معرف المستخدم
-        ws.merge_cells('A2:B2')
-        ws['A2'] = "معرف المستخدم:"
-        ws['A2'].font = label_font
-        ws['A2'].alignment = Alignment(horizontal='left', vertical='center')
-        ws['A2'].fill = info_fill
-        ws['A2'].border = thin_border
-        
-        ws.merge_cells('C2:D2')
-        ws['C2'] = user_id
-        ws['C2'].font = value_font
-        ws['C2'].alignment = Alignment(horizontal='right', vertical='center')
-        ws['C2'].fill = info_fill
-        ws['C2'].border = thin_border
-        
-        # الرصيد
-        ws.merge_cells('E2:F2')
-        ws['E2'] = "الرصيد الحالي:"
-        ws['E2'].font = label_font
-        ws['E2'].alignment = Alignment(horizontal='left', vertical='center')
-        ws['E2'].fill = info_fill
-        ws['E2'].border = thin_border
-        
-        ws.merge_cells('G2:H2')
-        ws['G2'] = f"{balance} CRN"
-        ws['G2'].font = value_font
-        ws['G2'].alignment = Alignment(horizontal='right', vertical='center')
-        ws['G2'].fill = info_fill
-        ws['G2'].border = thin_border
-        
-        # الصف الثالث: اسم المستخدم
-        ws.merge_cells('A3:B3')
-        ws['A3'] = "اسم المستخدم:"
-        ws['A3'].font = label_font
-        ws['A3'].alignment = Alignment(horizontal='left', vertical='center')
-        ws['A3'].fill = info_fill
-        ws['A3'].border = thin_border
-        
-        ws.merge_cells('C3:D3')
-        ws['C3'] = username
-        ws['C3'].font = value_font
-        ws['C3'].alignment = Alignment(horizontal='right', vertical='center')
-        ws['C3'].fill = info_fill
-        ws['C3'].border = thin_border
-        
-        # البريد الإلكتروني
-        ws.merge_cells('E3:F3')
-        ws['E3'] = "البريد الإلكتروني:"
-        ws['E3'].font = label_font
-        ws['E3'].alignment = Alignment(horizontal='left', vertical='center')
-        ws['E3'].fill = info_fill
-        ws['E3'].border = thin_border
-        
-        ws.merge_cells('G3:H3')
-        ws['G3'] = email
-        ws['G3'].font = value_font
-        ws['G3'].alignment = Alignment(horizontal='right', vertical='center')
-        ws['G3'].fill = info_fill
-        ws['G3'].border = thin_border
-        
-        # إضافة تاريخ التقرير
-        ws.merge_cells('A4:H4')
-        report_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        ws['A4'] = f"تم إنشاء التقرير في: {report_date}"
-        ws['A4'].font = Font(name='Arial', size=10, italic=True)
-        ws['A4'].alignment = Alignment(horizontal='center', vertical='center')
-        ws['A4'].fill = PatternFill(start_color="DDEBF7", end_color="DDEBF7", fill_type="solid")
-        ws['A4'].border = thin_border
-        
-        # إضافة ملاحظات المشرف إذا وجدت
-        current_row = 5
-        if admin_notes.strip():
-            ws.merge_cells(f'A{current_row}:H{current_row}')
-            ws[f'A{current_row}'] = f"ملاحظات المشرف: {admin_notes}"
-            ws[f'A{current_row}'].font = Font(name='Arial', size=11)
-            ws[f'A{current_row}'].alignment = Alignment(horizontal='right', vertical='center')
-            ws[f'A{current_row}'].fill = PatternFill(start_color="FFF2CC", end_color="FFF2CC", fill_type="solid")
-            ws[f'A{current_row}'].border = thin_border
-            current_row += 1
-        
-        # إضافة معلومات عن المعاملات المحددة
-        if selected_transaction_ids:
-            ws.merge_cells(f'A{current_row}:H{current_row}')
-            ws[f'A{current_row}'] = f"تم تصدير {len(transactions)} معاملة من أصل {len(user.get('transactions', []))} معاملة"
-            ws[f'A{current_row}'].font = Font(name='Arial', size=10)
-            ws[f'A{current_row}'].alignment = Alignment(horizontal='center', vertical='center')
-            ws[f'A{current_row}'].fill = PatternFill(start_color="EBF1DE", end_color="EBF1DE", fill_type="solid")
-            ws[f'A{current_row}'].border = thin_border
-            current_row += 1
-        
-        # إضافة مساحة
-        ws.row_dimensions[current_row].height = 10
-        current_row += 1
-        
-        # رؤوس الأعمدة - تحسين التنسيق
-        headers = ["رقم المعاملة", "النوع", "المبلغ", "الرسوم", "التاريخ والوقت", "الحالة", "معرف الطرف الآخر", "عنوان الطرف الآخر"]
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=current_row, column=col_num)
-            cell.value = header
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = header_alignment
-            cell.border = thin_border
-        
-        # ضبط عرض الأعمدة
-        column_widths = [30, 12, 15, 15, 25, 15, 30, 40]
-        for i, width in enumerate(column_widths, 1):
-            ws.column_dimensions[get_column_letter(i)].width = width
-        
-        # إضافة البيانات
-        for row_num, tx in enumerate(formatted_transactions, current_row + 1):
-            # نمط الصف
-            row_fill = PatternFill(start_color="F5F9FD", end_color="F5F9FD", fill_type="solid") if row_num % 2 == 0 else PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
-            
-            # تلوين حسب نوع المعاملة
-            type_fill = None
-            type_font = Font(name='Arial', size=11, bold=True)
-            
-            if tx["النوع"] == "إرسال":
-                type_fill = PatternFill(start_color="FFD9D9", end_color="FFD9D9", fill_type="solid")
-                type_font = Font(name='Arial', size=11, bold=True, color="C00000")
-            elif tx["النوع"] == "استلام":
-                type_fill = PatternFill(start_color="E2EFDA", end_color="E2EFDA", fill_type="solid")
-                type_font = Font(name='Arial', size=11, bold=True, color="006100")
-            
-            # تلوين حسب الحالة
-            status_fill = None
-            status_font = Font(name='Arial', size=11)
-            
-            if tx["الحالة"] == "مكتملة":
-                status_fill = PatternFill(start_color="E2EFDA", end_color="E2EFDA", fill_type="solid")
-                status_font = Font(name='Arial', size=11, color="006100", bold=True)
-            elif tx["الحالة"] == "قيد التنفيذ":
-                status_fill = PatternFill(start_color="FFF2CC", end_color="FFF2CC", fill_type="solid")
-                status_font = Font(name='Arial', size=11, color="9C5700", bold=True)
-            elif tx["الحالة"] == "ملغية":
-                status_fill = PatternFill(start_color="FFD9D9", end_color="FFD9D9", fill_type="solid")
-                status_font = Font(name='Arial', size=11, color="C00000", bold=True)
-            
-            # إضافة بيانات الصف
-            for col_num, (key, value) in enumerate(tx.items(), 1):
-                cell = ws.cell(row=row_num, column=col_num)
-                
-                # تنسيق التاريخ
-                if key == "التاريخ والوقت" and isinstance(value, datetime):
-                    cell.value = value.strftime("%Y-%m-%d %H:%M:%S")
-                else:
-                    cell.value = value
-                
-                # تطبيق التنسيق الأساسي
-                cell.border = thin_border
-                
-                if col_num != 2 and col_num != 6:  # ليس النوع أو الحالة
-                    cell.fill = row_fill
-                    
-                # تنسيق المبلغ
-                if key == "المبلغ":
-                    if tx["النوع"] == "إرسال":
-                        cell.font = Font(name='Arial', size=11, color="C00000", bold=True)
-                    else:
-                        cell.font = Font(name='Arial', size=11, color="006100", bold=True)
-                
-                # تنسيقات خاصة حسب العمود
-                if key == "النوع" and type_fill:
-                    cell.fill = type_fill
-                    cell.font = type_font
-                elif key == "الحالة" and status_fill:
-                    cell.fill = status_fill
-                    cell.font = status_font
-                
-                # محاذاة النص
-                if key in ["رقم المعاملة", "معرف الطرف الآخر", "عنوان الطرف الآخر"]:
-                    cell.alignment = Alignment(horizontal='right')
-                elif key in ["المبلغ", "الرسوم"]:
-                    cell.alignment = Alignment(horizontal='center')
-                    # إضافة وحدة العملة
-                    if key == "المبلغ":
-                        cell.value = f"{value} CRN"
-                    if key == "الرسوم" and float(value) > 0:
-                        cell.value = f"{value} CRN"
-                else:
-                    cell.alignment = Alignment(horizontal='center')
-        
-        # مصادقة المستند
-        ws.protection.sheet = True
-        ws.protection.password = "cryptonel"
-        
-        # حفظ الملف مؤقتًا
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
+        if export_format == 'csv':
+            return Response(
+                stream_csv(rows),
+                mimetype="text/csv; charset=utf-8",
+                headers={"Content-Disposition": f"attachment;filename={filename}.csv"}
+            )
         
-        # تجهيز ملف الإكسل للتنزيل
-        filename = f"transactions_{username}_{user_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.xlsx"
+        output = tempfile.TemporaryFile()
+        try:
+            write_transactions_xlsx(
+                rows, output, user_info, admin_notes,
+                selection=(export_count, total_count) if selected_transaction_ids else None
+            )
+        except Exception:
+            output.close()
+            raise
+        finally:
+            cursor.close()
         
+        # تجهيز ملف الإكسل للتنزيل
         return Response(
-            output,
+            stream_file(output),
             mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment;filename={filename}"}
+            headers={"Content-Disposition": f"attachment;filename={filename}.xlsx"}
         )
         
     except Exception as e:
@@ -507,6 +543,7 @@ def toggle_user_ban():
             {"user_id": user_id},
             {"$set": {"ban": new_ban_status}}
         )
+        bump_access_cache_version()
         
         # تحديث حالة الحظر في مجموعة معاملات المستخدم أيضًا
         user_transactions_collection.update_one(
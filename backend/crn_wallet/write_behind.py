@@ -0,0 +1,229 @@
+"""
+Bounded write-behind queue for MongoDB.
+
+Request threads enqueue inserts and keyed upserts and return immediately; a
+background thread writes them in batches with insert_many / bulk_write.
+Upserts with the same key that are still waiting are merged into one write,
+so a burst of updates for one IP costs a single database operation.
+
+When the queue is full the overflow policy decides what happens:
+
+- "drop_newest": reject the new write (default for logs)
+- "drop_oldest": discard the oldest queued insert to make room
+- "block": wait up to block_timeout for room, then drop the new write
+
+Queued writes are flushed on interpreter shutdown (atexit) and by stop().
+"""
+
+import time
+import atexit
+import logging
+import threading
+from collections import deque, OrderedDict
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("drop_newest", "drop_oldest", "block")
+
+
+class WriteBehindQueue:
+    """Batches MongoDB writes off the request path"""
+
+    def __init__(self, name, max_size=10000, batch_size=500, flush_interval=0.5,
+                 policy="drop_newest", block_timeout=0.05):
+        """
+        Args:
+            name: Name used in logs and stats
+            max_size: Max queued writes (inserts + distinct upsert keys)
+            batch_size: Max writes sent per collection per batch
+            flush_interval: Max seconds a write waits before being flushed
+            policy: Overflow policy, one of OVERFLOW_POLICIES
+            block_timeout: Max seconds to wait for room with the "block" policy
+        """
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self.name = name
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+
+        self._inserts = deque()  # (collection, document)
+        self._upserts = OrderedDict()  # (collection name, key) -> [collection, filter, $set, $setOnInsert]
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._stopped = False
+        self._thread = None
+
+        self.enqueued = 0
+        self.coalesced = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+        self.high_watermark = 0
+        self.last_flush_ms = 0.0
+
+    def _depth(self):
+        return len(self._inserts) + len(self._upserts)
+
+    def _make_room(self):
+        """Apply the overflow policy; called with the lock held. Returns False to drop the write."""
+        if self._depth() < self.max_size:
+            return True
+        if self.policy == "drop_oldest" and self._inserts:
+            self._inserts.popleft()
+            self.dropped += 1
+            return True
+        if self.policy == "block":
+            self._wakeup.set()
+            deadline = time.time() + self.block_timeout
+            while self._depth() >= self.max_size:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self._not_full.wait(remaining):
+                    break
+            if self._depth() < self.max_size:
+                return True
+        self.dropped += 1
+        return False
+
+    def _enqueued(self):
+        self.enqueued += 1
+        depth = self._depth()
+        if depth > self.high_watermark:
+            self.high_watermark = depth
+        if depth >= self.batch_size:
+            self._wakeup.set()
+
+    def insert(self, collection, document):
+        """Queue insert_one(document); returns False if the write was dropped"""
+        with self._lock:
+            if not self._make_room():
+                return False
+            self._inserts.append((collection, document))
+            self._enqueued()
+        return True
+
+    def upsert(self, collection, key, set_fields, set_on_insert=None):
+        """
+        Queue update_one(key, {$set, $setOnInsert}, upsert=True).
+        A pending upsert for the same key is merged: later $set values win,
+        the first $setOnInsert values are kept.
+        """
+        coalesce_key = (collection.full_name, tuple(sorted(key.items())))
+        with self._lock:
+            pending = self._upserts.get(coalesce_key)
+            if pending is not None:
+                pending[2].update(set_fields)
+                for field, value in (set_on_insert or {}).items():
+                    pending[3].setdefault(field, value)
+                self.coalesced += 1
+                return True
+            if not self._make_room():
+                return False
+            self._upserts[coalesce_key] = [collection, dict(key), dict(set_fields), dict(set_on_insert or {})]
+            self._enqueued()
+        return True
+
+    def _take_batch(self):
+        with self._lock:
+            inserts = [self._inserts.popleft() for _ in range(min(len(self._inserts), self.batch_size))]
+            upserts = []
+            while self._upserts and len(upserts) < self.batch_size:
+                upserts.append(self._upserts.popitem(last=False)[1])
+            self._not_full.notify_all()
+        return inserts, upserts
+
+    def _write(self, inserts, upserts):
+        by_collection = OrderedDict()
+        for collection, document in inserts:
+            by_collection.setdefault(collection.full_name, (collection, []))[1].append(document)
+        for collection, documents in by_collection.values():
+            try:
+                collection.insert_many(documents, ordered=False)
+                self.written += len(documents)
+            except Exception as e:
+                self.failed += len(documents)
+                logger.error(f"Write-behind queue {self.name}: insert into {collection.full_name} failed: {e}")
+
+        by_collection = OrderedDict()
+        for collection, key, set_fields, set_on_insert in upserts:
+            update = {"$set": set_fields}
+            if set_on_insert:
+                update["$setOnInsert"] = set_on_insert
+            by_collection.setdefault(collection.full_name, (collection, []))[1].append(
+                UpdateOne(key, update, upsert=True))
+        for collection, operations in by_collection.values():
+            try:
+                collection.bulk_write(operations, ordered=False)
+                self.written += len(operations)
+            except Exception as e:
+                self.failed += len(operations)
+                logger.error(f"Write-behind queue {self.name}: bulk write to {collection.full_name} failed: {e}")
+
+    def flush(self):
+        """Write everything queued so far; returns the number of writes attempted"""
+        total = 0
+        with self._flush_lock:
+            start = time.perf_counter()
+            while True:
+                inserts, upserts = self._take_batch()
+                if not inserts and not upserts:
+                    break
+                self._write(inserts, upserts)
+                total += len(inserts) + len(upserts)
+            if total:
+                self.flushes += 1
+                self.last_flush_ms = (time.perf_counter() - start) * 1000
+        return total
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind queue {self.name}: flush failed: {e}")
+
+    def start(self):
+        """Start the background flusher and register the shutdown flush"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"write-behind-{self.name}", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+        return self
+
+    def stop(self, timeout=5):
+        """Stop the flusher and write whatever is still queued"""
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def get_stats(self):
+        """Get queue depth and counters"""
+        with self._lock:
+            inserts, upserts = len(self._inserts), len(self._upserts)
+        return {
+            'name': self.name,
+            'depth': inserts + upserts,
+            'pending_inserts': inserts,
+            'pending_upserts': upserts,
+            'max_size': self.max_size,
+            'policy': self.policy,
+            'high_watermark': self.high_watermark,
+            'enqueued': self.enqueued,
+            'coalesced': self.coalesced,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'flushes': self.flushes,
+            'last_flush_ms': round(self.last_flush_ms, 2)
+        }
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark: per-request client IP resolution, before and after the offline resolver.
+
+The legacy helper.get_real_client_ip() filtered the forwarding headers and then
+verified the chosen IP with a blocking IPinfo call on every request. The
+current resolver walks X-Forwarded-For against the trusted proxy set locally,
+and IP metadata goes through an LRU+TTL cache. A local stub HTTP server with
+configurable latency stands in for IPinfo, so no external traffic is made.
+
+Usage:
+    python benchmarks/bench_client_ip_resolution.py [--requests 2000] [--clients 200] [--latency-ms 20]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend", "crn_wallet"))
+
+
+class StubIPInfoHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        ip = self.path.split("?")[0].strip("/")
+        body = json.dumps({"ip": ip, "country": "ZZ"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(latency):
+    StubIPInfoHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubIPInfoHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def legacy_get_real_client_ip(remote_addr, headers, session, base_url):
+    """The pre-change resolver, with IPinfo pointed at the stub server"""
+    ip_candidates = []
+    if headers.get("X-Forwarded-For"):
+        ip_candidates.extend(ip.strip() for ip in headers["X-Forwarded-For"].split(","))
+    if headers.get("X-Real-IP"):
+        ip_candidates.append(headers["X-Real-IP"].strip())
+    if headers.get("CF-Connecting-IP"):
+        ip_candidates.append(headers["CF-Connecting-IP"].strip())
+    if remote_addr:
+        ip_candidates.append(remote_addr)
+
+    private_ip_prefixes = ["10.", "192.168."] + [f"172.{i}." for i in range(16, 32)]
+    filtered_ips = [
+        ip for ip in ip_candidates
+        if ip and not any(ip.startswith(p) for p in private_ip_prefixes) and ip not in ("127.0.0.1", "localhost")
+    ]
+    if not filtered_ips:
+        return ip_candidates[0] if ip_candidates else remote_addr
+
+    real_ip = filtered_ips[0]
+    response = session.get(f"{base_url}/{real_ip}?token=stub")
+    if response.status_code == 200 and "ip" in response.json():
+        return response.json()["ip"]
+    return real_ip
+
+
+def make_requests(count, clients, rng):
+    client_ips = [f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+                  for _ in range(clients)]
+    # Client -> Cloudflare edge -> local nginx -> Flask
+    return [
+        ("127.0.0.1", {"X-Forwarded-For": f"{ip}, 104.16.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+                       "CF-Connecting-IP": ip})
+        for ip in (rng.choice(client_ips) for _ in range(count))
+    ]
+
+
+def run(label, func, reqs):
+    start = time.perf_counter()
+    for remote_addr, headers in reqs:
+        func(remote_addr, headers)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<44} {elapsed / len(reqs) * 1e6:>10.1f} us/req")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Simulated IPinfo round trip")
+    args = parser.parse_args()
+
+    server = start_stub_server(args.latency_ms / 1000)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["IPINFO_URL"] = base_url
+
+    import requests
+    import helper  # noqa: E402 - reads IPINFO_URL at import
+
+    reqs = make_requests(args.requests, args.clients, random.Random(7))
+    session = requests.Session()
+
+    print(f"{args.requests:,} requests from {args.clients} clients, stub IPinfo latency {args.latency_ms:.0f} ms\n")
+    run("legacy: header filter + IPinfo verify",
+        lambda remote, headers: legacy_get_real_client_ip(remote, headers, session, base_url), reqs)
+    run("new: trusted-proxy resolver (no I/O)", helper.resolve_client_ip, reqs)
+    run("new: resolver + cached get_ip_info()",
+        lambda remote, headers: helper.get_ip_info(helper.resolve_client_ip(remote, headers)), reqs)
+
+    stats = helper.ip_info_cache.get_stats()
+    print(f"\nip_info cache: {stats['hits']:,} hits, {stats['misses']:,} misses")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Stub-server benchmark: banning a bot wave under the same Cloudflare API budget.
+
+Per-rule bans create one firewall rule per IP, so every ban costs at least one
+API request and one rule. The bulk pipeline coalesces bans over a short window
+into bulk add operations on one managed IP List referenced by a single rule,
+so a batch of up to 1000 IPs costs one request plus a few operation polls.
+
+Both clients share the same token bucket budget and run against a local
+aiohttp stub of the Cloudflare firewall rules and IP Lists APIs. Bans are
+submitted from several threads, each with its own short-lived event loop, and
+the wave is done when every IP is blocked at the (stub) edge.
+
+Usage:
+    python benchmarks/bench_cloudflare_bulk_bans.py [--bans 1000] [--budget 100] [--threads 8]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import threading
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_cloudflare_client import StubCloudflare, ZONE, free_port, serve  # noqa: E402
+from ddos_protection.network.cloudflare import api  # noqa: E402
+from ddos_protection.network.cloudflare.api import CloudflareAPIClient  # noqa: E402
+
+ACCOUNT = "bench-account"
+
+
+class StubCloudflareLists(StubCloudflare):
+    """Adds IP Lists with asynchronous bulk operations to the firewall rules stub"""
+
+    def __init__(self, rules, operation_delay=0.05):
+        super().__init__(rules)
+        self.lists = {}
+        self.list_items = {}
+        self.operations = {}
+        self.operation_delay = operation_delay
+
+    def blocked_at_edge(self):
+        """IPs blocked by a per-IP rule or by a rule referencing a list"""
+        blocked = set()
+        for rule in self.rules.values():
+            expression = rule["filter"]["expression"]
+            if expression.startswith("(ip.src eq "):
+                blocked.add(expression[len("(ip.src eq "):-1])
+            elif expression.startswith("(ip.src in $"):
+                name = expression[len("(ip.src in $"):-1]
+                for list_id, ip_list in self.lists.items():
+                    if ip_list["name"] == name:
+                        blocked.update(self.list_items[list_id])
+        return blocked
+
+    async def get_lists(self, request):
+        return web.json_response({"success": True, "result": list(self.lists.values())})
+
+    async def create_list(self, request):
+        data = await request.json()
+        list_id = f"list{len(self.lists) + 1}"
+        self.lists[list_id] = {"id": list_id, "name": data["name"], "kind": data["kind"]}
+        self.list_items[list_id] = {}
+        return web.json_response({"success": True, "result": self.lists[list_id]})
+
+    async def get_items(self, request):
+        items = list(self.list_items[request.match_info["list_id"]].values())
+        per_page = int(request.query.get("per_page", 25))
+        start = int(request.query.get("cursor", 0))
+        result_info = {"cursors": {"after": str(start + per_page)}} if start + per_page < len(items) else {}
+        return web.json_response({"success": True, "result": items[start: start + per_page],
+                                  "result_info": result_info})
+
+    def start_operation(self, apply):
+        operation_id = f"op{len(self.operations) + 1}"
+        self.operations[operation_id] = {"id": operation_id, "status": "pending"}
+
+        def complete():
+            apply()
+            self.operations[operation_id]["status"] = "completed"
+
+        asyncio.get_running_loop().call_later(self.operation_delay, complete)
+        return web.json_response({"success": True, "result": {"operation_id": operation_id}})
+
+    async def add_items(self, request):
+        items = self.list_items[request.match_info["list_id"]]
+        data = await request.json()
+
+        def apply():
+            for item in data:
+                items[item["ip"]] = {"id": f"item-{item['ip']}", "ip": item["ip"], "comment": item.get("comment")}
+
+        return self.start_operation(apply)
+
+    async def delete_items(self, request):
+        items = self.list_items[request.match_info["list_id"]]
+        ids = {item["id"] for item in (await request.json())["items"]}
+
+        def apply():
+            for ip in [ip for ip, item in items.items() if item["id"] in ids]:
+                del items[ip]
+
+        return self.start_operation(apply)
+
+    async def get_operation(self, request):
+        return web.json_response({"success": True, "result": self.operations[request.match_info["operation_id"]]})
+
+    def app(self):
+        app = super().app()
+        base = f"/accounts/{ACCOUNT}/rules/lists"
+        app.router.add_get(base, self.get_lists)
+        app.router.add_post(base, self.create_list)
+        app.router.add_get(f"{base}/bulk_operations/{{operation_id}}", self.get_operation)
+        app.router.add_get(f"{base}/{{list_id}}/items", self.get_items)
+        app.router.add_post(f"{base}/{{list_id}}/items", self.add_items)
+        app.router.add_delete(f"{base}/{{list_id}}/items", self.delete_items)
+        return app
+
+
+def make_client(base_url, budget, account_id):
+    client = CloudflareAPIClient(email="bench", api_key="bench", zone_id=ZONE, max_requests=budget,
+                                 reset_interval=1, burst=budget // 10, account_id=account_id)
+    client.base_url = base_url
+    client.dev_mode = False
+    return client
+
+
+def ban_wave(client, ips, threads):
+    """Submit block_ip for every IP from several threads, each with its own loop"""
+    def worker(chunk):
+        loop = asyncio.new_event_loop()
+        for ip in chunk:
+            success, _ = loop.run_until_complete(client.block_ip(ip, "bot wave"))
+            assert success
+        loop.close()
+
+    workers = [threading.Thread(target=worker, args=(ips[i::threads],)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+
+async def blocked_at_edge(stub):
+    return stub.blocked_at_edge()
+
+
+def bench(label, stub, server_loop, client, ips, threads):
+    api.blocked_ips_cache.clear()
+    stub.reset_counters()
+    rules_before = len(stub.rules)
+    start = time.perf_counter()
+    ban_wave(client, ips, threads)
+    submitted = time.perf_counter() - start
+    wanted = set(ips)
+    while not wanted <= asyncio.run_coroutine_threadsafe(blocked_at_edge(stub), server_loop).result():
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<26} {len(ips) / elapsed:>8,.0f} bans/s  {stub.requests:>6,} requests  "
+          f"{len(stub.rules) - rules_before:>6,} new rules  (submitted in {submitted:.2f}s, "
+          f"at edge in {elapsed:.2f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--bans", type=int, default=1000, help="IPs in the bot wave")
+    parser.add_argument("--budget", type=int, default=100, help="API requests per second for both clients")
+    parser.add_argument("--threads", type=int, default=8, help="threads submitting bans")
+    args = parser.parse_args()
+
+    logging.getLogger("ddos_protection").setLevel(logging.ERROR)
+
+    stub = StubCloudflareLists(rules=0)
+    port = free_port()
+    server_loop = asyncio.new_event_loop()
+    runner = server_loop.run_until_complete(serve(stub, port))
+    threading.Thread(target=server_loop.run_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{port}"
+
+    print(f"{args.bans:,} bans from {args.threads} threads, API budget {args.budget} requests/s")
+    per_rule = make_client(base_url, args.budget, account_id="")
+    bench("per-IP firewall rules", stub, server_loop, per_rule, [f"203.0.{i // 256}.{i % 256}" for i in range(args.bans)],
+          args.threads)
+
+    bulk = make_client(base_url, args.budget, account_id=ACCOUNT)
+    # Create the list and its rule outside the timed wave
+    bulk.ban_pipeline.start()
+    while bulk.ban_pipeline.get_stats()['reconciles'] == 0:
+        time.sleep(0.01)
+    bench("bulk IP List pipeline", stub, server_loop, bulk, [f"192.0.{i // 256}.{i % 256}" for i in range(args.bans)],
+          args.threads)
+
+    for client in (per_rule, bulk):
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(client.close())
+        loop.close()
+    print(f"pipeline stats: {bulk.ban_pipeline.get_stats()}")
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), server_loop).result()
+    server_loop.call_soon_threadsafe(server_loop.stop)
+
+
+if __name__ == "__main__":
+    main()
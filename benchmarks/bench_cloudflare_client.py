@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Stub-server benchmark: CloudflareAPIClient.block_ip against a zone with many rules.
+
+The legacy client opened a new aiohttp.ClientSession for every call and, before
+each ban, paged through every firewall rule of the zone (100 per page) looking
+for the IP, so one ban cost total_rules / 100 + 1 HTTP requests and a fresh
+connection each time. The current client keeps one pooled session, looks the IP
+up in a local ip -> rule_id index (listed once, then updated by each
+block/unblock) and paces requests with an async token bucket.
+
+Both clients run against a local aiohttp stub of the Cloudflare firewall rules
+API; the stub counts the requests and connections it receives.
+
+Usage:
+    python benchmarks/bench_cloudflare_client.py [--rules 2000] [--bans 200]
+"""
+
+import os
+import sys
+import time
+import socket
+import asyncio
+import logging
+import argparse
+import threading
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ddos_protection.network.cloudflare import api  # noqa: E402
+from ddos_protection.network.cloudflare.api import CloudflareAPIClient  # noqa: E402
+
+ZONE = "bench-zone"
+
+
+class StubCloudflare:
+    """In-memory firewall rules endpoint that counts requests and connections"""
+
+    def __init__(self, rules):
+        self.rules = {}
+        self.next_id = 0
+        self.requests = 0
+        self.connections = set()
+        for i in range(rules):
+            self.add_rule(f"198.18.{i // 256 % 256}.{i % 256}")
+
+    def add_rule(self, ip):
+        self.next_id += 1
+        rule_id = f"rule{self.next_id:08d}"
+        self.rules[rule_id] = {
+            "id": rule_id,
+            "description": "DDoS Protection: stub",
+            "action": "block",
+            "filter": {"expression": f"(ip.src eq {ip})"},
+        }
+        return self.rules[rule_id]
+
+    def reset_counters(self):
+        self.requests = 0
+        self.connections = set()
+
+    @web.middleware
+    async def count(self, request, handler):
+        self.requests += 1
+        self.connections.add(request.transport.get_extra_info("peername"))
+        return await handler(request)
+
+    async def list_rules(self, request):
+        page = int(request.query.get("page", 1))
+        per_page = int(request.query.get("per_page", 100))
+        rules = list(self.rules.values())
+        total_pages = max(1, -(-len(rules) // per_page))
+        chunk = rules[(page - 1) * per_page: page * per_page]
+        return web.json_response({"success": True, "result": chunk,
+                                  "result_info": {"page": page, "total_pages": total_pages}})
+
+    async def create_rule(self, request):
+        data = await request.json()
+        rule = self.add_rule(None)
+        rule["filter"] = {"expression": data["filter"]["expression"]}
+        rule["description"] = data.get("description", "")
+        return web.json_response({"success": True, "result": [rule]})
+
+    async def delete_rule(self, request):
+        self.rules.pop(request.match_info["rule_id"], None)
+        return web.json_response({"success": True, "result": {"id": request.match_info["rule_id"]}})
+
+    def app(self):
+        app = web.Application(middlewares=[self.count])
+        app.router.add_get(f"/zones/{ZONE}/firewall/rules", self.list_rules)
+        app.router.add_post(f"/zones/{ZONE}/firewall/rules", self.create_rule)
+        app.router.add_delete(f"/zones/{ZONE}/firewall/rules/{{rule_id}}", self.delete_rule)
+        return app
+
+
+class LegacyClient:
+    """The pre-change block_ip: a new session per call and a full rule scan before each ban"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.headers = {"Content-Type": "application/json"}
+
+    async def _find_rule_by_ip(self, ip_address):
+        page = 1
+        while True:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{self.base_url}/zones/{ZONE}/firewall/rules",
+                                       headers=self.headers, params={"page": page, "per_page": 100}) as response:
+                    result = await response.json()
+            for rule in result.get("result", []):
+                if ip_address in rule.get("filter", {}).get("expression", ""):
+                    return rule.get("id")
+            if page >= result.get("result_info", {}).get("total_pages", 0):
+                return None
+            page += 1
+
+    async def block_ip(self, ip_address, reason, duration=86400):
+        if await self._find_rule_by_ip(ip_address):
+            return True, {}
+        data = {"description": reason, "action": "block",
+                "filter": {"expression": f"(ip.src eq {ip_address})", "paused": False}}
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{self.base_url}/zones/{ZONE}/firewall/rules",
+                                    headers=self.headers, json=data) as response:
+                result = await response.json()
+        return result.get("success", False), result
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def serve(stub, port):
+    runner = web.AppRunner(stub.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def bench(label, stub, client, ips):
+    """Ban every IP from a fresh caller loop, as the Flask routes do"""
+    stub.reset_counters()
+    start = time.perf_counter()
+    for ip in ips:
+        loop = asyncio.new_event_loop()
+        success, _ = loop.run_until_complete(client.block_ip(ip, "bench"))
+        loop.close()
+        assert success
+    elapsed = time.perf_counter() - start
+    print(f"{label:<34} {len(ips) / elapsed:>9,.0f} bans/s  {stub.requests / len(ips):>7.2f} requests/ban  "
+          f"{len(stub.connections):>5} connections")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rules", type=int, default=2000, help="block rules already in the zone")
+    parser.add_argument("--bans", type=int, default=200, help="new IPs to ban per client")
+    args = parser.parse_args()
+
+    logging.getLogger("ddos_protection").setLevel(logging.ERROR)
+
+    stub = StubCloudflare(args.rules)
+    port = free_port()
+    server_loop = asyncio.new_event_loop()
+    runner = server_loop.run_until_complete(serve(stub, port))
+    threading.Thread(target=server_loop.run_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{port}"
+
+    print(f"Zone with {args.rules:,} block rules, banning {args.bans:,} new IPs per client")
+    legacy_ips = [f"203.0.{i // 256 % 256}.{i % 256}" for i in range(args.bans)]
+    current_ips = [f"192.0.{i // 256 % 256}.{i % 256}" for i in range(args.bans)]
+    bench("legacy (session/call + rule scan)", stub, LegacyClient(base_url), legacy_ips)
+
+    # A high request budget so the token bucket does not dominate the timing
+    client = CloudflareAPIClient(email="bench", api_key="bench", zone_id=ZONE,
+                                 max_requests=10 ** 6, reset_interval=1, burst=10 ** 6)
+    client.base_url = base_url
+    client.dev_mode = False
+    api.blocked_ips_cache.clear()
+    bench("pooled session + rule index", stub, client, current_ips)
+    assert all(ip in client.rule_index for ip in current_ips)
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(client.close())
+    loop.close()
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), server_loop).result()
+    server_loop.call_soon_threadsafe(server_loop.stop)
+
+
+if __name__ == "__main__":
+    main()
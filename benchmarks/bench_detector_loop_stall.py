@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark: AttackDetector event-loop stall with and without off-loop training.
+
+Feeds synthetic traffic from many IPs into the detector's request buffer
+while a probe coroutine measures how late the event loop wakes it up. The
+"legacy" detector reproduces the previous ML behaviour: a synchronous
+IsolationForest fit over every TrafficRecord inside the processing loop and
+separate one-row predict()/decision_function() calls per IP. The "current"
+detector uses reservoir sampling, background fits and batched scoring.
+
+Usage:
+    python benchmarks/bench_detector_loop_stall.py [--seconds 10] [--rate 20000] [--ips 20000]
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ddos_protection.config import Config  # noqa: E402
+from ddos_protection.core.detector import AttackDetector  # noqa: E402
+
+PROBE_INTERVAL = 0.005
+
+
+class LegacyDetector(AttackDetector):
+    """Detector with the pre-reservoir, in-loop training and per-IP scoring."""
+
+    def train_ml_model(self):
+        X = np.array([[f[name] for name in self.model_features]
+                      for f in (record.get_features() for record in self.ip_records.values())])
+        if len(X) < self.config.detector.min_samples_for_training:
+            return None
+        self.last_ml_training = time.time()
+        model = self._build_ml_model()
+        model.fit(X)
+        self.ml_model = model
+        self.ml_model_trained = True
+        return None
+
+    def _check_ml_anomalies_batch(self, records, features):
+        for i, record in enumerate(records):
+            X = features[i:i + 1]
+            if self.ml_model.predict(X)[0] == -1:
+                record.block_score += 1
+            self.ml_model.decision_function(X)
+
+
+async def feed(detector, rate, ip_count, stop_at):
+    rng = random.Random(7)
+    per_tick = max(1, rate // 100)
+    while time.perf_counter() < stop_at:
+        now = time.time()
+        for _ in range(per_tick):
+            ip = f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, ip_count // 65536 + 1)}"
+            try:
+                detector.request_buffer.buffer.put_nowait({
+                    "ip": "1" + ip[2:],
+                    "path": f"/api/{rng.randint(0, 20)}",
+                    "status_code": 200 if rng.random() > 0.1 else 404,
+                    "user_agent": "bench",
+                    "timestamp": now,
+                    "bytes_received": rng.randint(100, 2000),
+                })
+            except asyncio.QueueFull:
+                break
+        await asyncio.sleep(0.01)
+
+
+async def probe(stop_at, stalls):
+    while time.perf_counter() < stop_at:
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        stalls.append(time.perf_counter() - start - PROBE_INTERVAL)
+
+
+async def run(detector_cls, args):
+    config = Config()
+    config.detector.use_ml = True
+    config.detector.cleanup_interval = 1
+    config.detector.ml_retrain_interval = 2
+    config.detector.min_samples_for_training = 100
+    config.detector.whitelist = []
+    detector = detector_cls(config)
+    detector.whitelisted_ips.clear()
+
+    stalls = []
+    stop_at = time.perf_counter() + args.seconds
+    loop_task = asyncio.create_task(detector.process_requests())
+    await asyncio.gather(feed(detector, args.rate, args.ips, stop_at), probe(stop_at, stalls))
+    loop_task.cancel()
+    try:
+        await loop_task
+    except asyncio.CancelledError:
+        pass
+    await detector.stop()
+
+    stalls_ms = np.array(stalls) * 1000
+    print(f"{detector_cls.__name__:<16} p50 {np.percentile(stalls_ms, 50):8.2f} ms  "
+          f"p99 {np.percentile(stalls_ms, 99):8.2f} ms  max {stalls_ms.max():8.2f} ms  "
+          f"records {len(detector.ip_records):,}  model trained: {detector.ml_model_trained}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--rate", type=int, default=20000, help="offered requests per second")
+    parser.add_argument("--ips", type=int, default=20000, help="approximate distinct source IPs")
+    args = parser.parse_args()
+
+    asyncio.run(run(LegacyDetector, args))
+    asyncio.run(run(AttackDetector, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmark: compiled IP classifier vs. the legacy per-request checks.
+
+The legacy path is what AttackMitigator/RateLimiter did before the classifier:
+a chain of str.startswith() checks plus utils.is_ip_in_any_network(), which
+re-parsed each network string with ipaddress on every call.
+
+Usage:
+    python benchmarks/bench_ip_classifier.py [--entries 1000000] [--requests 200000]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import ipaddress
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ddos_protection.utils.ip_classifier import IPClassifier  # noqa: E402
+
+WHITELIST = ["127.0.0.1", "::1", "10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16"]
+
+
+def legacy_is_ip_in_any_network(ip, networks):
+    for network in networks:
+        try:
+            if ipaddress.ip_address(ip) in ipaddress.ip_network(network, strict=False):
+                return True
+        except ValueError:
+            pass
+    return False
+
+
+def legacy_check(ip, banned, trusted):
+    if ip in banned:
+        return False
+    if ip in trusted:
+        return True
+    if ip == "127.0.0.1" or ip == "::1" or ip.startswith("192.168.") or ip.startswith("10.") or ip.startswith("172."):
+        return True
+    return not legacy_is_ip_in_any_network(ip, WHITELIST)
+
+
+def random_ipv4(rng):
+    return f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}"
+
+
+def run(label, func, ips):
+    start = time.perf_counter()
+    for ip in ips:
+        func(ip)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<42} {len(ips) / elapsed:>12,.0f} req/s  {elapsed / len(ips) * 1e6:>7.2f} us/req")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--entries", type=int, default=1_000_000, help="banned IP/CIDR entries to compile")
+    parser.add_argument("--requests", type=int, default=200_000, help="lookups per run")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    banned = [random_ipv4(rng) for _ in range(args.entries)]
+    # Mix in some subnet bans so several prefix lengths are populated
+    banned += [f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.0.0/16" for _ in range(args.entries // 100)]
+    banned += [f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.0/24" for _ in range(args.entries // 20)]
+    trusted = [random_ipv4(rng) for _ in range(1000)]
+
+    classifier = IPClassifier()
+    start = time.perf_counter()
+    entries = classifier.rebuild(banned=banned, trusted=trusted)
+    print(f"Compiled {entries:,} entries in {time.perf_counter() - start:.2f}s")
+
+    ips = [random_ipv4(rng) for _ in range(args.requests)]
+    ips[::10] = banned[: len(ips[::10])]
+
+    banned_set = set(banned)
+    trusted_set = set(trusted)
+
+    run("legacy (set + startswith + ipaddress)", lambda ip: legacy_check(ip, banned_set, trusted_set), ips)
+    run("compiled classifier (banned/trusted/internal)", classifier.classify, ips)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark: skip/limit vs. keyset (cursor) pagination on MongoDB.
+
+Seeds a scratch collection shaped like wallet users (created_at + _id, with a
+compound index), then times fetching page 1 and a deep page both ways. The
+skip() path has to walk every earlier index entry; the keyset path starts a
+range scan at the cursor, so its latency should not depend on page depth.
+
+The deep-page cursor is taken from the document just before that page, which
+is what a client holds after paging there with next_cursor.
+
+Requires a reachable MongoDB server; the scratch database is dropped at exit.
+
+Usage:
+    python benchmarks/bench_keyset_pagination.py [--uri mongodb://localhost:27017]
+        [--docs 1000000] [--limit 100] [--deep-page 10000] [--repeat 20]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+from datetime import datetime, timedelta, UTC
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend", "crn_wallet"))
+
+from pymongo import MongoClient, DESCENDING  # noqa: E402
+
+from pagination import paginate, encode_cursor  # noqa: E402
+
+SCRATCH_DB = "bench_keyset_pagination"
+
+
+def seed(collection, count, batch=10000):
+    start = datetime(2023, 1, 1, tzinfo=UTC)
+    rng = random.Random(42)
+    for offset in range(0, count, batch):
+        docs = [
+            {
+                "user_id": str(100000000000000000 + i),
+                "username": f"user{i}",
+                "created_at": start + timedelta(seconds=rng.randint(0, 60 * 60 * 24 * 700)),
+                "balance": f"{rng.random() * 10000:.8f}",
+            }
+            for i in range(offset, min(offset + batch, count))
+        ]
+        collection.insert_many(docs, ordered=False)
+    collection.create_index([("created_at", DESCENDING), ("_id", DESCENDING)])
+
+
+def time_call(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default=os.environ.get("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--docs", type=int, default=1000000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--deep-page", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if (args.deep_page - 1) * args.limit >= args.docs:
+        parser.error("--docs must exceed (--deep-page - 1) * --limit")
+
+    client = MongoClient(args.uri)
+    collection = client[SCRATCH_DB]["users"]
+    collection.drop()
+
+    try:
+        print(f"Seeding {args.docs:,} documents...")
+        seed(collection, args.docs)
+
+        # Cursor of the last document on the page before the deep page
+        boundary = collection.find({}, {"created_at": 1}).sort(
+            [("created_at", DESCENDING), ("_id", DESCENDING)]
+        ).skip((args.deep_page - 1) * args.limit - 1).limit(1)[0]
+        deep_cursor = encode_cursor(boundary["created_at"], boundary["_id"])
+
+        def skip_page(page):
+            return lambda: paginate(collection, {}, "created_at", -1, args.limit, page=page)
+
+        def keyset_page(after):
+            return lambda: paginate(collection, {}, "created_at", -1, args.limit, after=after)
+
+        # Both methods must return the same deep page
+        skip_docs, _ = skip_page(args.deep_page)()
+        keyset_docs, _ = keyset_page(deep_cursor)()
+        assert [d["_id"] for d in skip_docs] == [d["_id"] for d in keyset_docs]
+
+        print(f"\nMedian latency over {args.repeat} runs, limit={args.limit}")
+        print(f"{'method':<10} {'page 1':>12} {f'page {args.deep_page:,}':>14}")
+        print(f"{'skip':<10} {time_call(skip_page(1), args.repeat):>10.2f}ms "
+              f"{time_call(skip_page(args.deep_page), args.repeat):>12.2f}ms")
+        print(f"{'keyset':<10} {time_call(keyset_page(None), args.repeat):>10.2f}ms "
+              f"{time_call(keyset_page(deep_cursor), args.repeat):>12.2f}ms")
+    finally:
+        client.drop_database(SCRATCH_DB)
+
+
+if __name__ == "__main__":
+    main()
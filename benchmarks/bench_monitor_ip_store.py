@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Threaded benchmark: MonitorSystem request-pattern tracking at 16 threads.
+
+The legacy implementation kept one dict per IP (with per-path and per-method
+count dicts that were never trimmed) and updated and checked it under a single
+global RLock, so every worker thread serialised on every request and memory
+grew with every distinct IP and path. The current implementation records
+requests in IPBehaviorStore: lock-striped shards, __slots__ records with a
+fixed interval ring and a capped path set, and TTL/LRU eviction under a memory
+budget.
+
+Usage:
+    python benchmarks/bench_monitor_ip_store.py [--threads 16] [--ips 50000] [--calls 20000]
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import threading
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ddos_protection.config import MonitorConfig  # noqa: E402
+from ddos_protection.monitoring.monitoring import MonitorSystem, logger  # noqa: E402
+
+
+class NoBans:
+    """Ban/device manager stand-in: nothing is banned and nothing is persisted"""
+
+    def get_banned_ips(self):
+        return []
+
+    def get_banned_devices(self):
+        return []
+
+    def is_banned(self, key):
+        return False
+
+    def check_device_from_ip(self, ip):
+        return []
+
+
+class BenchMonitor(MonitorSystem):
+    """Counts rate-limit verdicts instead of banning, so every request keeps being tracked"""
+
+    def __init__(self, config):
+        super().__init__(storage_manager=object(), ban_manager=NoBans(), device_manager=NoBans(), config=config)
+        self.banned_ips_cache = set()
+        self.violations = 0
+
+    def _ban_for_rate_limit(self, ip, reason):
+        self.violations += 1
+
+    def handle(self, ip, path, method):
+        self._update_request_pattern(ip, path, 0, method)
+        return self._check_rate_limits(ip, None, method)
+
+
+class LegacyMonitor(BenchMonitor):
+    """The pre-change pattern tracking: plain dicts under one global RLock"""
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.ip_patterns = {}
+
+    def _update_request_pattern(self, ip, path, request_size, method=None):
+        with self.lock:
+            current_time = time.time()
+            if ip not in self.ip_patterns:
+                self.ip_patterns[ip] = {
+                    'first_seen': current_time, 'last_seen': current_time, 'request_count': 1,
+                    'paths': {path: 1}, 'methods': {method: 1} if method else {},
+                    'total_size': request_size, 'intervals': []
+                }
+            else:
+                pattern = self.ip_patterns[ip]
+                pattern['intervals'].append(current_time - pattern['last_seen'])
+                if len(pattern['intervals']) > 10:
+                    pattern['intervals'] = pattern['intervals'][-10:]
+                pattern['last_seen'] = current_time
+                pattern['request_count'] += 1
+                if method:
+                    pattern['methods'][method] = pattern['methods'].get(method, 0) + 1
+                pattern['paths'][path] = pattern['paths'].get(path, 0) + 1
+
+    def _check_rate_limits(self, ip, device_fingerprint=None, method=None):
+        with self.lock:
+            current_time = time.time()
+            if ip not in self.ip_patterns:
+                return False
+            pattern = self.ip_patterns[ip]
+            duration = current_time - pattern['first_seen']
+            request_rate = pattern['request_count'] / duration if duration > 0 else pattern['request_count']
+            if method == 'POST' and 'POST' in pattern['methods']:
+                post_count = pattern['methods']['POST']
+                if post_count >= 5 and duration < 5:
+                    logger.warning(f"Rate limit exceeded for POST requests: {ip} - {post_count} POST requests in {duration:.2f}s")
+                    self._ban_for_rate_limit(ip, f"Excessive POST requests: {post_count} in {duration:.2f}s")
+                    return True
+                if post_count > 3 and (post_count / pattern['request_count']) > 0.3:
+                    logger.warning(f"Abnormal POST ratio: {ip} - {post_count}/{pattern['request_count']} requests are POST")
+                    self._ban_for_rate_limit(ip, f"Abnormal POST ratio: {post_count}/{pattern['request_count']} requests are POST")
+                    return True
+            if len(pattern['intervals']) >= 5:
+                mean_interval = sum(pattern['intervals']) / len(pattern['intervals'])
+                variance = sum((x - mean_interval) ** 2 for x in pattern['intervals']) / len(pattern['intervals'])
+                if mean_interval < 1.0 and variance ** 0.5 < 0.1 and pattern['request_count'] > 10:
+                    logger.warning(f"Bot-like behavior detected: {ip} - Consistent intervals between requests")
+                    self._ban_for_rate_limit(ip, "Bot-like behavior: Too consistent request timing")
+                    return True
+            limit = 10 if pattern['request_count'] <= 10 else (5 if pattern['request_count'] <= 50 else 2)
+            if request_rate > limit:
+                logger.warning(f"High request rate: {ip} - {request_rate:.2f} req/s")
+                self._ban_for_rate_limit(ip, f"High request rate: {request_rate:.2f} req/s")
+                return True
+            if len(pattern['paths']) > 15 and duration < 10:
+                logger.warning(f"Suspicious path scanning: {ip} - {len(pattern['paths'])} paths in {duration:.2f}s")
+                self._ban_for_rate_limit(ip, f"Path scanning: {len(pattern['paths'])} paths in {duration:.2f}s")
+                return True
+            if len(pattern['methods']) >= 4 and duration < 30:
+                logger.warning(f"Suspicious method usage: {ip} - {len(pattern['methods'])} methods in {duration:.2f}s")
+                self._ban_for_rate_limit(ip, f"Unusual method usage: {len(pattern['methods'])} methods in {duration:.2f}s")
+                return True
+        return False
+
+
+def make_workload(rng, ips, calls):
+    pool = [f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}" for i in range(ips)]
+    methods = ["GET"] * 8 + ["POST", "PUT"]
+    return [(rng.choice(pool), f"/api/item/{rng.randrange(5000)}", rng.choice(methods)) for _ in range(calls)]
+
+
+def run(label, monitor, workloads):
+    latencies = [[] for _ in workloads]
+    barrier = threading.Barrier(len(workloads) + 1)
+
+    def worker(index):
+        handle = monitor.handle
+        record = latencies[index].append
+        barrier.wait()
+        for ip, path, method in workloads[index]:
+            start = time.perf_counter()
+            handle(ip, path, method)
+            record(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(workloads))]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    all_latencies = sorted(value for values in latencies for value in values)
+    total = len(all_latencies)
+    p99 = all_latencies[int(total * 0.99)] * 1e6
+    print(f"{label:<34} {total / elapsed:>10,.0f} req/s  p99 {p99:>8.1f} us")
+
+
+def retained_memory(label, monitor, workloads):
+    """Memory held by the pattern store after replaying every workload on one thread"""
+    tracemalloc.start()
+    for workload in workloads:
+        for ip, path, method in workload:
+            monitor.handle(ip, path, method)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<34} tracked IPs {len(monitor.ip_patterns):>8,}  retained {current / 1024 / 1024:>7.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=16, help="worker threads")
+    parser.add_argument("--ips", type=int, default=50000, help="distinct client IPs")
+    parser.add_argument("--calls", type=int, default=20000, help="requests per thread")
+    parser.add_argument("--budget-mb", type=float, default=16, help="memory budget for the sharded store")
+    args = parser.parse_args()
+
+    # Most synthetic requests trip a rate limit; keep the warnings out of the output
+    logging.getLogger('ddos_protection').setLevel(logging.CRITICAL)
+
+    rng = random.Random(42)
+    workloads = [make_workload(rng, args.ips, args.calls) for _ in range(args.threads)]
+    config = MonitorConfig(behavior_memory_budget_mb=args.budget_mb)
+
+    print(f"{args.threads} threads x {args.calls:,} requests over {args.ips:,} IPs")
+    run("legacy (dicts + global RLock)", LegacyMonitor(config), workloads)
+    run("sharded IPBehaviorStore", BenchMonitor(config), workloads)
+    retained_memory("legacy (dicts + global RLock)", LegacyMonitor(config), workloads)
+    retained_memory(f"sharded ({args.budget_mb:g} MB budget)", BenchMonitor(config), workloads)
+
+
+if __name__ == "__main__":
+    main()
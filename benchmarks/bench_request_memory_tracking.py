@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark: per-request overhead of MemoryMonitor request tracking.
+
+The legacy hooks called SystemDetector.get_resource_usage() (a full psutil
+sweep) before and after every request just to read RSS. The current hooks
+read /proc/self/statm (or tracemalloc's traced total) for a sampled fraction
+of requests and aggregate the deltas into per-endpoint histograms.
+
+Usage:
+    python benchmarks/bench_request_memory_tracking.py [--requests 2000] [--sample-rate 0.05]
+"""
+
+import os
+import sys
+import time
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+
+def make_app():
+    app = Flask(__name__)
+
+    @app.route("/api/items/<int:size>")
+    def items(size):
+        payload = [str(i) for i in range(size)]
+        return {"count": len(payload)}
+
+    return app
+
+
+def legacy_hooks(app, detector):
+    """The pre-change hooks: two full resource sweeps per request"""
+    import threading
+    tracking = {}
+
+    @app.before_request
+    def start():
+        usage = detector.get_resource_usage()
+        tracking[id(threading.current_thread())] = usage.process_memory_bytes
+
+    @app.after_request
+    def end(response):
+        tracking.pop(id(threading.current_thread()), None)
+        return response
+
+
+def run(label, app, count):
+    client = app.test_client()
+    sizes = (10, 1000, 20000)
+    start = time.perf_counter()
+    for i in range(count):
+        client.get(f"/api/items/{sizes[i % len(sizes)]}")
+    elapsed = time.perf_counter() - start
+    print(f"{label:<36} {elapsed / count * 1e6:>9.1f} us/req")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--sample-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    from memory_manager.config import MonitoringConfig
+    from memory_manager.monitor import MemoryMonitor
+
+    class Config:
+        pass
+
+    def monitor_app(mode, source="rss"):
+        config = Config()
+        config.monitoring = MonitoringConfig(enabled=False, log_to_file=False, log_to_console=False,
+                                             expose_prometheus=False, request_tracking=mode,
+                                             request_sample_rate=args.sample_rate, request_memory_source=source)
+        app = make_app()
+        monitor = MemoryMonitor(config=config).register(app)
+        return app, monitor
+
+    run("no tracking", make_app(), args.requests)
+
+    try:
+        from memory_manager.detector import SystemDetector
+        app = make_app()
+        legacy_hooks(app, SystemDetector())
+        run("legacy: psutil sweep x2 per request", app, args.requests)
+    except ImportError as e:
+        print(f"{'legacy: psutil sweep x2 per request':<36} skipped ({e})")
+
+    app, _ = monitor_app("sampled")
+    run(f"sampled {args.sample_rate:.0%}, statm", app, args.requests)
+    app, monitor = monitor_app("full")
+    run("every request, statm", app, args.requests)
+    app, _ = monitor_app("full", "tracemalloc")
+    run("every request, tracemalloc", app, args.requests)
+
+    print()
+    for endpoint in monitor.get_request_memory_profile()["endpoints"]:
+        print(f"{endpoint['endpoint']:<30} samples {endpoint['samples']:>6}  avg {endpoint['avg_kb']:>8.1f} KB"
+              f"  max {endpoint['max_kb']:>8.1f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Threaded benchmark: security.check_rate_limit with many tracked IPs.
+
+The legacy implementation rebuilt the caller's timestamp list and summed the
+timestamp lists of every tracked IP under one global RLock on each call, so
+per-request latency grew with the number of tracked IPs and every worker
+thread serialised on the lock. The current implementation records requests in
+the sharded counter store (fixed buckets, striped locks), so latency should
+stay flat as the number of tracked IPs grows.
+
+Usage:
+    python benchmarks/bench_security_rate_limit.py [--ips 50000] [--threads 8] [--calls 2000]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+import statistics
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend", "crn_wallet"))
+
+
+class LegacyRateLimiter:
+    """The pre-change check_rate_limit bookkeeping (without the block side effects)"""
+
+    def __init__(self):
+        self.ip_request_timestamps = defaultdict(list)
+        self.path_access_count = defaultdict(int)
+        self.lock = threading.RLock()
+
+    def check_rate_limit(self, ip, path, limit=30):
+        with self.lock:
+            current_time = time.time()
+            cutoff_time = current_time - 60
+            self.ip_request_timestamps[ip] = [t for t in self.ip_request_timestamps[ip] if t > cutoff_time]
+            self.ip_request_timestamps[ip].append(current_time)
+            count = len(self.ip_request_timestamps[ip])
+            self.path_access_count[path] += 1
+            # The per-call scan over every tracked IP
+            sum(len(timestamps) for timestamps in self.ip_request_timestamps.values())
+            return count <= limit * 2
+
+
+def random_ip(rng):
+    return f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+
+
+def run_threads(label, func, ips, threads, calls):
+    latencies = []
+    latencies_lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(seed):
+        rng = random.Random(seed)
+        local = []
+        barrier.wait()
+        for _ in range(calls):
+            ip = rng.choice(ips)
+            start = time.perf_counter()
+            func(ip, "/api/wallet/balance")
+            local.append(time.perf_counter() - start)
+        with latencies_lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1e6
+    p99 = latencies[int(len(latencies) * 0.99)] * 1e6
+    print(f"{label:<34} {len(latencies) / elapsed:>10,.0f} req/s  p50 {p50:>9.1f} us  p99 {p99:>9.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ips", type=int, default=50000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--calls", type=int, default=2000, help="Calls per thread")
+    parser.add_argument("--legacy-calls", type=int, default=50, help="Calls per thread for the legacy path")
+    args = parser.parse_args()
+
+    # security.py writes security.log/blacklist files to the working directory
+    os.chdir(tempfile.mkdtemp(prefix="bench_security_"))
+    import security  # noqa: E402
+    from rate_counters import ShardedCounterStore  # noqa: E402
+
+    rng = random.Random(1)
+    ips = [random_ip(rng) for _ in range(args.ips)]
+
+    print(f"{args.threads} threads\n")
+
+    legacy = LegacyRateLimiter()
+    now = time.time()
+    for ip in ips:
+        legacy.ip_request_timestamps[ip].append(now)
+    run_threads(f"legacy, {args.ips:,} IPs", legacy.check_rate_limit, ips, args.threads, args.legacy_calls)
+
+    # Latency should not depend on how many IPs are tracked
+    for tracked in sorted({min(1000, args.ips), min(10000, args.ips), args.ips}):
+        security.ip_request_counters = ShardedCounterStore(window=60)
+        subset = ips[:tracked]
+        for ip in subset:
+            security.check_rate_limit(ip, "/api/wallet/balance")
+        run_threads(f"sharded store, {tracked:,} IPs", security.check_rate_limit, subset, args.threads, args.calls)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmark: TrafficAnalyzer path-scanning check for a scanner IP.
+
+The legacy _check_path_scanning re-ran the static/browser-resource regexes over
+every unique path the IP had ever requested, then searched each path with ten
+uncompiled scanner signatures, on every request: O(paths x patterns) per call.
+The current analyzer classifies each path once when it is first seen and keeps
+per-IP class counters, so the check is O(1) regardless of how many paths the
+IP has hit.
+
+Usage:
+    python benchmarks/bench_traffic_analyzer_paths.py [--paths 1000] [--requests 20000]
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ddos_protection.core.analyzer import TrafficAnalyzer, SUSPICIOUS_PATH_PATTERNS  # noqa: E402
+
+SCANNER_IP = "203.0.113.7"
+SCANNER_AGENT = "Mozilla/5.0 (compatible; scanner)"
+SCANNER_PATHS = ["/.env", "/.git/config", "/wp-admin/", "/admin/login", "/backup.zip",
+                 "/phpmyadmin/index.php", "/config.php", "/dbadmin/", "/administrator/"]
+
+
+class LegacyPathScanning(TrafficAnalyzer):
+    """The pre-change path-scanning check, recomputed over every unique path"""
+
+    def _check_path_scanning(self, ip, path, user_agent, request_size, current_time):
+        unique_paths = len(self.ip_paths[ip])
+        request_count = len(self.ip_requests[ip])
+        if request_count < 10:
+            return False, 0.0
+        browser_resource_paths = sum(1 for p in self.ip_paths[ip] if self.browser_resources_pattern.search(p))
+        static_asset_paths = sum(1 for p in self.ip_paths[ip] if self.static_asset_pattern.search(p))
+        adjusted_unique_paths = max(unique_paths - (browser_resource_paths * 0.8) - (static_asset_paths * 0.6), 1)
+        path_diversity = adjusted_unique_paths / request_count
+        duration = max(current_time - self.ip_requests[ip][0], 0.1)
+        paths_per_minute = (adjusted_unique_paths / duration) * 60
+        confidence = 0.0
+        if path_diversity > 0.8:
+            confidence += path_diversity * 0.3
+        if paths_per_minute > self.thresholds['max_paths_per_minute']:
+            confidence += min(paths_per_minute / self.thresholds['max_paths_per_minute'], 10) / 10 * 0.5
+        suspicious_count = sum(1 for p in self.ip_paths[ip]
+                               if any(re.search(pattern, p) for pattern in SUSPICIOUS_PATH_PATTERNS))
+        if suspicious_count > 0:
+            confidence += min(suspicious_count / 3, 1.0) * 0.6
+        return confidence > 0.85, confidence
+
+
+def scanner_paths(rng, count):
+    paths = []
+    for i in range(count):
+        if i % 10 == 0:
+            paths.append(f"{rng.choice(SCANNER_PATHS)}?v={i}")
+        elif i % 7 == 0:
+            paths.append(f"/assets/app.{i}.js")
+        else:
+            paths.append(f"/dir{i}/{rng.choice(['index', 'login', 'upload', 'old'])}.php")
+    return paths
+
+
+def warm(analyzer, paths):
+    """Record one request per path so the IP has len(paths) unique paths"""
+    loop = asyncio.new_event_loop()
+    for path in paths:
+        loop.run_until_complete(analyzer.analyze_request(SCANNER_IP, path, SCANNER_AGENT))
+    loop.close()
+
+
+def run(label, analyzer, probes):
+    now = time.time()
+    check = analyzer._check_path_scanning
+    start = time.perf_counter()
+    for path in probes:
+        result = check(SCANNER_IP, path, SCANNER_AGENT, 0, now)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<42} {len(probes) / elapsed:>12,.0f} checks/s  {elapsed / len(probes) * 1e6:>9.2f} us/check")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--paths", type=int, default=1000, help="unique paths requested by the scanner IP")
+    parser.add_argument("--requests", type=int, default=20000, help="path-scanning checks per run")
+    args = parser.parse_args()
+
+    # Every scanner request is flagged; keep the warnings out of the output
+    logging.getLogger('ddos_protection.analyzer').setLevel(logging.ERROR)
+
+    rng = random.Random(42)
+    paths = scanner_paths(rng, args.paths)
+    probes = [rng.choice(paths) for _ in range(args.requests)]
+
+    legacy = LegacyPathScanning()
+    current = TrafficAnalyzer()
+    warm(legacy, paths)
+    warm(current, paths)
+    print(f"Scanner IP with {len(current.ip_paths[SCANNER_IP]):,} unique paths")
+
+    legacy_result = run("legacy (rescan paths x patterns)", legacy, probes[: max(1, args.requests // 20)])
+    current_result = run("incremental (classified at insertion)", current, probes)
+    assert legacy_result[0] == current_result[0] and abs(legacy_result[1] - current_result[1]) < 1e-9, \
+        (legacy_result, current_result)
+    print(f"Same verdict: attack={current_result[0]} confidence={current_result[1]:.3f}")
+
+    loop = asyncio.new_event_loop()
+    start = time.perf_counter()
+    for path in probes:
+        loop.run_until_complete(current.analyze_request(SCANNER_IP, path, SCANNER_AGENT))
+    elapsed = time.perf_counter() - start
+    loop.close()
+    print(f"{'analyze_request end to end (current)':<42} {len(probes) / elapsed:>12,.0f} req/s  "
+          f"{elapsed / len(probes) * 1e6:>9.2f} us/req")
+
+
+if __name__ == "__main__":
+    main()
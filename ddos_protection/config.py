@@ -38,6 +38,9 @@ class DetectorConfig:
     global_rate_threshold: float = 100.0  # Global requests per second threshold
     global_window: int = 60  # Window for global rate calculation (seconds)
     
+    # Batch processing
+    batch_size: int = 512  # Maximum buffered requests analyzed per vectorized batch
+    
     # Cleanup and maintenance
     cleanup_interval: int = 30  # Interval for cleaning up expired records (seconds)
     record_expiry: int = 1800  # Time until IP records expire (seconds)
@@ -55,6 +58,7 @@ class DetectorConfig:
     use_ml: bool = True  # Enable machine learning for anomaly detection
     min_samples_for_training: int = 100  # Minimum number of samples before training ML model
     ml_retrain_interval: int = 3600  # Interval for retraining ML model (seconds)
+    ml_reservoir_size: int = 10000  # Maximum feature rows kept (reservoir-sampled) for training
     
     # Geolocation settings
     use_geolocation: bool = False  # Enable geolocation-based filtering
@@ -99,6 +103,9 @@ class MitigatorConfig:
     global_rate_limit: int = 500  # Maximum global requests per window
     ip_rate_limit: int = 30  # Maximum requests per IP per window
     endpoint_rate_limit: int = 100  # Maximum requests per endpoint per window
+    rate_buckets: int = 12  # Number of counter buckets per rate window (window / buckets = resolution)
+    max_tracked_ips: int = 200000  # Maximum IPs with live rate counters (least recently seen evicted first)
+    max_tracked_endpoints: int = 10000  # Maximum endpoints with live rate counters
     resource_check_interval: int = 30  # Interval for checking server resources (seconds)
     
     # Circuit breaker settings
@@ -121,6 +128,7 @@ class MitigatorConfig:
     challenge_expiry: int = 300  # Time until challenges expire (seconds)
     challenge_secret: str = ""  # Secret key for signing challenges (autogenerated if empty)
     max_challenge_attempts: int = 5  # Maximum attempts to solve a challenge
+    challenge_cache_size: int = 100000  # Maximum IPs/tokens kept for challenge escalation and replay protection
     
     # Endpoint criticality
     critical_endpoints: List[str] = field(default_factory=lambda: [
@@ -133,6 +141,7 @@ class MitigatorConfig:
     
     # General settings
     cleanup_interval: int = 60  # Interval for cleaning up expired entries (seconds)
+    classifier_refresh_interval: int = 300  # Max age of the compiled IP classifier before a rebuild (seconds)
     permanent_block_threshold: int = 15  # Suspicious score threshold for permanent blocking
     
     def __post_init__(self):
@@ -204,6 +213,14 @@ class MonitorConfig:
     log_format: str = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     enable_json_logs: bool = False  # Enable JSON formatted logs
     
+    # Per-IP behavior store (MonitorSystem request patterns)
+    behavior_shards: int = 64  # Number of lock stripes for per-IP request patterns
+    max_tracked_ips: int = 100000  # Maximum IPs with request patterns (least recently seen evicted first)
+    idle_ip_ttl: int = 600  # Drop an IP's request pattern after this many idle seconds
+    max_paths_per_ip: int = 32  # Distinct paths remembered per IP (path scanning triggers above 15)
+    interval_window: int = 10  # Recent request intervals kept per IP for bot timing detection
+    behavior_memory_budget_mb: float = 64  # Approximate memory limit for request patterns (0 for no limit)
+    
     # Prometheus metrics
     enable_prometheus: bool = True  # Enable Prometheus metrics
     prometheus_port: int = 9090  # Port for Prometheus metrics server
@@ -12,12 +12,87 @@ import time
 import re
 import asyncio
 import threading
-from collections import defaultdict, deque
+from collections import defaultdict, deque, Counter
 from typing import Dict, List, Set, Optional, Any, Tuple
 
 # Setup logger
 logger = logging.getLogger('ddos_protection.analyzer')
 
+# Path classes (bit flags), computed once per distinct path
+PATH_STATIC = 1
+PATH_API = 2
+PATH_BROWSER_RESOURCE = 4
+PATH_SUSPICIOUS = 8
+PATH_EXPENSIVE = 16
+
+# Static assets regex pattern
+STATIC_ASSET_PATTERN = re.compile(r'\.(css|js|png|jpg|jpeg|gif|svg|ico|woff|woff2|ttf|eot|pdf)$', re.IGNORECASE)
+
+# API paths pattern
+API_PATH_PATTERN = re.compile(r'^/api/', re.IGNORECASE)
+
+# Common browser resources pattern - avoid flagging standard browser loading patterns as attacks
+BROWSER_RESOURCES_PATTERN = re.compile(r'/(favicon|robots|manifest|sw|serviceworker|favicon-sw|assets)', re.IGNORECASE)
+
+# Scanner signatures (directory scanning), matched as one alternation
+SUSPICIOUS_PATH_PATTERNS = [
+    r'/\.env',
+    r'/\.git',
+    r'/wp-admin',
+    r'/admin',
+    r'/config',
+    r'/backup',
+    r'/dbadmin',
+    r'/phpMyAdmin',
+    r'/phpmyadmin',
+    r'/administrator'
+]
+SUSPICIOUS_PATH_PATTERN = re.compile('|'.join(SUSPICIOUS_PATH_PATTERNS))
+
+# Resource-intensive endpoints
+EXPENSIVE_ENDPOINTS = [
+    r'/api/search',
+    r'/api/report',
+    r'/api/export',
+    r'/download',
+    r'/upload'
+]
+EXPENSIVE_ENDPOINT_PATTERN = re.compile('|'.join(EXPENSIVE_ENDPOINTS))
+
+# Automated client signatures in user agents (matched against the lowercased agent)
+SUSPICIOUS_AGENT_PATTERNS = [
+    r'got',
+    r'bot',
+    r'crawl',
+    r'spider',
+    r'scan',
+    r'python',
+    r'curl',
+    r'wget',
+    r'go-http',
+    r'(?:^|[^a-z])php'
+]
+SUSPICIOUS_AGENT_PATTERN = re.compile('|'.join(SUSPICIOUS_AGENT_PATTERNS))
+
+# Maximum number of distinct paths kept in the classification cache
+PATH_CLASS_CACHE_SIZE = 10000
+
+
+def classify_path(path: str) -> int:
+    """Get the PATH_* flags of a path"""
+    flags = 0
+    if STATIC_ASSET_PATTERN.search(path):
+        flags |= PATH_STATIC
+    if API_PATH_PATTERN.search(path):
+        flags |= PATH_API
+    if BROWSER_RESOURCES_PATTERN.search(path):
+        flags |= PATH_BROWSER_RESOURCE
+    if SUSPICIOUS_PATH_PATTERN.search(path):
+        flags |= PATH_SUSPICIOUS
+    if EXPENSIVE_ENDPOINT_PATTERN.search(path):
+        flags |= PATH_EXPENSIVE
+    return flags
+
 class TrafficAnalyzer:
     """
     Analyzes traffic patterns to detect DDoS attacks based on behavioral analysis.
@@ -27,19 +102,26 @@ class TrafficAnalyzer:
     def __init__(self):
         """Initialize the traffic analyzer"""
         # IP tracking
-        self.ip_requests = defaultdict(list)  # Tracks request times by IP
-        self.ip_paths = defaultdict(set)      # Tracks unique paths by IP
-        self.ip_agents = defaultdict(set)     # Tracks unique user agents by IP
+        self.ip_requests = defaultdict(deque)  # Tracks request times by IP
+        self.ip_paths = defaultdict(set)       # Tracks unique paths by IP
+        self.ip_agents = defaultdict(set)      # Tracks unique user agents by IP
+        
+        # Incremental per-IP counters, updated when a new path/agent is first seen
+        self.ip_path_classes = defaultdict(Counter)   # Unique paths per PATH_* flag
+        self.ip_suspicious_agents = defaultdict(int)  # Unique automated-looking user agents
         
         # Enhanced tracking for better detection
         self.ip_legitimate_score = defaultdict(float)  # Score for legitimate behavior
-        self.ip_request_patterns = defaultdict(list)   # Pattern of requests to detect normal browsing
+        self.ip_last_path_type = {}                    # Type of the previous request per IP
+        self.ip_page_asset_transitions = defaultdict(int)  # Page requests followed by a static asset
         self.ip_static_assets = defaultdict(int)       # Count of static asset requests per IP
         self.ip_api_requests = defaultdict(int)        # Count of API requests per IP
         
         # Global tracking
         self.recent_requests = deque(maxlen=1000)  # Recent requests for global analysis
+        self.ip_recent_expensive = defaultdict(int)  # Expensive-endpoint requests per IP in recent_requests
         self.path_counts = defaultdict(int)       # Count of requests by path
+        self._path_classes = {}                   # Classification cache: path -> PATH_* flags
         
         # Attack pattern recognition
         self.attack_patterns = {
@@ -61,17 +143,22 @@ class TrafficAnalyzer:
             'large_request_size': 1024 * 1000  # Increased from 500KB to 1000KB
         }
         
-        # Static assets regex pattern
-        self.static_asset_pattern = re.compile(r'\.(css|js|png|jpg|jpeg|gif|svg|ico|woff|woff2|ttf|eot|pdf)$', re.IGNORECASE)
-        
-        # API paths pattern
-        self.api_path_pattern = re.compile(r'^/api/', re.IGNORECASE)
-        
-        # Common browser resources pattern - avoid flagging standard browser loading patterns as attacks
-        self.browser_resources_pattern = re.compile(r'/(favicon|robots|manifest|sw|serviceworker|favicon-sw|assets)', re.IGNORECASE)
+        self.static_asset_pattern = STATIC_ASSET_PATTERN
+        self.api_path_pattern = API_PATH_PATTERN
+        self.browser_resources_pattern = BROWSER_RESOURCES_PATTERN
         
         logger.info("Traffic analyzer initialized with enhanced detection and reduced sensitivity")
     
+    def classify_path(self, path: str) -> int:
+        """Get the PATH_* flags of a path, classifying it only the first time it is seen"""
+        flags = self._path_classes.get(path)
+        if flags is None:
+            flags = classify_path(path)
+            if len(self._path_classes) >= PATH_CLASS_CACHE_SIZE:
+                self._path_classes.clear()
+            self._path_classes[path] = flags
+        return flags
+    
     async def analyze_request(self, ip: str, path: str, user_agent: Optional[str] = None, 
                          request_size: int = 0) -> bool:
         """
@@ -90,14 +177,26 @@ class TrafficAnalyzer:
             current_time = time.time()
             
             # Check if this is a static asset request
-            is_static_asset = bool(self.static_asset_pattern.search(path))
-            is_api_request = bool(self.api_path_pattern.search(path))
+            path_flags = self.classify_path(path)
+            is_static_asset = bool(path_flags & PATH_STATIC)
+            is_api_request = bool(path_flags & PATH_API)
+            is_expensive = bool(path_flags & PATH_EXPENSIVE)
             
             # Record request data
             self.ip_requests[ip].append(current_time)
-            self.ip_paths[ip].add(path)
+            paths = self.ip_paths[ip]
+            if path not in paths:
+                paths.add(path)
+                path_classes = self.ip_path_classes[ip]
+                for flag in (PATH_STATIC, PATH_BROWSER_RESOURCE, PATH_SUSPICIOUS):
+                    if path_flags & flag:
+                        path_classes[flag] += 1
             if user_agent:
-                self.ip_agents[ip].add(user_agent)
+                agents = self.ip_agents[ip]
+                if user_agent not in agents:
+                    agents.add(user_agent)
+                    if SUSPICIOUS_AGENT_PATTERN.search(user_agent.lower()):
+                        self.ip_suspicious_agents[ip] += 1
             
             # Track asset/API requests
             if is_static_asset:
@@ -107,12 +206,22 @@ class TrafficAnalyzer:
             
             # Record request pattern (simplified path)
             path_type = 'static' if is_static_asset else ('api' if is_api_request else 'page')
-            self.ip_request_patterns[ip].append((path_type, current_time))
+            if path_type == 'static' and self.ip_last_path_type.get(ip) == 'page':
+                self.ip_page_asset_transitions[ip] += 1
+            self.ip_last_path_type[ip] = path_type
             
             # Keep only recent data
             self._clean_old_data(ip, current_time)
             
             # Add to global tracking
+            if len(self.recent_requests) == self.recent_requests.maxlen:
+                evicted = self.recent_requests[0]
+                if evicted['is_expensive']:
+                    self.ip_recent_expensive[evicted['ip']] -= 1
+                    if not self.ip_recent_expensive[evicted['ip']]:
+                        del self.ip_recent_expensive[evicted['ip']]
+            if is_expensive:
+                self.ip_recent_expensive[ip] += 1
             self.recent_requests.append({
                 'ip': ip,
                 'path': path,
@@ -120,7 +229,8 @@ class TrafficAnalyzer:
                 'time': current_time,
                 'size': request_size,
                 'is_static': is_static_asset,
-                'is_api': is_api_request
+                'is_api': is_api_request,
+                'is_expensive': is_expensive
             })
             self.path_counts[path] += 1
             
@@ -166,16 +276,17 @@ class TrafficAnalyzer:
         """Remove data older than 1 minute"""
         # Keep only requests from the last minute
         cutoff_time = current_time - 60
-        while self.ip_requests[ip] and self.ip_requests[ip][0] < cutoff_time:
-            self.ip_requests[ip].pop(0)
+        requests = self.ip_requests[ip]
+        while requests and requests[0] < cutoff_time:
+            requests.popleft()
         
         # Remove IP tracking if no recent requests
-        if not self.ip_requests[ip]:
+        if not requests:
             del self.ip_requests[ip]
-            if ip in self.ip_paths:
-                del self.ip_paths[ip]
-            if ip in self.ip_agents:
-                del self.ip_agents[ip]
+            self.ip_paths.pop(ip, None)
+            self.ip_path_classes.pop(ip, None)
+            self.ip_agents.pop(ip, None)
+            self.ip_suspicious_agents.pop(ip, None)
     
     def _check_rapid_fire(self, ip: str, path: str, user_agent: Optional[str], 
                         request_size: int, current_time: float) -> Tuple[bool, float]:
@@ -201,9 +312,8 @@ class TrafficAnalyzer:
             
         requests_per_minute = (len(requests) / duration) * 60
         
-        # Calculate average interval between requests
-        intervals = [requests[i] - requests[i-1] for i in range(1, len(requests))]
-        avg_interval = sum(intervals) / len(intervals) if intervals else 1.0
+        # Calculate average interval between requests (the interval sum telescopes to last - first)
+        avg_interval = (requests[-1] - requests[0]) / (len(requests) - 1)
         avg_interval_ms = avg_interval * 1000
         
         # Confidence calculation based on multiple factors
@@ -240,8 +350,9 @@ class TrafficAnalyzer:
             return False, 0.0
         
         # Filter out browser resources (favicon, etc.) from the count
-        browser_resource_paths = sum(1 for p in self.ip_paths[ip] if self.browser_resources_pattern.search(p))
-        static_asset_paths = sum(1 for p in self.ip_paths[ip] if self.static_asset_pattern.search(p))
+        path_classes = self.ip_path_classes[ip]
+        browser_resource_paths = path_classes[PATH_BROWSER_RESOURCE]
+        static_asset_paths = path_classes[PATH_STATIC]
         
         # Adjusted unique paths count - give less weight to common browser resources
         adjusted_unique_paths = unique_paths - (browser_resource_paths * 0.8) - (static_asset_paths * 0.6)
@@ -273,20 +384,7 @@ class TrafficAnalyzer:
             confidence += rate_factor * 0.5  # Reduced from 0.7 to 0.5
         
         # Factor 3: Suspicious path patterns (like directory scanning)
-        suspicious_patterns = [
-            r'/\.env',
-            r'/\.git',
-            r'/wp-admin',
-            r'/admin',
-            r'/config',
-            r'/backup',
-            r'/dbadmin',
-            r'/phpMyAdmin',
-            r'/phpmyadmin',
-            r'/administrator'
-        ]
-        
-        suspicious_count = sum(1 for p in self.ip_paths[ip] if any(re.search(pattern, p) for pattern in suspicious_patterns))
+        suspicious_count = path_classes[PATH_SUSPICIOUS]
         
         # If suspicious paths are detected, increase confidence
         if suspicious_count > 0:
@@ -321,25 +419,7 @@ class TrafficAnalyzer:
             confidence = min((unique_agents / self.thresholds['max_agents_per_ip']) - 1, 1.0)
             
             # Check for any suspicious user agents
-            suspicious_patterns = [
-                r'got',
-                r'bot',
-                r'crawl',
-                r'spider',
-                r'scan',
-                r'python',
-                r'curl',
-                r'wget',
-                r'go-http',
-                r'(?:^|[^a-z])php'
-            ]
-            
-            suspicious_count = 0
-            for agent in self.ip_agents[ip]:
-                for pattern in suspicious_patterns:
-                    if re.search(pattern, agent.lower()):
-                        suspicious_count += 1
-                        break
+            suspicious_count = self.ip_suspicious_agents[ip]
             
             # If more than half are suspicious, increase confidence
             if suspicious_count / unique_agents > 0.5:
@@ -362,15 +442,7 @@ class TrafficAnalyzer:
         is_large_request = request_size > self.thresholds['large_request_size']
         
         # Check for expensive endpoints
-        expensive_endpoints = [
-            r'/api/search',
-            r'/api/report',
-            r'/api/export',
-            r'/download',
-            r'/upload'
-        ]
-        
-        is_expensive_endpoint = any(re.search(pattern, path) for pattern in expensive_endpoints)
+        is_expensive_endpoint = bool(self.classify_path(path) & PATH_EXPENSIVE)
         
         # Count total requests to this path
         path_request_count = self.path_counts[path]
@@ -387,7 +459,7 @@ class TrafficAnalyzer:
         if is_expensive_endpoint:
             request_count = len(self.ip_requests[ip])
             if request_count > 10:  # Need at least 10 requests to consider
-                expensive_count = sum(1 for req in self.recent_requests if req['ip'] == ip and any(re.search(pattern, req['path']) for pattern in expensive_endpoints))
+                expensive_count = self.ip_recent_expensive[ip]
                 expensive_ratio = expensive_count / request_count
                 
                 if expensive_ratio > 0.5:  # More than 50% of requests are to expensive endpoints
@@ -402,7 +474,6 @@ class TrafficAnalyzer:
         """Update the legitimate score for an IP based on browsing patterns"""
         # Check for normal browsing patterns
         requests = self.ip_requests[ip]
-        patterns = self.ip_request_patterns[ip]
         
         # Need enough data to analyze
         if len(requests) < 3:
@@ -422,18 +493,14 @@ class TrafficAnalyzer:
             score += 0.2
         
         # Factor 2: Reasonable intervals between requests (not too fast, not too slow)
-        intervals = [requests[i] - requests[i-1] for i in range(1, len(requests))]
-        avg_interval = sum(intervals) / len(intervals) if intervals else 1.0
+        avg_interval = (requests[-1] - requests[0]) / (len(requests) - 1)
         if 0.05 < avg_interval < 10.0:  # Between 50ms and 10s is reasonable
             score += 0.3
         elif 0.01 < avg_interval < 20.0:  # More generous interval range
             score += 0.2
         
         # Factor 3: Pattern of requests (page followed by multiple static assets)
-        page_followed_by_assets = 0
-        for i in range(len(patterns) - 1):
-            if patterns[i][0] == 'page' and patterns[i+1][0] == 'static':
-                page_followed_by_assets += 1
+        page_followed_by_assets = self.ip_page_asset_transitions[ip]
         
         if page_followed_by_assets > 0:
             score += 0.2
@@ -17,11 +17,14 @@ import ipaddress
 import logging
 import json
 from datetime import datetime, timedelta
-from collections import defaultdict, deque
+from collections import defaultdict
 from typing import Dict, List, Set, Tuple, Optional, Union, Any
 import socket
 import hashlib
+import math
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
 
 import numpy as np
 from sklearn.ensemble import IsolationForest
@@ -32,7 +35,6 @@ from ddos_protection.config import Config
 from ddos_protection.utils import (
     is_valid_ip, 
     is_known_good_bot, 
-    calculate_entropy, 
     analyze_path_distribution,
     load_geolocation_db,
     get_ip_geolocation,
@@ -42,88 +44,349 @@ from ddos_protection.utils import (
 # Configure logger
 logger = logging.getLogger("ddos_protection.detector")
 
+# c * log2(c) for small counts, used for O(1) incremental entropy updates
+_XLOG2X_TABLE = [0.0, 0.0] + [c * math.log2(c) for c in range(2, 4096)]
+
+
+def _xlog2x(count: int) -> float:
+    """Return count * log2(count), using the lookup table for small counts."""
+    if count < 4096:
+        return _XLOG2X_TABLE[count]
+    return count * math.log2(count)
+
+
+class TrafficFeatureStore:
+    """
+    Struct-of-arrays storage for per-IP numeric traffic state.
+    
+    Every tracked IP owns one row (slot) in a set of NumPy arrays. Batches of
+    requests are applied with vectorized updates: request timestamps go into a
+    fixed per-row ring, interval variance is maintained with Welford/Chan
+    merging, and entropies are kept as running sums of c*log2(c) so they never
+    need the full distribution to be rebuilt.
+    """
+    
+    _FIELDS = {
+        "count": np.int64,            # Total requests seen
+        "last_ts": np.float64,        # Timestamp of the latest request
+        "interval_n": np.int64,       # Number of inter-request intervals
+        "interval_mean": np.float64,  # Running mean of intervals (Welford)
+        "interval_m2": np.float64,    # Running sum of squared deviations (Welford)
+        "error_count": np.int64,      # Requests answered with status >= 400
+        "bytes_sent": np.float64,
+        "bytes_received": np.float64,
+        "ua_count": np.int64,         # Distinct user agents
+        "path_xlogx": np.float64,     # Sum of c*log2(c) over path counts
+        "status_xlogx": np.float64,   # Sum of c*log2(c) over status code counts
+    }
+    
+    def __init__(self, window_size: int = 60, capacity: int = 1024):
+        self.window_size = max(1, window_size)
+        self.capacity = 0
+        self._next_slot = 0
+        self._free_slots: List[int] = []
+        for name, dtype in self._FIELDS.items():
+            setattr(self, name, np.zeros(0, dtype=dtype))
+        self.ts_ring = np.zeros((0, self.window_size), dtype=np.float64)
+        self._grow(max(1, capacity))
+    
+    def _grow(self, capacity: int):
+        """Resize all arrays to hold at least `capacity` rows."""
+        for name, dtype in self._FIELDS.items():
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        
+        ring = np.zeros((capacity, self.window_size), dtype=np.float64)
+        ring[:len(self.ts_ring)] = self.ts_ring
+        self.ts_ring = ring
+        self.capacity = capacity
+    
+    def allocate(self, timestamp: float) -> int:
+        """Reserve a zeroed row for a new IP and return its slot."""
+        if self._free_slots:
+            slot = self._free_slots.pop()
+        else:
+            if self._next_slot >= self.capacity:
+                self._grow(self.capacity * 2)
+            slot = self._next_slot
+            self._next_slot += 1
+        self.last_ts[slot] = timestamp
+        return slot
+    
+    def release(self, slot: int):
+        """Zero a row and return it to the free list."""
+        for name in self._FIELDS:
+            getattr(self, name)[slot] = 0
+        self.ts_ring[slot] = 0
+        self._free_slots.append(slot)
+    
+    def update_batch(self, slots: np.ndarray, timestamps: np.ndarray, bytes_sent: np.ndarray,
+                     bytes_received: np.ndarray, errors: np.ndarray, ua_new: np.ndarray,
+                     path_delta: np.ndarray, status_delta: np.ndarray):
+        """
+        Apply a batch of requests to their rows.
+        
+        Args:
+            slots: Row of each request
+            timestamps: Request timestamps
+            bytes_sent: Bytes sent per request
+            bytes_received: Bytes received per request
+            errors: 1 for responses with status >= 400, else 0
+            ua_new: 1 if the request introduced a new user agent for its IP
+            path_delta: Change in the row's path c*log2(c) sum
+            status_delta: Change in the row's status c*log2(c) sum
+        """
+        if len(slots) == 0:
+            return
+        
+        # Group requests by row, in time order within each row
+        order = np.lexsort((timestamps, slots))
+        slots = slots[order]
+        timestamps = timestamps[order]
+        unique_slots, starts, sizes = np.unique(slots, return_index=True, return_counts=True)
+        groups = len(unique_slots)
+        group_id = np.repeat(np.arange(groups), sizes)
+        rank = np.arange(len(slots)) - starts[group_id]
+        prior_count = self.count[unique_slots]
+        
+        # Intervals: previous request in the batch, or the row's last timestamp
+        previous = np.empty_like(timestamps)
+        previous[1:] = timestamps[:-1]
+        first = rank == 0
+        previous[first] = self.last_ts[unique_slots]
+        has_previous = ~first | (prior_count[group_id] > 0)
+        intervals = (timestamps - previous)[has_previous]
+        interval_group = group_id[has_previous]
+        
+        # Merge batch interval statistics into the running Welford state (Chan et al.)
+        n_b = np.bincount(interval_group, minlength=groups)
+        mean_b = np.bincount(interval_group, weights=intervals, minlength=groups) / np.maximum(n_b, 1)
+        m2_b = np.bincount(interval_group, weights=(intervals - mean_b[interval_group]) ** 2, minlength=groups)
+        n_a = self.interval_n[unique_slots]
+        mean_a = self.interval_mean[unique_slots]
+        n_total = n_a + n_b
+        delta = mean_b - mean_a
+        safe_total = np.maximum(n_total, 1)
+        self.interval_mean[unique_slots] = mean_a + delta * n_b / safe_total
+        self.interval_m2[unique_slots] += m2_b + delta ** 2 * n_a * n_b / safe_total
+        self.interval_n[unique_slots] = n_total
+        
+        # Write timestamps into each row's ring; only the newest window_size per row survive
+        window = self.window_size
+        keep = rank >= sizes[group_id] - window
+        positions = (prior_count[group_id] + rank) % window
+        self.ts_ring[slots[keep], positions[keep]] = timestamps[keep]
+        
+        # Plain counters
+        self.count[unique_slots] = prior_count + sizes
+        self.last_ts[unique_slots] = timestamps[starts + sizes - 1]
+        for name, values in (("error_count", errors), ("bytes_sent", bytes_sent),
+                             ("bytes_received", bytes_received), ("ua_count", ua_new),
+                             ("path_xlogx", path_delta), ("status_xlogx", status_delta)):
+            column = getattr(self, name)
+            column[unique_slots] += np.bincount(group_id, weights=values[order], minlength=groups).astype(column.dtype)
+    
+    def request_rates(self, slots: np.ndarray, now: float, window_seconds: int = 60) -> np.ndarray:
+        """Requests per second over the last window_seconds for each row."""
+        window = self.window_size
+        ts = self.ts_ring[slots]
+        filled = np.minimum(self.count[slots], window)
+        recent = (np.arange(window)[None, :] < filled[:, None]) & (now - ts <= window_seconds)
+        recent_count = recent.sum(axis=1)
+        span = now - np.where(recent, ts, np.inf).min(axis=1)
+        valid = (recent_count > 0) & (span > 0)
+        return np.where(valid, recent_count / np.where(valid, span, 1.0), 0.0)
+    
+    def window_request_count(self, now: float, window_seconds: float) -> int:
+        """Total requests across all rows within the last window_seconds."""
+        rows = self._next_slot
+        if rows == 0:
+            return 0
+        window = self.window_size
+        filled = np.minimum(self.count[:rows], window)
+        valid = np.arange(window)[None, :] < filled[:, None]
+        return int(np.count_nonzero(valid & (now - self.ts_ring[:rows] <= window_seconds)))
+    
+    def _entropy(self, xlogx: np.ndarray, counts: np.ndarray) -> np.ndarray:
+        """Shannon entropy from sum(c*log2(c)) and total N: log2(N) - S/N."""
+        safe = np.maximum(counts, 1)
+        return np.maximum(0.0, np.log2(safe) - xlogx / safe)
+    
+    def feature_matrix(self, slots: np.ndarray, now: float) -> np.ndarray:
+        """
+        Build the anomaly-detection feature matrix for a set of rows.
+        
+        Columns follow FEATURE_NAMES.
+        """
+        counts = self.count[slots]
+        safe_counts = np.maximum(counts, 1)
+        interval_n = self.interval_n[slots]
+        variance = np.where(interval_n > 0, self.interval_m2[slots] / np.maximum(interval_n, 1), 0.0)
+        
+        return np.column_stack((
+            self.request_rates(slots, now),
+            self._entropy(self.path_xlogx[slots], counts),
+            self._entropy(self.status_xlogx[slots], counts),
+            self.ua_count[slots],
+            self.error_count[slots] / safe_counts,
+            self.bytes_received[slots] / safe_counts,
+            variance,
+        ))
+
+
+FEATURE_NAMES = [
+    "request_rate",
+    "path_entropy",
+    "status_entropy",
+    "user_agent_diversity",
+    "error_ratio",
+    "bytes_per_request",
+    "request_interval_variance"
+]
+
+
+class FeatureReservoir:
+    """
+    Bounded, uniformly sampled set of feature rows for model training.
+    
+    Implements reservoir sampling (Algorithm R) over every feature row offered,
+    so the training set stays representative of the whole stream while its
+    size never exceeds `capacity`.
+    """
+    
+    def __init__(self, capacity: int, feature_count: int, seed: Optional[int] = None):
+        self.capacity = max(1, capacity)
+        self.rows = np.zeros((self.capacity, feature_count), dtype=np.float64)
+        self.size = 0
+        self.seen = 0
+        self._rng = np.random.default_rng(seed)
+    
+    def offer(self, features: np.ndarray):
+        """Offer a batch of feature rows to the reservoir."""
+        count = len(features)
+        if count == 0:
+            return
+        
+        # Fill free space first
+        fill = min(count, self.capacity - self.size)
+        if fill > 0:
+            self.rows[self.size:self.size + fill] = features[:fill]
+            self.size += fill
+        
+        # Each remaining row i replaces a random slot with probability capacity / (seen_i + 1)
+        rest = features[fill:]
+        if len(rest):
+            seen = self.seen + fill + np.arange(1, len(rest) + 1)
+            targets = (self._rng.random(len(rest)) * seen).astype(np.int64)
+            accepted = targets < self.capacity
+            self.rows[targets[accepted]] = rest[accepted]
+        
+        self.seen += count
+    
+    def snapshot(self) -> np.ndarray:
+        """Copy of the current sample, safe to hand to another thread."""
+        return self.rows[:self.size].copy()
+
+
 class TrafficRecord:
-    """Stores traffic data for a specific IP address."""
+    """
+    Stores traffic data for a specific IP address.
+    
+    Categorical state (paths, status codes, user agents) is kept here; numeric
+    counters live in this record's row of a shared TrafficFeatureStore.
+    """
     
-    def __init__(self, ip: str, window_size: int = 60):
+    def __init__(self, ip: str, window_size: int = 60, store: Optional[TrafficFeatureStore] = None):
         self.ip = ip
-        self.request_timestamps = deque(maxlen=window_size)  # Rolling window of timestamps
+        self.store = store if store is not None else TrafficFeatureStore(window_size, capacity=1)
+        self.slot = self.store.allocate(time.time())
         self.path_distribution = defaultdict(int)  # Path frequency count
-        self.bytes_sent = 0
-        self.bytes_received = 0
-        self.error_count = 0
         self.user_agent_hash = set()  # Hashed user agents for this IP
         self.response_codes = defaultdict(int)  # Status code distribution
-        self.last_updated = time.time()
         self.is_suspicious = False
         self.block_score = 0  # Score used to determine if IP should be blocked
         self.challenge_status = False  # Has the IP passed a challenge?
         self.geolocation = None  # Location data
-        self.request_interval_variance = 0.0  # Variance in request timing (low variance = bot-like)
+    
+    @property
+    def last_updated(self) -> float:
+        return float(self.store.last_ts[self.slot])
+    
+    @property
+    def request_count(self) -> int:
+        return int(self.store.count[self.slot])
+    
+    @property
+    def sample_count(self) -> int:
+        """Number of timestamps held in the rolling window."""
+        return min(self.request_count, self.store.window_size)
+    
+    @property
+    def bytes_sent(self) -> float:
+        return float(self.store.bytes_sent[self.slot])
+    
+    @property
+    def bytes_received(self) -> float:
+        return float(self.store.bytes_received[self.slot])
+    
+    @property
+    def error_count(self) -> int:
+        return int(self.store.error_count[self.slot])
+    
+    @property
+    def request_interval_variance(self) -> float:
+        """Variance in request timing (low variance = bot-like)."""
+        n = self.store.interval_n[self.slot]
+        return float(self.store.interval_m2[self.slot] / n) if n > 0 else 0.0
+    
+    @property
+    def path_entropy(self) -> float:
+        return float(self.store._entropy(self.store.path_xlogx[self.slot:self.slot + 1],
+                                         self.store.count[self.slot:self.slot + 1])[0])
+    
+    def record_categorical(self, path: str, status_code: int, user_agent: str) -> Tuple[float, float, int]:
+        """
+        Update path/status/user-agent counts for one request.
         
-    def add_request(self, timestamp: float, path: str, bytes_sent: int, 
-                  bytes_received: int, status_code: int, user_agent: str):
-        """Record a new request from this IP."""
-        self.request_timestamps.append(timestamp)
-        self.path_distribution[path] += 1
-        self.bytes_sent += bytes_sent
-        self.bytes_received += bytes_received
-        self.response_codes[status_code] += 1
-        self.last_updated = timestamp
+        Returns:
+            Tuple[float, float, int]: Path entropy sum delta, status entropy sum delta,
+            and 1 if the user agent is new for this IP
+        """
+        path_count = self.path_distribution[path]
+        self.path_distribution[path] = path_count + 1
+        status_count = self.response_codes[status_code]
+        self.response_codes[status_code] = status_count + 1
         
         # Hash and store the user agent to track agent diversity
         ua_hash = mmh3.hash(user_agent, signed=False)
+        ua_new = 0 if ua_hash in self.user_agent_hash else 1
         self.user_agent_hash.add(ua_hash)
         
-        # Update request interval variance if we have enough samples
-        if len(self.request_timestamps) > 3:
-            intervals = np.diff(list(self.request_timestamps))
-            self.request_interval_variance = np.var(intervals)
+        return (_xlog2x(path_count + 1) - _xlog2x(path_count),
+                _xlog2x(status_count + 1) - _xlog2x(status_count),
+                ua_new)
+    
+    def add_request(self, timestamp: float, path: str, bytes_sent: int, 
+                  bytes_received: int, status_code: int, user_agent: str):
+        """Record a new request from this IP."""
+        path_delta, status_delta, ua_new = self.record_categorical(path, status_code, user_agent)
+        self.store.update_batch(
+            np.array([self.slot]), np.array([timestamp], dtype=np.float64),
+            np.array([bytes_sent], dtype=np.float64), np.array([bytes_received], dtype=np.float64),
+            np.array([1 if status_code >= 400 else 0]), np.array([ua_new]),
+            np.array([path_delta]), np.array([status_delta])
+        )
     
     def get_request_rate(self, window_seconds: int = 60) -> float:
         """Calculate requests per second over the last window_seconds."""
-        if not self.request_timestamps:
-            return 0.0
-            
-        now = time.time()
-        # Filter timestamps within the window
-        recent_requests = [ts for ts in self.request_timestamps 
-                         if now - ts <= window_seconds]
-        
-        if not recent_requests:
-            return 0.0
-            
-        # Calculate requests per second
-        time_diff = now - min(recent_requests)
-        if time_diff <= 0:
-            return 0.0
-            
-        return len(recent_requests) / time_diff
+        return float(self.store.request_rates(np.array([self.slot]), time.time(), window_seconds)[0])
     
     def get_features(self) -> Dict[str, float]:
         """Extract features for anomaly detection."""
-        request_rate = self.get_request_rate()
-        path_entropy = calculate_entropy(list(self.path_distribution.values()))
-        status_entropy = calculate_entropy(list(self.response_codes.values()))
-        user_agent_count = len(self.user_agent_hash)
-        
-        # Calculate ratio of 4xx/5xx errors to total requests
-        total_requests = sum(self.response_codes.values())
-        error_ratio = 0.0
-        if total_requests > 0:
-            error_requests = sum(self.response_codes[code] for code in self.response_codes 
-                               if code >= 400)
-            error_ratio = error_requests / total_requests
-        
-        return {
-            "request_rate": request_rate,
-            "path_entropy": path_entropy,
-            "status_entropy": status_entropy,
-            "user_agent_diversity": user_agent_count,
-            "error_ratio": error_ratio,
-            "bytes_per_request": self.bytes_received / max(1, total_requests),
-            "request_interval_variance": self.request_interval_variance
-        }
+        row = self.store.feature_matrix(np.array([self.slot]), time.time())[0]
+        return {name: float(value) for name, value in zip(FEATURE_NAMES, row)}
 
 class RequestBuffer:
     """Thread-safe buffer for incoming requests to be analyzed."""
@@ -143,6 +406,16 @@ class RequestBuffer:
         """Get the next request from the buffer."""
         return await self.buffer.get()
     
+    def get_batch(self, max_items: int) -> List[Dict[str, Any]]:
+        """Drain up to max_items buffered requests without waiting."""
+        batch = []
+        while len(batch) < max_items:
+            try:
+                batch.append(self.buffer.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+    
     def qsize(self) -> int:
         """Get current buffer size."""
         return self.buffer.qsize()
@@ -157,13 +430,21 @@ class AttackDetector:
     def __init__(self, config: Config):
         self.config = config
         self.ip_records: Dict[str, TrafficRecord] = {}
+        self.feature_store = TrafficFeatureStore(window_size=self.config.detector.window_size)
         self.blocked_ips: Set[str] = set()
         self.whitelisted_ips: Set[str] = set()
         self.global_request_rate = 0.0
         self.request_buffer = RequestBuffer()
         self.last_cleanup = time.time()
         self.ml_model = None
+        self.ml_model_trained = False
         self.model_features = None
+        self.ml_reservoir = FeatureReservoir(self.config.detector.ml_reservoir_size, len(FEATURE_NAMES))
+        self.last_ml_training = 0.0
+        # Model fits run on a single background thread; the finished model is swapped in atomically
+        self._ml_executor: Optional[ThreadPoolExecutor] = None
+        self._ml_training_future: Optional[Future] = None
+        self._ml_lock = threading.Lock()
         self.attack_status = {
             "under_attack": False,
             "attack_type": None,
@@ -196,8 +477,18 @@ class AttackDetector:
     def initialize_ml_model(self):
         """Initialize machine learning model for anomaly detection."""
         logger.info("Initializing machine learning model for anomaly detection")
+        self.ml_model = self._build_ml_model()
+        self.ml_model_trained = False
+        
+        # Define feature names used for model training/inference
+        self.model_features = list(FEATURE_NAMES)
+        
+        # We'll train the model later when we have enough data
+    
+    def _build_ml_model(self) -> IsolationForest:
+        """Create an untrained anomaly detection model."""
         # Using Isolation Forest for anomaly detection (lightweight and effective)
-        self.ml_model = IsolationForest(
+        return IsolationForest(
             n_estimators=100,
             max_samples='auto',
             contamination=0.05,  # Expect about 5% of traffic to be anomalous
@@ -205,19 +496,6 @@ class AttackDetector:
             n_jobs=1  # Limit to single thread for resource efficiency
         )
         
-        # Define feature names used for model training/inference
-        self.model_features = [
-            "request_rate", 
-            "path_entropy",
-            "status_entropy", 
-            "user_agent_diversity",
-            "error_ratio",
-            "bytes_per_request",
-            "request_interval_variance"
-        ]
-        
-        # We'll train the model later when we have enough data
-        
     async def start(self):
         """Start attack detector components."""
         logger.info("Starting DDoS attack detector")
@@ -246,6 +524,11 @@ class AttackDetector:
             except asyncio.CancelledError:
                 pass
         
+        # Stop background model training
+        if self._ml_executor:
+            self._ml_executor.shutdown(wait=False, cancel_futures=True)
+            self._ml_executor = None
+        
         logger.info("DDoS attack detector stopped")
     
     async def process_requests(self):
@@ -253,10 +536,11 @@ class AttackDetector:
         logger.info("Starting request processing loop")
         try:
             while True:
-                # Process requests in buffer
+                # Drain the buffer in fixed-size chunks, yielding to the loop between chunks
                 while not self.request_buffer.is_empty():
-                    request_data = await self.request_buffer.get_request()
-                    self.process_request(request_data)
+                    batch = self.request_buffer.get_batch(self.config.detector.batch_size)
+                    self.process_batch(batch)
+                    await asyncio.sleep(0)
                 
                 # Perform periodic tasks
                 current_time = time.time()
@@ -266,9 +550,12 @@ class AttackDetector:
                     self.detect_ongoing_attacks()
                     self.last_cleanup = current_time
                     
-                    # Retrain ML model periodically if we have enough data
-                    if (self.config.detector.use_ml and 
-                        len(self.ip_records) > self.config.detector.min_samples_for_training):
+                    # Retrain ML model periodically if we have enough data.
+                    # train_ml_model() only schedules the fit; it never blocks this loop.
+                    retrain_due = (not self.ml_model_trained or
+                                   current_time - self.last_ml_training >= self.config.detector.ml_retrain_interval)
+                    if (self.config.detector.use_ml and retrain_due and
+                        self.ml_reservoir.size >= self.config.detector.min_samples_for_training):
                         self.train_ml_model()
                 
                 # Wait a short time to avoid consuming too many resources
@@ -283,165 +570,233 @@ class AttackDetector:
             await asyncio.sleep(1)
             asyncio.create_task(self.process_requests())
     
+    def _get_or_create_record(self, ip: str) -> TrafficRecord:
+        """Get the traffic record for an IP, creating it on first sight."""
+        record = self.ip_records.get(ip)
+        if record is not None:
+            return record
+        
+        record = TrafficRecord(ip, window_size=self.config.detector.window_size, store=self.feature_store)
+        self.ip_records[ip] = record
+        
+        # Get geolocation data if enabled
+        if self.config.detector.use_geolocation:
+            try:
+                record.geolocation = get_ip_geolocation(
+                    ip, 
+                    self.geo_db,
+                    self.ipinfo_api_token if self.use_ipinfo_api else None
+                )
+                
+                # Check if IP is from a blocked country
+                if (record.geolocation and 
+                    record.geolocation.get("country_code") in self.config.detector.blocked_countries):
+                    record.block_score += 100  # Automatic high score
+                    logger.info(f"IP {ip} from blocked country: {record.geolocation.get('country_code')}")
+            except Exception as e:
+                logger.error(f"Error getting geolocation for {ip}: {e}")
+        
+        return record
+    
     def process_request(self, request_data: Dict[str, Any]):
         """Process a request and check for anomalies."""
-        ip = request_data.get("ip", "")
-        path = request_data.get("path", "")
-        user_agent = request_data.get("user_agent", "")
+        self.process_batch([request_data])
+    
+    def process_batch(self, requests: List[Dict[str, Any]]):
+        """
+        Process a chunk of requests with vectorized feature updates.
         
-        # Skip processing for whitelisted IPs
-        if ip in self.whitelisted_ips:
+        Categorical counts are updated per request (O(1) each); all numeric
+        state is then updated for the whole chunk in one pass over the
+        feature store, and rules are evaluated once per distinct IP.
+        """
+        count = len(requests)
+        if count == 0:
             return
+        
+        now = time.time()
+        slots = np.empty(count, dtype=np.int64)
+        timestamps = np.empty(count, dtype=np.float64)
+        bytes_sent = np.empty(count, dtype=np.float64)
+        bytes_received = np.empty(count, dtype=np.float64)
+        errors = np.empty(count, dtype=np.int64)
+        ua_new = np.empty(count, dtype=np.int64)
+        path_delta = np.empty(count, dtype=np.float64)
+        status_delta = np.empty(count, dtype=np.float64)
+        hits: Dict[str, int] = {}
+        n = 0
+        
+        for request_data in requests:
+            ip = request_data.get("ip", "")
             
-        # Create or update IP record
-        if ip not in self.ip_records:
-            self.ip_records[ip] = TrafficRecord(ip, window_size=self.config.detector.window_size)
+            # Skip processing for whitelisted IPs
+            if ip in self.whitelisted_ips:
+                continue
             
-            # Get geolocation data if enabled
-            if self.config.detector.use_geolocation:
-                try:
-                    self.ip_records[ip].geolocation = get_ip_geolocation(
-                        ip, 
-                        self.geo_db,
-                        self.ipinfo_api_token if self.use_ipinfo_api else None
-                    )
-                    
-                    # Check if IP is from a blocked country
-                    if (self.ip_records[ip].geolocation and 
-                        self.ip_records[ip].geolocation.get("country_code") in self.config.detector.blocked_countries):
-                        self.ip_records[ip].block_score += 100  # Automatic high score
-                        logger.info(f"IP {ip} from blocked country: {self.ip_records[ip].geolocation.get('country_code')}")
-                except Exception as e:
-                    logger.error(f"Error getting geolocation for {ip}: {e}")
-        
-        # Add request to IP record
-        self.ip_records[ip].add_request(
-            request_data.get("timestamp", time.time()),
-            path,
-            request_data.get("bytes_sent", 0),
-            request_data.get("bytes_received", 0),
-            request_data.get("status_code", 200),
-            user_agent
+            record = self._get_or_create_record(ip)
+            status_code = request_data.get("status_code", 200)
+            path_delta[n], status_delta[n], ua_new[n] = record.record_categorical(
+                request_data.get("path", ""), status_code, request_data.get("user_agent", "")
+            )
+            slots[n] = record.slot
+            timestamps[n] = request_data.get("timestamp", now)
+            bytes_sent[n] = request_data.get("bytes_sent", 0)
+            bytes_received[n] = request_data.get("bytes_received", 0)
+            errors[n] = 1 if status_code >= 400 else 0
+            hits[ip] = hits.get(ip, 0) + 1
+            n += 1
+        
+        if n == 0:
+            return
+        
+        self.feature_store.update_batch(
+            slots[:n], timestamps[:n], bytes_sent[:n], bytes_received[:n],
+            errors[:n], ua_new[:n], path_delta[:n], status_delta[:n]
         )
         
-        # Check for suspicious patterns for this individual IP
-        self.check_ip_level_anomalies(ip)
+        records = [self.ip_records[ip] for ip in hits]
+        batch_slots = np.fromiter((r.slot for r in records), dtype=np.int64, count=len(records))
+        features = self.feature_store.feature_matrix(batch_slots, now)
         
-        # If ML model is enabled and trained, check for anomalies
-        if self.config.detector.use_ml and self.ml_model and hasattr(self.ml_model, 'predict'):
-            self.check_ml_anomalies(ip)
+        # Check for suspicious patterns for the individual IPs in this batch
+        self._check_ip_level_anomalies_batch(records, batch_slots, features, hits)
+        
+        if self.config.detector.use_ml:
+            self.ml_reservoir.offer(features)
+            
+            # If ML model is trained, score every IP in the batch with one call
+            if self.ml_model_trained:
+                self._check_ml_anomalies_batch(records, features)
     
     def check_ip_level_anomalies(self, ip: str):
         """Check for suspicious patterns at the individual IP level."""
         record = self.ip_records[ip]
+        slots = np.array([record.slot])
+        features = self.feature_store.feature_matrix(slots, time.time())
+        self._check_ip_level_anomalies_batch([record], slots, features, {ip: 1})
+    
+    def _check_ip_level_anomalies_batch(self, records: List[TrafficRecord], slots: np.ndarray,
+                                        features: np.ndarray, hits: Dict[str, int]):
+        """
+        Apply the rule-based checks to many IPs at once.
         
-        # Simple rule-based detection
-        request_rate = record.get_request_rate()
+        Args:
+            records: Records to check
+            slots: Feature store rows of the records
+            features: Feature matrix rows of the records
+            hits: Mapping of IP to the number of requests it made in this batch;
+                  rule scores are weighted by it, as if evaluated per request
+        """
+        weights = np.fromiter((hits[r.ip] for r in records), dtype=np.int64, count=len(records))
+        request_rate, path_entropy, _, ua_count, error_rate, _, variance = features.T
+        total_requests = self.feature_store.count[slots]
+        sample_count = np.minimum(total_requests, self.feature_store.window_size)
+        distinct_paths = np.fromiter((len(r.path_distribution) for r in records),
+                                     dtype=np.int64, count=len(records))
+        detector_config = self.config.detector
         
         # Rule 1: High request rate
-        if request_rate > self.config.detector.rate_threshold:
-            record.block_score += 2
-            logger.debug(f"IP {ip} has high request rate: {request_rate:.2f}/sec")
-        
+        high_rate = request_rate > detector_config.rate_threshold
         # Rule 2: Path/endpoint hammering (low entropy = repetitive behavior)
-        path_values = list(record.path_distribution.values())
-        if len(path_values) > 5:  # Only check if we have enough data
-            path_entropy = calculate_entropy(path_values)
-            if path_entropy < self.config.detector.path_entropy_threshold:
-                record.block_score += 2
-                logger.debug(f"IP {ip} has low path entropy: {path_entropy:.2f}")
-        
+        low_entropy = (distinct_paths > 5) & (path_entropy < detector_config.path_entropy_threshold)
         # Rule 3: Unusual user-agent diversity (many different UAs from same IP)
-        ua_count = len(record.user_agent_hash)
-        if ua_count > self.config.detector.ua_diversity_threshold:
-            record.block_score += 2
-            logger.debug(f"IP {ip} has high UA diversity: {ua_count}")
-        
+        high_ua = ua_count > detector_config.ua_diversity_threshold
         # Rule 4: High error rate (4xx/5xx responses)
-        total_requests = sum(record.response_codes.values())
-        if total_requests > 10:  # Only check if we have enough data
-            error_requests = sum(record.response_codes[code] for code in record.response_codes 
-                               if code >= 400)
-            error_rate = error_requests / total_requests
-            if error_rate > self.config.detector.error_rate_threshold:
-                record.block_score += 1
-                logger.debug(f"IP {ip} has high error rate: {error_rate:.2f}")
-        
+        high_errors = (total_requests > 10) & (error_rate > detector_config.error_rate_threshold)
         # Rule 5: Very low request interval variance (bot-like behavior)
-        if (record.request_interval_variance < self.config.detector.bot_variance_threshold and
-            len(record.request_timestamps) > 10):
-            record.block_score += 2
-            logger.debug(f"IP {ip} has low request interval variance: {record.request_interval_variance:.5f}")
+        bot_like = (variance < detector_config.bot_variance_threshold) & (sample_count > 10)
+        
+        increments = (2 * high_rate + 2 * low_entropy + 2 * high_ua + high_errors + 2 * bot_like) * weights
         
-        # Update suspicious status if block score exceeds threshold
-        if record.block_score >= self.config.detector.block_score_threshold:
-            record.is_suspicious = True
-            self.attack_status["suspicious_ips"].add(ip)
-            logger.warning(f"IP {ip} flagged as suspicious (score: {record.block_score})")
+        for i, record in enumerate(records):
+            if increments[i]:
+                record.block_score += int(increments[i])
+                logger.debug(
+                    f"IP {record.ip} rule hits: rate={request_rate[i]:.2f}/sec, "
+                    f"path_entropy={path_entropy[i]:.2f}, ua_count={int(ua_count[i])}, "
+                    f"error_rate={error_rate[i]:.2f}, interval_variance={variance[i]:.5f}"
+                )
+            
+            # Update suspicious status if block score exceeds threshold
+            if record.block_score >= detector_config.block_score_threshold and not record.is_suspicious:
+                record.is_suspicious = True
+                self.attack_status["suspicious_ips"].add(record.ip)
+                logger.warning(f"IP {record.ip} flagged as suspicious (score: {record.block_score})")
     
     def check_ml_anomalies(self, ip: str):
         """Use machine learning model to detect anomalies."""
+        if not self.ml_model_trained:
+            return
         record = self.ip_records[ip]
+        features = self.feature_store.feature_matrix(np.array([record.slot]), time.time())
+        self._check_ml_anomalies_batch([record], features)
+    
+    def _check_ml_anomalies_batch(self, records: List[TrafficRecord], features: np.ndarray):
+        """Score many IPs with a single decision_function call."""
+        model = self.ml_model  # Read once; a retrain may swap the reference concurrently
+        try:
+            # Score is distance from decision boundary, lower is more anomalous.
+            # IsolationForest.predict() is exactly "score < 0", so one call covers both.
+            scores = model.decision_function(features)
+        except Exception as e:
+            logger.error(f"Error in ML anomaly detection: {e}")
+            return
         
-        # Extract features for this IP
-        features = record.get_features()
+        for i in np.flatnonzero(scores < 0):  # Anomaly detected
+            record = records[i]
+            score = scores[i]
+            
+            # Adjust block score based on how anomalous it is
+            score_adjustment = max(1, int((0.5 - score) * 5)) if score < 0.5 else 1
+            record.block_score += score_adjustment
+            logger.debug(f"ML model detected anomaly for IP {record.ip} (score: {score:.4f})")
+            
+            # Update suspicious status if block score exceeds threshold
+            if record.block_score >= self.config.detector.block_score_threshold:
+                record.is_suspicious = True
+                self.attack_status["suspicious_ips"].add(record.ip)
+    
+    def train_ml_model(self) -> Optional[Future]:
+        """
+        Schedule a model fit on the reservoir sample, off the event loop.
         
-        # Skip if we don't have all required features
-        if not all(f in features for f in self.model_features):
-            return
+        The fit runs on a background thread against a copy of the sample and
+        the trained model replaces the live one with a single reference swap.
+        At most one fit runs at a time.
         
-        # Convert features to array for prediction
-        X = np.array([[features[f] for f in self.model_features]])
+        Returns:
+            Optional[Future]: Future of the scheduled fit, or None if skipped
+        """
+        if not self.config.detector.use_ml or self.ml_model is None:
+            return None
         
-        # Predict anomaly (-1 for anomaly, 1 for normal)
-        try:
-            prediction = self.ml_model.predict(X)[0]
-            # Score is distance from decision boundary, lower is more anomalous
-            score = self.ml_model.decision_function(X)[0]
+        with self._ml_lock:
+            if self._ml_training_future and not self._ml_training_future.done():
+                return None
             
-            if prediction == -1:  # Anomaly detected
-                # Adjust block score based on how anomalous it is
-                score_adjustment = max(1, int((0.5 - score) * 5)) if score < 0.5 else 1
-                record.block_score += score_adjustment
-                logger.debug(f"ML model detected anomaly for IP {ip} (score: {score:.4f})")
-                
-                # Update suspicious status if block score exceeds threshold
-                if record.block_score >= self.config.detector.block_score_threshold:
-                    record.is_suspicious = True
-                    self.attack_status["suspicious_ips"].add(ip)
-        except Exception as e:
-            logger.error(f"Error in ML anomaly detection for IP {ip}: {e}")
-    
-    def train_ml_model(self):
-        """Train the ML model using current traffic data."""
-        if not self.config.detector.use_ml or not self.ml_model:
-            return
+            # Only train if we have enough samples
+            if self.ml_reservoir.size < self.config.detector.min_samples_for_training:
+                return None
             
-        try:
-            # Only train if we have enough records
-            if len(self.ip_records) < self.config.detector.min_samples_for_training:
-                return
-                
-            logger.info(f"Training ML model with {len(self.ip_records)} IP records")
+            X = self.ml_reservoir.snapshot()
+            self.last_ml_training = time.time()
             
-            # Extract features from all IP records
-            feature_lists = []
-            for ip, record in self.ip_records.items():
-                features = record.get_features()
-                # Only use if we have all required features
-                if all(f in features for f in self.model_features):
-                    feature_lists.append([features[f] for f in self.model_features])
+            if self._ml_executor is None:
+                self._ml_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ddos-ml-train")
+            self._ml_training_future = self._ml_executor.submit(self._fit_ml_model, X)
+            return self._ml_training_future
+    
+    def _fit_ml_model(self, X: np.ndarray):
+        """Fit a fresh model on a training sample and swap it in (runs on the training thread)."""
+        try:
+            logger.info(f"Training ML model with {len(X)} sampled feature rows")
+            model = self._build_ml_model()
+            model.fit(X)
             
-            # Skip if we don't have enough valid feature sets
-            if len(feature_lists) < self.config.detector.min_samples_for_training:
-                logger.info(f"Not enough valid feature sets for training ({len(feature_lists)})")
-                return
-                
-            # Convert to numpy array and train
-            X = np.array(feature_lists)
-            self.ml_model.fit(X)
+            # Atomic reference swap - scorers see either the old or the new model
+            self.ml_model = model
+            self.ml_model_trained = True
             logger.info("ML model training completed")
-            
         except Exception as e:
             logger.error(f"Error training ML model: {e}")
     
@@ -450,12 +805,8 @@ class AttackDetector:
         current_time = time.time()
         window = self.config.detector.global_window
         
-        # Calculate global request rate across all IPs
-        total_requests = 0
-        for ip, record in self.ip_records.items():
-            # Count requests within the window
-            count = sum(1 for ts in record.request_timestamps if current_time - ts <= window)
-            total_requests += count
+        # Calculate global request rate across all IPs in one vectorized pass
+        total_requests = self.feature_store.window_request_count(current_time, window)
         
         # Calculate requests per second
         self.global_request_rate = total_requests / window if window > 0 else 0
@@ -523,9 +874,9 @@ class AttackDetector:
             if current_time - record.last_updated > expiration
         ]
         
-        # Remove expired records
+        # Remove expired records and free their feature rows
         for ip in expired_ips:
-            del self.ip_records[ip]
+            self.feature_store.release(self.ip_records.pop(ip).slot)
             if ip in self.attack_status["suspicious_ips"]:
                 self.attack_status["suspicious_ips"].remove(ip)
         
@@ -567,8 +918,7 @@ class AttackDetector:
             is_high_frequency = request_rate > self.config.detector.rate_threshold * 2
             
             # Check pattern of requests (low entropy = repetitive behavior = suspicious)
-            path_values = list(record.path_distribution.values())
-            path_entropy = calculate_entropy(path_values) if len(path_values) > 5 else 999
+            path_entropy = record.path_entropy if len(record.path_distribution) > 5 else 999
             is_repetitive = path_entropy < self.config.detector.path_entropy_threshold / 2
             
             # Check interval variance (extremely low variance = bot-like)
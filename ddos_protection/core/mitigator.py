@@ -19,11 +19,14 @@ import random
 import os
 import json
 import base64
+import binascii
 import hashlib
 import hmac
+import threading
+import tempfile
 from typing import Dict, List, Set, Tuple, Optional, Union, Any, Callable
 from datetime import datetime, timedelta
-from collections import defaultdict, deque
+from collections import OrderedDict
 import subprocess
 import ipaddress
 import traceback
@@ -35,9 +38,9 @@ from ddos_protection.utils import (
     is_valid_ip,
     get_server_resources,
     generate_challenge,
-    verify_challenge_response,
     execute_command
 )
+from ddos_protection.utils.ip_classifier import ip_classifier, TRUSTED, BANNED, INTERNAL
 from ddos_protection.storage import storage_manager
 from ddos_protection.storage import ban_manager
 
@@ -106,6 +109,135 @@ logger.addFilter(block_filter)
 security_logger = logging.getLogger("security")
 security_logger.addFilter(block_filter)
 
+class _WindowEntry:
+    """Per-key ring of request counts, one slot per bucket of the window."""
+    
+    __slots__ = ("last_slot", "total", "buckets")
+    
+    def __init__(self, slot: int, bucket_count: int):
+        self.last_slot = slot
+        self.total = 0
+        self.buckets = [0] * bucket_count
+
+
+class SlidingWindowCounter:
+    """
+    Bucketed sliding-window request counter.
+    
+    Each key owns a fixed ring of buckets covering the window, plus a running
+    total, so recording a request and reading the count are O(1). Buckets
+    that fall out of the window are zeroed lazily when the key is next seen.
+    Keys are kept in LRU order and the least recently seen key is evicted once
+    max_keys is reached, which bounds memory regardless of how many distinct
+    sources are seen.
+    """
+    
+    def __init__(self, window: float, bucket_count: int = 12, max_keys: int = 100000):
+        self.window = window
+        self.bucket_count = max(1, bucket_count)
+        self.bucket_span = window / self.bucket_count
+        self.max_keys = max(1, max_keys)
+        self.evictions = 0
+        self._entries: "OrderedDict[str, _WindowEntry]" = OrderedDict()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+    
+    def _advance(self, entry: _WindowEntry, slot: int) -> None:
+        """Zero the buckets between the entry's last slot and the current one."""
+        elapsed = slot - entry.last_slot
+        if elapsed <= 0:
+            return
+        
+        buckets = entry.buckets
+        if elapsed >= self.bucket_count:
+            # Whole window expired
+            for i in range(self.bucket_count):
+                buckets[i] = 0
+            entry.total = 0
+        else:
+            for s in range(entry.last_slot + 1, slot + 1):
+                index = s % self.bucket_count
+                entry.total -= buckets[index]
+                buckets[index] = 0
+        entry.last_slot = slot
+    
+    def hit(self, key: str, now: float) -> int:
+        """
+        Record one request for a key.
+        
+        Args:
+            key: Counter key (IP, endpoint, ...)
+            now: Current timestamp
+            
+        Returns:
+            int: Number of requests for the key within the window, including this one
+        """
+        slot = int(now / self.bucket_span)
+        entries = self._entries
+        entry = entries.get(key)
+        
+        if entry is None:
+            entry = _WindowEntry(slot, self.bucket_count)
+            entries[key] = entry
+            if len(entries) > self.max_keys:
+                entries.popitem(last=False)
+                self.evictions += 1
+        else:
+            entries.move_to_end(key)
+            self._advance(entry, slot)
+        
+        entry.buckets[slot % self.bucket_count] += 1
+        entry.total += 1
+        return entry.total
+    
+    def count(self, key: str, now: float) -> int:
+        """
+        Get the number of requests for a key within the window.
+        
+        Args:
+            key: Counter key
+            now: Current timestamp
+            
+        Returns:
+            int: Request count (0 for unknown keys)
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return 0
+        self._advance(entry, int(now / self.bucket_span))
+        return entry.total
+    
+    def expire_idle(self, now: float) -> int:
+        """
+        Drop keys with no requests inside the window.
+        
+        Keys are in least-recently-seen order, so only the idle prefix is
+        visited and the scan stops at the first active key.
+        
+        Args:
+            now: Current timestamp
+            
+        Returns:
+            int: Number of keys removed
+        """
+        oldest_live_slot = int(now / self.bucket_span) - self.bucket_count + 1
+        entries = self._entries
+        removed = 0
+        
+        while entries:
+            key, entry = next(iter(entries.items()))
+            if entry.last_slot >= oldest_live_slot:
+                break
+            del entries[key]
+            removed += 1
+        
+        return removed
+
+
 class RateLimiter:
     """
     Implements adaptive rate limiting for requests
@@ -114,9 +246,11 @@ class RateLimiter:
     
     def __init__(self, config: Config):
         self.config = config
-        self.ip_counters: Dict[str, deque] = defaultdict(lambda: deque(maxlen=1000))
-        self.endpoint_counters: Dict[str, deque] = defaultdict(lambda: deque(maxlen=1000))
-        self.global_counter: deque = deque(maxlen=10000)
+        window = config.mitigator.rate_window
+        buckets = config.mitigator.rate_buckets
+        self.ip_counters = SlidingWindowCounter(window, buckets, config.mitigator.max_tracked_ips)
+        self.endpoint_counters = SlidingWindowCounter(window, buckets, config.mitigator.max_tracked_endpoints)
+        self.global_counter = SlidingWindowCounter(window, buckets, 1)
         self.last_resource_check = 0
         self.current_threshold_multiplier = 1.0
         self.last_cleanup = time.time()
@@ -156,36 +290,16 @@ class RateLimiter:
             self.current_threshold_multiplier = 0.7
     
     def cleanup_old_records(self):
-        """Remove expired timestamps from counters."""
+        """Drop counters for IPs and endpoints that went idle for a full window."""
         current_time = time.time()
         if current_time - self.last_cleanup < self.config.mitigator.cleanup_interval:
             return
             
         self.last_cleanup = current_time
-        window = self.config.mitigator.rate_window
-        cutoff = current_time - window
-        
-        # Cleanup global counter
-        while self.global_counter and self.global_counter[0] < cutoff:
-            self.global_counter.popleft()
-        
-        # Cleanup IP counters
-        for ip in list(self.ip_counters.keys()):
-            while self.ip_counters[ip] and self.ip_counters[ip][0] < cutoff:
-                self.ip_counters[ip].popleft()
-            
-            # Remove empty counters
-            if not self.ip_counters[ip]:
-                del self.ip_counters[ip]
         
-        # Cleanup endpoint counters
-        for endpoint in list(self.endpoint_counters.keys()):
-            while self.endpoint_counters[endpoint] and self.endpoint_counters[endpoint][0] < cutoff:
-                self.endpoint_counters[endpoint].popleft()
-            
-            # Remove empty counters
-            if not self.endpoint_counters[endpoint]:
-                del self.endpoint_counters[endpoint]
+        # Only the idle prefix of each LRU is visited, never the whole table
+        self.ip_counters.expire_idle(current_time)
+        self.endpoint_counters.expire_idle(current_time)
     
     async def check_rate_limit(self, ip: str, endpoint: str) -> bool:
         """
@@ -200,10 +314,10 @@ class RateLimiter:
         """
         current_time = time.time()
         
-        # Add timestamp to counters
-        self.global_counter.append(current_time)
-        self.ip_counters[ip].append(current_time)
-        self.endpoint_counters[endpoint].append(current_time)
+        # Record the request and get current counts in one step
+        global_count = self.global_counter.hit("*", current_time)
+        ip_count = self.ip_counters.hit(ip, current_time)
+        endpoint_count = self.endpoint_counters.hit(endpoint, current_time)
         
         # Update thresholds and clean up periodically
         await self.update_thresholds()
@@ -219,15 +333,10 @@ class RateLimiter:
         if endpoint in self.config.mitigator.critical_endpoints:
             endpoint_limit = int(endpoint_limit * 0.7)  # 70% of normal limit
             
-        # Calculate current rates
-        global_count = len(self.global_counter)
-        ip_count = len(self.ip_counters[ip])
-        endpoint_count = len(self.endpoint_counters[endpoint])
-        
         # ----------------- IMPROVED LOGIC TO PREVENT FALSE POSITIVES -----------------
         
         # 1. Add progressive rate limiting - first warn, then enforce
-        is_localhost = ip == "127.0.0.1" or ip == "::1" or ip.startswith("192.168.") or ip.startswith("10.") or ip.startswith("172.")
+        is_localhost = ip_classifier.is_internal(ip)
         
         # 2. Check if it's a legitimate user based on previous successful interactions
         # We'll need to add tracking of successful responses somewhere else
@@ -745,65 +854,163 @@ class TrafficRedirector:
             await self.remove_redirect(ip)
 
 
+def _load_challenge_secret(config: Config) -> str:
+    """
+    Get the challenge signing secret shared by all workers.
+    
+    Uses mitigator.challenge_secret, then the DDOS_CHALLENGE_SECRET environment
+    variable, then a secret file in data_dir that the first worker creates.
+    The secret is written to a temp file and hard-linked into place, so the file
+    never exists half-written and concurrent workers agree on one value. Falls
+    back to a per-process secret if none of these is available.
+    """
+    if config.mitigator.challenge_secret:
+        return config.mitigator.challenge_secret
+    
+    env_secret = os.environ.get("DDOS_CHALLENGE_SECRET")
+    if env_secret:
+        return env_secret
+    
+    secret_path = os.path.join(config.data_dir, "challenge_secret")
+    try:
+        os.makedirs(config.data_dir, exist_ok=True)
+        if not os.path.exists(secret_path):
+            # mkstemp creates the file with mode 0600
+            fd, tmp_path = tempfile.mkstemp(dir=config.data_dir, prefix=".challenge_secret.")
+            try:
+                secret = os.urandom(32).hex()
+                with os.fdopen(fd, 'w') as f:
+                    f.write(secret)
+                    f.flush()
+                    os.fsync(f.fileno())
+                # link() fails if another worker got there first; theirs wins
+                os.link(tmp_path, secret_path)
+                logger.info(f"Generated challenge signing secret in {secret_path}")
+                return secret
+            except FileExistsError:
+                pass
+            finally:
+                os.unlink(tmp_path)
+        with open(secret_path, 'r') as f:
+            secret = f.read().strip()
+        if secret:
+            return secret
+        raise OSError(f"Challenge secret file {secret_path} is empty")
+    except OSError as e:
+        logger.warning(f"Could not load shared challenge secret ({e}); challenges will only verify in this process")
+        return os.urandom(32).hex()
+
+
 class ChallengeManager:
     """
     Manages client challenges for suspicious requests.
     Implements lightweight JavaScript challenges or CAPTCHA alternatives.
+    
+    Challenges are stateless: the token carries the IP, difficulty, expiry and
+    a keyed commitment to the expected answer, all signed with HMAC-SHA256, so
+    any worker sharing the secret can verify it after a restart. Local state is
+    limited to a bounded per-IP issue counter (difficulty escalation) and a
+    bounded cache of attempted/solved tokens (attempt limits and replay
+    protection).
     """
     
+    TOKEN_VERSION = "v2"
+    
     def __init__(self, config: Config):
         self.config = config
-        self.challenges: Dict[str, Dict[str, Any]] = {}
         self.last_cleanup = time.time()
-        self.secret_key = config.mitigator.challenge_secret or os.urandom(32).hex()
+        self.secret_key = _load_challenge_secret(config)
+        self._key = self.secret_key.encode('utf-8')
+        self.lock = threading.Lock()
+        
+        # Challenges issued per IP within the expiry window
+        self.issued = SlidingWindowCounter(
+            config.mitigator.challenge_expiry,
+            max_keys=config.mitigator.challenge_cache_size
+        )
+        
+        # nonce -> [expires, attempts, solved] for tokens seen by verify_challenge
+        self.seen_tokens: "OrderedDict[str, List]" = OrderedDict()
+        self.max_seen_tokens = config.mitigator.challenge_cache_size
+    
+    def _sign(self, message: str) -> str:
+        return hmac.new(self._key, message.encode('utf-8'), hashlib.sha256).hexdigest()
+    
+    def _commit(self, nonce: str, answer: str) -> str:
+        """Keyed commitment to the expected answer (the answer itself is not in the token)"""
+        return self._sign(f"answer|{nonce}|{answer}")[:32]
     
     def cleanup_expired(self):
-        """Remove expired challenges."""
+        """Remove expired entries from the token cache and idle IPs from the issue counter."""
         current_time = time.time()
         if current_time - self.last_cleanup < self.config.mitigator.cleanup_interval:
             return
             
         self.last_cleanup = current_time
-        expiry = self.config.mitigator.challenge_expiry
-        
-        # Find and remove expired entries
-        expired_tokens = [token for token, data in self.challenges.items() 
-                        if current_time - data["timestamp"] > expiry]
         
-        for token in expired_tokens:
-            del self.challenges[token]
+        with self.lock:
+            expired_tokens = [nonce for nonce, state in self.seen_tokens.items() if state[0] <= current_time]
+            for nonce in expired_tokens:
+                del self.seen_tokens[nonce]
+            self.issued.expire_idle(current_time)
             
         if expired_tokens:
             logger.debug(f"Removed {len(expired_tokens)} expired challenges")
     
-    def generate_token(self, ip: str, difficulty: int = 1) -> str:
+    def generate_token(self, ip: str, difficulty: int = 1, expected_answer: str = "") -> str:
         """
-        Generate a unique token for a challenge.
+        Generate a signed, self-contained challenge token.
         
         Args:
             ip: Client IP address
             difficulty: Challenge difficulty level (1-5)
+            expected_answer: Answer the token commits to
             
         Returns:
             str: Challenge token
         """
         timestamp = int(time.time())
-        random_part = os.urandom(8).hex()
+        expires = timestamp + self.config.mitigator.challenge_expiry
+        nonce = os.urandom(8).hex()
         
-        # Combine data into a base string
-        base = f"{ip}:{timestamp}:{random_part}:{difficulty}"
-        
-        # Create HMAC signature
-        signature = hmac.new(
-            self.secret_key.encode('utf-8'),
-            base.encode('utf-8'),
-            hashlib.sha256
-        ).hexdigest()
+        # Combine data into a base string ('|' does not occur in IPv4/IPv6 addresses)
+        base = "|".join((self.TOKEN_VERSION, ip, str(difficulty), str(timestamp), str(expires),
+                         nonce, self._commit(nonce, expected_answer)))
         
         # Combine into token
-        token = f"{base}:{signature}"
+        token = f"{base}|{self._sign(base)}"
         return base64.urlsafe_b64encode(token.encode('utf-8')).decode('utf-8')
     
+    def decode_token(self, token: str) -> Optional[Dict[str, Any]]:
+        """
+        Check a token's signature and expiry and return its claims.
+        
+        Returns:
+            Optional[Dict[str, Any]]: Token claims, or None if the token is malformed, forged or expired
+        """
+        try:
+            decoded = base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8')
+            base, signature = decoded.rsplit("|", 1)
+            version, ip, difficulty, timestamp, expires, nonce, commitment = base.split("|")
+        except (ValueError, UnicodeError, binascii.Error):
+            return None
+        
+        if version != self.TOKEN_VERSION or not hmac.compare_digest(signature, self._sign(base)):
+            return None
+        
+        expires = int(expires)
+        if expires <= time.time():
+            return None
+        
+        return {
+            "ip": ip,
+            "difficulty": int(difficulty),
+            "timestamp": int(timestamp),
+            "expires": expires,
+            "nonce": nonce,
+            "commitment": commitment
+        }
+    
     def create_challenge(self, ip: str, user_agent: str) -> Dict[str, Any]:
         """
         Create a new challenge for a client.
@@ -819,31 +1026,18 @@ class ChallengeManager:
         
         # Determine challenge difficulty based on client behavior
         # More suspicious clients get harder challenges
-        difficulty = 1
-        if ip in self.challenges:
-            # Increase difficulty for repeated challenges
-            previous_challenges = sum(1 for c in self.challenges.values() if c["ip"] == ip)
-            difficulty = min(5, 1 + previous_challenges // 2)
+        with self.lock:
+            issued = self.issued.hit(ip, time.time())
         
-        # Generate token
-        token = self.generate_token(ip, difficulty)
+        # Increase difficulty for repeated challenges
+        previous_challenges = issued - 1
+        difficulty = min(5, 1 + previous_challenges // 2)
         
         # Generate JavaScript challenge
         js_challenge, expected_answer = generate_challenge(difficulty)
         
-        # Store challenge data
-        challenge_data = {
-            "ip": ip,
-            "token": token,
-            "difficulty": difficulty,
-            "timestamp": time.time(),
-            "expected_answer": expected_answer,
-            "solved": False,
-            "attempts": 0,
-            "user_agent": user_agent
-        }
-        
-        self.challenges[token] = challenge_data
+        # Generate token
+        token = self.generate_token(ip, difficulty, expected_answer)
         
         # Return data needed for client challenge
         return {
@@ -853,42 +1047,58 @@ class ChallengeManager:
             "expires_in": self.config.mitigator.challenge_expiry
         }
     
-    def verify_challenge(self, token: str, answer: str) -> bool:
+    def verify_challenge(self, token: str, answer: str, ip: Optional[str] = None) -> bool:
         """
         Verify a challenge response.
         
         Args:
             token: Challenge token
             answer: Client's answer to the challenge
+            ip: Client IP address (the token must have been issued to it when given)
             
         Returns:
             bool: True if challenge is solved correctly, False otherwise
         """
         self.cleanup_expired()
         
-        # Check if token exists
-        if token not in self.challenges:
+        claims = self.decode_token(token)
+        if claims is None:
             logger.warning(f"Challenge verification attempt with invalid token: {token}")
             return False
         
-        challenge = self.challenges[token]
-        challenge["attempts"] += 1
-        
-        # Check if already solved
-        if challenge["solved"]:
-            return True
-        
-        # Check if too many attempts
-        if challenge["attempts"] > self.config.mitigator.max_challenge_attempts:
-            logger.warning(f"Too many challenge attempts for token {token} from IP {challenge['ip']}")
+        if ip is not None and ip != claims["ip"]:
+            logger.warning(f"Challenge token issued to {claims['ip']} presented by IP {ip}")
             return False
         
-        # Verify the answer
-        is_correct = verify_challenge_response(answer, challenge["expected_answer"])
+        nonce = claims["nonce"]
+        with self.lock:
+            state = self.seen_tokens.get(nonce)
+            if state is None:
+                state = [claims["expires"], 0, False]
+                self.seen_tokens[nonce] = state
+                while len(self.seen_tokens) > self.max_seen_tokens:
+                    self.seen_tokens.popitem(last=False)
+            
+            # A solved token cannot be replayed
+            if state[2]:
+                logger.warning(f"Replayed challenge token from IP {claims['ip']}")
+                return False
+            
+            state[1] += 1
+            
+            # Check if too many attempts
+            if state[1] > self.config.mitigator.max_challenge_attempts:
+                logger.warning(f"Too many challenge attempts for token {token} from IP {claims['ip']}")
+                return False
+            
+            # Verify the answer against the token's commitment
+            is_correct = answer is not None and hmac.compare_digest(self._commit(nonce, str(answer)), claims["commitment"])
+            
+            if is_correct:
+                state[2] = True
         
         if is_correct:
-            challenge["solved"] = True
-            logger.info(f"Challenge solved successfully by IP {challenge['ip']}")
+            logger.info(f"Challenge solved successfully by IP {claims['ip']}")
         
         return is_correct
     
@@ -902,7 +1112,12 @@ class ChallengeManager:
         Returns:
             bool: True if challenge is solved, False otherwise
         """
-        return token in self.challenges and self.challenges[token]["solved"]
+        claims = self.decode_token(token)
+        if claims is None:
+            return False
+        with self.lock:
+            state = self.seen_tokens.get(claims["nonce"])
+            return state is not None and state[2]
 
 
 class AttackMitigator:
@@ -933,12 +1148,20 @@ class AttackMitigator:
         # Use the optimized ban manager for faster IP ban operations
         self.ban_manager = ban_manager
         
+        # Shared compiled classifier for trusted/banned/internal membership
+        self.ip_classifier = ip_classifier
+        self._classifier_built_at = 0.0
+        # Exact-IP ban entries at the last build; their BANNED bit is confirmed against
+        # storage, since unbans through ban_manager do not touch the classifier
+        self._banned_entries: frozenset = frozenset()
+        self._next_ban_expiry = float('inf')
+        
         # Initialize required components - fix for 'object has no attribute' errors
-        self.rate_limiter = RateLimiter(config)
-        self.circuit_breaker = CircuitBreaker(config)
-        self.tarpitter = Tarpitter(config)
-        self.challenge_manager = ChallengeManager(config)
-        self.traffic_redirector = TrafficRedirector(config)
+        self.rate_limiter = RateLimiter(self.config)
+        self.circuit_breaker = CircuitBreaker(self.config)
+        self.tarpitter = Tarpitter(self.config)
+        self.challenge_manager = ChallengeManager(self.config)
+        self.traffic_redirector = TrafficRedirector(self.config)
         
         # Store start time for uptime calculation
         self.start_time = time.time()
@@ -979,6 +1202,31 @@ class AttackMitigator:
             logger.info(f"Preloaded {count} banned IPs and {trusted_count} trusted IPs into memory cache")
         except Exception as e:
             logger.error(f"Failed to preload IPs into cache: {e}")
+        
+        self._rebuild_ip_classifier()
+    
+    def _rebuild_ip_classifier(self) -> None:
+        """Recompile trusted/banned lists into the shared IP classifier."""
+        # Clear before reading the lists so changes made during the build re-mark it
+        self.ip_classifier.dirty = False
+        try:
+            banned = list(self.banned_ips.keys())
+            expiries = {}
+            for entry in banned:
+                ban_info = self.banned_ips.get(entry)
+                if isinstance(ban_info, dict) and ban_info.get('expires_at') is not None:
+                    expiries[entry] = ban_info['expires_at']
+            
+            self.ip_classifier.rebuild(
+                trusted=self.trusted_ips.keys(),
+                banned=banned
+            )
+            self._banned_entries = frozenset(banned)
+            self._next_ban_expiry = min(expiries.values(), default=float('inf'))
+            self._classifier_built_at = time.time()
+        except Exception as e:
+            self.ip_classifier.mark_dirty()
+            logger.error(f"Failed to rebuild IP classifier: {e}")
     
     def _handle_task_done(self, task):
         """Handle task completion callback to prevent pending task destruction errors."""
@@ -1005,6 +1253,16 @@ class AttackMitigator:
                     if storage:
                         storage.maybe_cleanup()
                 
+                # Pick up new bans/trusts and drop expired bans from the classifier.
+                # Compiling large lists is CPU-bound, so keep it off the event loop.
+                now = time.time()
+                refresh_due = (now - self._classifier_built_at
+                               >= self.config.mitigator.classifier_refresh_interval
+                               or now >= self._next_ban_expiry)
+                if self.ip_classifier.dirty or refresh_due:
+                    loop = asyncio.get_event_loop()
+                    await loop.run_in_executor(None, self._rebuild_ip_classifier)
+                
                 # Clean up rate limiter
                 self.rate_limiter.cleanup_old_records()
                 
@@ -1067,9 +1325,15 @@ class AttackMitigator:
             # If import fails, fall back to normal checking
             pass
             
-        # Check if in loopback/internal networks for fast allowlist
-        is_internal = ip == "127.0.0.1" or ip == "::1" or ip.startswith("192.168.") or ip.startswith("10.") or ip.startswith("172.")
-        if is_internal:
+        # Single compiled lookup for banned/trusted/internal network membership
+        ip_flags = self.ip_classifier.classify(ip)
+        if ip_flags & BANNED:
+            # Network bans are only lifted through storage and picked up on rebuild;
+            # an exact-IP ban may have been lifted or expired since the last build
+            if ip not in self._banned_entries or self._is_banned(ip):
+                return False, None
+            self.ip_classifier.mark_dirty()
+        if ip_flags & (TRUSTED | INTERNAL):
             return True, None
         
         # Check banned IPs first for speed - use database lookup as fallback
@@ -1266,6 +1530,7 @@ class AttackMitigator:
         """
         # Use the more efficient ban manager
         self.ban_manager.ban_ip(ip, reason, duration)
+        self.ip_classifier.mark_dirty()
         
         # Log appropriate message based on ban type
         if duration is not None:
@@ -1293,6 +1558,7 @@ class AttackMitigator:
         """
         # Use the more efficient ban manager for immediate ban
         self.ban_manager.ban_ip(ip, reason, None)
+        self.ip_classifier.mark_dirty()
         logger.warning(f"PERMANENT IMMEDIATE ban for IP {ip}: {reason}")
         
         # System-level firewall block in a separate task
@@ -1560,6 +1826,9 @@ class AttackMitigator:
         if result:
             logger.info(f"Unbanned IP address: {ip}")
             
+            # Removals must take effect immediately, so rebuild now
+            self._rebuild_ip_classifier()
+            
             # Try to remove system firewall rules
             try:
                 asyncio.create_task(self._remove_system_firewall_block(ip))
@@ -1609,6 +1878,7 @@ class AttackMitigator:
         
         # Store trusted IP in persistent storage
         self.trusted_ips.set(ip, trust_data)
+        self.ip_classifier.mark_dirty()
         logger.info(f"Added trusted IP: {ip}")
     
     async def remove_trusted_ip(self, ip: str) -> bool:
@@ -1624,6 +1894,7 @@ class AttackMitigator:
         if self._is_trusted(ip):
             # Remove IP from trusted list
             self.trusted_ips.delete(ip)
+            self._rebuild_ip_classifier()
             logger.info(f"Removed trusted IP: {ip}")
             return True
         
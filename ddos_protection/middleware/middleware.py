@@ -209,7 +209,7 @@ class DDoSMiddleware:
             try:
                 # Verify the challenge
                 challenge_manager = self.ddos_system.mitigator.challenge_manager
-                is_valid = challenge_manager.verify_challenge(token, answer)
+                is_valid = challenge_manager.verify_challenge(token, answer, ip=client_ip)
                 
                 if is_valid:
                     # Challenge solved - whitelist the IP temporarily
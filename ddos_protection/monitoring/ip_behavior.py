@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+DDoS Protection System - IP Behavior Store
+------------------------------------------
+Bounded per-IP request pattern records for MonitorSystem.
+
+IPs are spread over lock-striped shards so worker threads only contend when
+they hash to the same shard. Each record is a compact __slots__ object with a
+fixed ring of recent request intervals and a capped array of path hashes (only
+the number of distinct paths is ever needed, so path strings are not kept
+alive). Every shard
+keeps its IPs in last-seen order, so idle IPs are expired from the front (TTL)
+and the least recently seen IP is evicted when the shard exceeds its share of
+the IP limit or of the memory budget.
+"""
+
+import sys
+import time
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Any
+
+# Approximate cost of one dict slot (hash + key + value pointers, amortised over resizes)
+_SLOT_BYTES = 24
+# Bytes per path hash in a record's path array
+_PATH_BYTES = array('q').itemsize
+
+
+class IPBehavior:
+    """Request pattern of one IP"""
+
+    __slots__ = ('first_seen', 'last_seen', 'request_count', 'total_size', 'methods', 'paths',
+                 'intervals', 'interval_index', 'interval_count', 'nbytes')
+
+    def __init__(self, now: float):
+        self.first_seen = now
+        self.last_seen = now
+        self.request_count = 0
+        self.total_size = 0
+        self.methods = {}
+        self.paths = array('q')
+        self.intervals = None  # allocated on the second request
+        self.interval_index = 0
+        self.interval_count = 0
+        self.nbytes = 0
+
+    @property
+    def unique_paths(self) -> int:
+        """Number of distinct paths seen (capped by the store's max_paths)"""
+        return len(self.paths)
+
+    def add_interval(self, interval: float, window: int):
+        """Store an interval in the ring, overwriting the oldest one when full"""
+        if self.intervals is None:
+            self.intervals = array('d', [0.0]) * window
+        self.intervals[self.interval_index] = interval
+        self.interval_index = (self.interval_index + 1) % window
+        if self.interval_count < window:
+            self.interval_count += 1
+
+    def recent_intervals(self) -> List[float]:
+        """Get the stored intervals (order is irrelevant for mean/variance)"""
+        if self.intervals is None:
+            return []
+        return self.intervals[:self.interval_count].tolist()
+
+
+def _record_bytes(interval_window: int) -> int:
+    """Approximate size of a record with one path and one method, including its key and LRU slot"""
+    record = IPBehavior(0.0)
+    record.paths.append(0)
+    record.methods['GET'] = 0
+    return (sys.getsizeof(record) + sys.getsizeof(record.paths) + sys.getsizeof(record.methods)
+            + sys.getsizeof(array('d', [0.0]) * interval_window) + sys.getsizeof('255.255.255.255')
+            + 4 * _SLOT_BYTES)
+
+
+class _Shard:
+    """One lock stripe: its IPs in last-seen order and their approximate size"""
+
+    __slots__ = ('lock', 'records', 'nbytes')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = OrderedDict()
+        self.nbytes = 0
+
+
+class IPBehaviorStore:
+    """Sharded, bounded store of IPBehavior records"""
+
+    def __init__(self, shards: int = 64, max_ips: int = 100000, idle_ttl: float = 600,
+                 max_paths: int = 32, max_methods: int = 8, interval_window: int = 10,
+                 memory_budget_bytes: Optional[int] = None):
+        """
+        Args:
+            shards: Number of lock stripes
+            max_ips: Tracked IPs before least recently seen ones are evicted
+            idle_ttl: Seconds without requests after which an IP is dropped
+            max_paths: Distinct paths counted per IP
+            max_methods: Distinct HTTP methods counted per IP
+            interval_window: Request intervals kept per IP
+            memory_budget_bytes: Approximate memory limit for all records (None for no limit)
+        """
+        self.idle_ttl = idle_ttl
+        self.max_paths = max_paths
+        self.max_methods = max_methods
+        self.interval_window = interval_window
+        self.record_bytes = _record_bytes(interval_window)
+        self.max_ips_per_shard = max(1, max_ips // shards)
+        self.max_bytes_per_shard = max(1, memory_budget_bytes // shards) if memory_budget_bytes else None
+        self._shards = [_Shard() for _ in range(shards)]
+        self._shard_count = shards
+        self.evictions = 0
+        self.expirations = 0
+
+    def _shard(self, ip: str) -> _Shard:
+        return self._shards[hash(ip) % self._shard_count]
+
+    def _remove_front(self, shard: _Shard):
+        _, record = shard.records.popitem(last=False)
+        shard.nbytes -= record.nbytes
+
+    def _evict(self, shard: _Shard, now: float):
+        """Drop idle IPs, then least recently seen ones while the shard is over its limits"""
+        records = shard.records
+        cutoff = now - self.idle_ttl
+        while records and next(iter(records.values())).last_seen < cutoff:
+            self._remove_front(shard)
+            self.expirations += 1
+        # The IP that was just recorded is at the end and is never evicted here
+        while len(records) > 1 and (len(records) > self.max_ips_per_shard or
+                                    (self.max_bytes_per_shard and shard.nbytes > self.max_bytes_per_shard)):
+            self._remove_front(shard)
+            self.evictions += 1
+
+    def record(self, ip: str, path: str, request_size: int = 0, method: Optional[str] = None,
+               now: Optional[float] = None):
+        """Record one request from ip"""
+        if now is None:
+            now = time.time()
+        shard = self._shards[hash(ip) % self._shard_count]
+
+        with shard.lock:
+            record = shard.records.get(ip)
+            if record is None:
+                record = IPBehavior(now)
+                record.nbytes = self.record_bytes
+                shard.records[ip] = record
+                shard.nbytes += record.nbytes
+            else:
+                record.add_interval(now - record.last_seen, self.interval_window)
+                shard.records.move_to_end(ip)
+
+            record.last_seen = now
+            record.request_count += 1
+            record.total_size += request_size
+
+            if method:
+                methods = record.methods
+                if method in methods:
+                    methods[method] += 1
+                elif len(methods) < self.max_methods:
+                    methods[method] = 1
+                    if len(methods) > 1:
+                        record.nbytes += _SLOT_BYTES
+                        shard.nbytes += _SLOT_BYTES
+
+            # A linear scan of at most max_paths integers, done in C by array.__contains__
+            paths = record.paths
+            path_hash = hash(path)
+            if len(paths) < self.max_paths and path_hash not in paths:
+                paths.append(path_hash)
+                if len(paths) > 1:
+                    record.nbytes += _PATH_BYTES
+                    shard.nbytes += _PATH_BYTES
+
+            if record.request_count == 1:
+                self._evict(shard, now)
+
+    def inspect(self, ip: str, func: Callable[..., Any], *args) -> Any:
+        """
+        Call func(record, *args) while holding the IP's shard lock.
+
+        Returns:
+            The result of func, or None if the IP is not tracked
+        """
+        shard = self._shards[hash(ip) % self._shard_count]
+        with shard.lock:
+            record = shard.records.get(ip)
+            if record is None:
+                return None
+            return func(record, *args)
+
+    def expire_idle(self, now: Optional[float] = None) -> int:
+        """Drop IPs idle for longer than idle_ttl; returns how many were dropped"""
+        if now is None:
+            now = time.time()
+        cutoff = now - self.idle_ttl
+        removed = 0
+        for shard in self._shards:
+            with shard.lock:
+                # Records are kept in last-seen order, so idle ones are at the front
+                while shard.records and next(iter(shard.records.values())).last_seen < cutoff:
+                    self._remove_front(shard)
+                    removed += 1
+        self.expirations += removed
+        return removed
+
+    def get_metrics(self) -> Dict:
+        """Get store size and eviction metrics"""
+        return {
+            'tracked_ips': len(self),
+            'approx_bytes': sum(shard.nbytes for shard in self._shards),
+            'memory_budget_bytes': self.max_bytes_per_shard * len(self._shards) if self.max_bytes_per_shard else None,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'shards': len(self._shards)
+        }
+
+    def __contains__(self, ip: str) -> bool:
+        shard = self._shard(ip)
+        with shard.lock:
+            return ip in shard.records
+
+    def __len__(self) -> int:
+        return sum(len(shard.records) for shard in self._shards)
@@ -15,6 +15,7 @@ from typing import Dict, Set, List, Optional, Tuple
 
 # Import utility for IP validation
 from ddos_protection.utils import is_valid_ip
+from ddos_protection.monitoring.ip_behavior import IPBehaviorStore
 
 # Setup logger
 logger = logging.getLogger('ddos_protection.monitoring')
@@ -25,7 +26,7 @@ class MonitorSystem:
     malicious IPs and devices at both application and network levels.
     """
     
-    def __init__(self, storage_manager=None, ban_manager=None, device_manager=None):
+    def __init__(self, storage_manager=None, ban_manager=None, device_manager=None, config=None):
         """
         Initialize the monitoring system with required components.
         
@@ -33,7 +34,13 @@ class MonitorSystem:
             storage_manager: Storage manager for persistent data
             ban_manager: Ban manager for handling IP bans
             device_manager: Device manager for handling device bans
+            config: MonitorConfig (uses the default configuration if not provided)
         """
+        if config is None:
+            from ddos_protection.config import default_config
+            config = default_config.monitor
+        self.config = config
+        
         # Import required components if not provided
         if storage_manager is None:
             from ddos_protection.storage import storage_manager
@@ -57,14 +64,21 @@ class MonitorSystem:
             self.banned_ips_cache = set()
             self.banned_devices_cache = set()
         
-        # Lock for thread safety
+        # Lock for thread safety (statistics only; IP patterns use the store's lock stripes)
         self.lock = threading.RLock()
         
         # Track last time IP rate limits were checked
         self.last_ip_check = {}
         
         # Track IP request patterns
-        self.ip_patterns = {}
+        self.ip_patterns = IPBehaviorStore(
+            shards=config.behavior_shards,
+            max_ips=config.max_tracked_ips,
+            idle_ttl=config.idle_ip_ttl,
+            max_paths=config.max_paths_per_ip,
+            interval_window=config.interval_window,
+            memory_budget_bytes=int(config.behavior_memory_budget_mb * 1024 * 1024) or None
+        )
         
         # Counters for statistics and reporting
         self.stats = {
@@ -273,44 +287,7 @@ class MonitorSystem:
     
     def _update_request_pattern(self, ip: str, path: str, request_size: int, method: Optional[str] = None):
         """Update tracking data for IP request patterns"""
-        with self.lock:
-            current_time = time.time()
-            
-            if ip not in self.ip_patterns:
-                self.ip_patterns[ip] = {
-                    'first_seen': current_time,
-                    'last_seen': current_time,
-                    'request_count': 1,
-                    'paths': {path: 1},
-                    'methods': {method: 1} if method else {},
-                    'total_size': request_size,
-                    'intervals': []
-                }
-            else:
-                pattern = self.ip_patterns[ip]
-                
-                # Calculate time since last request
-                if 'last_seen' in pattern:
-                    interval = current_time - pattern['last_seen']
-                    pattern['intervals'].append(interval)
-                    # Keep only last 10 intervals
-                    if len(pattern['intervals']) > 10:
-                        pattern['intervals'] = pattern['intervals'][-10:]
-                
-                # Update counters
-                pattern['last_seen'] = current_time
-                pattern['request_count'] = pattern.get('request_count', 0) + 1
-                
-                # Track HTTP methods
-                if method:
-                    if 'methods' not in pattern:
-                        pattern['methods'] = {}
-                    pattern['methods'][method] = pattern['methods'].get(method, 0) + 1
-                
-                # Update path stats
-                if 'paths' not in pattern:
-                    pattern['paths'] = {}
-                pattern['paths'][path] = pattern['paths'].get(path, 0) + 1
+        self.ip_patterns.record(ip, path, request_size, method)
     
     def _check_rate_limits(self, ip: str, device_fingerprint: Optional[str] = None, method: Optional[str] = None) -> bool:
         """
@@ -324,88 +301,95 @@ class MonitorSystem:
         Returns:
             bool: True if request should be blocked, False if allowed
         """
-        with self.lock:
-            current_time = time.time()
-            
-            # Check if IP pattern data exists
-            if ip not in self.ip_patterns:
-                return False
-            
-            pattern = self.ip_patterns[ip]
-            duration = current_time - pattern['first_seen']
-            
-            # Calculate request rate (requests per second)
-            if duration > 0:
-                request_rate = pattern['request_count'] / duration
-            else:
-                request_rate = pattern['request_count']  # Avoid division by zero
-            
-            # Check if method is POST and apply stricter limits
-            if method == 'POST' and 'methods' in pattern and 'POST' in pattern['methods']:
-                post_count = pattern['methods']['POST']
-                
-                # More than 5 POST requests in under 5 seconds is suspicious
-                if post_count >= 5 and duration < 5:
-                    logger.warning(f"Rate limit exceeded for POST requests: {ip} - {post_count} POST requests in {duration:.2f}s")
-                    self._ban_for_rate_limit(ip, f"Excessive POST requests: {post_count} in {duration:.2f}s")
-                    return True
-                
-                # POST should be less than 30% of all requests for normal browsing
-                if post_count > 3 and (post_count / pattern['request_count']) > 0.3:
-                    logger.warning(f"Abnormal POST ratio: {ip} - {post_count}/{pattern['request_count']} requests are POST")
-                    self._ban_for_rate_limit(ip, f"Abnormal POST ratio: {post_count}/{pattern['request_count']} requests are POST")
-                    return True
-            
-            # Standard rate limits
-            
-            # Check interval variance for bot detection
-            if len(pattern.get('intervals', [])) >= 5:
-                # Calculate standard deviation of request intervals
-                mean_interval = sum(pattern['intervals']) / len(pattern['intervals'])
-                variance = sum((x - mean_interval) ** 2 for x in pattern['intervals']) / len(pattern['intervals'])
-                std_dev = variance ** 0.5
-                
-                # Very low standard deviation indicates bot-like behavior
-                # Real humans have more variable intervals between requests
-                if mean_interval < 1.0 and std_dev < 0.1 and pattern['request_count'] > 10:
-                    logger.warning(f"Bot-like behavior detected: {ip} - Consistent intervals between requests")
-                    self._ban_for_rate_limit(ip, "Bot-like behavior: Too consistent request timing")
-                    return True
+        # The pattern is evaluated under its shard lock; the ban itself runs after the lock is released
+        violation = self.ip_patterns.inspect(ip, self._find_rate_limit_violation, ip, method, time.time())
+        if violation is None:
+            return False
+        
+        message, reason = violation
+        logger.warning(message)
+        self._ban_for_rate_limit(ip, reason)
+        return True
+    
+    def _find_rate_limit_violation(self, pattern, ip: str, method: Optional[str],
+                                   current_time: float) -> Optional[Tuple[str, str]]:
+        """
+        Evaluate the rate limits against an IP's request pattern.
+        
+        Returns:
+            Optional[Tuple[str, str]]: (log message, ban reason) or None if within limits
+        """
+        duration = current_time - pattern.first_seen
+        request_count = pattern.request_count
+        
+        # Calculate request rate (requests per second)
+        if duration > 0:
+            request_rate = request_count / duration
+        else:
+            request_rate = request_count  # Avoid division by zero
+        
+        # Check if method is POST and apply stricter limits
+        if method == 'POST' and 'POST' in pattern.methods:
+            post_count = pattern.methods['POST']
             
-            # General rate limits - allow burst for small numbers of requests
-            # but be strict after they've made many requests
-            if pattern['request_count'] <= 10:
-                # Allow higher rates for initial requests
-                if request_rate > 10:  # More than 10 requests per second
-                    logger.warning(f"High initial request rate: {ip} - {request_rate:.2f} req/s")
-                    self._ban_for_rate_limit(ip, f"High initial request rate: {request_rate:.2f} req/s")
-                    return True
-            elif pattern['request_count'] <= 50:
-                # Medium strict for established sessions
-                if request_rate > 5:  # More than 5 requests per second
-                    logger.warning(f"High sustained request rate: {ip} - {request_rate:.2f} req/s")
-                    self._ban_for_rate_limit(ip, f"High sustained request rate: {request_rate:.2f} req/s")
-                    return True
-            else:
-                # Very strict for long sessions
-                if request_rate > 2:  # More than 2 requests per second over a long period
-                    logger.warning(f"Excessive long-term request rate: {ip} - {request_rate:.2f} req/s")
-                    self._ban_for_rate_limit(ip, f"Excessive long-term request rate: {request_rate:.2f} req/s")
-                    return True
+            # More than 5 POST requests in under 5 seconds is suspicious
+            if post_count >= 5 and duration < 5:
+                return (f"Rate limit exceeded for POST requests: {ip} - {post_count} POST requests in {duration:.2f}s",
+                        f"Excessive POST requests: {post_count} in {duration:.2f}s")
             
-            # Check path diversity - normal users don't access many different URLs quickly
-            if len(pattern['paths']) > 15 and duration < 10:
-                logger.warning(f"Suspicious path scanning: {ip} - {len(pattern['paths'])} paths in {duration:.2f}s")
-                self._ban_for_rate_limit(ip, f"Path scanning: {len(pattern['paths'])} paths in {duration:.2f}s")
-                return True
+            # POST should be less than 30% of all requests for normal browsing
+            if post_count > 3 and (post_count / request_count) > 0.3:
+                return (f"Abnormal POST ratio: {ip} - {post_count}/{request_count} requests are POST",
+                        f"Abnormal POST ratio: {post_count}/{request_count} requests are POST")
+        
+        # Standard rate limits
+        
+        # Check interval variance for bot detection
+        if pattern.interval_count >= 5:
+            # Calculate standard deviation of request intervals
+            intervals = pattern.recent_intervals()
+            mean_interval = sum(intervals) / len(intervals)
+            variance = sum((x - mean_interval) ** 2 for x in intervals) / len(intervals)
+            std_dev = variance ** 0.5
             
-            # Check method diversity - normal users don't use many different HTTP methods
-            if 'methods' in pattern and len(pattern['methods']) >= 4 and duration < 30:
-                logger.warning(f"Suspicious method usage: {ip} - {len(pattern['methods'])} methods in {duration:.2f}s")
-                self._ban_for_rate_limit(ip, f"Unusual method usage: {len(pattern['methods'])} methods in {duration:.2f}s")
-                return True
+            # Very low standard deviation indicates bot-like behavior
+            # Real humans have more variable intervals between requests
+            if mean_interval < 1.0 and std_dev < 0.1 and request_count > 10:
+                return (f"Bot-like behavior detected: {ip} - Consistent intervals between requests",
+                        "Bot-like behavior: Too consistent request timing")
         
-        return False
+        # General rate limits - allow burst for small numbers of requests
+        # but be strict after they've made many requests
+        if request_count <= 10:
+            # Allow higher rates for initial requests
+            if request_rate > 10:  # More than 10 requests per second
+                return (f"High initial request rate: {ip} - {request_rate:.2f} req/s",
+                        f"High initial request rate: {request_rate:.2f} req/s")
+        elif request_count <= 50:
+            # Medium strict for established sessions
+            if request_rate > 5:  # More than 5 requests per second
+                return (f"High sustained request rate: {ip} - {request_rate:.2f} req/s",
+                        f"High sustained request rate: {request_rate:.2f} req/s")
+        else:
+            # Very strict for long sessions
+            if request_rate > 2:  # More than 2 requests per second over a long period
+                return (f"Excessive long-term request rate: {ip} - {request_rate:.2f} req/s",
+                        f"Excessive long-term request rate: {request_rate:.2f} req/s")
+        
+        # Check path diversity - normal users don't access many different URLs quickly
+        # (paths are capped per IP, the cap is well above this threshold)
+        path_count = pattern.unique_paths
+        if path_count > 15 and duration < 10:
+            return (f"Suspicious path scanning: {ip} - {path_count} paths in {duration:.2f}s",
+                    f"Path scanning: {path_count} paths in {duration:.2f}s")
+        
+        # Check method diversity - normal users don't use many different HTTP methods
+        method_count = len(pattern.methods)
+        if method_count >= 4 and duration < 30:
+            return (f"Suspicious method usage: {ip} - {method_count} methods in {duration:.2f}s",
+                    f"Unusual method usage: {method_count} methods in {duration:.2f}s")
+        
+        return None
     
     def _ban_for_rate_limit(self, ip: str, reason: str):
         """Ban an IP for exceeding rate limits"""
@@ -423,8 +407,9 @@ class MonitorSystem:
             self._apply_firewall_block(ip)
             
             # Update stats
-            self.stats['rate_limited'] = self.stats.get('rate_limited', 0) + 1
-            self.stats['blocked_ips'] += 1
+            with self.lock:
+                self.stats['rate_limited'] = self.stats.get('rate_limited', 0) + 1
+                self.stats['blocked_ips'] += 1
             
             logger.warning(f"Banned IP {ip} for rate limiting: {reason}")
         except Exception as e:
@@ -433,7 +418,13 @@ class MonitorSystem:
     def get_stats(self) -> Dict:
         """Get monitoring statistics"""
         with self.lock:
-            return self.stats.copy()
+            stats = self.stats.copy()
+        stats['ip_behavior'] = self.ip_patterns.get_metrics()
+        return stats
+    
+    def expire_idle_ips(self) -> int:
+        """Drop request patterns of IPs idle for longer than the configured TTL"""
+        return self.ip_patterns.expire_idle()
     
     def reset_stats(self):
         """Reset monitoring statistics"""
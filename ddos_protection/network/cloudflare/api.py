@@ -12,9 +12,11 @@ Features:
 - List currently blocked IPs
 - Retrieve analytics data
 - Support for firewall rules
+- Bulk bans through a managed IP List (see ban_pipeline)
 """
 
 import os
+import re
 import time
 import json
 import logging
@@ -27,10 +29,14 @@ import aiohttp
 import threading
 from datetime import datetime, timedelta
 
+from .ban_pipeline import BulkBanPipeline
+
 # Configure environment variables
 CF_API_EMAIL = os.environ.get('CF_API_EMAIL', '')
 CF_API_KEY = os.environ.get('CF_API_KEY', '')
 CF_ZONE_ID = os.environ.get('CF_ZONE_ID', '')
+# Account that owns the managed IP List; bans go through bulk list operations when set
+CF_ACCOUNT_ID = os.environ.get('CF_ACCOUNT_ID', '')
 
 # Check if we're in development mode
 CF_DEV_MODE = os.environ.get('CF_DEV_MODE', 'false').lower() == 'true'
@@ -41,10 +47,62 @@ logger = logging.getLogger('ddos_protection.cloudflare.api')
 # Fast lookup cache to minimize API calls
 blocked_ips_cache: Set[str] = set()
 
+# Cloudflare allows 1200 API requests per 5 minutes per user; stay below it
+DEFAULT_MAX_REQUESTS = 1000
+DEFAULT_RESET_INTERVAL = 300
+DEFAULT_BURST = 100
+
+# Matches the source IP of rules created by block_ip ("(ip.src eq <ip>)")
+_RULE_IP_PATTERN = re.compile(r'ip\.src eq ([0-9A-Fa-f:.]+)')
+
+
+class AsyncTokenBucket:
+    """
+    Async token bucket for API calls.
+    
+    Tokens refill continuously at `rate` per second up to `capacity`. A caller
+    without a token sleeps until one is due; no lock is held while waiting.
+    All calls are made from the client's own event loop.
+    """
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.waits = 0
+    
+    async def acquire(self):
+        """Wait for and take one token."""
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            self.waits += 1
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
 class CloudflareAPIClient:
-    """Cloudflare API client for DDoS protection."""
+    """
+    Cloudflare API client for DDoS protection.
+    
+    All HTTP traffic goes through one pooled aiohttp session that lives on a
+    background event loop owned by the client, so callers using short-lived
+    loops (run_until_complete, asyncio.run) still reuse connections. Block
+    rules are tracked in a local ip -> rule_id index that is updated on every
+    block/unblock and fully re-listed only when older than rule_index_ttl.
     
-    def __init__(self, email=CF_API_EMAIL, api_key=CF_API_KEY, zone_id=CF_ZONE_ID):
+    When an account ID is configured, bans are queued to a BulkBanPipeline that
+    adds them to one managed IP List in batches instead of creating a rule per IP.
+    """
+    
+    def __init__(self, email=CF_API_EMAIL, api_key=CF_API_KEY, zone_id=CF_ZONE_ID,
+                 max_requests=DEFAULT_MAX_REQUESTS, reset_interval=DEFAULT_RESET_INTERVAL,
+                 burst=DEFAULT_BURST, max_connections=20, rule_index_ttl=600,
+                 account_id=CF_ACCOUNT_ID):
         """
         Initialize Cloudflare API client.
         
@@ -52,10 +110,17 @@ class CloudflareAPIClient:
             email: Cloudflare account email
             api_key: Cloudflare API key
             zone_id: Cloudflare zone ID
+            max_requests: Maximum API requests per reset_interval
+            reset_interval: Rate limit period in seconds
+            burst: Requests that may be sent back to back before throttling
+            max_connections: Size of the HTTP connection pool
+            rule_index_ttl: Seconds before the ip -> rule index is re-listed from Cloudflare
+            account_id: Cloudflare account ID; enables the IP List bulk ban pipeline
         """
         self.email = email
         self.api_key = api_key
         self.zone_id = zone_id
+        self.account_id = account_id
         self.base_url = "https://api.cloudflare.com/client/v4"
         
         # Define headers used for API requests
@@ -66,12 +131,30 @@ class CloudflareAPIClient:
         }
         
         # Rate limiting parameters to avoid hitting Cloudflare API limits
+        # (burst + refill over one interval never exceeds max_requests)
         self.request_count = 0
-        self.last_reset = time.time()
-        self.max_requests = 1000  # Maximum requests per 5 minute period
-        self.reset_interval = 300  # 5 minutes
+        self.max_requests = max_requests
+        self.reset_interval = reset_interval
+        burst = min(burst, max_requests)
+        self.rate_limiter = AsyncTokenBucket(
+            rate=max(max_requests - burst, 1) / reset_interval,
+            capacity=max(burst, 1)
+        )
         self.lock = threading.Lock()
         
+        # Connection pool and the event loop it belongs to
+        self.max_connections = max_connections
+        self._session = None
+        self._loop = None
+        self._loop_thread = None
+        
+        # Local index of block rules: ip -> rule id, plus rule details for listings
+        self.rule_index: Dict[str, str] = {}
+        self.rule_details: Dict[str, Dict] = {}
+        self.rule_index_ttl = rule_index_ttl
+        self.rule_index_loaded_at = 0.0
+        self._index_lock = None
+        
         # For development mode
         self.dev_mode = CF_DEV_MODE
         if self.dev_mode:
@@ -80,30 +163,172 @@ class CloudflareAPIClient:
             self.dev_blocked_ips = {}
         else:
             logger.info("Cloudflare API client initialized")
+        
+        # Bulk bans through a managed IP List (started on the first ban)
+        self.ban_pipeline = None
+        if self.account_id and not self.dev_mode:
+            self.ban_pipeline = BulkBanPipeline(self, self.account_id, blocked_ips_cache)
     
-    async def _check_rate_limit(self):
-        """Check and limit API request rate to avoid hitting Cloudflare limits."""
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        """Start the client's background event loop on first use."""
         with self.lock:
-            current_time = time.time()
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, daemon=True,
+                                                     name="cloudflare-api")
+                self._loop_thread.start()
+            return self._loop
+    
+    async def _on_client_loop(self, coro):
+        """Run a coroutine on the client's event loop and await its result from any loop."""
+        loop = self._ensure_loop()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Get the pooled session (client loop only)."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=aiohttp.TCPConnector(limit=self.max_connections, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+        return self._session
+    
+    async def _send(self, method: str, path: str, params: Optional[Dict] = None, data: Any = None) -> Dict:
+        # Avoid rate limit issues
+        await self.rate_limiter.acquire()
+        self.request_count += 1
+        
+        session = self._get_session()
+        async with session.request(method, f"{self.base_url}{path}", params=params, json=data) as response:
+            return await response.json(content_type=None)
+    
+    async def _request(self, method: str, path: str, params: Optional[Dict] = None, data: Any = None) -> Dict:
+        """
+        Send an API request through the pooled session.
+        
+        Args:
+            method: HTTP method
+            path: Path below base_url
+            params: Query parameters
+            data: JSON body
+            
+        Returns:
+            Dict: Decoded JSON response
+        """
+        return await self._on_client_loop(self._send(method, path, params, data))
+    
+    async def _check_rate_limit(self):
+        """Wait for an API request slot (requests made through _request already do this)."""
+        await self._on_client_loop(self.rate_limiter.acquire())
+    
+    async def close(self):
+        """Close the pooled session and stop the client's event loop."""
+        if self._loop is None:
+            return
+        
+        if self.ban_pipeline is not None:
+            await self.ban_pipeline.stop()
+        
+        async def _close_session():
+            if self._session is not None and not self._session.closed:
+                await self._session.close()
+        
+        await self._on_client_loop(_close_session())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join(timeout=5)
+        self._loop.close()
+        self._loop = None
+        self._session = None
+    
+    def _index_rule(self, rule: Dict) -> Optional[str]:
+        """Add a rule to the local index if it blocks a single IP; returns the IP"""
+        filter_expr = rule.get("filter", {}).get("expression", "")
+        ip_match = _RULE_IP_PATTERN.search(filter_expr)
+        if not ip_match:
+            return None
+        ip = ip_match.group(1)
+        try:
+            ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        self.rule_index[ip] = rule.get("id")
+        self.rule_details[ip] = {
+            "ip": ip,
+            "rule_id": rule.get("id"),
+            "description": rule.get("description", ""),
+            "created_on": rule.get("created_on")
+        }
+        return ip
+    
+    def _unindex_ip(self, ip_address: str):
+        self.rule_index.pop(ip_address, None)
+        self.rule_details.pop(ip_address, None)
+    
+    async def _list_rules(self) -> Optional[List[Dict]]:
+        """List every firewall rule of the zone (None if a page fails)"""
+        rules = []
+        # Use paging to get all rules (100 per page)
+        page = 1
+        per_page = 100
+        
+        while True:
+            result = await self._request("GET", f"/zones/{self.zone_id}/firewall/rules",
+                                         params={"page": page, "per_page": per_page})
             
-            # Reset counter if reset interval has passed
-            if current_time - self.last_reset > self.reset_interval:
-                self.request_count = 0
-                self.last_reset = current_time
+            if not result.get("success", False):
+                logger.error(f"Failed to fetch firewall rules: {result.get('errors', [])}")
+                return None
+            
+            page_rules = result.get("result", [])
+            rules.extend(page_rules)
             
-            # Check if we've hit the limit
-            if self.request_count >= self.max_requests:
-                # Wait until reset
-                wait_time = self.reset_interval - (current_time - self.last_reset)
-                if wait_time > 0:
-                    logger.warning(f"Cloudflare API rate limit reached, waiting {wait_time:.2f} seconds")
-                    await asyncio.sleep(wait_time)
-                    # Reset counter
-                    self.request_count = 0
-                    self.last_reset = time.time()
+            # Check if there are more pages
+            result_info = result.get("result_info", {})
+            if page >= result_info.get("total_pages", 0) or not page_rules:
+                return rules
             
-            # Increment counter
-            self.request_count += 1
+            # Move to next page
+            page += 1
+    
+    async def _refresh_rule_index(self, force: bool = False) -> bool:
+        """
+        Rebuild the ip -> rule index from Cloudflare if it is stale.
+        
+        Concurrent callers share one listing. Returns False if the listing failed.
+        """
+        async def _refresh():
+            if self._index_lock is None:
+                self._index_lock = asyncio.Lock()
+            requested_at = time.time()
+            async with self._index_lock:
+                # Another caller may have refreshed while this one waited
+                if self.rule_index_loaded_at >= requested_at or (
+                        not force and time.time() - self.rule_index_loaded_at < self.rule_index_ttl):
+                    return True
+                
+                rules = await self._list_rules()
+                if rules is None:
+                    return False
+                
+                self.rule_index = {}
+                self.rule_details = {}
+                for rule in rules:
+                    self._index_rule(rule)
+                self.rule_index_loaded_at = time.time()
+                blocked_ips_cache.update(self.rule_index)
+                logger.debug(f"Indexed {len(self.rule_index)} Cloudflare block rules")
+                return True
+        
+        if not force and time.time() - self.rule_index_loaded_at < self.rule_index_ttl:
+            return True
+        return await self._on_client_loop(_refresh())
     
     async def block_ip(self, ip_address: str, reason: str, duration: int = 86400) -> Tuple[bool, Dict]:
         """
@@ -117,8 +342,6 @@ class CloudflareAPIClient:
         Returns:
             Tuple[bool, Dict]: (success, response data)
         """
-        global blocked_ips_cache
-        
         # Skip OPTIONS requests
         if reason and "OPTIONS" in reason:
             logger.info(f"Skipping block for IP {ip_address} using OPTIONS request: {reason}")
@@ -145,9 +368,9 @@ class CloudflareAPIClient:
                 "rule_id": f"dev-rule-{int(time.time())}-{hash(ip_address) % 10000}"
             }
             return True, {"success": True, "message": f"IP {ip_address} blocked (simulated in dev mode)"}
-            
-        # Avoid rate limit issues
-        await self._check_rate_limit()
+        
+        # Reasons are truncated to avoid issues
+        max_reason_length = 128
         
         try:
             # Check if valid IP
@@ -157,6 +380,11 @@ class CloudflareAPIClient:
                 logger.error(f"Invalid IP address: {ip_address}")
                 return False, {"success": False, "message": "Invalid IP address"}
             
+            # Queue to the IP List pipeline, which sends bans in bulk
+            if self.ban_pipeline is not None:
+                self.ban_pipeline.ban(ip_address, reason[:max_reason_length] if reason else "")
+                return True, {"success": True, "message": f"IP {ip_address} queued for bulk ban"}
+            
             # Check if rule already exists
             rule_id = await self._find_rule_by_ip(ip_address)
             if rule_id:
@@ -165,40 +393,39 @@ class CloudflareAPIClient:
                 return True, {"success": True, "message": "IP already blocked", "rule_id": rule_id}
                 
             # Create rule description (truncate to avoid issues)
-            max_reason_length = 128
             description = f"DDoS Protection: {reason[:max_reason_length]}" if reason else "DDoS Protection"
                 
             # Create firewall rule to block IP
             expression = f"(ip.src eq {ip_address})"
             
-            # Make request to Cloudflare API
-            async with aiohttp.ClientSession() as session:
-                url = f"{self.base_url}/zones/{self.zone_id}/firewall/rules"
-                
-                # Prepare data
-                data = {
-                    "name": f"Block {ip_address} - {int(time.time())}",
-                    "description": description,
-                    "action": "block",
-                    "filter": {
-                        "expression": expression,
-                        "paused": False
-                    },
-                    "products": ["firewall"]
-                }
-                
-                # Send request
-                async with session.post(url, headers=self.headers, json=data) as response:
-                    result = await response.json()
-                    
-                    # Check if request was successful
-                    if result.get("success", False):
-                        logger.info(f"Successfully blocked IP {ip_address} in Cloudflare")
-                        blocked_ips_cache.add(ip_address)
-                        return True, result
-                    else:
-                        logger.error(f"Failed to block IP {ip_address} in Cloudflare: {result.get('errors', [])}")
-                        return False, result
+            # Prepare data
+            data = {
+                "name": f"Block {ip_address} - {int(time.time())}",
+                "description": description,
+                "action": "block",
+                "filter": {
+                    "expression": expression,
+                    "paused": False
+                },
+                "products": ["firewall"]
+            }
+            
+            # Send request
+            result = await self._request("POST", f"/zones/{self.zone_id}/firewall/rules", data=data)
+            
+            # Check if request was successful
+            if result.get("success", False):
+                logger.info(f"Successfully blocked IP {ip_address} in Cloudflare")
+                created = result.get("result")
+                for rule in created if isinstance(created, list) else [created or {}]:
+                    rule.setdefault("filter", {"expression": expression})
+                    rule.setdefault("description", description)
+                    self._index_rule(rule)
+                blocked_ips_cache.add(ip_address)
+                return True, result
+            else:
+                logger.error(f"Failed to block IP {ip_address} in Cloudflare: {result.get('errors', [])}")
+                return False, result
         except Exception as e:
             logger.error(f"Error blocking IP {ip_address} in Cloudflare: {e}")
             return False, {"success": False, "message": str(e)}
@@ -213,8 +440,6 @@ class CloudflareAPIClient:
         Returns:
             Tuple[bool, Dict]: (success, response data)
         """
-        global blocked_ips_cache
-        
         # Development mode - simulate API call
         if self.dev_mode:
             logger.info(f"[DEV MODE] Simulating unblocking IP {ip_address}")
@@ -224,45 +449,43 @@ class CloudflareAPIClient:
                 del self.dev_blocked_ips[ip_address]
             return True, {"success": True, "message": f"IP {ip_address} unblocked (simulated in dev mode)"}
         
-        # Avoid rate limit issues
-        await self._check_rate_limit()
-        
         try:
-            # Find the rule ID for the IP
+            if self.ban_pipeline is not None:
+                self.ban_pipeline.unban(ip_address)
+            
+            # Find the rule ID for the IP (bans made before the IP List was used)
             rule_id = await self._find_rule_by_ip(ip_address)
             
+            if not rule_id and self.ban_pipeline is not None:
+                return True, {"success": True, "message": f"IP {ip_address} queued for bulk unban"}
+            
             if not rule_id:
                 logger.warning(f"IP {ip_address} not found in Cloudflare rules")
                 # Remove from cache anyway
-                if ip_address in blocked_ips_cache:
-                    blocked_ips_cache.remove(ip_address)
+                blocked_ips_cache.discard(ip_address)
                 return True, {"success": True, "message": "IP not found in Cloudflare rules"}
                 
             # Delete the rule
-            async with aiohttp.ClientSession() as session:
-                url = f"{self.base_url}/zones/{self.zone_id}/firewall/rules/{rule_id}"
+            result = await self._request("DELETE", f"/zones/{self.zone_id}/firewall/rules/{rule_id}")
+            
+            if result.get("success", False):
+                logger.info(f"Successfully unblocked IP {ip_address} in Cloudflare")
                 
-                async with session.delete(url, headers=self.headers) as response:
-                    result = await response.json()
+                # Remove from index and cache
+                self._unindex_ip(ip_address)
+                blocked_ips_cache.discard(ip_address)
                     
-                    if result.get("success", False):
-                        logger.info(f"Successfully unblocked IP {ip_address} in Cloudflare")
-                        
-                        # Remove from cache
-                        if ip_address in blocked_ips_cache:
-                            blocked_ips_cache.remove(ip_address)
-                            
-                        return True, result
-                    else:
-                        logger.error(f"Failed to unblock IP {ip_address} in Cloudflare: {result.get('errors', [])}")
-                        return False, result
+                return True, result
+            else:
+                logger.error(f"Failed to unblock IP {ip_address} in Cloudflare: {result.get('errors', [])}")
+                return False, result
         except Exception as e:
             logger.error(f"Error unblocking IP {ip_address} in Cloudflare: {e}")
             return False, {"success": False, "message": str(e)}
     
     async def _find_rule_by_ip(self, ip_address: str) -> Optional[str]:
         """
-        Find firewall rule ID for an IP address.
+        Find firewall rule ID for an IP address using the local rule index.
         
         Args:
             ip_address: IP address to find
@@ -270,43 +493,9 @@ class CloudflareAPIClient:
         Returns:
             Optional[str]: Rule ID if found, None otherwise
         """
-        # Avoid rate limit issues
-        await self._check_rate_limit()
-        
         try:
-            # Find firewall rule for the IP
-            async with aiohttp.ClientSession() as session:
-                # Use paging to get all rules (100 per page)
-                page = 1
-                per_page = 100
-                
-                while True:
-                    url = f"{self.base_url}/zones/{self.zone_id}/firewall/rules?page={page}&per_page={per_page}"
-                    
-                    async with session.get(url, headers=self.headers) as response:
-                        result = await response.json()
-                        
-                        if not result.get("success", False):
-                            logger.error(f"Failed to fetch firewall rules: {result.get('errors', [])}")
-                            return None
-                            
-                        # Check if any rule matches the IP
-                        rules = result.get("result", [])
-                        for rule in rules:
-                            # Check if rule targets our IP
-                            filter_expr = rule.get("filter", {}).get("expression", "")
-                            if f"ip.src eq {ip_address}" in filter_expr:
-                                return rule.get("id")
-                        
-                        # Check if there are more pages
-                        result_info = result.get("result_info", {})
-                        if page >= result_info.get("total_pages", 0) or not rules:
-                            break
-                            
-                        # Move to next page
-                        page += 1
-                
-                return None
+            await self._refresh_rule_index()
+            return self.rule_index.get(ip_address)
         except Exception as e:
             logger.error(f"Error finding rule for IP {ip_address}: {e}")
             return None
@@ -318,59 +507,15 @@ class CloudflareAPIClient:
         Returns:
             List[Dict]: List of blocked IPs with rule details
         """
-        global blocked_ips_cache
-        
-        # Avoid rate limit issues
-        await self._check_rate_limit()
-        
         try:
-            # Get all firewall rules
-            async with aiohttp.ClientSession() as session:
-                # Use paging to get all rules (100 per page)
-                page = 1
-                per_page = 100
-                blocked_ips = []
-                
-                while True:
-                    url = f"{self.base_url}/zones/{self.zone_id}/firewall/rules?page={page}&per_page={per_page}"
-                    
-                    async with session.get(url, headers=self.headers) as response:
-                        result = await response.json()
-                        
-                        if not result.get("success", False):
-                            logger.error(f"Failed to fetch firewall rules: {result.get('errors', [])}")
-                            return []
-                            
-                        # Find rules that block IPs
-                        rules = result.get("result", [])
-                        for rule in rules:
-                            # Check if rule targets an IP
-                            filter_expr = rule.get("filter", {}).get("expression", "")
-                            if "ip.src eq " in filter_expr:
-                                # Extract IP address
-                                import re
-                                ip_match = re.search(r'ip\.src eq (\d+\.\d+\.\d+\.\d+)', filter_expr)
-                                if ip_match:
-                                    ip = ip_match.group(1)
-                                    blocked_ips.append({
-                                        "ip": ip,
-                                        "rule_id": rule.get("id"),
-                                        "description": rule.get("description", ""),
-                                        "created_on": rule.get("created_on")
-                                    })
-                                    
-                                    # Update cache
-                                    blocked_ips_cache.add(ip)
-                        
-                        # Check if there are more pages
-                        result_info = result.get("result_info", {})
-                        if page >= result_info.get("total_pages", 0) or not rules:
-                            break
-                            
-                        # Move to next page
-                        page += 1
-                
-                return blocked_ips
+            # An explicit listing always re-reads the rules (and refreshes the index)
+            if not await self._refresh_rule_index(force=True):
+                return []
+            blocked = list(self.rule_details.values())
+            if self.ban_pipeline is not None:
+                listed = set(self.rule_details)
+                blocked.extend(entry for entry in self.ban_pipeline.get_blocked_ips() if entry["ip"] not in listed)
+            return blocked
         except Exception as e:
             logger.error(f"Error fetching blocked IPs: {e}")
             return []
@@ -387,37 +532,29 @@ class CloudflareAPIClient:
         Returns:
             Tuple[bool, Dict]: (success, response data)
         """
-        # Avoid rate limit issues
-        await self._check_rate_limit()
-        
         try:
-            # Make request to Cloudflare API
-            async with aiohttp.ClientSession() as session:
-                url = f"{self.base_url}/zones/{self.zone_id}/firewall/rules"
-                
-                # Prepare data
-                data = {
-                    "name": f"Rule {int(time.time())}",
-                    "description": description,
-                    "action": action,
-                    "filter": {
-                        "expression": expression,
-                        "paused": False
-                    },
-                    "products": ["firewall"]
-                }
-                
-                # Send request
-                async with session.post(url, headers=self.headers, json=data) as response:
-                    result = await response.json()
-                    
-                    # Check if request was successful
-                    if result.get("success", False):
-                        logger.info(f"Successfully created firewall rule in Cloudflare")
-                        return True, result
-                    else:
-                        logger.error(f"Failed to create firewall rule in Cloudflare: {result.get('errors', [])}")
-                        return False, result
+            # Prepare data
+            data = {
+                "name": f"Rule {int(time.time())}",
+                "description": description,
+                "action": action,
+                "filter": {
+                    "expression": expression,
+                    "paused": False
+                },
+                "products": ["firewall"]
+            }
+            
+            # Send request
+            result = await self._request("POST", f"/zones/{self.zone_id}/firewall/rules", data=data)
+            
+            # Check if request was successful
+            if result.get("success", False):
+                logger.info(f"Successfully created firewall rule in Cloudflare")
+                return True, result
+            else:
+                logger.error(f"Failed to create firewall rule in Cloudflare: {result.get('errors', [])}")
+                return False, result
         except Exception as e:
             logger.error(f"Error creating firewall rule in Cloudflare: {e}")
             return False, {"success": False, "message": str(e)}
@@ -434,25 +571,12 @@ class CloudflareAPIClient:
             logger.info("[DEV MODE] Simulating list_blocked_ips call")
             return self.dev_blocked_ips
         
-        # Avoid rate limit issues
-        await self._check_rate_limit()
-        
         try:
             # Get all firewall rules
             rules = await self.get_blocked_ips()
             
             # Extract IPs and reasons
-            blocked_ips = {}
-            for rule in rules:
-                ip = rule.get("ip")
-                description = rule.get("description", "")
-                
-                if ip:
-                    blocked_ips[ip] = description
-                    # Update cache
-                    blocked_ips_cache.add(ip)
-            
-            return blocked_ips
+            return {rule["ip"]: rule.get("description", "") for rule in rules}
         except Exception as e:
             logger.error(f"Error listing blocked IPs: {e}")
             return {}
@@ -476,11 +600,8 @@ class CloudflareAPIClient:
             is_blocked = ip_address in self.dev_blocked_ips
             reason = self.dev_blocked_ips.get(ip_address, {}).get("reason", "Unknown") if is_blocked else None
             return is_blocked, reason
-            
-        # Avoid rate limit issues
-        await self._check_rate_limit()
         
-        # Not in cache, check with API
+        # Not in cache, check the rule index
         rule_id = await self._find_rule_by_ip(ip_address)
         if rule_id:
             # IP is blocked, add to cache
@@ -492,6 +613,10 @@ class CloudflareAPIClient:
 # Initialize global client
 cf_client = CloudflareAPIClient() if CF_API_EMAIL and CF_API_KEY and CF_ZONE_ID else None
 
+def _run_on_client_loop(coro):
+    """Schedule a client coroutine from synchronous code; returns a concurrent Future"""
+    return asyncio.run_coroutine_threadsafe(coro, cf_client._ensure_loop())
+
 # Integration with the existing ban system
 def integrate_with_ban_manager():
     """Integrate Cloudflare with the ban manager system."""
@@ -517,7 +642,12 @@ def integrate_with_ban_manager():
             
             # Then block on Cloudflare if enabled - without duplicate log
             if CF_API_EMAIL and CF_API_KEY and CF_ZONE_ID and cf_client:
-                cf_client.block_ip(ip, reason, duration)
+                if cf_client.ban_pipeline is not None:
+                    # Queue only; the pipeline sends bans to Cloudflare in bulk
+                    cf_client.ban_pipeline.ban(ip, reason)
+                else:
+                    # Don't block the ban path on the API call
+                    _run_on_client_loop(cf_client.block_ip(ip, reason, duration or 86400))
             
             # طباعة تقرير مجمع كل فترة زمنية 
             current_time = time.time()
@@ -533,7 +663,10 @@ def integrate_with_ban_manager():
             
             # Then unblock on Cloudflare if enabled
             if CF_API_EMAIL and CF_API_KEY and CF_ZONE_ID and cf_client:
-                cf_client.unblock_ip(ip)
+                if cf_client.ban_pipeline is not None:
+                    cf_client.ban_pipeline.unban(ip)
+                # Also removes a per-IP rule left from before the IP List was used
+                _run_on_client_loop(cf_client.unblock_ip(ip))
                 
             return result
         
@@ -563,7 +696,7 @@ def sync_from_cloudflare():
         original_ban_ip = ban_manager.ban_ip
         
         # Get blocked IPs from Cloudflare
-        blocked_ips = cf_client.get_blocked_ips()
+        blocked_ips = _run_on_client_loop(cf_client.get_blocked_ips()).result()
         
         # Add each IP to the local ban system
         count = 0
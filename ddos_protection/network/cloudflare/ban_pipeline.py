@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Cloudflare Bulk Ban Pipeline
+----------------------------
+Bans IPs through one managed Cloudflare IP List instead of one firewall rule per IP.
+
+A single firewall rule blocks `ip.src in $<list>`. Bans and unbans are queued
+from any thread, coalesced over a short window (a ban followed by an unban of
+the same IP cancels out) and sent as bulk add/remove operations on the list.
+Each bulk call returns an operation id that is polled until Cloudflare reports
+it completed or failed; only one operation is in flight at a time, as
+Cloudflare requires. API calls are retried with exponential backoff, and a
+periodic reconcile re-reads the list, which every worker shares, and retries
+operations of this process that failed.
+
+Features:
+- Coalesced bulk add/remove on one IP List
+- Operation id tracking with backoff polling
+- Retry with exponential backoff and jitter
+- Periodic reconcile against the shared list
+"""
+
+import time
+import random
+import asyncio
+import logging
+import ipaddress
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+
+# Configure logger
+logger = logging.getLogger('ddos_protection.cloudflare.ban_pipeline')
+
+# Queued operations
+ADD = "add"
+REMOVE = "remove"
+
+# Cloudflare list item comments are limited to 500 characters
+MAX_COMMENT_LENGTH = 500
+
+# First delay between bulk operation status polls (doubles up to backoff_max)
+OPERATION_POLL_INTERVAL = 0.1
+
+
+class BulkBanPipeline:
+    """
+    Batching ban pipeline on top of a CloudflareAPIClient.
+
+    Requests go through the client's pooled session and token bucket, and all
+    pipeline work runs on the client's event loop. ban() and unban() only queue
+    and return immediately; the local blocked IP cache is updated at once so
+    the middleware blocks the IP while the batch is on its way to Cloudflare.
+    """
+
+    def __init__(self, client, account_id: str, blocked_cache: Set[str],
+                 list_name: str = "ddos_protection_blocklist", batch_window: float = 0.5,
+                 max_batch: int = 1000, max_retries: int = 5, backoff_base: float = 0.5,
+                 backoff_max: float = 30.0, reconcile_interval: float = 300.0):
+        """
+        Args:
+            client: CloudflareAPIClient used for requests
+            account_id: Cloudflare account that owns the IP List
+            blocked_cache: Local set of IPs blocked in Cloudflare
+            list_name: Name of the managed IP List (letters, digits and underscores)
+            batch_window: Seconds to collect bans before sending a batch
+            max_batch: Maximum IPs per bulk operation
+            max_retries: Retries per API call before giving up until the next reconcile
+            backoff_base: First retry delay in seconds (doubles on each retry)
+            backoff_max: Maximum retry delay in seconds
+            reconcile_interval: Seconds between diffs of wanted bans against the list
+        """
+        self.client = client
+        self.account_id = account_id
+        self.blocked_cache = blocked_cache
+        self.list_name = list_name
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.reconcile_interval = reconcile_interval
+
+        self.list_id = None
+        self.rule_id = None
+
+        # Wanted state (ip -> comment) and queued changes (ip -> ADD/REMOVE), shared with callers
+        self.lock = threading.Lock()
+        self.desired: Dict[str, str] = {}
+        self.pending: "OrderedDict[str, str]" = OrderedDict()
+        # Changes sent by this process that failed (ip -> ADD/REMOVE), retried on reconcile
+        self.failed: Dict[str, str] = {}
+
+        # Items known to be on the list: ip -> item id (None until the list is re-read)
+        self.items: Dict[str, Optional[str]] = {}
+
+        self._wakeup = None
+        self._task = None
+        self._stopped = False
+        self._flush_on_stop = True
+
+        self.stats = {
+            'queued': 0,
+            'coalesced': 0,
+            'batches': 0,
+            'ips_added': 0,
+            'ips_removed': 0,
+            'operations_failed': 0,
+            'retries': 0,
+            'reconciles': 0,
+            'last_reconcile': None
+        }
+
+    @property
+    def base_path(self) -> str:
+        return f"/accounts/{self.account_id}/rules/lists"
+
+    def ban(self, ip_address: str, reason: str = "") -> bool:
+        """
+        Queue a ban. Thread-safe; returns False for an invalid IP.
+
+        Args:
+            ip_address: IP address to ban
+            reason: Reason stored as the list item comment
+        """
+        try:
+            ipaddress.ip_address(ip_address)
+        except ValueError:
+            logger.error(f"Invalid IP address: {ip_address}")
+            return False
+
+        comment = f"DDoS Protection: {reason}" if reason else "DDoS Protection"
+        with self.lock:
+            self.desired[ip_address] = comment[:MAX_COMMENT_LENGTH]
+            self._queue(ip_address, ADD)
+        self.blocked_cache.add(ip_address)
+        self._notify()
+        return True
+
+    def unban(self, ip_address: str) -> bool:
+        """Queue an unban. Thread-safe."""
+        with self.lock:
+            self.desired.pop(ip_address, None)
+            self._queue(ip_address, REMOVE)
+        self.blocked_cache.discard(ip_address)
+        self._notify()
+        return True
+
+    def _queue(self, ip_address: str, operation: str):
+        # The latest operation for an IP replaces any queued one (caller holds self.lock)
+        if self.pending.pop(ip_address, None) is not None:
+            self.stats['coalesced'] += 1
+        self.failed.pop(ip_address, None)
+        self.pending[ip_address] = operation
+        self.stats['queued'] += 1
+
+    def _notify(self):
+        """Start the pipeline on first use (or after its task ended) and wake it up"""
+        loop = self.client._ensure_loop()
+        with self.lock:
+            if self._task is None or self._task.done():
+                self._stopped = False
+                self._task = asyncio.run_coroutine_threadsafe(self._run(), loop)
+        loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        """Start the pipeline without queueing anything (runs the initial reconcile)"""
+        self._notify()
+
+    async def stop(self, flush: bool = True):
+        """
+        Stop the pipeline.
+
+        Args:
+            flush: Send queued changes before stopping
+        """
+        async def _stop():
+            self._flush_on_stop = flush
+            self._stopped = True
+            self._wake()
+
+        if self._task is None:
+            return
+        await self.client._on_client_loop(_stop())
+        await asyncio.wrap_future(self._task)
+        self._task = None
+
+    async def _run(self):
+        """Main loop: set up the list, then send batches and reconcile periodically"""
+        self._wakeup = asyncio.Event()
+
+        attempt = 0
+        while not self._stopped:
+            try:
+                if await self.ensure_list() and await self.reconcile():
+                    break
+            except Exception as e:
+                logger.error(f"Error setting up Cloudflare ban pipeline: {e}")
+            attempt += 1
+            await asyncio.sleep(self._backoff(attempt))
+        next_reconcile = time.monotonic() + self.reconcile_interval
+        reconcile_failures = 0
+
+        while not self._stopped:
+            try:
+                if not self.pending:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(),
+                                               timeout=max(next_reconcile - time.monotonic(), 0))
+                    except asyncio.TimeoutError:
+                        pass
+                    self._wakeup.clear()
+
+                if self.pending and not self._stopped:
+                    # Let more bans arrive so they share one operation, unless a batch is already full
+                    if len(self.pending) < self.max_batch:
+                        await asyncio.sleep(self.batch_window)
+                    await self.flush()
+
+                if time.monotonic() >= next_reconcile:
+                    # Retry a failed reconcile with backoff instead of waiting a full interval
+                    reconcile_failures += 1
+                    next_reconcile = time.monotonic() + self._backoff(reconcile_failures)
+                    if await self.reconcile():
+                        reconcile_failures = 0
+                        next_reconcile = time.monotonic() + self.reconcile_interval
+            except Exception as e:
+                logger.error(f"Error in Cloudflare ban pipeline: {e}")
+                await asyncio.sleep(self.backoff_base)
+
+        if self._flush_on_stop and self.list_id is not None:
+            try:
+                while self.pending:
+                    await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing Cloudflare ban pipeline on stop: {e}")
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_base * (2 ** (attempt - 1)), self.backoff_max)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _call(self, method: str, path: str, params: Optional[Dict] = None, data=None) -> Optional[Dict]:
+        """
+        Send a request, retrying failures with exponential backoff.
+
+        Returns:
+            Optional[Dict]: The response, or None once retries are exhausted
+        """
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.stats['retries'] += 1
+                await asyncio.sleep(self._backoff(attempt))
+            try:
+                result = await self.client._request(method, path, params=params, data=data)
+                if result.get("success", False):
+                    return result
+                logger.warning(f"Cloudflare {method} {path} failed: {result.get('errors', [])}")
+            except Exception as e:
+                logger.warning(f"Cloudflare {method} {path} error: {e}")
+        logger.error(f"Cloudflare {method} {path} failed after {self.max_retries + 1} attempts")
+        return None
+
+    async def ensure_list(self) -> bool:
+        """Find or create the managed IP List and the firewall rule that blocks it"""
+        if self.list_id is None:
+            result = await self._call("GET", self.base_path)
+            if result is None:
+                return False
+            for ip_list in result.get("result", []):
+                if ip_list.get("name") == self.list_name:
+                    self.list_id = ip_list.get("id")
+                    break
+            else:
+                result = await self._call("POST", self.base_path, data={
+                    "name": self.list_name,
+                    "kind": "ip",
+                    "description": "Managed by DDoS Protection"
+                })
+                if result is None:
+                    return False
+                self.list_id = result.get("result", {}).get("id")
+                logger.info(f"Created Cloudflare IP List {self.list_name}")
+
+        if self.rule_id is None:
+            expression = f"(ip.src in ${self.list_name})"
+            rules = await self.client._list_rules()
+            if rules is None:
+                return False
+            for rule in rules:
+                if rule.get("filter", {}).get("expression") == expression:
+                    self.rule_id = rule.get("id")
+                    break
+            else:
+                success, result = await self.client.create_firewall_rule(
+                    expression, "block", f"DDoS Protection: block IPs in ${self.list_name}")
+                if not success:
+                    return False
+                created = result.get("result")
+                self.rule_id = (created[0] if isinstance(created, list) else created or {}).get("id")
+
+        return True
+
+    async def list_items(self) -> Optional[Dict[str, Dict]]:
+        """Read every item of the managed list (None if a page fails)"""
+        items = {}
+        cursor = None
+        while True:
+            params = {"per_page": 500}
+            if cursor:
+                params["cursor"] = cursor
+            result = await self._call("GET", f"{self.base_path}/{self.list_id}/items", params=params)
+            if result is None:
+                return None
+            for item in result.get("result", []):
+                items[item.get("ip")] = item
+            cursor = result.get("result_info", {}).get("cursors", {}).get("after")
+            if not cursor:
+                return items
+
+    async def _wait_for_operation(self, operation_id: str) -> bool:
+        """Poll a bulk operation until it completes or fails"""
+        delay = OPERATION_POLL_INTERVAL
+        while True:
+            await asyncio.sleep(delay)
+            result = await self._call("GET", f"{self.base_path}/bulk_operations/{operation_id}")
+            if result is None:
+                return False
+            operation = result.get("result", {})
+            status = operation.get("status")
+            if status == "completed":
+                return True
+            if status == "failed":
+                logger.error(f"Cloudflare bulk operation {operation_id} failed: {operation.get('error')}")
+                return False
+            delay = min(delay * 2, self.backoff_max)
+
+    async def _bulk(self, method: str, data) -> bool:
+        """Send one bulk list operation and wait for it"""
+        result = await self._call(method, f"{self.base_path}/{self.list_id}/items", data=data)
+        if result is None:
+            return False
+        self.stats['batches'] += 1
+        operation_id = result.get("result", {}).get("operation_id")
+        return operation_id is None or await self._wait_for_operation(operation_id)
+
+    async def flush(self):
+        """Send up to max_batch queued adds and max_batch queued removes"""
+        adds = {}
+        removes = []
+        with self.lock:
+            for ip_address in list(self.pending):
+                if len(adds) >= self.max_batch and len(removes) >= self.max_batch:
+                    break
+                operation = self.pending[ip_address]
+                if operation == ADD and len(adds) < self.max_batch:
+                    del self.pending[ip_address]
+                    if ip_address not in self.items and ip_address in self.desired:
+                        adds[ip_address] = self.desired[ip_address]
+                elif operation == REMOVE and len(removes) < self.max_batch:
+                    del self.pending[ip_address]
+                    if ip_address in self.items and ip_address not in self.desired:
+                        removes.append(ip_address)
+
+        if adds:
+            if await self._bulk("POST", [{"ip": ip, "comment": comment} for ip, comment in adds.items()]):
+                for ip_address in adds:
+                    self.items[ip_address] = None
+                self._settle(adds, ADD, failed=False)
+                self.stats['ips_added'] += len(adds)
+            else:
+                self._settle(adds, ADD, failed=True)
+                self.stats['operations_failed'] += 1
+
+        if removes:
+            # Items added by this pipeline have no id until the list is re-read
+            if any(self.items.get(ip_address) is None for ip_address in removes):
+                remote = await self.list_items()
+                if remote is None:
+                    self._settle(removes, REMOVE, failed=True)
+                    self.stats['operations_failed'] += 1
+                    return
+                self.items = {ip: item.get("id") for ip, item in remote.items()}
+            ids = [{"id": self.items[ip]} for ip in removes if self.items.get(ip)]
+            if ids and await self._bulk("DELETE", {"items": ids}):
+                for ip_address in removes:
+                    self.items.pop(ip_address, None)
+                self._settle(removes, REMOVE, failed=False)
+                self.stats['ips_removed'] += len(ids)
+            elif ids:
+                self._settle(removes, REMOVE, failed=True)
+                self.stats['operations_failed'] += 1
+            else:
+                # Already gone from the list
+                self._settle(removes, REMOVE, failed=False)
+
+    def _settle(self, ips, operation: str, failed: bool):
+        """Record the outcome of sent operations, unless the IP was re-queued since"""
+        with self.lock:
+            for ip_address in ips:
+                if ip_address in self.pending:
+                    continue
+                if failed:
+                    self.failed[ip_address] = operation
+                else:
+                    self.failed.pop(ip_address, None)
+
+    async def reconcile(self) -> bool:
+        """
+        Re-read the list and retry this process's failed operations.
+
+        Every worker has its own pipeline on the same list, so the list items
+        are the wanted state: bans and unbans made by other workers are adopted
+        rather than undone. Only changes this process queued itself (pending,
+        or sent and failed) override what the list says.
+        """
+        remote = await self.list_items()
+        if remote is None:
+            return False
+        self.items = {ip: item.get("id") for ip, item in remote.items()}
+
+        with self.lock:
+            own = dict(self.failed)
+            own.update(self.pending)
+            desired = {ip: item.get("comment", "") for ip, item in remote.items() if own.get(ip) != REMOVE}
+            for ip_address, operation in own.items():
+                if operation == ADD and ip_address in self.desired:
+                    desired[ip_address] = self.desired[ip_address]
+            dropped = [ip for ip in self.desired if ip not in desired]
+            self.desired = desired
+
+            retried = []
+            for ip_address, operation in list(self.failed.items()):
+                if ip_address in self.pending:
+                    continue
+                if (operation == ADD) == (ip_address in self.items):
+                    # Applied after all (e.g. the status poll failed, not the operation)
+                    del self.failed[ip_address]
+                else:
+                    self.pending[ip_address] = operation
+                    retried.append(ip_address)
+
+            self.blocked_cache.difference_update(dropped)
+            self.blocked_cache.update(self.desired)
+
+        self.stats['reconciles'] += 1
+        self.stats['last_reconcile'] = time.time()
+        if retried or dropped:
+            logger.info(f"Reconcile retried {len(retried)} operations and dropped {len(dropped)} bans "
+                        f"lifted elsewhere from {self.list_name}")
+        if retried:
+            self._wake()
+        return True
+
+    def get_blocked_ips(self) -> List[Dict]:
+        """Get the wanted bans with their list item ids (None while an add is in flight)"""
+        with self.lock:
+            return [{"ip": ip, "rule_id": self.items.get(ip), "description": comment}
+                    for ip, comment in self.desired.items()]
+
+    def get_stats(self) -> Dict:
+        """Get pipeline counters"""
+        return dict(self.stats, pending=len(self.pending), banned=len(self.desired),
+                    list_items=len(self.items))
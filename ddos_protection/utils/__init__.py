@@ -9,8 +9,9 @@ from .utils import (
     get_server_resources, generate_challenge, verify_challenge_response,
     analyze_path_distribution, load_geolocation_db, extract_request_features,
     get_client_ip_from_request, get_real_ip_from_request, get_ip_info_from_api,
-    is_ip_in_any_network
+    is_ip_in_any_network, compile_network_set
 )
+from .ip_classifier import IPClassifier, NetworkSet, ip_classifier
 
 __all__ = [
     'is_valid_ip', 
@@ -29,5 +30,9 @@ __all__ = [
     'get_client_ip_from_request',
     'get_real_ip_from_request',
     'get_ip_info_from_api',
-    'is_ip_in_any_network'
+    'is_ip_in_any_network',
+    'compile_network_set',
+    'NetworkSet',
+    'IPClassifier',
+    'ip_classifier'
 ] 
\ No newline at end of file
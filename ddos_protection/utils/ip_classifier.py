@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+DDoS Protection System - Compiled IP Classifier
+----------------------------------------------
+Precompiled CIDR membership for the request hot path.
+
+Every network list (trusted, banned, internal, geo-blocked) is compiled into
+one prefix table keyed by integer-packed address. Each prefix length present
+in the lists gets its own hash table, so a lookup costs one integer conversion
+plus one dict probe per distinct prefix length - independent of how many
+CIDR entries are loaded. The compiled tables are immutable and swapped in with
+a single reference assignment, so readers never see a half-built table.
+"""
+
+import socket
+import logging
+import ipaddress
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Configure logger
+logger = logging.getLogger("ddos_protection.ip_classifier")
+
+# Membership flags returned by IPClassifier.classify()
+TRUSTED = 1
+BANNED = 2
+INTERNAL = 4
+GEO_BLOCKED = 8
+
+LABELS = {
+    "trusted": TRUSTED,
+    "banned": BANNED,
+    "internal": INTERNAL,
+    "geo_blocked": GEO_BLOCKED,
+}
+
+# Loopback and RFC1918/RFC4193 ranges treated as internal traffic
+DEFAULT_INTERNAL_NETWORKS = [
+    "127.0.0.0/8",
+    "10.0.0.0/8",
+    "172.16.0.0/12",
+    "192.168.0.0/16",
+    "::1/128",
+    "fc00::/7",
+]
+
+_AF_INET = socket.AF_INET
+_AF_INET6 = socket.AF_INET6
+_inet_pton = socket.inet_pton
+_from_bytes = int.from_bytes
+
+# IPv4-mapped IPv6 addresses (::ffff:a.b.c.d) are classified as IPv4
+_V4_MAPPED_PREFIX = 0xFFFF
+
+
+def _parse_network(entry: str) -> Optional[Tuple[int, int, int]]:
+    """
+    Parse an IP or CIDR string into (version, network_int, prefix_len).
+
+    Args:
+        entry: IP address or network in CIDR notation
+
+    Returns:
+        Optional[Tuple[int, int, int]]: Parsed network or None if invalid
+    """
+    entry = entry.strip()
+
+    # Fast path for plain addresses, which make up most ban lists
+    if "/" not in entry:
+        try:
+            return 4, _from_bytes(_inet_pton(_AF_INET, entry), "big"), 32
+        except OSError:
+            pass
+        try:
+            value = _from_bytes(_inet_pton(_AF_INET6, entry), "big")
+        except OSError:
+            return None
+        if value >> 32 == _V4_MAPPED_PREFIX:
+            return 4, value & 0xFFFFFFFF, 32
+        return 6, value, 128
+
+    try:
+        network = ipaddress.ip_network(entry, strict=False)
+    except ValueError:
+        return None
+    return network.version, int(network.network_address), network.prefixlen
+
+
+class _CompiledTables:
+    """Immutable per-prefix-length lookup tables for one classifier generation."""
+
+    __slots__ = ("v4", "v6", "entry_count")
+
+    def __init__(self, v4: Dict[int, Dict[int, int]], v6: Dict[int, Dict[int, int]]):
+        # Store as (shift, table) tuples so lookups only do shifts and dict probes
+        self.v4 = tuple((32 - length, table) for length, table in sorted(v4.items(), reverse=True))
+        self.v6 = tuple((128 - length, table) for length, table in sorted(v6.items(), reverse=True))
+        self.entry_count = sum(len(t) for t in v4.values()) + sum(len(t) for t in v6.values())
+
+
+def compile_networks(sources: Dict[int, Iterable[str]]) -> _CompiledTables:
+    """
+    Compile labelled network lists into lookup tables.
+
+    Args:
+        sources: Mapping of membership flag to iterable of IPs/CIDRs
+
+    Returns:
+        _CompiledTables: Compiled, immutable tables
+    """
+    v4: Dict[int, Dict[int, int]] = {}
+    v6: Dict[int, Dict[int, int]] = {}
+    invalid = 0
+
+    for flag, networks in sources.items():
+        for entry in networks:
+            parsed = _parse_network(str(entry))
+            if parsed is None:
+                invalid += 1
+                continue
+
+            version, value, length = parsed
+            if version == 4:
+                table = v4.setdefault(length, {})
+                key = value >> (32 - length)
+            else:
+                table = v6.setdefault(length, {})
+                key = value >> (128 - length)
+            table[key] = table.get(key, 0) | flag
+
+    if invalid:
+        logger.debug(f"Skipped {invalid} invalid IP/CIDR entries while compiling classifier")
+
+    return _CompiledTables(v4, v6)
+
+
+def lookup(tables: _CompiledTables, ip: str) -> int:
+    """
+    Look up the membership flags of an IP in compiled tables.
+
+    Args:
+        tables: Tables returned by compile_networks()
+        ip: IP address to look up
+
+    Returns:
+        int: Bitwise OR of matching flags (0 if none or invalid)
+    """
+    try:
+        value = _from_bytes(_inet_pton(_AF_INET, ip), "big")
+        levels = tables.v4
+    except (OSError, TypeError):
+        try:
+            value = _from_bytes(_inet_pton(_AF_INET6, ip), "big")
+        except (OSError, TypeError):
+            return 0
+        if value >> 32 == _V4_MAPPED_PREFIX:
+            value &= 0xFFFFFFFF
+            levels = tables.v4
+        else:
+            levels = tables.v6
+
+    flags = 0
+    for shift, table in levels:
+        flag = table.get(value >> shift)
+        if flag:
+            flags |= flag
+    return flags
+
+
+class NetworkSet:
+    """
+    Compiled, immutable set of IPs/CIDRs for repeated membership checks.
+
+    Build it once and keep it; each `ip in network_set` is one lookup against
+    the compiled prefix tables.
+    """
+
+    __slots__ = ("_tables",)
+
+    def __init__(self, networks: Iterable[str]):
+        self._tables = compile_networks({1: networks})
+
+    def __contains__(self, ip: str) -> bool:
+        return lookup(self._tables, ip) != 0
+
+    def __len__(self) -> int:
+        return self._tables.entry_count
+
+
+class IPClassifier:
+    """
+    Answers trusted/banned/internal/geo-blocked membership for an IP
+    in a single lookup against precompiled prefix tables.
+    """
+
+    def __init__(self, internal_networks: Optional[List[str]] = None):
+        """
+        Create a classifier.
+
+        Args:
+            internal_networks: Networks treated as internal (defaults to loopback/private ranges)
+        """
+        self._sources: Dict[int, List[str]] = {
+            TRUSTED: [],
+            BANNED: [],
+            INTERNAL: list(DEFAULT_INTERNAL_NETWORKS if internal_networks is None else internal_networks),
+            GEO_BLOCKED: [],
+        }
+        self._build_lock = threading.Lock()
+        self._tables = compile_networks(self._sources)
+        self.generation = 0
+        self.dirty = False
+
+    def classify(self, ip: str) -> int:
+        """
+        Get all membership flags for an IP address.
+
+        Args:
+            ip: IP address to classify
+
+        Returns:
+            int: Bitwise OR of TRUSTED/BANNED/INTERNAL/GEO_BLOCKED (0 if none or invalid)
+        """
+        return lookup(self._tables, ip)
+
+    def is_trusted(self, ip: str) -> bool:
+        """Check if an IP is in a trusted network."""
+        return bool(self.classify(ip) & TRUSTED)
+
+    def is_banned(self, ip: str) -> bool:
+        """Check if an IP is in a banned network."""
+        return bool(self.classify(ip) & BANNED)
+
+    def is_internal(self, ip: str) -> bool:
+        """Check if an IP is in an internal network."""
+        return bool(self.classify(ip) & INTERNAL)
+
+    def is_geo_blocked(self, ip: str) -> bool:
+        """Check if an IP is in a geo-blocked network."""
+        return bool(self.classify(ip) & GEO_BLOCKED)
+
+    def rebuild(self, **lists: Iterable[str]) -> int:
+        """
+        Replace one or more network lists and atomically swap in new tables.
+
+        Args:
+            **lists: Any of trusted=, banned=, internal=, geo_blocked= iterables
+
+        Returns:
+            int: Number of compiled entries in the new generation
+        """
+        with self._build_lock:
+            sources = dict(self._sources)
+            for name, networks in lists.items():
+                if name not in LABELS:
+                    raise ValueError(f"Unknown classifier list: {name}")
+                sources[LABELS[name]] = list(networks)
+
+            tables = compile_networks(sources)
+
+            # Single reference assignment - readers see either the old or new tables
+            self._sources = sources
+            self._tables = tables
+            self.generation += 1
+
+        logger.debug(f"IP classifier rebuilt (generation {self.generation}, {tables.entry_count} entries)")
+        return tables.entry_count
+
+    def mark_dirty(self) -> None:
+        """Flag that a source list changed; the owner clears it before rebuilding."""
+        self.dirty = True
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get classifier size statistics."""
+        tables = self._tables
+        return {
+            "generation": self.generation,
+            "entries": tables.entry_count,
+            "ipv4_prefix_lengths": len(tables.v4),
+            "ipv6_prefix_lengths": len(tables.v6),
+        }
+
+
+# Shared classifier used by the mitigator and rate limiter
+ip_classifier = IPClassifier()
@@ -13,8 +13,9 @@ Helper functions for various components of the DDoS protection system:
 - Path and pattern analysis
 """
 
-import asyncio
+import importlib
 import os
+import sys
 import re
 import math
 import time
@@ -31,7 +32,9 @@ import json
 import urllib.parse
 import base64
 from pathlib import Path
-import platform
+from functools import lru_cache
+
+from .ip_classifier import NetworkSet, compile_networks, lookup
 
 # Configure logger
 logger = logging.getLogger("ddos_protection.utils")
@@ -95,18 +98,43 @@ def is_ip_in_network(ip: str, network: str) -> bool:
         return False
 
 
-def is_ip_in_any_network(ip: str, networks: List[str]) -> bool:
+def is_ip_in_any_network(ip: str, networks: Union[NetworkSet, List[str]]) -> bool:
     """
     Check if an IP address is in any of the specified networks.
     
+    Callers that check many IPs against the same list should build a
+    NetworkSet once (compile_network_set) and pass it here or use `ip in`;
+    a plain list has to be converted and hashed on every call.
+    
     Args:
         ip: IP address to check
-        networks: List of networks in CIDR notation
+        networks: NetworkSet, or list of networks in CIDR notation
         
     Returns:
         bool: True if IP is in any network, False otherwise
     """
-    return any(is_ip_in_network(ip, network) for network in networks)
+    if isinstance(networks, NetworkSet):
+        return ip in networks
+    return lookup(_compile_network_list(tuple(networks)), ip) != 0
+
+
+def compile_network_set(networks: List[str]) -> NetworkSet:
+    """
+    Compile a network list for repeated membership checks.
+    
+    Args:
+        networks: List of IPs/networks in CIDR notation
+        
+    Returns:
+        NetworkSet: Compiled set supporting `ip in network_set`
+    """
+    return NetworkSet(networks)
+
+
+@lru_cache(maxsize=128)
+def _compile_network_list(networks: Tuple[str, ...]):
+    """Compile a network list once so repeated membership checks skip re-parsing."""
+    return compile_networks({1: networks})
 
 
 def is_private_ip(ip: str) -> bool:
@@ -414,91 +442,73 @@ def get_ip_geolocation(ip: str, geo_db: Any = None, api_token: str = None) -> Op
     return None
 
 
+# Import paths of the memory manager's process-wide resource sampler
+RESOURCE_SAMPLER_MODULES = ("backend.crn_wallet.memory_manager.sampler", "memory_manager.sampler")
+_resource_sampler = None
+_fallback_net_counters = None
+
+
+def get_resource_sampler():
+    """
+    Get the shared background resource sampler, or None if the memory manager
+    is not installed.
+    """
+    global _resource_sampler
+    if _resource_sampler is None:
+        # Prefer a copy the application already imported, so there is one sampler per process
+        loaded = [name for name in RESOURCE_SAMPLER_MODULES if name in sys.modules]
+        for module_name in loaded + [name for name in RESOURCE_SAMPLER_MODULES if name not in loaded]:
+            try:
+                module = importlib.import_module(module_name)
+                _resource_sampler = module.get_resource_sampler()
+                break
+            except Exception:
+                continue
+    return _resource_sampler
+
+
 async def get_server_resources() -> Tuple[float, float, float]:
     """
     Get current server resource usage (CPU, memory, network).
     
+    Reads the latest snapshot published by the shared resource sampler, so it
+    never blocks. Without the sampler, psutil's non-blocking counters are
+    compared with the previous call.
+    
     Returns:
         Tuple[float, float, float]: CPU usage (%), memory usage (%), network usage (%)
     """
+    global _fallback_net_counters
+    
+    sampler = get_resource_sampler()
+    if sampler is not None:
+        snapshot = sampler.snapshot
+        return snapshot.cpu_percent, snapshot.memory_percent, snapshot.network_usage_percent()
+    
     if PSUTIL_AVAILABLE:
         try:
-            # Run intensive operations in a thread pool to avoid blocking
-            loop = asyncio.get_event_loop()
-            
-            # Get CPU usage (percent)
-            cpu_usage = await loop.run_in_executor(None, psutil.cpu_percent, 1)
+            cpu_usage = psutil.cpu_percent(interval=None)
+            memory_usage = psutil.virtual_memory().percent
             
-            # Get memory usage (percent)
-            memory = await loop.run_in_executor(None, psutil.virtual_memory)
-            memory_usage = memory.percent
-            
-            # Get network usage (percent of capacity, estimated)
-            # This is an approximation as we don't know the maximum bandwidth
-            net_before = await loop.run_in_executor(None, psutil.net_io_counters)
-            await asyncio.sleep(0.5)
-            net_after = await loop.run_in_executor(None, psutil.net_io_counters)
-            
-            # Calculate bytes per second
-            bytes_sent = net_after.bytes_sent - net_before.bytes_sent
-            bytes_recv = net_after.bytes_recv - net_before.bytes_recv
-            bytes_total = (bytes_sent + bytes_recv) * 2  # Multiply by 2 to convert to bits
-            
-            # Estimate network usage as percentage of a typical 1Gbps link
-            # Adjust this based on your actual network capacity
-            network_capacity_bits = 1000 * 1000 * 1000  # 1 Gbps in bits
-            network_usage = min(100, (bytes_total / 0.5) / (network_capacity_bits / 100))
+            # Network usage as a percentage of a 1 Gbps link, since the previous call
+            now = time.time()
+            counters = psutil.net_io_counters()
+            network_usage = 0.0
+            if _fallback_net_counters is not None:
+                previous_time, previous = _fallback_net_counters
+                elapsed = now - previous_time
+                if elapsed > 0:
+                    bytes_total = (counters.bytes_sent - previous.bytes_sent) + (counters.bytes_recv - previous.bytes_recv)
+                    network_usage = min(100, bytes_total * 8 / elapsed / (1000 * 1000 * 1000) * 100)
+            _fallback_net_counters = (now, counters)
             
             return cpu_usage, memory_usage, network_usage
             
         except Exception as e:
             logger.error(f"Error getting server resources: {e}")
     
-    # Fallback to basic system calls if psutil is not available
-    try:
-        # Try to get CPU usage with basic commands
-        if platform.system() == "Linux":
-            # Use top command to get CPU usage
-            proc = await asyncio.create_subprocess_shell(
-                "top -b -n 1 | grep '%Cpu' | awk '{print $2}'",
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, _ = await proc.communicate()
-            cpu_usage = float(stdout.decode().strip()) if stdout else 50.0
-            
-            # Use free command to get memory usage
-            proc = await asyncio.create_subprocess_shell(
-                "free | grep Mem | awk '{print $3/$2 * 100.0}'",
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, _ = await proc.communicate()
-            memory_usage = float(stdout.decode().strip()) if stdout else 50.0
-            
-            # Use ifstat to get network usage (if available)
-            proc = await asyncio.create_subprocess_shell(
-                "ifstat 1 1 | tail -n 1 | awk '{print $1+$2}'",
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, _ = await proc.communicate()
-            network_kbps = float(stdout.decode().strip()) if stdout and stdout.decode().strip() else 5000
-            network_usage = min(100, network_kbps / 100000 * 100)  # Assuming 1Gbps max
-            
-            return cpu_usage, memory_usage, network_usage
-            
-        elif platform.system() == "Windows":
-            # For Windows, we provide conservative estimates without psutil
-            return 50.0, 50.0, 30.0
-        else:
-            # For other platforms, provide conservative estimates
-            return 50.0, 50.0, 30.0
-            
-    except Exception as e:
-        logger.error(f"Error getting server resources with fallback method: {e}")
-        # Return conservative estimates
-        return 50.0, 50.0, 30.0
+    # Conservative estimates when no resource source is available
+    return 50.0, 50.0, 30.0
 
 
 def execute_command(command: List[str], raise_on_error: bool = True) -> subprocess.CompletedProcess:
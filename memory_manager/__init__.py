@@ -16,6 +16,7 @@ from .monitor import MemoryMonitor
 from .object_tracker import ObjectTracker
 from .heap_analyzer import HeapAnalyzer
 from .critical_section import CriticalSectionAnalyzer
+from .sampler import ResourceSampler, ResourceSnapshot, get_resource_sampler
 
 # Setup logging
 logger = logging.getLogger("memory_manager")
@@ -44,6 +45,9 @@ __all__ = [
     'ObjectTracker',
     'HeapAnalyzer', 
     'CriticalSectionAnalyzer',
+    'ResourceSampler',
+    'ResourceSnapshot',
+    'get_resource_sampler',
     'init_manager',
     'memory_manager'
 ] 
\ No newline at end of file
@@ -18,6 +18,8 @@ from typing import Dict, List, Set, Any, Optional, Tuple, Union, Callable
 from collections import defaultdict, deque
 import gc
 
+from .sampler import get_resource_sampler
+
 logger = logging.getLogger("memory_manager.critical_section")
 
 class CriticalSectionAnalyzer:
@@ -72,14 +74,12 @@ class CriticalSectionAnalyzer:
         self.pressure_samples = []
         self.max_pressure_samples = 50  # Maximum number of samples to keep
         
-        # Initialize with reasonable baseline if system detector available
-        if system_detector:
-            try:
-                usage = system_detector.get_resource_usage()
-                self.baseline_memory = usage.process_memory_bytes
-                self.max_memory_seen = self.baseline_memory * 1.2  # 20% higher than baseline
-            except:
-                pass
+        # Initialize with reasonable baseline from the shared resource sampler
+        try:
+            self.baseline_memory = get_resource_sampler().snapshot.process_rss_bytes
+            self.max_memory_seen = self.baseline_memory * 1.2  # 20% higher than baseline
+        except:
+            pass
         
         logger.info("Critical section analyzer initialized")
     
@@ -164,12 +164,13 @@ class CriticalSectionAnalyzer:
     
     def _get_current_memory(self):
         """Get current memory usage in bytes"""
-        if self.system_detector:
-            try:
-                usage = self.system_detector.get_resource_usage()
-                return usage.process_memory_bytes
-            except:
-                pass
+        try:
+            # Sampled in the background; reading it costs nothing
+            rss = get_resource_sampler().snapshot.process_rss_bytes
+            if rss:
+                return rss
+        except:
+            pass
         
         # Fallback method
         try:
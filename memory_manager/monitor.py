@@ -9,9 +9,11 @@ import os
 import sys
 import time
 import json
+import random
 import logging
 import threading
 import traceback
+import tracemalloc
 from typing import Dict, List, Any, Optional, Tuple, Union
 from datetime import datetime, timedelta
 from collections import deque
@@ -25,8 +27,75 @@ try:
 except ImportError:
     HAS_PROMETHEUS = False
 
+from .utils import get_process_rss
+from .sampler import get_resource_sampler
+
 logger = logging.getLogger("memory_manager.monitor")
 
+# Upper bounds (bytes) of the per-request memory delta histogram buckets;
+# deltas <= 0 land in the first bucket, anything larger than the last in +Inf
+REQUEST_MEMORY_BUCKETS = (0, 64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2)
+
+# Endpoints tracked before new ones are folded into "<other>"
+MAX_TRACKED_ENDPOINTS = 500
+
+class EndpointMemoryHistogram:
+    """Memory delta histogram and totals for one endpoint"""
+    
+    __slots__ = ('count', 'total_bytes', 'max_bytes', 'min_bytes', 'total_seconds', 'buckets')
+    
+    def __init__(self):
+        self.count = 0
+        self.total_bytes = 0
+        self.max_bytes = 0
+        self.min_bytes = 0
+        self.total_seconds = 0.0
+        self.buckets = [0] * (len(REQUEST_MEMORY_BUCKETS) + 1)
+    
+    def observe(self, delta_bytes, seconds):
+        """Add one measured request"""
+        if self.count == 0:
+            self.max_bytes = self.min_bytes = delta_bytes
+        else:
+            self.max_bytes = max(self.max_bytes, delta_bytes)
+            self.min_bytes = min(self.min_bytes, delta_bytes)
+        self.count += 1
+        self.total_bytes += delta_bytes
+        self.total_seconds += seconds
+        for i, bound in enumerate(REQUEST_MEMORY_BUCKETS):
+            if delta_bytes <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+    
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket that contains it"""
+        if self.count == 0:
+            return 0
+        target = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= target:
+                return REQUEST_MEMORY_BUCKETS[i] if i < len(REQUEST_MEMORY_BUCKETS) else self.max_bytes
+        return self.max_bytes
+    
+    def to_dict(self):
+        """Summary of the histogram"""
+        labels = [f"le_{bound // 1024}kb" for bound in REQUEST_MEMORY_BUCKETS] + ["le_inf"]
+        return {
+            'samples': self.count,
+            'avg_kb': round(self.total_bytes / self.count / 1024, 2) if self.count else 0,
+            'max_kb': round(self.max_bytes / 1024, 2),
+            'min_kb': round(self.min_bytes / 1024, 2),
+            'p50_kb': round(self.quantile(0.5) / 1024, 2),
+            'p95_kb': round(self.quantile(0.95) / 1024, 2),
+            'total_mb': round(self.total_bytes / (1024 * 1024), 2),
+            'avg_ms': round(self.total_seconds / self.count * 1000, 2) if self.count else 0,
+            'buckets': dict(zip(labels, self.buckets))
+        }
+
 class MemoryMonitor:
     """Monitors memory usage and provides logging, metrics, and visualization"""
     
@@ -51,6 +120,9 @@ class MemoryMonitor:
             self.metrics_write_interval = config.monitoring.metrics_write_interval
             self.max_log_size = config.monitoring.max_log_size_mb * 1024 * 1024
             self.max_log_files = config.monitoring.max_log_files
+            self.request_tracking = getattr(config.monitoring, 'request_tracking', "sampled")
+            self.request_sample_rate = getattr(config.monitoring, 'request_sample_rate', 0.05)
+            self.request_memory_source = getattr(config.monitoring, 'request_memory_source', "rss")
         else:
             # Default values
             self.enabled = True
@@ -64,6 +136,9 @@ class MemoryMonitor:
             self.metrics_write_interval = 60.0
             self.max_log_size = 100 * 1024 * 1024  # 100 MB
             self.max_log_files = 10
+            self.request_tracking = "sampled"
+            self.request_sample_rate = 0.05
+            self.request_memory_source = "rss"
         
         # Get API configuration
         if config and hasattr(config, 'api'):
@@ -89,8 +164,11 @@ class MemoryMonitor:
         self.memory_spikes = []
         self.last_memory_value = 0
         
-        # Per-request memory tracking
-        self.request_memory_tracking = {}
+        # Per-request memory tracking, aggregated per endpoint
+        self.request_histograms = {}
+        self.request_histograms_lock = threading.Lock()
+        self.requests_seen = 0
+        self.requests_sampled = 0
         
         # Log file handling
         self._setup_logging()
@@ -211,6 +289,13 @@ class MemoryMonitor:
                 'Total memory freed by optimizations in bytes'
             )
             
+            self.prom_request_memory = Histogram(
+                'memory_request_delta_bytes',
+                'Process memory growth during sampled requests in bytes',
+                ['endpoint'],
+                buckets=REQUEST_MEMORY_BUCKETS[1:] + (float('inf'),)
+            )
+            
             # Start HTTP server for metrics if not already running
             if not self.prometheus_started:
                 try:
@@ -256,57 +341,102 @@ class MemoryMonitor:
                 logger.warning(f"Failed to register API endpoints: {e}")
         
         # Register request tracking if using Flask
-        if self.app and hasattr(self.app, 'before_request') and hasattr(self.app, 'after_request'):
+        if self.request_tracking != "off" and self.app and hasattr(self.app, 'before_request') and hasattr(self.app, 'after_request'):
             try:
+                from flask import g, request
+                
+                if self.request_memory_source == "tracemalloc" and not tracemalloc.is_tracing():
+                    # One frame per allocation keeps tracemalloc overhead low
+                    tracemalloc.start(1)
+                
                 @self.app.before_request
                 def track_request_memory_start():
-                    # Record memory usage at start of request
-                    if self.system_detector:
-                        try:
-                            usage = self.system_detector.get_resource_usage()
-                            request_id = id(threading.current_thread())
-                            self.request_memory_tracking[request_id] = {
-                                'start_memory': usage.process_memory_bytes,
-                                'start_time': time.time()
-                            }
-                        except:
-                            pass
+                    # Only a fraction of requests is measured in sampled mode
+                    self.requests_seen += 1
+                    if self.request_tracking == "sampled" and random.random() >= self.request_sample_rate:
+                        return
+                    try:
+                        g._memory_monitor_start = (self._read_request_memory(), time.perf_counter())
+                    except Exception:
+                        pass
                 
                 @self.app.after_request
                 def track_request_memory_end(response):
-                    # Record memory usage at end of request and log if significant
-                    if self.system_detector:
-                        try:
-                            usage = self.system_detector.get_resource_usage()
-                            request_id = id(threading.current_thread())
-                            
-                            if request_id in self.request_memory_tracking:
-                                start_data = self.request_memory_tracking[request_id]
-                                memory_diff = usage.process_memory_bytes - start_data['start_memory']
-                                time_diff = time.time() - start_data['start_time']
-                                
-                                # Clean up tracking data
-                                del self.request_memory_tracking[request_id]
-                                
-                                # Log significant memory changes
-                                if memory_diff > (self.spike_threshold_mb * 1024 * 1024):
-                                    from flask import request
-                                    logger.warning(
-                                        f"Large memory increase: {memory_diff/(1024*1024):.1f}MB for "
-                                        f"request {request.method} {request.path} ({time_diff:.3f}s)"
-                                    )
-                        except:
-                            pass
+                    start = g.pop('_memory_monitor_start', None)
+                    if start is None:
+                        return response
+                    try:
+                        memory_diff = self._read_request_memory() - start[0]
+                        time_diff = time.perf_counter() - start[1]
+                        
+                        # Route templates keep the number of series bounded
+                        rule = request.url_rule.rule if request.url_rule else "<unmatched>"
+                        self.record_request_memory(f"{request.method} {rule}", memory_diff, time_diff)
+                        
+                        # Log significant memory changes
+                        if memory_diff > (self.spike_threshold_mb * 1024 * 1024):
+                            logger.warning(
+                                f"Large memory increase: {memory_diff/(1024*1024):.1f}MB for "
+                                f"request {request.method} {request.path} ({time_diff:.3f}s)"
+                            )
+                    except Exception:
+                        pass
                     
                     return response
                 
-                logger.info("Request memory tracking registered")
+                logger.info(f"Request memory tracking registered ({self.request_tracking}, {self.request_memory_source})")
             except Exception as e:
                 logger.warning(f"Failed to register request memory tracking: {e}")
         
         # Return self for method chaining
         return self
     
+    def _read_request_memory(self):
+        """Cheap process memory reading used around requests (RSS or traced bytes)"""
+        if self.request_memory_source == "tracemalloc" and tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[0]
+        return get_process_rss()
+    
+    def record_request_memory(self, endpoint, delta_bytes, seconds):
+        """Add a measured request to the histogram of its endpoint"""
+        with self.request_histograms_lock:
+            histogram = self.request_histograms.get(endpoint)
+            if histogram is None:
+                if len(self.request_histograms) >= MAX_TRACKED_ENDPOINTS:
+                    endpoint = "<other>"
+                    histogram = self.request_histograms.get(endpoint)
+                if histogram is None:
+                    histogram = self.request_histograms[endpoint] = EndpointMemoryHistogram()
+            histogram.observe(delta_bytes, seconds)
+            self.requests_sampled += 1
+        
+        if self.prometheus_started and hasattr(self, 'prom_request_memory'):
+            try:
+                self.prom_request_memory.labels(endpoint=endpoint).observe(max(delta_bytes, 0))
+            except Exception:
+                pass
+    
+    def get_request_memory_profile(self, sort_by='total_mb', limit=50):
+        """Get per-endpoint memory histograms, largest first"""
+        with self.request_histograms_lock:
+            endpoints = [dict(endpoint=name, **histogram.to_dict()) for name, histogram in self.request_histograms.items()]
+        endpoints.sort(key=lambda e: e.get(sort_by, 0), reverse=True)
+        return {
+            'mode': self.request_tracking,
+            'source': self.request_memory_source,
+            'sample_rate': self.request_sample_rate if self.request_tracking == "sampled" else 1.0,
+            'requests_seen': self.requests_seen,
+            'requests_sampled': self.requests_sampled,
+            'endpoints': endpoints[:limit]
+        }
+    
+    def reset_request_memory_profile(self):
+        """Clear the per-endpoint histograms"""
+        with self.request_histograms_lock:
+            self.request_histograms.clear()
+            self.requests_sampled = 0
+        self.requests_seen = 0
+    
     def _register_api_endpoints(self):
         """Register API endpoints with Flask app"""
         if not self.app or not hasattr(self.app, 'route'):
@@ -341,6 +471,15 @@ class MemoryMonitor:
                 # Get memory history
                 history = self.get_memory_history(minutes)
                 return jsonify(history)
+            
+            @self.app.route(f"{self.api_prefix}/requests")
+            def memory_requests():
+                from flask import jsonify, request
+                
+                # Per-endpoint memory cost of sampled requests
+                sort_by = request.args.get('sort', 'total_mb')
+                limit = min(max(1, int(request.args.get('limit', 50))), MAX_TRACKED_ENDPOINTS)
+                return jsonify(self.get_request_memory_profile(sort_by=sort_by, limit=limit))
         
         # Endpoint for memory optimization (management)
         if self.management_endpoints:
@@ -416,19 +555,15 @@ class MemoryMonitor:
     def _record_memory_usage(self):
         """Record current memory usage and log"""
         try:
-            # Need system detector for this
-            if not self.system_detector:
-                return False
-            
-            # Get resource usage
-            usage = self.system_detector.get_resource_usage()
+            # Latest snapshot from the shared resource sampler
+            usage = get_resource_sampler().snapshot
             
             # Create metrics object
             metrics = {
                 'timestamp': time.time(),
                 'datetime': datetime.now().isoformat(),
-                'process_memory_bytes': usage.process_memory_bytes,
-                'process_memory_mb': usage.process_memory_bytes / (1024 * 1024),
+                'process_memory_bytes': usage.process_rss_bytes,
+                'process_memory_mb': usage.process_rss_bytes / (1024 * 1024),
                 'process_memory_percent': usage.process_memory_percent,
                 'system_memory_percent': usage.memory_percent,
                 'system_memory_available_mb': usage.memory_available_bytes / (1024 * 1024),
@@ -654,11 +789,8 @@ class MemoryMonitor:
             current_metrics = self.memory_history[-1]
         else:
             # If no history yet, get current usage
-            if self.system_detector:
-                metrics = self._record_memory_usage()
-                current_metrics = metrics if metrics else {}
-            else:
-                current_metrics = {}
+            metrics = self._record_memory_usage()
+            current_metrics = metrics if metrics else {}
         
         # Add system information
         status = {
@@ -750,6 +882,8 @@ class MemoryMonitor:
         return {
             'memory_spikes': len(self.memory_spikes),
             'history_points': len(self.memory_history),
+            'requests_sampled': self.requests_sampled,
+            'tracked_endpoints': len(self.request_histograms),
             'monitoring_active': self.running,
             'prometheus_active': self.prometheus_started if HAS_PROMETHEUS else False,
             'last_metrics_write': self.last_metrics_write,
@@ -6,21 +6,106 @@ and identifying retain cycles in the application.
 
 This module provides tools to analyze objects lifecycle, track references,
 and detect memory-related issues like retain cycles and orphaned objects.
+
+Census modes (object_tracker.census_mode):
+
+- "generational" (default): every object in the young GC generations is
+  counted exactly and a random sample of the oldest generation is counted and
+  scaled to its size. New allocations are always seen; the long-lived bulk of
+  the heap costs a fixed sample per tick.
+- "sampled": a random sample of all GC-tracked objects, scaled.
+- "full": the original exhaustive scan that also builds the per-object
+  reference map used for retain cycle and dangling pointer detection.
+
+In the census modes no per-object state is kept between ticks. Type counts
+live in flat arrays indexed by a type-name table, and retain cycles are only
+searched for on demand (find_cycles) over a bounded subgraph.
 """
 
 import sys
 import gc
 import time
+import random
 import logging
 import threading
 import weakref
 import inspect
+from array import array
 from typing import Dict, List, Set, Any, Optional, Tuple, Union, Callable
-from collections import defaultdict, deque
+from collections import defaultdict, deque, Counter
 import traceback
 
 logger = logging.getLogger("memory_manager.object_tracker")
 
+CENSUS_MODES = ("generational", "sampled", "full")
+
+# Estimated counts resting on fewer sampled objects than this are too noisy to log
+MIN_SAMPLE_HITS_TO_LOG = 25
+
+
+def _get_generation_objects(generation):
+    """gc.get_objects() restricted to one generation (all objects before Python 3.8)"""
+    try:
+        return gc.get_objects(generation=generation)
+    except TypeError:
+        return gc.get_objects() if generation == 2 else []
+
+
+def _strongly_connected_components(edges):
+    """
+    Iterative Tarjan over an adjacency list of node indices.
+    Returns the components that contain a cycle (size > 1 or a self reference).
+    """
+    count = len(edges)
+    index = [-1] * count
+    low = [0] * count
+    on_stack = [False] * count
+    stack = []
+    components = []
+    counter = 0
+
+    for root in range(count):
+        if index[root] != -1:
+            continue
+        work = [(root, 0)]
+        while work:
+            node, i = work.pop()
+            if i == 0:
+                index[node] = low[node] = counter
+                counter += 1
+                stack.append(node)
+                on_stack[node] = True
+            else:
+                # Returning from the child at position i - 1
+                low[node] = min(low[node], low[edges[node][i - 1]])
+
+            neighbours = edges[node]
+            descended = False
+            while i < len(neighbours):
+                child = neighbours[i]
+                i += 1
+                if index[child] == -1:
+                    work.append((node, i))
+                    work.append((child, 0))
+                    descended = True
+                    break
+                if on_stack[child]:
+                    low[node] = min(low[node], index[child])
+            if descended:
+                continue
+
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component.append(member)
+                    if member == node:
+                        break
+                if len(component) > 1 or node in edges[node]:
+                    components.append(component)
+    return components
+
 class ObjectTracker:
     """
     Tracks object allocations and references to detect memory leaks,
@@ -39,6 +124,9 @@ class ObjectTracker:
         self.max_objects_tracked = 5000
         self.track_types = []  # Empty list means track all types
         self.ignore_types = ['function', 'module', 'type', 'NoneType', 'frame']
+        self.census_mode = "generational"
+        self.census_sample_size = 20000  # objects sampled per tick from the sampled population
+        self.cycle_max_objects = 10000  # node budget of one find_cycles() run
         
         # Override with config if available
         if config and hasattr(config, 'object_tracker'):
@@ -47,10 +135,31 @@ class ObjectTracker:
             self.max_objects_tracked = getattr(config.object_tracker, 'max_objects_tracked', self.max_objects_tracked)
             self.track_types = getattr(config.object_tracker, 'track_types', self.track_types)
             self.ignore_types = getattr(config.object_tracker, 'ignore_types', self.ignore_types)
+            self.census_mode = getattr(config.object_tracker, 'census_mode', self.census_mode)
+            self.census_sample_size = getattr(config.object_tracker, 'census_sample_size', self.census_sample_size)
+            self.cycle_max_objects = getattr(config.object_tracker, 'cycle_max_objects', self.cycle_max_objects)
         
-        # Object tracking data structures
-        self.object_counts = defaultdict(int)
-        self.previous_counts = defaultdict(int)
+        if self.census_mode not in CENSUS_MODES:
+            logger.warning(f"Unknown census mode {self.census_mode!r}, using 'generational'")
+            self.census_mode = "generational"
+        
+        # Type counts: slot i of each array belongs to self._type_names[i]
+        self._type_slots = {}  # type name -> slot
+        self._type_names = []
+        self._counts = array('q')
+        self._previous_counts = array('q')
+        self._sample_hits = array('q')  # objects actually inspected per type in the last census
+        self._counts_exact = True
+        
+        # Census cost
+        self.census_runs = 0
+        self.last_pause_ms = 0.0
+        self.max_pause_ms = 0.0
+        self.total_pause_ms = 0.0
+        self.last_population = 0
+        self.last_inspected = 0
+        
+        # Object tracking data structures (filled by the "full" mode only)
         self.tracked_objects = {}  # id -> (type, creation_time, creation_stack)
         self.reference_map = {}    # id -> set(referenced_ids)
         self.tracking_lock = threading.RLock()
@@ -66,8 +175,19 @@ class ObjectTracker:
         # Dangling pointer detection
         self.weak_references = {}  # id -> weakref
         self.dangling_pointers = []
+        self.last_cycle_search = None
         
-        logger.info("Object tracker initialized")
+        logger.info(f"Object tracker initialized (census mode: {self.census_mode})")
+    
+    @property
+    def object_counts(self):
+        """Counts (estimated outside "full" mode) by type name from the last census"""
+        return {name: count for name, count in zip(self._type_names, self._counts) if count}
+    
+    @property
+    def previous_counts(self):
+        """Counts by type name from the census before the last one"""
+        return {name: count for name, count in zip(self._type_names, self._previous_counts) if count}
     
     @property
     def is_tracking(self):
@@ -106,7 +226,8 @@ class ObjectTracker:
         while self.running:
             try:
                 self._scan_objects()
-                self._detect_memory_issues()
+                if self.census_mode == "full":
+                    self._detect_memory_issues()
             except Exception as e:
                 logger.error(f"Error in object tracking loop: {e}")
                 logger.error(traceback.format_exc())
@@ -115,20 +236,96 @@ class ObjectTracker:
             time.sleep(self.track_interval)
     
     def _scan_objects(self):
-        """Scan all objects in memory and update tracking data"""
+        """Run one census in the configured mode and record its pause time"""
+        start = time.perf_counter()
+        if self.census_mode == "full":
+            self._scan_all_objects()
+        else:
+            self._run_census()
+        pause_ms = (time.perf_counter() - start) * 1000
+        
+        self.census_runs += 1
+        self.last_pause_ms = pause_ms
+        self.total_pause_ms += pause_ms
+        if pause_ms > self.max_pause_ms:
+            self.max_pause_ms = pause_ms
+    
+    def _is_counted(self, type_name):
+        if type_name in self.ignore_types:
+            return False
+        return not self.track_types or type_name in self.track_types
+    
+    def _run_census(self):
+        """Count objects by type from the young generations and/or a random sample"""
+        sample_size = self.census_sample_size
+        if self.census_mode == "generational":
+            exact = _get_generation_objects(0) + _get_generation_objects(1)
+            sampled = _get_generation_objects(2)
+        else:
+            exact = []
+            sampled = gc.get_objects()
+        population = len(exact) + len(sampled)
+        
+        # Counting by type object runs in C; names are resolved once per type
+        exact_counts = Counter(map(type, exact))
+        del exact
+        if len(sampled) > sample_size:
+            scale = len(sampled) / sample_size
+            sampled = random.sample(sampled, sample_size)
+        else:
+            scale = 1.0
+        sampled_counts = Counter(map(type, sampled))
+        inspected = sum(exact_counts.values()) + len(sampled)
+        del sampled
+        
+        counts = defaultdict(float)
+        hits = defaultdict(int)
+        for counter, weight in ((exact_counts, 1.0), (sampled_counts, scale)):
+            for obj_type, count in counter.items():
+                type_name = obj_type.__name__
+                if self._is_counted(type_name):
+                    counts[type_name] += count * weight
+                    hits[type_name] += count
+        
+        self.last_population = population
+        self.last_inspected = inspected
+        self._publish_counts(counts, hits, exact=scale == 1.0)
+    
+    def _publish_counts(self, counts, hits, exact):
+        """Store one census in the type-count arrays and log notable changes"""
         with self.tracking_lock:
-            # Store previous counts for comparison
-            self.previous_counts = self.object_counts.copy()
-            self.object_counts.clear()
+            for type_name in counts:
+                if type_name not in self._type_slots:
+                    self._type_slots[type_name] = len(self._type_names)
+                    self._type_names.append(type_name)
             
+            size = len(self._type_names)
+            new_counts = array('q', bytes(8 * size))
+            new_hits = array('q', bytes(8 * size))
+            for type_name, count in counts.items():
+                slot = self._type_slots[type_name]
+                new_counts[slot] = int(round(count))
+                new_hits[slot] = hits[type_name]
+            
+            previous = self._counts
+            previous.extend(array('q', bytes(8 * (size - len(previous)))))
+            self._previous_counts = previous
+            self._counts = new_counts
+            self._sample_hits = new_hits
+            self._counts_exact = exact
+            
+            self._log_object_count_changes()
+    
+    def _scan_all_objects(self):
+        """Scan all objects in memory and update tracking data"""
+        counts = defaultdict(int)
+        with self.tracking_lock:
             # Get all objects from garbage collector
             all_objects = gc.get_objects()
+            self.last_population = self.last_inspected = len(all_objects)
             
             # Count objects by type
             for obj in all_objects:
-                if len(self.tracked_objects) >= self.max_objects_tracked:
-                    break
-                
                 try:
                     obj_type = type(obj).__name__
                     
@@ -141,11 +338,15 @@ class ObjectTracker:
                         continue
                     
                     # Count by type
-                    self.object_counts[obj_type] += 1
+                    counts[obj_type] += 1
                     
                     # Check if this is a new object to track
                     obj_id = id(obj)
                     if obj_id not in self.tracked_objects:
+                        # Keep counting once the tracking budget is used up
+                        if len(self.tracked_objects) >= self.max_objects_tracked:
+                            continue
+                        
                         # Get creation stack if possible
                         creation_stack = None
                         try:
@@ -175,8 +376,8 @@ class ObjectTracker:
                     # Some objects may not be properly inspectable
                     continue
             
-            # Log notable changes
-            self._log_object_count_changes()
+            # Store counts and log notable changes
+            self._publish_counts(counts, counts, exact=True)
     
     def _update_references(self, obj, obj_id):
         """Update the reference map for an object"""
@@ -215,9 +416,12 @@ class ObjectTracker:
     
     def _log_object_count_changes(self):
         """Log significant changes in object counts"""
-        for obj_type, count in self.object_counts.items():
-            prev_count = self.previous_counts.get(obj_type, 0)
+        for slot, obj_type in enumerate(self._type_names):
+            count = self._counts[slot]
+            prev_count = self._previous_counts[slot]
             delta = count - prev_count
+            if not delta or (not self._counts_exact and self._sample_hits[slot] < MIN_SAMPLE_HITS_TO_LOG):
+                continue
             
             # Log if significant change (more than 10% and at least 10 objects)
             if abs(delta) > max(10, prev_count * 0.1):
@@ -350,15 +554,138 @@ class ObjectTracker:
                 if len(self.dangling_pointers) > 50:
                     self.dangling_pointers = self.dangling_pointers[-50:]
     
+    def _growing_types(self, limit=5):
+        """Type names with the largest count increase between the last two censuses"""
+        with self.tracking_lock:
+            deltas = [(self._counts[slot] - self._previous_counts[slot], name)
+                      for slot, name in enumerate(self._type_names)]
+        return [name for delta, name in sorted(deltas, reverse=True)[:limit] if delta > 0]
+    
+    def find_cycles(self, type_names=None, max_objects=None, max_roots=1000):
+        """
+        Search for reference cycles in a bounded subgraph.
+        
+        Roots are objects of the given types found in the young generations
+        and a sample of the oldest one (default: the types that grew most in
+        the last census). The graph is expanded with gc.get_referents() until
+        max_objects nodes are reached, then Tarjan's algorithm finds the
+        strongly connected components. Found cycles are added to the
+        detected retain cycles.
+        
+        Returns:
+            List of cycle dicts in the get_retain_cycles() format
+        """
+        max_objects = max_objects or self.cycle_max_objects
+        type_names = set(type_names or self._growing_types())
+        start = time.perf_counter()
+        
+        candidates = _get_generation_objects(0) + _get_generation_objects(1)
+        old = _get_generation_objects(2)
+        if len(old) > self.census_sample_size:
+            old = random.sample(old, self.census_sample_size)
+        candidates.extend(old)
+        del old
+        
+        roots = []
+        for obj in candidates:
+            type_name = type(obj).__name__
+            if (type_name in type_names if type_names else type_name not in self.ignore_types):
+                roots.append(obj)
+        del candidates
+        if len(roots) > max_roots:
+            roots = random.sample(roots, max_roots)
+        
+        # Nodes are held strongly for the duration of the search so ids stay unique
+        nodes = []
+        node_index = {}
+        for obj in roots:
+            if id(obj) not in node_index:
+                node_index[id(obj)] = len(nodes)
+                nodes.append(obj)
+        del roots
+        
+        edges = []
+        position = 0
+        while position < len(nodes):
+            referents = []
+            for ref in gc.get_referents(nodes[position]):
+                if type(ref).__name__ in self.ignore_types:
+                    continue
+                slot = node_index.get(id(ref))
+                if slot is None:
+                    if len(nodes) >= max_objects:
+                        continue
+                    slot = node_index[id(ref)] = len(nodes)
+                    nodes.append(ref)
+                referents.append(slot)
+            edges.append(referents)
+            position += 1
+        
+        now = time.time()
+        cycles = []
+        for component in _strongly_connected_components(edges):
+            cycles.append({
+                'detected_time': now,
+                'cycle_objects': [(id(nodes[i]), type(nodes[i]).__name__) for i in component[:20]],
+                'cycle_length': len(component),
+                'root_types': sorted(type_names)
+            })
+        searched = len(nodes)
+        del nodes, node_index, edges
+        
+        with self.tracking_lock:
+            if cycles:
+                self.detected_cycles.extend(cycles)
+                self.detected_cycles = self.detected_cycles[-50:]
+            self.last_cycle_search = {
+                'time': now,
+                'objects_searched': searched,
+                'cycles_found': len(cycles),
+                'duration_ms': round((time.perf_counter() - start) * 1000, 2)
+            }
+        if cycles:
+            logger.warning(f"Detected {len(cycles)} reference cycles among {searched} objects")
+        return cycles
+    
+    def get_overhead_bytes(self):
+        """Approximate memory held by the tracker's own data structures"""
+        with self.tracking_lock:
+            size = sum(sys.getsizeof(a) for a in (self._counts, self._previous_counts, self._sample_hits))
+            size += sys.getsizeof(self._type_slots) + sys.getsizeof(self._type_names)
+            size += sum(sys.getsizeof(name) for name in self._type_names)
+            size += sys.getsizeof(self.tracked_objects) + sys.getsizeof(self.weak_references)
+            size += sum(sys.getsizeof(ref) for ref in self.weak_references.values())
+            size += sys.getsizeof(self.reference_map)
+            size += sum(sys.getsizeof(refs) for refs in self.reference_map.values())
+            size += sys.getsizeof(self.cycle_candidates) + sys.getsizeof(self.detected_cycles)
+        return size
+    
+    def get_census_metrics(self):
+        """Cost of the census: pause times, objects inspected and tracker overhead"""
+        return {
+            'mode': self.census_mode,
+            'runs': self.census_runs,
+            'last_pause_ms': round(self.last_pause_ms, 2),
+            'max_pause_ms': round(self.max_pause_ms, 2),
+            'avg_pause_ms': round(self.total_pause_ms / self.census_runs, 2) if self.census_runs else 0.0,
+            'population': self.last_population,
+            'inspected': self.last_inspected,
+            'estimated': not self._counts_exact,
+            'overhead_bytes': self.get_overhead_bytes(),
+            'last_cycle_search': self.last_cycle_search
+        }
+    
     def get_object_summary(self):
         """Get summary of tracked objects"""
+        object_counts = self.object_counts
         with self.tracking_lock:
             return {
                 'total_tracked_objects': len(self.tracked_objects),
-                'object_counts': dict(self.object_counts),
-                'top_types': sorted(self.object_counts.items(), key=lambda x: x[1], reverse=True)[:10],
+                'object_counts': object_counts,
+                'top_types': sorted(object_counts.items(), key=lambda x: x[1], reverse=True)[:10],
                 'potential_cycles': len(self.detected_cycles),
-                'potential_dangling_pointers': len(self.dangling_pointers)
+                'potential_dangling_pointers': len(self.dangling_pointers),
+                'census': self.get_census_metrics()
             }
     
     def get_retain_cycles(self):
@@ -387,7 +714,11 @@ class ObjectTracker:
             'tracked_objects': len(self.tracked_objects),
             'object_types': len(self.object_counts),
             'retain_cycles': len(self.detected_cycles),
-            'dangling_pointers': len(self.dangling_pointers)
+            'dangling_pointers': len(self.dangling_pointers),
+            'census_mode': self.census_mode,
+            'last_pause_ms': round(self.last_pause_ms, 2),
+            'max_pause_ms': round(self.max_pause_ms, 2),
+            'overhead_bytes': self.get_overhead_bytes()
         }
     
     def register(self, app=None):
@@ -3,6 +3,14 @@ Stress Handler Module
 ------------------
 Detects and handles high stress conditions in the application,
 dynamically adjusting resource usage to maintain stability during load spikes.
+
+Requests pass through an admission controller. Each request path maps to a
+priority class, and every class may fill only its share of an adaptive
+concurrency limit. The limit shrinks when smoothed request latency rises above
+the target and grows back slowly. Low-priority requests run out of room first
+and are shed; higher-priority requests may wait briefly for a slot. Staff
+login and token verification therefore stay responsive when Mongo or the CPU
+saturates.
 """
 
 import os
@@ -14,8 +22,18 @@ import traceback
 from typing import Dict, List, Set, Tuple, Any, Optional, Callable
 from dataclasses import dataclass, field
 from enum import Enum, auto
+from fnmatch import fnmatchcase
 from collections import deque
 
+from .sampler import get_resource_sampler
+from .config import DEFAULT_PRIORITY_CLASSES, DEFAULT_ENDPOINT_PRIORITIES
+
+try:
+    from prometheus_client import Counter, Histogram, Gauge
+    HAS_PROMETHEUS = True
+except ImportError:
+    HAS_PROMETHEUS = False
+
 logger = logging.getLogger("memory_manager.stress_handler")
 
 class StressState(Enum):
@@ -26,6 +44,263 @@ class StressState(Enum):
     CRITICAL = auto()
 
 
+@dataclass
+class PriorityClass:
+    """Admission settings for one request priority class"""
+    name: str
+    priority: int  # 0 is the most important
+    limit_share: float = 1.0
+    max_concurrency: Optional[int] = None
+    max_queue_ms: float = 0.0
+
+
+class _ClassStats:
+    """Admission counters for one priority class"""
+    
+    __slots__ = ('accepted', 'rejected', 'queued', 'in_flight', 'completed',
+                 'queue_ms_total', 'queue_ms_max', 'latency_ms_total')
+    
+    def __init__(self):
+        self.accepted = 0
+        self.rejected = 0
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.queue_ms_total = 0.0
+        self.queue_ms_max = 0.0
+        self.latency_ms_total = 0.0
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    AIMD concurrency limit driven by request latency.
+    
+    The limit grows by 1/limit per request (about +1 per limit requests) while
+    it is being used and smoothed latency is under the target. When latency
+    goes over the target it is cut by the latency gradient target/latency,
+    but never by more than backoff per cut and at most once per interval.
+    """
+    
+    def __init__(self, initial=64, min_limit=4, max_limit=512, latency_target_ms=250.0,
+                 backoff=0.7, smoothing=0.1, decrease_interval=0.1):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target_ms = latency_target_ms
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.decrease_interval = decrease_interval
+        self.latency_ms = 0.0  # exponentially smoothed
+        self.decreases = 0
+        self._last_decrease = 0.0
+    
+    def on_sample(self, latency_ms, in_flight):
+        """Update the limit with one completed request; called under the controller lock"""
+        if self.latency_ms:
+            self.latency_ms += self.smoothing * (latency_ms - self.latency_ms)
+        else:
+            self.latency_ms = latency_ms
+        
+        if self.latency_ms > self.latency_target_ms:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.decrease_interval:
+                gradient = max(self.backoff, self.latency_target_ms / self.latency_ms)
+                self.limit = max(self.min_limit, self.limit * gradient)
+                self._last_decrease = now
+                self.decreases += 1
+        elif in_flight >= self.limit / 2:
+            # Only grow while the limit is actually constraining concurrency
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+    
+    def reduce(self, factor=0.5):
+        """Cut the limit immediately (e.g. on critical stress)"""
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.decreases += 1
+
+
+_prometheus_metrics = None
+
+
+def _get_prometheus_metrics():
+    """Admission metrics, registered once per process"""
+    global _prometheus_metrics
+    if _prometheus_metrics is None and HAS_PROMETHEUS:
+        try:
+            _prometheus_metrics = {
+                'requests': Counter('memory_admission_requests_total',
+                                    'Admission decisions by priority class',
+                                    ['priority_class', 'outcome']),
+                'queue_time': Histogram('memory_admission_queue_seconds',
+                                        'Time requests waited for an admission slot',
+                                        ['priority_class'],
+                                        buckets=(0.001, 0.005, 0.025, 0.1, 0.25, 0.5, 1.0, 2.0)),
+                'limit': Gauge('memory_admission_concurrency_limit', 'Adaptive concurrency limit'),
+            }
+        except Exception as e:
+            logger.warning(f"Failed to register admission metrics: {e}")
+            _prometheus_metrics = {}
+    return _prometheus_metrics or {}
+
+
+class AdmissionController:
+    """Admits, queues or sheds requests by priority class under an adaptive limit"""
+    
+    def __init__(self, classes=None, endpoint_priorities=None, default_class='normal',
+                 critical_endpoints=None, limiter=None):
+        """
+        Args:
+            classes: {name: {priority, limit_share, max_concurrency, max_queue_ms}}
+            endpoint_priorities: [(path pattern, class name)], first match wins
+            default_class: Class of paths no pattern matches
+            critical_endpoints: Endpoint names or paths always in the most important class
+            limiter: AdaptiveConcurrencyLimit shared by all classes
+        """
+        classes = classes or DEFAULT_PRIORITY_CLASSES
+        self.classes = {name: PriorityClass(name=name, **spec) for name, spec in classes.items()}
+        self.top_class = min(self.classes.values(), key=lambda c: c.priority).name
+        self.endpoint_priorities = list(endpoint_priorities if endpoint_priorities is not None
+                                        else DEFAULT_ENDPOINT_PRIORITIES)
+        self.default_class = default_class if default_class in self.classes else self.top_class
+        self.critical_endpoints = set(critical_endpoints or ())
+        self.limiter = limiter or AdaptiveConcurrencyLimit()
+        
+        self.in_flight = 0
+        self.stats = {name: _ClassStats() for name in self.classes}
+        self._waiting = {c.priority: 0 for c in self.classes.values()}
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._class_cache = {}
+        self._prometheus = _get_prometheus_metrics()
+    
+    def classify(self, path, endpoint=None):
+        """Get the priority class name of a request"""
+        if endpoint in self.critical_endpoints or path in self.critical_endpoints:
+            return self.top_class
+        name = self._class_cache.get(path)
+        if name is None:
+            name = self.default_class
+            for pattern, class_name in self.endpoint_priorities:
+                if fnmatchcase(path, pattern):
+                    name = class_name if class_name in self.classes else self.default_class
+                    break
+            # Bounded so paths with ids in them cannot grow the cache forever
+            if len(self._class_cache) < 4096:
+                self._class_cache[path] = name
+        return name
+    
+    def _can_admit(self, cls, stats):
+        """Called with the lock held"""
+        if cls.max_concurrency is not None and stats.in_flight >= cls.max_concurrency:
+            return False
+        # Queued requests of more important classes go first
+        for priority, waiting in self._waiting.items():
+            if waiting and priority < cls.priority:
+                return False
+        return self.in_flight < max(1.0, self.limiter.limit * cls.limit_share)
+    
+    def _admitted(self, stats, queue_ms):
+        stats.accepted += 1
+        stats.in_flight += 1
+        self.in_flight += 1
+        if queue_ms:
+            stats.queue_ms_total += queue_ms
+            if queue_ms > stats.queue_ms_max:
+                stats.queue_ms_max = queue_ms
+    
+    def _observe(self, class_name, outcome, queue_ms=None):
+        if self._prometheus:
+            self._prometheus['requests'].labels(class_name, outcome).inc()
+            if queue_ms is not None:
+                self._prometheus['queue_time'].labels(class_name).observe(queue_ms / 1000)
+    
+    def acquire(self, class_name):
+        """
+        Try to admit a request, waiting up to the class queue budget.
+        
+        Returns:
+            tuple: (admitted, milliseconds spent waiting)
+        """
+        cls = self.classes[class_name]
+        stats = self.stats[class_name]
+        with self._lock:
+            if self._can_admit(cls, stats):
+                self._admitted(stats, 0.0)
+                admitted, queue_ms = True, 0.0
+            elif cls.max_queue_ms <= 0:
+                stats.rejected += 1
+                admitted, queue_ms = False, 0.0
+            else:
+                stats.queued += 1
+                self._waiting[cls.priority] += 1
+                start = time.monotonic()
+                deadline = start + cls.max_queue_ms / 1000
+                admitted = True
+                try:
+                    while not self._can_admit(cls, stats):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            admitted = False
+                            break
+                        self._slot_freed.wait(remaining)
+                finally:
+                    self._waiting[cls.priority] -= 1
+                queue_ms = (time.monotonic() - start) * 1000
+                if admitted:
+                    self._admitted(stats, queue_ms)
+                else:
+                    stats.rejected += 1
+                    # Our slot in the wait order is gone; let less important waiters re-check
+                    self._slot_freed.notify_all()
+        
+        self._observe(class_name, 'accepted' if admitted else 'rejected', queue_ms)
+        return admitted, queue_ms
+    
+    def reject(self, class_name):
+        """Count a request refused before reaching the limiter (e.g. circuit breaker)"""
+        with self._lock:
+            self.stats[class_name].rejected += 1
+        self._observe(class_name, 'rejected')
+    
+    def release(self, class_name, latency_ms):
+        """Free the slot of an admitted request and feed its latency to the limiter"""
+        stats = self.stats[class_name]
+        with self._lock:
+            in_flight = self.in_flight
+            self.in_flight -= 1
+            stats.in_flight -= 1
+            stats.completed += 1
+            stats.latency_ms_total += latency_ms
+            self.limiter.on_sample(latency_ms, in_flight)
+            if any(self._waiting.values()):
+                self._slot_freed.notify_all()
+        if self._prometheus:
+            self._prometheus['limit'].set(self.limiter.limit)
+    
+    def get_metrics(self):
+        """Limiter state and per-class accept/reject/queue-time counters"""
+        with self._lock:
+            classes = {}
+            for name, stats in self.stats.items():
+                classes[name] = {
+                    'priority': self.classes[name].priority,
+                    'accepted': stats.accepted,
+                    'rejected': stats.rejected,
+                    'queued': stats.queued,
+                    'in_flight': stats.in_flight,
+                    'avg_queue_ms': round(stats.queue_ms_total / stats.queued, 2) if stats.queued else 0.0,
+                    'max_queue_ms': round(stats.queue_ms_max, 2),
+                    'avg_latency_ms': round(stats.latency_ms_total / stats.completed, 2) if stats.completed else 0.0,
+                }
+            return {
+                'concurrency_limit': round(self.limiter.limit, 2),
+                'in_flight': self.in_flight,
+                'latency_ms': round(self.limiter.latency_ms, 2),
+                'latency_target_ms': self.limiter.latency_target_ms,
+                'limit_decreases': self.limiter.decreases,
+                'classes': classes,
+            }
+
+
 class StressHandler:
     """Handles high load conditions and stress scenarios"""
     
@@ -59,6 +334,22 @@ class StressHandler:
             self.stress_actions = ["pause_background", "reduce_logging"]
             self.max_stress_time = 300.0  # 5 minutes
         
+        # Admission control
+        stress_config = getattr(config, 'stress_handling', None)
+        self.admission_control = getattr(stress_config, 'admission_control', True)
+        self.admission = AdmissionController(
+            classes=getattr(stress_config, 'priority_classes', None),
+            endpoint_priorities=getattr(stress_config, 'endpoint_priorities', None),
+            default_class=getattr(stress_config, 'default_priority', 'normal'),
+            critical_endpoints=self.critical_endpoints,
+            limiter=AdaptiveConcurrencyLimit(
+                initial=getattr(stress_config, 'initial_concurrency_limit', 64),
+                min_limit=getattr(stress_config, 'min_concurrency_limit', 4),
+                max_limit=getattr(stress_config, 'max_concurrency_limit', 512),
+                latency_target_ms=getattr(stress_config, 'latency_target_ms', 250.0)
+            )
+        )
+        
         # Get memory thresholds from config
         if config and hasattr(config, 'thresholds'):
             self.memory_warning_threshold = config.thresholds.warning_percent
@@ -130,30 +421,43 @@ class StressHandler:
         # Register middleware for request prioritization if using Flask
         if self.app and hasattr(self.app, 'before_request'):
             try:
+                from flask import request, jsonify, g
+                
+                def unavailable():
+                    response = jsonify({
+                        'status': 'error',
+                        'message': 'Service temporarily unavailable due to high load'
+                    })
+                    response.status_code = 503
+                    response.headers['Retry-After'] = '1'
+                    return response
+                
                 # Register before_request handler for prioritization
                 @self.app.before_request
                 def prioritize_requests():
-                    # Skip if not in stress mode
-                    if self.current_state == StressState.NORMAL:
-                        return None
+                    class_name = self.admission.classify(request.path, request.endpoint)
                     
-                    # Get the current endpoint (route)
-                    endpoint = None
-                    if hasattr(self.app, 'current_url_rule') and self.app.current_url_rule:
-                        endpoint = self.app.current_url_rule.endpoint
+                    # Circuit breaker: only the most important class gets through
+                    if self.circuit_breaker_active and class_name != self.admission.top_class:
+                        self.admission.reject(class_name)
+                        return unavailable()
                     
-                    # Apply circuit breaking if active and not a critical endpoint
-                    if (self.circuit_breaker_active and 
-                        endpoint and 
-                        endpoint not in self.critical_endpoints):
-                        from flask import request, jsonify
-                        # Return a service unavailable response
-                        response = jsonify({
-                            'status': 'error',
-                            'message': 'Service temporarily unavailable due to high load'
-                        })
-                        response.status_code = 503
-                        return response
+                    if not self.admission_control:
+                        return None
+                    
+                    admitted, _ = self.admission.acquire(class_name)
+                    if not admitted:
+                        return unavailable()
+                    g._admission = (class_name, time.perf_counter())
+                    return None
+                
+                # teardown_request also runs when the view raised, so slots are never leaked
+                @self.app.teardown_request
+                def release_admission(exc=None):
+                    admission = g.pop('_admission', None)
+                    if admission is not None:
+                        class_name, started = admission
+                        self.admission.release(class_name, (time.perf_counter() - started) * 1000)
                 
                 logger.info("Request prioritization middleware registered")
             except Exception as e:
@@ -209,12 +513,8 @@ class StressHandler:
     
     def _check_stress_level(self) -> float:
         """Check the current stress level of the system"""
-        # Need system detector to check stress
-        if not self.system_detector:
-            return 0.0
-        
-        # Get current resource usage
-        usage = self.system_detector.get_resource_usage()
+        # Latest published snapshot from the shared sampler (no system calls here)
+        usage = get_resource_sampler().snapshot
         
         # Calculate stress level based on CPU and memory usage
         cpu_stress = usage.cpu_percent / self.cpu_threshold if self.cpu_threshold > 0 else 0
@@ -513,10 +813,11 @@ class StressHandler:
     
     def _throttle_requests(self):
         """Throttle incoming requests during stress"""
-        # Implementation depends on the web framework
-        # For Flask, we could use a rate limiter
-        # This is a placeholder
-        return False
+        if not self.admission_control:
+            return False
+        # Halve the admission limit; latency feedback grows it back once load drops
+        self.admission.limiter.reduce(0.5)
+        return True
     
     def register_background_task(self, name, pause_function=None, resume_function=None, is_critical=False):
         """Register a background task that can be paused during stress"""
@@ -547,7 +848,8 @@ class StressHandler:
             'current_state': self.current_state.name,
             'stress_duration': self.stress_duration_time if self.current_state != StressState.NORMAL else 0,
             'circuit_breaker_active': self.circuit_breaker_active,
-            'background_tasks_paused': self.background_tasks_paused
+            'background_tasks_paused': self.background_tasks_paused,
+            'admission': self.admission.get_metrics()
         }
         
         # Add resource history summaries if available
@@ -384,6 +384,11 @@ def create_helper_files():
     # Create helper.py file with IP detection functions
     helper_path = os.path.join("backend", "crn_wallet", "helper.py")
     
+    # Keep the maintained helper (trusted-proxy resolver, cached IP info) if present
+    if os.path.exists(helper_path):
+        print_status("helper.py already exists, keeping it", "info")
+        return True
+    
     with open(helper_path, "w", encoding="utf-8") as f:
         f.write("""
 from flask import request